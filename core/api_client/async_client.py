@@ -0,0 +1,442 @@
+from typing import AsyncIterator, Awaitable, Iterable, Optional, Dict, Any, List
+from concurrent.futures import Future
+import asyncio
+import functools
+import inspect
+import threading
+import logging
+import time
+import httpx
+from modules.GlobalModule import global_config, GenerationSettings
+from core.api_client.deepseek import DeepSeekAPIClient, APIKeyMissingError, ContextOverflowError
+from core.api_client.router import ModelTarget
+from core.api_client.retry import CircuitOpenError, CLOSED
+from core.api_client.response_cache import CACHE_NEVER
+from core.api_client.handle import GenerationHandle, new_handle
+from core.api_client.pool import PoolLease
+
+logger = logging.getLogger(__name__)
+
+
+class AsyncDeepSeekAPIClient(DeepSeekAPIClient):
+    """基于AsyncOpenAI的异步API客户端
+
+    与DeepSeekAPIClient共用密钥获取、参数构建与连接池，回调约定保持一致：
+    思维链以{"reasoning_content": ...}、思维结束以{"thinking_finished": True}、
+    正文以字符串增量传给callback。多个流可在同一个事件循环中并发运行。
+    """
+
+    def _lease_async_client(self, api_key: str, target: Optional[ModelTarget] = None) -> PoolLease:
+        """从连接池租用当前事件循环中目标提供商（默认当前提供商）的异步客户端，用完须释放"""
+        target = target or ModelTarget.current()
+        return self.pool.lease_async(target.provider, target.base_url, api_key)
+
+    @staticmethod
+    async def _in_thread(func, *args, **kwargs):
+        """在线程池中执行阻塞的调用（磁盘缓存读写、分词与上下文打包），不占用共享的事件循环"""
+        return await asyncio.get_running_loop().run_in_executor(None, functools.partial(func, *args, **kwargs))
+
+    async def _build_params_async(self, messages: List[Dict[str, Any]], stream: bool, target: ModelTarget,
+                                  settings: GenerationSettings) -> Dict[str, Any]:
+        """在线程池中构建请求参数（含上下文打包与token计数）"""
+        return await self._in_thread(self._build_params, messages, stream=stream, target=target, settings=settings)
+
+    async def _acquire(self, target: ModelTarget, messages: List[Dict[str, Any]]):
+        """按prompt的token数限流，计数在线程池中进行"""
+        tokens = await self._in_thread(self.tokens.count_messages, messages, target.name)
+        await self.limiter.acquire_async(target.provider, tokens)
+
+    @staticmethod
+    async def _close_opened(opened):
+        """关闭_open_and_peek打开的流并释放其客户端租约"""
+        try:
+            await opened[1].close()
+        finally:
+            opened[4].release()
+
+    @staticmethod
+    async def _invoke(callback, chunk):
+        """调用回调，兼容普通函数与协程函数"""
+        if callback is None:
+            return
+        result = callback(chunk)
+        if inspect.isawaitable(result):
+            await result
+
+    async def generate(self, messages: List[Dict[str, Any]], cache_policy: str = CACHE_NEVER,
+                       model_name: Optional[str] = None, prompt_family: Optional[str] = None,
+                       settings: Optional[GenerationSettings] = None) -> str:
+        """异步生成文本，settings为本次请求的生成参数快照，默认取开始生成时的全局参数"""
+        logger.debug(f"开始异步生成文本，消息数: {len(messages)}")
+        settings = settings or global_config.generation_settings()
+
+        try:
+            state = self.retry.begin(self._route(model_name))
+        except APIKeyMissingError:
+            logger.error("未找到API密钥")
+            return "错误: 未找到API密钥，请在设置中配置"
+
+        while True:
+            target = timer = lease = None
+            try:
+                target, delay = self._next_target(state)
+                if delay:
+                    await asyncio.sleep(delay)
+                lease = self._lease_async_client(self._get_api_key(target.provider), target)
+                client = lease.client
+                params = await self._build_params_async(messages, False, target, settings)
+
+                cache_key = self._cache_key(params, cache_policy)
+                if cache_key:
+                    cached = await self._in_thread(self.cache.get, cache_key)
+                    if cached is not None:
+                        logger.debug("响应缓存命中")
+                        state.release()
+                        return cached
+
+                logger.debug(f"使用模型: {params['model']}")
+
+                await self._acquire(target, params["messages"])
+                timer = self.telemetry.timer(target.name, target.provider, prompt_family)
+                response = await client.chat.completions.create(**params)
+                content = response.choices[0].message.content or ""
+                completion_tokens = self._completion_tokens(response, content)
+                timer.finish("ok", completion_tokens)
+                self.limiter.record(target.provider, completion_tokens)
+                self.prompt_cache.record(prompt_family, target.name, getattr(response, 'usage', None))
+                state.succeeded()
+                if cache_key:
+                    await self._in_thread(self.cache.put, cache_key, content, params['model'])
+                return content
+
+            except Exception as e:
+                if target is not None:
+                    self._record_failure(target, timer, e)
+                if target is not None and state.failed(e):
+                    logger.error(f"请求失败 (尝试 {state.attempt}/{state.policy.max_attempts}, {target.name}): {str(e)}")
+                    continue
+                if isinstance(e, httpx.HTTPError):
+                    return f"API请求失败: {str(e)}"
+                if isinstance(e, (CircuitOpenError, ContextOverflowError)):
+                    logger.warning(str(e))
+                    return f"生成失败: {str(e)}"
+                logger.exception(f"异步生成文本时发生错误: {str(e)}")
+                return f"生成失败: {str(e)}"
+            finally:
+                if lease is not None:
+                    lease.release()
+
+    async def _open_and_peek(self, target: ModelTarget, messages: List[Dict[str, Any]],
+                             settings: Optional[GenerationSettings] = None):
+        """发起流式请求并读到第一个有内容的块，返回(target, stream, 迭代器, 已读的块, 客户端租约)
+
+        租约随流一起交给调用方，流关闭后须释放（见_close_opened）。
+        """
+        lease = self._lease_async_client(self._get_api_key(target.provider), target)
+        try:
+            params = await self._build_params_async(messages, True, target, settings)
+            logger.debug(f"使用模型: {params['model']}，异步流式模式")
+            await self._acquire(target, params["messages"])
+
+            started = time.monotonic()
+            stream = await lease.client.chat.completions.create(**params)
+        except BaseException:
+            lease.release()
+            raise
+        iterator = stream.__aiter__()
+        buffered = []
+        try:
+            while True:
+                try:
+                    chunk = await iterator.__anext__()
+                except StopAsyncIteration:
+                    break
+                buffered.append(chunk)
+                if getattr(chunk, 'choices', None):
+                    delta = chunk.choices[0].delta
+                    if getattr(delta, 'content', None) or getattr(delta, 'reasoning_content', None):
+                        self.router.latency.observe(target.name, time.monotonic() - started)
+                        break
+        except BaseException:
+            await self._close_opened((target, stream, iterator, buffered, lease))
+            raise
+        return target, stream, iterator, buffered, lease
+
+    async def _open_stream(self, messages: List[Dict[str, Any]], primary: ModelTarget,
+                           alternate: Optional[ModelTarget] = None,
+                           settings: Optional[GenerationSettings] = None):
+        """打开流式响应，必要时对冲
+
+        主模型首字延迟超过其TTFT分位数阈值时，向备选模型发起第二个请求，
+        先产出内容的一方胜出，另一方被取消并关闭连接。
+        """
+        delay = self.router.hedge_delay(primary.name) if alternate else None
+        if delay is None:
+            return await self._open_and_peek(primary, messages, settings)
+
+        tasks = [asyncio.ensure_future(self._open_and_peek(primary, messages, settings))]
+        done, _ = await asyncio.wait(tasks, timeout=delay)
+        if not done:
+            logger.info(f"{primary.name} 首字超过 {delay:.2f} 秒，向 {alternate.name} 发起对冲请求")
+            self.router.record("hedges")
+            tasks.append(asyncio.ensure_future(self._open_and_peek(alternate, messages, settings)))
+
+        winner, error = None, None
+        pending = set(tasks)
+        try:
+            while pending and winner is None:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    if task.exception() is not None:
+                        error = task.exception()
+                    elif winner is None:
+                        winner = task.result()
+                    else:
+                        await self._close_opened(task.result())
+        finally:
+            # 取消落后的请求并释放其连接
+            for task in pending:
+                task.cancel()
+            for result in await asyncio.gather(*pending, return_exceptions=True):
+                if isinstance(result, tuple):
+                    await self._close_opened(result)
+
+        if winner is None:
+            raise error
+        if winner[0] is not primary:
+            self.router.record("hedge_wins")
+        return winner
+
+    def _hedge_target(self, state, targets: List[ModelTarget]) -> Optional[ModelTarget]:
+        """对冲用的备选模型：链路中的下一个且熔断器处于关闭状态"""
+        index = targets.index(state.target)
+        for target in targets[index + 1:]:
+            if self.retry.breaker(self._breaker_key(target)).state == CLOSED:
+                return target
+        return None
+
+    @staticmethod
+    def _breaker_key(target: ModelTarget):
+        return target.provider, target.model
+
+    @staticmethod
+    async def _chunks(buffered: List[Any], iterator) -> AsyncIterator[Any]:
+        """先产出预读的块，再继续读取剩余的流"""
+        for chunk in buffered:
+            yield chunk
+        async for chunk in iterator:
+            yield chunk
+
+    async def stream_generate(self, messages: List[Dict[str, Any]], callback=None,
+                              cache_policy: str = CACHE_NEVER,
+                              handle: Optional[GenerationHandle] = None,
+                              model_name: Optional[str] = None,
+                              prompt_family: Optional[str] = None,
+                              settings: Optional[GenerationSettings] = None) -> AsyncIterator[str]:
+        """异步流式生成文本，支持回调函数处理每个块
+
+        handle: 生成句柄，可在任意线程调用handle.cancel()，读取中的任务随即被取消、
+            响应关闭，生成正常结束而不抛出异常
+        model_name: 指定model_mapping中的模型，默认使用当前选择的模型。
+            尚未输出内容前失败时沿路由链路切换；启用对冲时首字过慢会同时请求备选模型
+        prompt_family: 提示词族，用于按族统计前缀缓存命中率
+        settings: 本次请求的生成参数快照，默认取开始生成时的全局参数；
+            同一事件循环上并发的多个流可以各自使用不同的参数
+        """
+        logger.debug(f"开始异步流式生成文本，消息数: {len(messages)}")
+        settings = settings or global_config.generation_settings()
+
+        handle = handle or new_handle()
+        handle.start()
+        self._open_journal(handle, messages, model_name)
+        error = None
+
+        try:
+            try:
+                targets = self._route(model_name)
+            except APIKeyMissingError:
+                logger.error("未找到API密钥")
+                error = "错误: 未找到API密钥，请在设置中配置"
+                await self._invoke(callback, error)
+                yield error
+                return
+            state = self.retry.begin(targets)
+
+            while True:
+                if handle.cancelled:
+                    return
+                target = timer = lease = None
+                try:
+                    target, delay = self._next_target(state)
+                    if delay:
+                        handle.bind_task(asyncio.current_task(), asyncio.get_running_loop())
+                        await asyncio.sleep(delay)
+                    params = await self._build_params_async(messages, True, target, settings)
+                    cache_key = self._cache_key(params, cache_policy)
+                    if cache_key:
+                        cached = await self._in_thread(self.cache.get, cache_key)
+                        if cached is not None:
+                            logger.debug("响应缓存命中")
+                            state.release()
+                            handle.record_content(cached)
+                            await self._invoke(callback, cached)
+                            yield cached
+                            return
+
+                    handle.bind_task(asyncio.current_task(), asyncio.get_running_loop())
+                    alternate = self._hedge_target(state, targets)
+                    started = time.monotonic()
+                    timer = self.telemetry.timer(target.name, target.provider, prompt_family, started)
+                    winner, stream, iterator, buffered, lease = await self._open_stream(messages, target, alternate, settings)
+
+                    # 每个流的状态保存在各自的句柄上，互不干扰
+                    last_content = None
+                    last_reasoning = None
+
+                    try:
+                        if winner is not target:
+                            state.release()
+                            target = state.adopt(winner)
+                            params = await self._build_params_async(messages, True, target, settings)
+                            cache_key = self._cache_key(params, cache_policy)
+                            # 对冲胜出时按胜出模型记录，起点仍为用户发起请求的时刻
+                            timer = self.telemetry.timer(target.name, target.provider, prompt_family, started)
+                        is_reasoning_model = target.is_reasoning
+
+                        async for chunk in self._chunks(buffered, iterator):
+                            if handle.cancelled:
+                                break
+                            if not getattr(chunk, 'choices', None):
+                                # 流末尾的usage块
+                                self._record_stream_usage(handle, target, chunk, prompt_family)
+                                continue
+                            delta = chunk.choices[0].delta
+
+                            reasoning = getattr(delta, 'reasoning_content', None) if is_reasoning_model else None
+                            if reasoning:
+                                # 防止重复发送相同的思维链内容
+                                if reasoning != last_reasoning:
+                                    last_reasoning = reasoning
+                                    timer.chunk(reasoning=True)
+                                    handle.record_reasoning(reasoning)
+                                    await self._invoke(callback, {"reasoning_content": reasoning})
+                                continue  # 思维链内容仅通过回调传递，不作为返回值
+
+                            content_delta = getattr(delta, 'content', None)
+                            if is_reasoning_model and content_delta and not handle.thinking_finished_sent:
+                                handle.thinking_finished_sent = True
+                                await self._invoke(callback, {"thinking_finished": True})
+
+                            # 确保不是空内容且不重复
+                            if content_delta and content_delta != last_content:
+                                last_content = content_delta
+                                timer.chunk()
+                                handle.record_content(content_delta)
+                                await self._invoke(callback, content_delta)
+                                yield content_delta
+                    finally:
+                        # 无论正常结束、取消还是调用方提前退出，都立即释放连接
+                        handle.unbind()
+                        await stream.close()
+
+                    self.limiter.record(target.provider, self._handle_tokens(handle))
+                    timer.finish("cancelled" if handle.cancelled else "ok", self._handle_tokens(handle))
+                    if not handle.cancelled:
+                        state.succeeded()
+                    if cache_key and not handle.cancelled:
+                        await self._in_thread(self.cache.put, cache_key, handle.content, params['model'])
+                    return
+
+                except asyncio.CancelledError:
+                    if timer is not None:
+                        timer.finish("cancelled")
+                    if not handle.cancelled:
+                        raise
+                    # 由句柄发起的取消：吞掉取消信号，正常结束本次生成
+                    task = asyncio.current_task()
+                    if task is not None and hasattr(task, 'uncancel'):
+                        task.uncancel()
+                    return
+
+                except Exception as e:
+                    if target is not None:
+                        self._record_failure(target, timer, e, cancelled=handle.cancelled)
+                    if handle.cancelled:
+                        return
+                    # 尚未输出内容时可以换提供商重试，已输出部分内容则不能无缝切换
+                    if target is not None and state.failed(e) and handle.chunks == 0:
+                        logger.error(f"请求失败 (尝试 {state.attempt}/{state.policy.max_attempts}, {target.name}): {str(e)}")
+                        continue
+                    if isinstance(e, httpx.HTTPError):
+                        logger.error(f"HTTP错误 ({target.name}): {str(e)}")
+                        error = f"API请求失败: {str(e)}"
+                    elif isinstance(e, (CircuitOpenError, ContextOverflowError)):
+                        logger.warning(str(e))
+                        error = f"生成失败: {str(e)}"
+                    else:
+                        logger.exception(f"异步流式生成文本时发生错误: {str(e)}")
+                        error = self._format_error_message(e)
+                    await self._invoke(callback, error)
+                    yield error
+                    return
+                finally:
+                    # 流关闭后才释放租约，连接池此后才可能关闭该客户端
+                    if lease is not None:
+                        lease.release()
+        finally:
+            handle.unbind()
+            handle.finish(error)
+
+    async def gather(self, aws: Iterable[Awaitable], limit: int = 8,
+                     return_exceptions: bool = True) -> List[Any]:
+        """以有限并发执行多个协程，结果顺序与输入一致"""
+        semaphore = asyncio.Semaphore(max(1, limit))
+
+        async def run(aw):
+            async with semaphore:
+                return await aw
+
+        return await asyncio.gather(*(run(aw) for aw in aws), return_exceptions=return_exceptions)
+
+
+class AsyncRunner:
+    """后台事件循环线程，供Tk等同步代码提交协程
+
+    所有提交的生成任务共享同一个事件循环，而不是每个生成占用一个线程。
+    """
+
+    def __init__(self):
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._thread: Optional[threading.Thread] = None
+        self._lock = threading.Lock()
+
+    @property
+    def loop(self) -> asyncio.AbstractEventLoop:
+        """返回后台事件循环，首次访问时启动"""
+        with self._lock:
+            if self._loop is None or self._loop.is_closed():
+                self._loop = asyncio.new_event_loop()
+                self._thread = threading.Thread(
+                    target=self._loop.run_forever,
+                    name="AsyncRunner",
+                    daemon=True
+                )
+                self._thread.start()
+            return self._loop
+
+    def submit(self, coro) -> Future:
+        """提交协程到后台事件循环，返回concurrent.futures.Future"""
+        return asyncio.run_coroutine_threadsafe(coro, self.loop)
+
+    def stop(self):
+        """停止后台事件循环"""
+        with self._lock:
+            if self._loop is not None and self._loop.is_running():
+                self._loop.call_soon_threadsafe(self._loop.stop)
+            self._loop = None
+            self._thread = None
+
+
+# 单例实例
+async_api_client = AsyncDeepSeekAPIClient()
+async_runner = AsyncRunner()
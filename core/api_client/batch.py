@@ -0,0 +1,122 @@
+from concurrent.futures import ThreadPoolExecutor, CancelledError, wait, FIRST_COMPLETED
+from typing import Callable, Iterable, Iterator, Optional, Any
+import threading
+import time
+import logging
+
+logger = logging.getLogger(__name__)
+
+# 设置了on_cancel时检查取消事件的间隔（秒）
+_CANCEL_POLL = 0.1
+
+
+class BatchItemError(Exception):
+    """批量请求中的单项生成失败，消息为面向用户的错误信息"""
+
+
+class BatchResult:
+    """批量生成中单个请求的结果，失败时content为None、error为异常"""
+
+    def __init__(self, index: int, request: Any, content: Optional[str] = None,
+                 error: Optional[BaseException] = None, elapsed: float = 0.0):
+        self.index = index  # 请求在输入中的位置
+        self.request = request
+        self.content = content
+        self.error = error
+        self.elapsed = elapsed  # 耗时（秒）
+
+    @property
+    def ok(self) -> bool:
+        return self.error is None
+
+    @property
+    def cancelled(self) -> bool:
+        return isinstance(self.error, CancelledError)
+
+    def __repr__(self):
+        state = "ok" if self.ok else ("cancelled" if self.cancelled else f"error={self.error!r}")
+        return f"BatchResult(index={self.index}, {state}, elapsed={self.elapsed:.2f})"
+
+
+def run_batch(worker: Callable[[Any, threading.Event], str], requests: Iterable[Any],
+              max_concurrency: int = 4, ordered: bool = False,
+              cancel_event: Optional[threading.Event] = None,
+              on_cancel: Optional[Callable[[], None]] = None) -> Iterator[BatchResult]:
+    """以有限并发执行worker(request, cancel_event)，逐个产出BatchResult
+
+    ordered为False时按完成顺序产出，为True时按输入顺序产出。
+    单个请求抛出的异常只记录在对应结果中，不影响其他请求。
+    设置cancel_event或提前关闭迭代器会取消尚未开始的请求，
+    这些请求以CancelledError结果产出（提前关闭时不再产出）；
+    on_cancel在取消时调用一次，用于中断执行中的请求。
+    """
+    items = list(requests)
+    cancel_event = cancel_event or threading.Event()
+    max_concurrency = max(1, max_concurrency)
+    executor = ThreadPoolExecutor(max_workers=max_concurrency, thread_name_prefix="generate_many")
+    pending = {}
+    submitted = 0
+    buffered = {}
+    next_index = 0
+    finished = False
+    notified = False
+
+    def notify_cancel():
+        nonlocal notified
+        if on_cancel is not None and not notified:
+            notified = True
+            on_cancel()
+
+    def run(index: int) -> BatchResult:
+        start = time.monotonic()
+        if cancel_event.is_set():
+            return BatchResult(index, items[index], error=CancelledError())
+        try:
+            content = worker(items[index], cancel_event)
+            return BatchResult(index, items[index], content=content, elapsed=time.monotonic() - start)
+        except CancelledError as e:
+            return BatchResult(index, items[index], error=e, elapsed=time.monotonic() - start)
+        except Exception as e:
+            logger.warning(f"批量请求 {index} 失败: {str(e)}")
+            return BatchResult(index, items[index], error=e, elapsed=time.monotonic() - start)
+
+    def submit_next():
+        nonlocal submitted
+        if submitted < len(items) and not cancel_event.is_set():
+            pending[executor.submit(run, submitted)] = submitted
+            submitted += 1
+
+    def emit(result: BatchResult) -> Iterator[BatchResult]:
+        nonlocal next_index
+        if not ordered:
+            yield result
+            return
+        buffered[result.index] = result
+        while next_index in buffered:
+            yield buffered.pop(next_index)
+            next_index += 1
+
+    try:
+        for _ in range(max_concurrency):
+            submit_next()
+        while pending:
+            done, _ = wait(list(pending), timeout=_CANCEL_POLL if on_cancel else None,
+                           return_when=FIRST_COMPLETED)
+            if cancel_event.is_set():
+                notify_cancel()
+            for future in done:
+                pending.pop(future)
+                submit_next()
+                yield from emit(future.result())
+        # 取消后未提交的请求
+        for index in range(submitted, len(items)):
+            yield from emit(BatchResult(index, items[index], error=CancelledError()))
+        finished = True
+    finally:
+        if not finished:
+            # 调用方提前结束迭代：通知执行中的请求并丢弃排队的请求
+            cancel_event.set()
+            notify_cancel()
+            for future in pending:
+                future.cancel()
+        executor.shutdown(wait=False)
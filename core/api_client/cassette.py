@@ -0,0 +1,405 @@
+from pathlib import Path
+from typing import Any, Dict, Iterator, AsyncIterator, List, Optional
+import asyncio
+import codecs
+import hashlib
+import json
+import threading
+import time
+import logging
+import httpx
+
+logger = logging.getLogger(__name__)
+
+RECORD = "record"
+REPLAY = "replay"
+
+CASSETTE_DIR = Path(__file__).parent.parent.parent / 'data/cassettes'
+
+# 录制时保留的响应头，其余（Content-Length、Content-Encoding等）回放时由httpx重新生成
+_KEPT_HEADERS = ("content-type", "retry-after", "retry-after-ms", "x-request-id")
+
+
+def request_key(method: str, path: str, body: Any) -> str:
+    """请求的匹配键：方法、路径与规范化后的请求体"""
+    canonical = json.dumps(body, ensure_ascii=False, sort_keys=True, separators=(',', ':'))
+    return hashlib.sha256(f"{method} {path}\n{canonical}".encode('utf-8')).hexdigest()[:24]
+
+
+def _request_body(request: httpx.Request) -> Any:
+    content = request.content
+    if not content:
+        return None
+    try:
+        return json.loads(content)
+    except ValueError:
+        return content.decode('utf-8', errors='replace')
+
+
+class Interaction:
+    """一次请求与响应：chunks为[距上一块的毫秒数, 文本]，第一块的间隔从发出请求算起"""
+
+    def __init__(self, method: str, path: str, body: Any, started: Optional[float] = None):
+        self.method = method
+        self.path = path
+        self.body = body
+        self.key = request_key(method, path, body)
+        self.status: Optional[int] = None
+        self.headers: Dict[str, str] = {}
+        self.chunks: List[List[Any]] = []
+        self.error: Optional[List[Any]] = None  # [httpx异常类名, 信息, 抛出前经过的毫秒数]
+        self.complete = False
+        self.started = started or time.monotonic()
+        self._last = self.started
+        self._decoder = codecs.getincrementaldecoder('utf-8')(errors='replace')
+
+    def add_chunk(self, data: bytes):
+        text = self._decoder.decode(data)
+        now = time.monotonic()
+        if text:
+            self.chunks.append([round((now - self._last) * 1000, 1), text])
+            self._last = now
+
+    def finish(self, complete: bool = True):
+        tail = self._decoder.decode(b"", final=True)
+        if tail:
+            self.chunks.append([0.0, tail])
+        self.complete = complete
+
+    def to_dict(self) -> Dict[str, Any]:
+        data = {
+            "key": self.key, "method": self.method, "path": self.path, "request": self.body,
+            "status": self.status, "headers": self.headers, "chunks": self.chunks, "complete": self.complete
+        }
+        if self.error:
+            data["error"] = self.error
+        return data
+
+    @classmethod
+    def from_dict(cls, data: Dict[str, Any]) -> "Interaction":
+        interaction = cls(data["method"], data["path"], data.get("request"))
+        interaction.status = data.get("status")
+        interaction.headers = data.get("headers") or {}
+        interaction.chunks = data.get("chunks") or []
+        interaction.error = data.get("error")
+        interaction.complete = data.get("complete", True)
+        return interaction
+
+    @property
+    def duration(self) -> float:
+        """录制时的总耗时（毫秒）"""
+        if self.error:
+            return self.error[2] if len(self.error) > 2 else 0.0
+        return sum(chunk[0] for chunk in self.chunks)
+
+
+class Cassette:
+    """API会话的录制与回放
+
+    在httpx传输层工作：录制时记录每次请求的完整参数、状态码与每个原始响应块到达的时刻，
+    回放时不访问网络，按录制的间隔（除以speed）逐块返回，客户端的SSE解析、重试与界面刷新
+    路径与真实请求完全一致。speed为0时不等待，用于测试解析吞吐。
+
+    每行一个JSON记录一次请求，文件可直接追加。用法：
+        with Cassette(CASSETTE_DIR / "worldview.jsonl", RECORD):
+            api_client.generate(messages)
+        with Cassette(CASSETTE_DIR / "worldview.jsonl", REPLAY, speed=10):
+            api_client.generate(messages)
+
+    回放时按请求体精确匹配，相同请求按录制顺序依次返回；strict为False时，
+    找不到匹配的请求按顺序取下一条未回放的记录（提示词含随机内容时使用）。
+    找不到可回放的记录时返回404。
+    """
+
+    def __init__(self, path: Path, mode: str = REPLAY, speed: float = 1.0, strict: bool = True):
+        if mode not in (RECORD, REPLAY):
+            raise ValueError(f"未知的录制模式: {mode}")
+        self.path = Path(path)
+        self.mode = mode
+        self.speed = speed  # 回放速度倍数，0表示不等待
+        self.strict = strict
+        self._lock = threading.Lock()
+        self._interactions: List[Interaction] = []
+        self._queues: Dict[str, List[Interaction]] = {}
+        self._played: set = set()
+        self._counters = {"recorded": 0, "played": 0, "misses": 0}
+        if mode == REPLAY:
+            self.load()
+
+    def load(self):
+        """读取录制文件，格式错误的行被跳过"""
+        interactions = []
+        with open(self.path, 'r', encoding='utf-8') as f:
+            for number, line in enumerate(f, 1):
+                if not line.strip():
+                    continue
+                try:
+                    interactions.append(Interaction.from_dict(json.loads(line)))
+                except (ValueError, KeyError) as e:
+                    logger.warning(f"跳过无效的录制记录 {self.path.name}:{number}: {str(e)}")
+        with self._lock:
+            self._interactions = interactions
+            self._queues = {}
+            for interaction in interactions:
+                self._queues.setdefault(interaction.key, []).append(interaction)
+            self._played = set()
+        logger.info(f"已加载 {len(interactions)} 条录制记录: {self.path}")
+
+    @property
+    def interactions(self) -> List[Interaction]:
+        with self._lock:
+            return list(self._interactions)
+
+    def __enter__(self) -> "Cassette":
+        from core.api_client.pool import client_pool
+        client_pool.use_cassette(self)
+        return self
+
+    def __exit__(self, *exc):
+        from core.api_client.pool import client_pool
+        client_pool.use_cassette(None)
+
+    def wrap(self, transport: httpx.BaseTransport) -> httpx.BaseTransport:
+        """包装同步传输层（供ClientPool调用）"""
+        return _RecordingTransport(self, transport) if self.mode == RECORD else _ReplayTransport(self)
+
+    def wrap_async(self, transport: httpx.AsyncBaseTransport) -> httpx.AsyncBaseTransport:
+        """包装异步传输层（供ClientPool调用）"""
+        return _AsyncRecordingTransport(self, transport) if self.mode == RECORD else _AsyncReplayTransport(self)
+
+    def _save(self, interaction: Interaction):
+        line = json.dumps(interaction.to_dict(), ensure_ascii=False, separators=(',', ':')) + "\n"
+        with self._lock:
+            try:
+                self.path.parent.mkdir(parents=True, exist_ok=True)
+                with open(self.path, 'a', encoding='utf-8') as f:
+                    f.write(line)
+            except OSError as e:
+                logger.warning(f"写入录制记录失败: {str(e)}")
+                return
+            self._interactions.append(interaction)
+            self._counters["recorded"] += 1
+
+    def _match(self, method: str, path: str, body: Any) -> Optional[Interaction]:
+        key = request_key(method, path, body)
+        with self._lock:
+            queue = [item for item in self._queues.get(key, []) if id(item) not in self._played]
+            if not queue and not self.strict:
+                queue = [item for item in self._interactions
+                         if id(item) not in self._played and item.method == method and item.path == path]
+            if not queue:
+                # 相同请求的记录已全部回放过时重复最后一条
+                queue = self._queues.get(key, [])[-1:]
+            if not queue:
+                self._counters["misses"] += 1
+                return None
+            interaction = queue[0]
+            self._played.add(id(interaction))
+            self._counters["played"] += 1
+            return interaction
+
+    def _delay(self, milliseconds: float) -> float:
+        if not self.speed or self.speed <= 0:
+            return 0.0
+        return milliseconds / 1000 / self.speed
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                **self._counters,
+                "mode": self.mode,
+                "path": str(self.path),
+                "speed": self.speed,
+                "interactions": len(self._interactions),
+                "unplayed": sum(1 for item in self._interactions if id(item) not in self._played)
+            }
+
+
+def _miss_response(request: httpx.Request) -> httpx.Response:
+    body = {"error": {"message": f"No recorded response for {request.method} {request.url.path}",
+                      "type": "cassette_miss"}}
+    return httpx.Response(404, json=body, request=request)
+
+
+def _replay_headers(interaction: Interaction) -> Dict[str, str]:
+    return dict(interaction.headers) or {"content-type": "application/json"}
+
+
+def _raise_recorded(interaction: Interaction, request: httpx.Request):
+    name, message = interaction.error[:2]
+    error_type = getattr(httpx, name, None)
+    if not (isinstance(error_type, type) and issubclass(error_type, httpx.TransportError)):
+        error_type = httpx.TransportError
+    raise error_type(message, request=request)
+
+
+class _RecordingStream(httpx.SyncByteStream):
+    def __init__(self, cassette: Cassette, interaction: Interaction, stream: httpx.SyncByteStream):
+        self.cassette = cassette
+        self.interaction = interaction
+        self.stream = stream
+        self._saved = False
+
+    def __iter__(self) -> Iterator[bytes]:
+        for data in self.stream:
+            self.interaction.add_chunk(data)
+            yield data
+        self._finish(True)
+
+    def _finish(self, complete: bool):
+        if not self._saved:
+            self._saved = True
+            self.interaction.finish(complete)
+            self.cassette._save(self.interaction)
+
+    def close(self):
+        # 未读完就关闭（取消生成）时记录为不完整
+        self._finish(False)
+        self.stream.close()
+
+
+class _AsyncRecordingStream(httpx.AsyncByteStream):
+    def __init__(self, cassette: Cassette, interaction: Interaction, stream: httpx.AsyncByteStream):
+        self.cassette = cassette
+        self.interaction = interaction
+        self.stream = stream
+        self._saved = False
+
+    async def __aiter__(self) -> AsyncIterator[bytes]:
+        async for data in self.stream:
+            self.interaction.add_chunk(data)
+            yield data
+        self._finish(True)
+
+    def _finish(self, complete: bool):
+        if not self._saved:
+            self._saved = True
+            self.interaction.finish(complete)
+            self.cassette._save(self.interaction)
+
+    async def aclose(self):
+        self._finish(False)
+        await self.stream.aclose()
+
+
+def _begin_recording(request: httpx.Request) -> Interaction:
+    # 录制原始响应块需要未压缩的内容
+    request.headers["Accept-Encoding"] = "identity"
+    return Interaction(request.method, request.url.path, _request_body(request))
+
+
+def _record_headers(interaction: Interaction, response: httpx.Response):
+    interaction.status = response.status_code
+    interaction.headers = {name: response.headers[name] for name in _KEPT_HEADERS if name in response.headers}
+
+
+class _RecordingTransport(httpx.BaseTransport):
+    def __init__(self, cassette: Cassette, transport: httpx.BaseTransport):
+        self.cassette = cassette
+        self.transport = transport
+
+    def handle_request(self, request: httpx.Request) -> httpx.Response:
+        interaction = _begin_recording(request)
+        try:
+            response = self.transport.handle_request(request)
+        except httpx.TransportError as e:
+            interaction.error = [type(e).__name__, str(e), round((time.monotonic() - interaction.started) * 1000, 1)]
+            interaction.finish(False)
+            self.cassette._save(interaction)
+            raise
+        _record_headers(interaction, response)
+        stream = _RecordingStream(self.cassette, interaction, response.stream)
+        return httpx.Response(response.status_code, headers=response.headers, stream=stream,
+                              extensions=response.extensions, request=request)
+
+    def close(self):
+        self.transport.close()
+
+
+class _AsyncRecordingTransport(httpx.AsyncBaseTransport):
+    def __init__(self, cassette: Cassette, transport: httpx.AsyncBaseTransport):
+        self.cassette = cassette
+        self.transport = transport
+
+    async def handle_async_request(self, request: httpx.Request) -> httpx.Response:
+        interaction = _begin_recording(request)
+        try:
+            response = await self.transport.handle_async_request(request)
+        except httpx.TransportError as e:
+            interaction.error = [type(e).__name__, str(e), round((time.monotonic() - interaction.started) * 1000, 1)]
+            interaction.finish(False)
+            self.cassette._save(interaction)
+            raise
+        _record_headers(interaction, response)
+        stream = _AsyncRecordingStream(self.cassette, interaction, response.stream)
+        return httpx.Response(response.status_code, headers=response.headers, stream=stream,
+                              extensions=response.extensions, request=request)
+
+    async def aclose(self):
+        await self.transport.aclose()
+
+
+class _ReplayStream(httpx.SyncByteStream):
+    def __init__(self, cassette: Cassette, interaction: Interaction):
+        self.cassette = cassette
+        self.interaction = interaction
+        self._closed = threading.Event()
+
+    def __iter__(self) -> Iterator[bytes]:
+        for delay, text in self.interaction.chunks:
+            # 关闭（取消生成）时立即结束等待
+            if self._closed.wait(self.cassette._delay(delay)):
+                return
+            yield text.encode('utf-8')
+
+    def close(self):
+        self._closed.set()
+
+
+class _AsyncReplayStream(httpx.AsyncByteStream):
+    def __init__(self, cassette: Cassette, interaction: Interaction):
+        self.cassette = cassette
+        self.interaction = interaction
+        self._closed = False
+
+    async def __aiter__(self) -> AsyncIterator[bytes]:
+        for delay, text in self.interaction.chunks:
+            wait = self.cassette._delay(delay)
+            if wait:
+                await asyncio.sleep(wait)
+            if self._closed:
+                return
+            yield text.encode('utf-8')
+
+    async def aclose(self):
+        self._closed = True
+
+
+class _ReplayTransport(httpx.BaseTransport):
+    def __init__(self, cassette: Cassette):
+        self.cassette = cassette
+
+    def handle_request(self, request: httpx.Request) -> httpx.Response:
+        interaction = self.cassette._match(request.method, request.url.path, _request_body(request))
+        if interaction is None:
+            return _miss_response(request)
+        if interaction.error:
+            time.sleep(self.cassette._delay(interaction.duration))
+            _raise_recorded(interaction, request)
+        return httpx.Response(interaction.status or 200, headers=_replay_headers(interaction),
+                              stream=_ReplayStream(self.cassette, interaction), request=request)
+
+
+class _AsyncReplayTransport(httpx.AsyncBaseTransport):
+    def __init__(self, cassette: Cassette):
+        self.cassette = cassette
+
+    async def handle_async_request(self, request: httpx.Request) -> httpx.Response:
+        interaction = self.cassette._match(request.method, request.url.path, _request_body(request))
+        if interaction is None:
+            return _miss_response(request)
+        if interaction.error:
+            await asyncio.sleep(self.cassette._delay(interaction.duration))
+            _raise_recorded(interaction, request)
+        return httpx.Response(interaction.status or 200, headers=_replay_headers(interaction),
+                              stream=_AsyncReplayStream(self.cassette, interaction), request=request)
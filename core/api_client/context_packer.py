@@ -0,0 +1,261 @@
+from collections import OrderedDict
+from typing import Dict, Any, Optional, List, Callable
+import threading
+import hashlib
+import logging
+from core.api_client.tokenizer import token_counter, TokenCounter
+
+logger = logging.getLogger(__name__)
+
+# 只在打包阶段使用、发送前剥离的消息字段
+PRIORITY_KEY = "priority"  # 数值越大越晚被压缩
+COMPRESS_KEY = "compress"  # False表示该消息不可压缩
+BLOCKS_KEY = "blocks"  # 正文的分块列表[{"text", "priority"}]，见PromptLayout.volatile
+_PACKING_KEYS = (PRIORITY_KEY, COMPRESS_KEY, BLOCKS_KEY)
+BLOCK_SEPARATOR = "\n\n"
+
+# 按角色的默认优先级；最后一条消息（本次请求）与系统提示视为固定
+ROLE_PRIORITIES = {"system": 100, "user": 50, "assistant": 40}
+PINNED_PRIORITY = 100  # 不低于此优先级的块只在最后一轮按比例截断，不会被省略
+RECENCY_STEP = 0.01  # 同优先级下越早的块越先压缩
+
+# 截断时保留的头部比例，其余保留尾部（尾部通常是最新的章节或要求）
+HEAD_RATIO = 0.7
+MIN_BLOCK_TOKENS = 64  # 压缩后低于此值的块直接用占位说明代替
+OMITTED_TEXT = "（此处内容因超出模型上下文长度已省略）"
+
+
+def strip_packing_keys(messages: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """去掉打包用的附加字段，返回可直接发送的消息列表"""
+    if not any(key in message for message in messages for key in _PACKING_KEYS):
+        return messages
+    return [{k: v for k, v in message.items() if k not in _PACKING_KEYS} for message in messages]
+
+
+def truncate_marker(omitted_chars: int) -> str:
+    return f"\n……（中间省略约{omitted_chars}字）……\n"
+
+
+class _Block:
+    """打包的最小单位：一条消息的全部正文或其中的一个分块"""
+    __slots__ = ("message", "text", "priority", "compressible", "tokens")
+
+    def __init__(self, message: int, text: str, priority: float, compressible: bool):
+        self.message = message
+        self.text = text
+        self.priority = priority
+        self.compressible = compressible
+        self.tokens = 0
+
+
+class ContextPacker:
+    """请求发送前的上下文打包
+
+    按目标模型的上下文窗口为prompt分配预算：预留输出空间后，若消息总token数超出预算，
+    按优先级从低到高压缩（同优先级先压缩较早的），直到放得下为止：
+    1. 低优先级块先缩减到所需长度（有summarizer时摘要，否则保留首尾截断中间）；
+    2. 仍超出时，非固定块替换为一行占位说明；
+    3. 最后才按比例截断系统提示与本次请求等固定块。
+    默认优先级按角色决定（系统提示与最后一条消息固定，较早的对话历史可压缩）；
+    消息可带priority（数值）、compress（False为不可压缩）与blocks（正文分块及各块优先级）
+    字段指定打包行为，这些字段发送前会被剥离。
+    压缩结果按(内容哈希, 分词器, 目标token数)缓存，同一段长世界观或章节在
+    多次请求、多次重试之间只压缩一次；summarizer在请求线程中同步调用，应足够快。
+    """
+
+    def __init__(self, counter: TokenCounter = token_counter, max_cached: int = 256,
+                 reserve_ratio: float = 0.5, min_reserve: int = 512):
+        self.counter = counter
+        self.max_cached = max_cached  # 压缩结果缓存的最大条目数
+        self.reserve_ratio = reserve_ratio  # 为输出预留的空间最多占上下文窗口的比例
+        self.min_reserve = min_reserve  # 至少为输出预留的token数
+        self.enabled = True
+        # 可选的摘要函数(text, target_tokens) -> str，未设置或失败时退回截断
+        self.summarizer: Optional[Callable[[str, int], str]] = None
+        self._cache: "OrderedDict[tuple, str]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._counters = {
+            "requests": 0, "packed": 0, "compressed": 0, "omitted": 0,
+            "summarized": 0, "cache_hits": 0, "overflow": 0, "saved_tokens": 0
+        }
+
+    def budget(self, context_window: int, max_output: int) -> int:
+        """prompt可用的token数：上下文窗口减去预留的输出空间与估算误差余量"""
+        reserve = max(min(max_output, int(context_window * self.reserve_ratio)), self.min_reserve)
+        available = context_window - reserve
+        margin = max(64, int(available * 0.05))
+        return max(available - margin, 0)
+
+    def pack(self, messages: List[Dict[str, Any]], model: Optional[str] = None,
+             context_window: Optional[int] = None, max_output: int = 0) -> List[Dict[str, Any]]:
+        """返回适配目标模型上下文窗口的消息列表（未超出时原样返回，仅剥离打包字段）"""
+        with self._lock:
+            self._counters["requests"] += 1
+        clean = strip_packing_keys(messages)
+        if not self.enabled or not context_window or not messages:
+            return clean
+
+        budget = self.budget(context_window, max_output)
+        original = self.counter.count_messages(clean, model)
+        if original <= budget:
+            return clean
+
+        tokenizer = self.counter.for_model(model)
+        blocks = self._blocks(messages)
+        for block in blocks:
+            block.tokens = self.counter.count(block.text, tokenizer)
+        # 消息格式开销与分块分隔符，不随压缩变化
+        fixed = original - sum(block.tokens for block in blocks)
+
+        def excess() -> int:
+            return fixed + sum(block.tokens for block in blocks) - budget
+
+        order = [block for _, block in sorted(
+            ((block.priority + i * RECENCY_STEP, block) for i, block in enumerate(blocks) if block.compressible),
+            key=lambda item: item[0])]
+        flexible = [b for b in order if b.priority < PINNED_PRIORITY]
+        pinned = [b for b in order if b.priority >= PINNED_PRIORITY]
+
+        # 1. 低优先级块逐个缩减到恰好放得下
+        for block in flexible:
+            over = excess()
+            if over <= 0:
+                break
+            self._replace(block, self._shrink(block.text, block.tokens - over, tokenizer, True), tokenizer)
+
+        # 2. 仍超出时省略非固定块
+        for block in flexible:
+            if excess() <= 0:
+                break
+            if block.text != OMITTED_TEXT:
+                self._replace(block, OMITTED_TEXT, tokenizer)
+                self._bump("omitted")
+
+        # 3. 最后按比例截断固定块
+        over = excess()
+        if over > 0 and pinned:
+            pinned_tokens = sum(block.tokens for block in pinned) or 1
+            for block in pinned:
+                keep = block.tokens - int(over * block.tokens / pinned_tokens + 0.999)
+                self._replace(block, self._shrink(block.text, keep, tokenizer, False), tokenizer)
+
+        total = budget + excess()
+        if total > budget:
+            self._bump("overflow")
+            logger.warning(f"压缩后prompt仍约 {total} tokens，超出 {model} 的预算 {budget}")
+        with self._lock:
+            self._counters["packed"] += 1
+            self._counters["saved_tokens"] += original - total
+        logger.info(f"上下文打包：{original} -> {total} tokens（{model}，预算 {budget}）")
+
+        packed = []
+        for i, message in enumerate(clean):
+            content = BLOCK_SEPARATOR.join(block.text for block in blocks if block.message == i)
+            packed.append(message if content == self._content(message) else {**message, "content": content})
+        return packed
+
+    def _blocks(self, messages: List[Dict[str, Any]]) -> List[_Block]:
+        """拆分为打包单位：带分块信息的消息按块拆分，其余消息整条作为一块"""
+        blocks = []
+        last = len(messages) - 1
+        for i, message in enumerate(messages):
+            priority = message.get(PRIORITY_KEY)
+            if priority is None:
+                priority = PINNED_PRIORITY if i == last else ROLE_PRIORITIES.get(message.get("role"), 50)
+            compressible = message.get(COMPRESS_KEY, True) is not False
+            content = self._content(message)
+            parts = message.get(BLOCKS_KEY) or []
+            if parts and BLOCK_SEPARATOR.join(part["text"] for part in parts) == content:
+                for part in parts:
+                    part_priority = part.get("priority")
+                    blocks.append(_Block(i, part["text"], priority if part_priority is None else part_priority,
+                                         compressible))
+            else:
+                blocks.append(_Block(i, content, priority, compressible))
+        return blocks
+
+    def _replace(self, block: _Block, text: str, tokenizer):
+        block.text = text
+        block.tokens = self.counter.count(text, tokenizer)
+
+    def _shrink(self, text: str, keep: int, tokenizer, allow_summary: bool) -> str:
+        """把文本压缩到约keep个token，结果按内容哈希缓存"""
+        if keep < MIN_BLOCK_TOKENS:
+            if allow_summary:
+                self._bump("omitted")
+                return OMITTED_TEXT
+            return self._truncate(text, max(keep, 1), tokenizer)
+        key = (hashlib.sha1(text.encode('utf-8')).digest(), tokenizer.name, keep, allow_summary)
+        with self._lock:
+            cached = self._cache.get(key)
+            if cached is not None:
+                self._cache.move_to_end(key)
+                self._counters["cache_hits"] += 1
+                return cached
+
+        result = None
+        if allow_summary and self.summarizer:
+            try:
+                result = self.summarizer(text, keep)
+            except Exception as e:
+                logger.warning(f"摘要失败，改为截断: {str(e)}")
+            if result and self.counter.count(result, tokenizer) <= keep:
+                self._bump("summarized")
+            else:
+                result = None
+        if result is None:
+            result = self._truncate(text, keep, tokenizer)
+
+        with self._lock:
+            self._counters["compressed"] += 1
+            self._cache[key] = result
+            while len(self._cache) > self.max_cached:
+                self._cache.popitem(last=False)
+        return result
+
+    def _truncate(self, text: str, keep: int, tokenizer) -> str:
+        """保留首尾、省略中间，尽量在换行处断开"""
+        tokens = self.counter.count(text, tokenizer)
+        if tokens <= keep:
+            return text
+        ratio = keep / tokens
+        for _ in range(4):
+            chars = max(int(len(text) * ratio), 0)
+            head_len = int(chars * HEAD_RATIO)
+            tail_len = chars - head_len
+            head = text[:head_len]
+            tail = text[len(text) - tail_len:] if tail_len else ""
+            cut = head.rfind("\n")
+            if cut > head_len * 0.8:
+                head = head[:cut]
+            cut = tail.find("\n")
+            if 0 <= cut < tail_len * 0.2:
+                tail = tail[cut + 1:]
+            result = head + truncate_marker(len(text) - len(head) - len(tail)) + tail
+            size = self.counter.count(result, tokenizer)
+            if size <= keep:
+                return result
+            ratio *= keep / size * 0.98
+        return text[:max(int(len(text) * ratio), 0)]
+
+    @staticmethod
+    def _content(message: Dict[str, Any]) -> str:
+        content = message.get("content") or ""
+        return content if isinstance(content, str) else str(content)
+
+    def _bump(self, name: str):
+        with self._lock:
+            self._counters[name] += 1
+
+    def stats(self) -> Dict[str, Any]:
+        """返回打包统计信息"""
+        with self._lock:
+            return {**self._counters, "cached": len(self._cache)}
+
+    def clear(self):
+        with self._lock:
+            self._cache.clear()
+
+
+# 全局上下文打包器实例
+context_packer = ContextPacker()
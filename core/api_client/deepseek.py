@@ -1,23 +1,61 @@
-from openai import OpenAI
 from typing import Iterator, Optional, Dict, Any, List
-from modules.GlobalModule import global_config
+from concurrent.futures import CancelledError
+from modules.GlobalModule import global_config, GenerationSettings
 import os
 import httpx
+import threading
 import time
 import logging
 from modules.AuthModule import validate_token
-from utils.config_loader import get_version_info, get_api_key
+from utils.config_loader import get_version_info, get_provider_key
 from cryptography.fernet import Fernet
+from core.api_client.pool import client_pool, PoolLease
+from core.api_client.response_cache import response_cache, CACHE_NEVER
+from core.api_client.tokenizer import token_counter
+from core.api_client.rate_limit import rate_limiter
+from core.api_client.batch import run_batch, BatchResult, BatchItemError
+from core.api_client.handle import GenerationHandle, new_handle, handle_registry
+from core.api_client.router import model_router, ModelTarget
+from core.api_client.retry import retry_engine, RetryState, CircuitOpenError, classify_error
+from core.api_client.telemetry import telemetry, StreamTimer
+from core.api_client.prompt_layout import prompt_cache_stats
+from core.api_client.context_packer import context_packer
+from core.api_client.warmup import warmup_service
+from core.persistence.journal import generation_journal
 
 logger = logging.getLogger(__name__)
 
+# 支持stream_options.include_usage、会在流末尾返回usage的提供商
+_STREAM_USAGE_PROVIDERS = ("DeepSeek", "Qwen")
+
+# 至少为输出保留的令牌数（配置的max_tokens更小时以配置为准）
+_MIN_OUTPUT_TOKENS = 256
+
+
+class APIKeyMissingError(Exception):
+    """当前提供商未配置API密钥"""
+
+
+class ContextOverflowError(Exception):
+    """prompt占满模型上下文窗口，留给输出的令牌数不足"""
+
+
 class DeepSeekAPIClient:
     """DeepSeek API客户端，处理与DeepSeek API的所有交互"""
     
     def __init__(self):
         self.key_cache = {}  # 简单缓存机制
-        self.max_retries = 3  # 最大重试次数
-        self.retry_delay = 2  # 重试延迟（秒）
+        self.pool = client_pool  # 长连接客户端注册表
+        self.cache = response_cache  # 按内容寻址的响应缓存
+        self.tokens = token_counter  # 按模型选择的token计数器
+        self.limiter = rate_limiter  # 按提供商的请求/token限流
+        self.router = model_router  # 等价模型之间的故障转移与对冲
+        self.retry = retry_engine  # 错误分类、退避重试与按提供商/模型熔断
+        self.journal = generation_journal  # 流式生成的崩溃安全日志
+        self.prompt_cache = prompt_cache_stats  # 提供商前缀缓存命中统计
+        self.telemetry = telemetry  # 首字延迟、生成速度等指标
+        self.packer = context_packer  # 超出上下文窗口时按优先级压缩消息
+        self.warmup = warmup_service  # 后台预先建立与当前提供商的连接
         logger.debug("初始化DeepSeek API客户端")
     
     # def _fetch_encrypted_key(self) -> str:
@@ -48,286 +86,615 @@ class DeepSeekAPIClient:
     #     f = Fernet(os.getenv('APP_JWT_SECRET').encode())
     #     return f.decrypt(encrypted.encode()).decode()
 
-    def _get_api_key(self) -> str:
+    def _get_api_key(self, provider: Optional[str] = None) -> str:
         """获取API密钥
         
-        根据当前选择的模型提供商(global_config.model_config.provider)
+        根据提供商（默认为当前选择的模型提供商global_config.model_config.provider）
         从apikey.yaml文件的providers部分获取对应的API密钥。
         例如，当provider为"DeepSeek"时，会返回DeepSeek的API密钥；
         当provider为"Qwen"时，会返回Qwen的API密钥。
         """
-        # 直接从apikey.yaml获取API密钥
-        api_keys = get_api_key()
-        provider = global_config.model_config.provider
-        
-        # 获取对应提供商的API密钥
-        key = api_keys.get('providers', {}).get(provider, "")
+        # 从apikey.yaml的缓存快照获取，文件未变化时不重新解析
+        provider = provider or global_config.model_config.provider
+        key = get_provider_key(provider)
         
         if not key:
             logger.warning(f"警告: 没有找到提供商 {provider} 的API密钥")
             
         return key
 
-    def generate(self, messages: List[Dict[str, Any]]) -> str:
-        """生成文本"""
+    def _has_api_key(self, provider: str) -> bool:
+        """提供商是否配置了API密钥（不输出警告）"""
+        return bool(get_provider_key(provider))
+
+    def _lease_client(self, api_key: str, target: Optional[ModelTarget] = None) -> PoolLease:
+        """从连接池租用目标提供商（默认当前提供商）的客户端，复用已建立的连接
+
+        请求或流结束后须释放租约，期间客户端不会被空闲回收或切换模型关闭。
+        """
+        target = target or ModelTarget.current()
+        return self.pool.lease(target.provider, target.base_url, api_key)
+
+    def _route(self, model_name: Optional[str] = None) -> List[ModelTarget]:
+        """返回本次请求依次尝试的目标模型，均未配置密钥时抛出APIKeyMissingError"""
+        targets = [
+            target for target in self.router.chain(model_name, has_key=self._has_api_key)
+            if self._has_api_key(target.provider)
+        ]
+        if not targets:
+            raise APIKeyMissingError("未找到API密钥，请在设置中配置")
+        return targets
+
+    def _next_target(self, state: RetryState):
+        """下一次尝试的目标与需等待的秒数
+
+        先依次故障转移到备选模型（不等待），回到失败过的模型时按退避策略等待；
+        熔断中的模型被跳过，全部熔断时抛出CircuitOpenError。
+        """
+        previous = state.target
+        target, delay = state.next()
+        if previous is not None and target is not previous:
+            self.router.record("failovers")
+            self.telemetry.retry(previous.name, previous.provider, "failover")
+            logger.warning(f"{previous.name} 请求失败，切换到 {target.name}")
+        elif previous is not None:
+            self.telemetry.retry(target.name, target.provider, "backoff")
+            logger.info(f"{delay:.2f} 秒后重试 {target.name}")
+        return target, delay
+
+    def _record_failure(self, target: ModelTarget, timer: Optional[StreamTimer], e: Exception,
+                        cancelled: bool = False):
+        """记录一次失败的尝试"""
+        if timer is not None:
+            timer.finish("cancelled" if cancelled else "error")
+        if not cancelled:
+            self.telemetry.error(target.name, target.provider, classify_error(e))
+
+    def _on_model_changed(self, previous: Dict[str, Any]):
+        """模型切换回调：提供商或地址变化时关闭旧客户端，并在后台预热新提供商的连接"""
+        current = global_config.model_config
+        if previous.get('provider') == current.provider and previous.get('base_url') == current.base_url:
+            return
+        closed = self.pool.invalidate(previous.get('provider'), previous.get('base_url'))
+        self.warmup.forget(previous.get('provider'), previous.get('base_url'))
+        logger.debug(f"提供商切换为 {current.provider}，已关闭 {closed} 个旧客户端（仍在使用的在请求结束后关闭）")
+        self.warmup.warm()
+
+    def pool_stats(self) -> Dict[str, Any]:
+        """返回连接池统计信息"""
+        return self.pool.stats()
+
+    def cache_stats(self) -> Dict[str, Any]:
+        """返回响应缓存统计信息"""
+        return self.cache.stats()
+
+    def rate_limit_stats(self) -> Dict[str, Any]:
+        """返回限流统计信息"""
+        return self.limiter.stats()
+
+    def routing_stats(self) -> Dict[str, Any]:
+        """返回故障转移与对冲统计信息"""
+        return self.router.stats()
+
+    def retry_stats(self) -> Dict[str, Any]:
+        """返回重试计数与各提供商/模型的熔断器状态"""
+        return self.retry.stats()
+
+    def prompt_cache_stats(self) -> Dict[str, Any]:
+        """返回各提示词族在各模型上的前缀缓存命中率"""
+        return self.prompt_cache.stats()
+
+    def telemetry_stats(self) -> Dict[str, Any]:
+        """返回首字延迟、块间隔、生成速度与总耗时等指标摘要"""
+        return self.telemetry.stats()
+
+    def warmup_stats(self) -> Dict[str, Any]:
+        """返回连接预热状态"""
+        return self.warmup.stats()
+
+    def packing_stats(self) -> Dict[str, Any]:
+        """返回上下文打包（超窗压缩）统计信息"""
+        return self.packer.stats()
+
+    def _cache_key(self, params: Dict[str, Any], cache_policy: str) -> Optional[str]:
+        """按缓存策略返回本次请求的缓存键，不走缓存时返回None"""
+        if self.cache.should_cache(params, cache_policy):
+            return self.cache.make_key(params)
+        return None
+
+    def generate(self, messages: List[Dict[str, Any]], cache_policy: str = CACHE_NEVER,
+                 model_name: Optional[str] = None, prompt_family: Optional[str] = None,
+                 settings: Optional[GenerationSettings] = None) -> str:
+        """生成文本
+
+        cache_policy: 缓存策略，never/deterministic/always，命中时直接返回缓存结果
+        model_name: 指定model_mapping中的模型，默认使用当前选择的模型
+        prompt_family: 提示词族（见PromptLayout），用于按族统计前缀缓存命中率
+        settings: 本次请求的生成参数快照，默认取开始生成时的全局参数
+        """
         logger.debug(f"开始生成文本，消息数: {len(messages)}")
         
-        for attempt in range(self.max_retries):
+        try:
+            return self._complete(messages, cache_policy, model_name=model_name, prompt_family=prompt_family,
+                                  settings=settings)
+        except APIKeyMissingError:
+            logger.error("未找到API密钥")
+            return "错误: 未找到API密钥，请在设置中配置"
+        except httpx.HTTPError as e:
+            return f"API请求失败: {str(e)}"
+        except (CircuitOpenError, ContextOverflowError) as e:
+            logger.warning(str(e))
+            return f"生成失败: {str(e)}"
+        except Exception as e:
+            logger.exception(f"生成文本时发生错误: {str(e)}")
+            return f"生成失败: {str(e)}"
+
+    def _complete(self, messages: List[Dict[str, Any]], cache_policy: str = CACHE_NEVER,
+                  cancel_event=None, model_name: Optional[str] = None,
+                  prompt_family: Optional[str] = None,
+                  settings: Optional[GenerationSettings] = None) -> str:
+        """执行一次非流式请求，失败时抛出异常而不是返回错误文本
+
+        连接失败、超时、限流或服务端错误时沿路由链路切换到等价模型或退避重试。
+        """
+        # 请求开始时取一次快照，重试与故障转移沿用同一组参数
+        settings = settings or global_config.generation_settings()
+        state = self.retry.begin(self._route(model_name))
+        while True:
+            target, delay = self._next_target(state)
+            if delay:
+                if cancel_event is None:
+                    time.sleep(delay)
+                elif cancel_event.wait(delay):
+                    raise CancelledError()
+            timer = lease = None
             try:
-                api_key = self._get_api_key()
-                if not api_key:
-                    logger.error("未找到API密钥")
-                    return "错误: 未找到API密钥，请在设置中配置"
+                lease = self._lease_client(self._get_api_key(target.provider), target)
+                client = lease.client
                 
-                client = OpenAI(
-                    api_key=api_key,
-                    base_url=global_config.model_config.base_url
-                )
+                params = self._build_params(messages, stream=False, target=target, settings=settings)
                 
-                params = {
-                    "model": global_config.model_config.model,
-                    "messages": messages,
-                    "temperature": global_config.generation_params.temperature,
-                    "top_p": global_config.generation_params.top_p,
-                    "frequency_penalty": global_config.generation_params.frequency_penalty,
-                    "presence_penalty": global_config.generation_params.presence_penalty,
-                    "max_tokens": self._calculate_max_tokens(messages),
-                    "stream": False,
-                }
+                cache_key = self._cache_key(params, cache_policy)
+                if cache_key:
+                    cached = self.cache.get(cache_key)
+                    if cached is not None:
+                        logger.debug("响应缓存命中")
+                        state.release()
+                        return cached
                 
                 logger.debug(f"使用模型: {params['model']}")
                 
+                self.limiter.acquire(target.provider, self.tokens.count_messages(params["messages"], target.name), cancel_event)
+                timer = self.telemetry.timer(target.name, target.provider, prompt_family)
                 response = client.chat.completions.create(**params)
-                return response.choices[0].message.content or ""
+                content = response.choices[0].message.content or ""
+                completion_tokens = self._completion_tokens(response, content)
+                timer.finish("ok", completion_tokens)
+                self.limiter.record(target.provider, completion_tokens)
+                self.prompt_cache.record(prompt_family, target.name, getattr(response, 'usage', None))
+                state.succeeded()
+                if cache_key:
+                    self.cache.put(cache_key, content, params['model'])
+                return content
                 
-            except httpx.HTTPError as e:
-                logger.error(f"HTTP错误 (尝试 {attempt+1}/{self.max_retries}): {str(e)}")
-                if attempt < self.max_retries - 1:
-                    time.sleep(self.retry_delay)
-                else:
-                    return f"API请求失败: {str(e)}"
-                    
             except Exception as e:
-                logger.exception(f"生成文本时发生错误: {str(e)}")
-                return f"生成失败: {str(e)}"
+                self._record_failure(target, timer, e)
+                if not state.failed(e):
+                    raise
+                logger.error(f"请求失败 (尝试 {state.attempt}/{state.policy.max_attempts}, {target.name}): {str(e)}")
+            finally:
+                if lease is not None:
+                    lease.release()
+
+    def generate_many(self, requests, max_concurrency: int = 4, ordered: bool = False,
+                      cancel_event=None, cache_policy: str = CACHE_NEVER,
+                      settings: Optional[GenerationSettings] = None) -> Iterator[BatchResult]:
+        """并发执行多个独立的生成请求，按完成顺序（ordered=True时按输入顺序）产出结果
+
+        requests中每项为消息列表，或形如{"messages": [...], "cache_policy": ..., "model_name": ...,
+        "prompt_family": ..., "settings": ..., "label": ...}的字典；未指定settings的请求共用调用时的全局参数快照。
+        每项结果为BatchResult，单项失败只体现在该项的error中（BatchItemError，消息为面向用户的错误信息）；
+        设置cancel_event或提前关闭迭代器会取消尚未开始的请求，执行中的请求随即关闭连接。
+        每项以流式请求执行并持有自己的生成句柄，可在句柄列表中查看进度。
+        限流由rate_limiter按提供商统一控制，max_concurrency只限制同时在途的请求数。
+        """
+        settings = settings or global_config.generation_settings()
+        active = set()
+        lock = threading.Lock()
+
+        def worker(request, event):
+            if not isinstance(request, dict):
+                request = {"messages": request}
+            handle = new_handle(request.get("label") or "批量生成")
+            with lock:
+                active.add(handle)
+            try:
+                # 登记句柄之后再检查，取消与登记交错时也不会漏掉
+                if event.is_set():
+                    handle.cancel()
+                for _ in self.stream_generate(request["messages"], cache_policy=request.get("cache_policy", cache_policy),
+                                              handle=handle, model_name=request.get("model_name"),
+                                              prompt_family=request.get("prompt_family"),
+                                              settings=request.get("settings") or settings):
+                    pass
+            finally:
+                with lock:
+                    active.discard(handle)
+            if handle.cancelled:
+                raise CancelledError()
+            if handle.error:
+                raise BatchItemError(handle.error)
+            return handle.content
+
+        def cancel_active():
+            with lock:
+                handles = list(active)
+            for handle in handles:
+                handle.cancel()
+
+        return run_batch(worker, requests, max_concurrency=max_concurrency,
+                         ordered=ordered, cancel_event=cancel_event, on_cancel=cancel_active)
+
+    def _completion_tokens(self, response, content: str) -> int:
+        """输出token数，优先使用接口返回的usage"""
+        usage = getattr(response, 'usage', None)
+        completion_tokens = getattr(usage, 'completion_tokens', None) if usage else None
+        if completion_tokens:
+            return completion_tokens
+        return self.tokens.count(content)
     
-    def stream_generate(self, messages: List[Dict[str, Any]], callback=None) -> Iterator[str]:
-        """流式生成文本，支持回调函数处理每个块"""
+    def new_handle(self, label: str = "") -> GenerationHandle:
+        """创建生成句柄，传给stream_generate后可用于取消和查询状态"""
+        return new_handle(label)
+
+    def active_generations(self) -> List[Dict[str, Any]]:
+        """返回所有进行中生成的状态"""
+        return handle_registry.status()
+
+    def _open_journal(self, handle: GenerationHandle, messages: List[Dict[str, Any]],
+                      model_name: Optional[str] = None, resume_of: Optional[str] = None):
+        """为句柄创建生成日志（已有日志时不重复创建）"""
+        if handle.journal is None:
+            handle.attach_journal(self.journal.open(
+                handle.label, model_name or global_config.model_config.name, messages, resume_of
+            ))
+
+    def incomplete_generations(self) -> List[Dict[str, Any]]:
+        """返回被取消、失败或因崩溃中断、可以恢复的生成"""
+        return self.journal.list()
+
+    def resume_generation(self, journal_id: str, callback=None,
+                          handle: Optional[GenerationHandle] = None,
+                          settings: Optional[GenerationSettings] = None):
+        """从中断处续写一次生成，返回值与stream_generate相同（异步客户端为异步迭代器）
+
+        已保存的正文不会再次产出，可通过self.journal.recover(journal_id)取得后先行显示。
+        新日志包含原有内容与续写内容，创建后旧日志即被删除。
+        """
+        record = self.journal.recover(journal_id)
+        handle = handle or new_handle(record.label)
+        self._open_journal(handle, record.messages, record.model, resume_of=journal_id)
+        if handle.journal is not None:
+            if record.reasoning:
+                handle.journal.reasoning(record.reasoning)
+            if record.content:
+                handle.journal.content(record.content)
+            handle.journal.flush()
+            self.journal.discard(journal_id)
+        model_name = record.model if record.model in global_config.model_mapping else None
+        return self.stream_generate(record.resume_messages(), callback, handle=handle, model_name=model_name,
+                                    settings=settings)
+
+    def stream_generate(self, messages: List[Dict[str, Any]], callback=None,
+                        cache_policy: str = CACHE_NEVER,
+                        handle: Optional[GenerationHandle] = None,
+                        model_name: Optional[str] = None,
+                        prompt_family: Optional[str] = None,
+                        settings: Optional[GenerationSettings] = None) -> Iterator[str]:
+        """流式生成文本，支持回调函数处理每个块
+
+        cache_policy: 缓存策略，命中时整段缓存内容作为一个块返回
+        handle: 生成句柄，调用handle.cancel()会关闭底层响应并结束本次生成；
+            不传时内部创建，每次生成的状态互相独立
+        model_name: 指定model_mapping中的模型，默认使用当前选择的模型。
+            尚未输出任何内容前失败时，沿路由链路切换到等价模型
+        prompt_family: 提示词族，用于按族统计前缀缓存命中率
+        settings: 本次请求的生成参数快照，默认取开始生成时的全局参数
+        """
         logger.debug(f"开始流式生成文本，消息数: {len(messages)}")
 
-        # 创建停止标记，用于在外部停止生成时快速结束
-        self._generation_stopped = False
+        settings = settings or global_config.generation_settings()
+        handle = handle or new_handle()
+        handle.start()
+        self._open_journal(handle, messages, model_name)
+        error = None
         
-        for attempt in range(self.max_retries):
+        try:
             try:
-                api_key = self._get_api_key()
-                if not api_key:
-                    logger.error("未找到API密钥")
-                    error_msg = "错误: 未找到API密钥，请在设置中配置"
-                    if callback:
-                        callback(error_msg)
-                    yield error_msg
+                state = self.retry.begin(self._route(model_name))
+            except APIKeyMissingError:
+                logger.error("未找到API密钥")
+                error = "错误: 未找到API密钥，请在设置中配置"
+                if callback:
+                    callback(error)
+                yield error
+                return
+            
+            while True:
+                if handle.cancelled:
                     return
-                
-                client = OpenAI(
-                    api_key=api_key,
-                    base_url=global_config.model_config.base_url
-                )
-                
-                # 获取模型信息
-                model_name = global_config.model_config.name
-                is_reasoning_model = "DeepSeek-R1" in model_name or "Qwen-R1" in model_name
-                is_qwen_model = "Qwen" in model_name
-                is_hunyuan_model = "HunYuan" in model_name
-                
-                # 构建基本参数
-                params = {
-                    'model': global_config.model_config.model,
-                    'messages': messages,
-                    'temperature': global_config.generation_params.temperature,
-                    'frequency_penalty': global_config.generation_params.frequency_penalty,
-                    'presence_penalty': global_config.generation_params.presence_penalty,
-                    'top_p': global_config.generation_params.top_p,
-                    'stream': True
-                }
-                
-                # 设定最大tokens
-                params['max_tokens'] = min(
-                    global_config.generation_params.max_tokens,
-                    self._calculate_max_tokens(messages)
-                )
-                
-                # 模型特定参数调整
-                if is_qwen_model:
-                    # 青云模型特定参数，有些模型不支持response_format参数
-                    if hasattr(global_config.generation_params, 'response_format'):
-                        response_format = global_config.generation_params.response_format
-                        if isinstance(response_format, dict) and response_format.get('type') == 'json':
-                            params['response_format'] = response_format
-                elif is_hunyuan_model:
-                    # 混元模型特殊处理
-                    # 注意：混元模型可能对某些参数有特殊要求
-                    # 例如可能不支持某些OpenAI参数或需要额外参数
-                    pass
-                else:
-                    # 非特殊模型使用标准参数
-                    if hasattr(global_config.generation_params, 'response_format'):
-                        params['response_format'] = global_config.generation_params.response_format
-                
-                logger.debug(f"使用模型: {params['model']}，流式模式，参数: {params}")
-                
-                # 获取流式响应
-                stream = client.chat.completions.create(**params)
-                
-                # 记录已处理内容，防止重复
-                last_content = None
-                last_reasoning = None
-                
-                # 处理流式响应
-                for chunk in stream:
-                    # 外部中断检查
-                    if getattr(self, '_generation_stopped', False):
-                        logger.info("流生成被外部中断")
-                        break
-                        
-                    if not hasattr(chunk, 'choices') or not chunk.choices:
-                        continue
+                target = timer = lease = None
+                try:
+                    target, delay = self._next_target(state)
+                    # 等待期间可被取消
+                    if delay and handle.cancel_event.wait(delay):
+                        return
+                    lease = self._lease_client(self._get_api_key(target.provider), target)
+                    client = lease.client
                     
-                    # 尝试提取思维链内容（仅支持思维链的模型）
-                    if is_reasoning_model:
-                        delta = chunk.choices[0].delta
-                        reasoning = getattr(delta, 'reasoning_content', None)
-                        
-                        # 防止重复发送相同的思维链内容
-                        if reasoning and reasoning != last_reasoning:
-                            last_reasoning = reasoning
-                            if callback:
-                                # 对较长的思维链内容进行分块处理，确保流畅显示
-                                if len(reasoning) > 30:
-                                    # 将长内容分成小块，确保流畅显示
-                                    for i in range(0, len(reasoning), 30):
-                                        # 再次检查中断
-                                        if getattr(self, '_generation_stopped', False):
-                                            break
-                                        reasoning_chunk = reasoning[i:i+30]
-                                        callback({"reasoning_content": reasoning_chunk})
-                                        # 短暂延迟，模拟打字效果
-                                        time.sleep(0.01)
-                                else:
-                                    callback({"reasoning_content": reasoning})
-                            continue  # 思维链内容仅通过回调传递，不作为返回值
+                    is_reasoning_model = target.is_reasoning
+                    
+                    # 构建请求参数
+                    params = self._build_params(messages, stream=True, target=target, settings=settings)
                     
-                    # 检查是否结束思维链 (当delta中有普通内容但没有reasoning_content时)
-                    delta = chunk.choices[0].delta
-                    if is_reasoning_model and hasattr(delta, 'content') and delta.content and not getattr(delta, 'reasoning_content', None):
-                        # 检查是否已经发送过thinking_finished标记
-                        if not getattr(self, '_thinking_finished_sent', False):
-                            self._thinking_finished_sent = True
+                    cache_key = self._cache_key(params, cache_policy)
+                    if cache_key:
+                        cached = self.cache.get(cache_key)
+                        if cached is not None:
+                            logger.debug("响应缓存命中")
+                            state.release()
+                            handle.record_content(cached)
                             if callback:
-                                callback({"thinking_finished": True})
-                                time.sleep(0.2)  # 给UI一些时间来处理思维链结束标记
+                                callback(cached)
+                            yield cached
+                            return
                     
-                    # 提取内容增量
-                    content_delta = chunk.choices[0].delta.content
+                    logger.debug(f"使用模型: {params['model']}，流式模式，参数: {params}")
                     
-                    # 确保不是空内容且不重复
-                    if content_delta and content_delta != last_content:
-                        last_content = content_delta
-                        if callback:
-                            callback(content_delta)
-                        yield content_delta
-                
-                # 重置状态标记
-                self._thinking_finished_sent = False
-                self._generation_stopped = False
-                return
-                
-            except httpx.HTTPError as e:
-                error_msg = f"HTTP错误 (尝试 {attempt+1}/{self.max_retries}): {str(e)}"
-                logger.error(error_msg)
-                if attempt < self.max_retries - 1:
-                    time.sleep(self.retry_delay)
-                else:
-                    if callback:
-                        callback(f"API请求失败: {str(e)}")
-                    yield f"API请求失败: {str(e)}"
+                    # 获取流式响应，关联到句柄以便取消时立即关闭连接
+                    self.limiter.acquire(target.provider, self.tokens.count_messages(params["messages"], target.name),
+                                         handle.cancel_event)
+                    started = time.monotonic()
+                    timer = self.telemetry.timer(target.name, target.provider, prompt_family, started)
+                    stream = client.chat.completions.create(**params)
+                    handle.bind_response(stream)
                     
-            except Exception as e:
-                error_msg = f"流式生成文本时发生错误: {str(e)}"
-                logger.exception(error_msg)
-                
-                # 改进错误信息可读性
-                user_error_msg = f"生成失败: {str(e)}"
-                
-                # 针对认证错误提供更具体的建议
-                if "AuthenticationError" in str(type(e)) or "401" in str(e):
-                    provider = global_config.model_config.provider
-                    provider_info = ""
+                    # 记录已处理内容，防止重复
+                    last_content = None
+                    last_reasoning = None
                     
-                    if provider == "Qwen":
-                        provider_info = "对于Qwen模型，确保使用的是通义千问提供的密钥"
-                    elif provider == "HunYuan":
-                        provider_info = "对于HunYuan模型，确保使用的是腾讯混元提供的密钥"
-                    elif provider == "DeepSeek":
-                        provider_info = "对于DeepSeek模型，确保使用的是DeepSeek提供的密钥"
-                        
-                    user_error_msg = (
-                        f"API密钥认证失败: {str(e)}\n\n"
-                        f"可能的解决方案:\n"
-                        f"1. 检查apikey.yaml中的密钥是否正确\n"
-                        f"2. {provider_info}\n"
-                        f"3. 确认当前选择的模型({global_config.model_config.name})与您的API密钥匹配\n"
-                        f"4. 检查模型配置中的base_url是否正确"
-                    )
+                    # 处理流式响应
+                    try:
+                        for chunk in stream:
+                            # 外部中断检查
+                            if handle.cancelled:
+                                logger.info(f"生成 #{handle.id} 被外部中断")
+                                break
+                            
+                            if not hasattr(chunk, 'choices') or not chunk.choices:
+                                # 流末尾的usage块
+                                self._record_stream_usage(handle, target, chunk, prompt_family)
+                                continue
+                            
+                            delta = chunk.choices[0].delta
+                            reasoning = getattr(delta, 'reasoning_content', None) if is_reasoning_model else None
+                            content_delta = delta.content
+                            
+                            # 记录首字延迟，用于对冲阈值
+                            if handle.chunks == 0 and (reasoning or content_delta):
+                                self.router.latency.observe(target.name, time.monotonic() - started)
+                            
+                            # 尝试提取思维链内容（仅支持思维链的模型）
+                            # 防止重复发送相同的思维链内容
+                            if reasoning and reasoning != last_reasoning:
+                                last_reasoning = reasoning
+                                timer.chunk(reasoning=True)
+                                handle.record_reasoning(reasoning)
+                                # 原样转发，显示节奏由界面侧的StreamBuffer控制，网络读取不等待
+                                if callback:
+                                    callback({"reasoning_content": reasoning})
+                                continue  # 思维链内容仅通过回调传递，不作为返回值
+                            
+                            # 检查是否结束思维链 (当delta中有普通内容但没有reasoning_content时)
+                            if is_reasoning_model and content_delta and not reasoning:
+                                # 每个句柄只发送一次thinking_finished标记
+                                if not handle.thinking_finished_sent:
+                                    handle.thinking_finished_sent = True
+                                    if callback:
+                                        callback({"thinking_finished": True})
+                            
+                            # 确保不是空内容且不重复
+                            if content_delta and content_delta != last_content:
+                                last_content = content_delta
+                                timer.chunk()
+                                handle.record_content(content_delta)
+                                if callback:
+                                    callback(content_delta)
+                                yield content_delta
+                    finally:
+                        # 无论正常结束、取消还是调用方提前退出，都立即释放连接
+                        handle.unbind()
+                        stream.close()
                     
-                # 通过回调发送用户错误消息
-                if callback:
-                    callback(user_error_msg)
-                yield user_error_msg
-        
-        # 确保清理状态
-        self._thinking_finished_sent = False
-        self._generation_stopped = False
+                    self.limiter.record(target.provider, self._handle_tokens(handle))
+                    timer.finish("cancelled" if handle.cancelled else "ok", self._handle_tokens(handle))
+                    if not handle.cancelled:
+                        state.succeeded()
+                    
+                    # 仅缓存完整结束的生成
+                    if cache_key and not handle.cancelled:
+                        self.cache.put(cache_key, handle.content, params['model'])
+                    return
+                    
+                except Exception as e:
+                    if target is not None:
+                        self._record_failure(target, timer, e, cancelled=handle.cancelled)
+                    if handle.cancelled:
+                        return  # 取消时关闭响应引起的读取错误
+                    # 尚未输出内容时可以换提供商重试，已输出部分内容则不能无缝切换
+                    if target is not None and state.failed(e) and handle.chunks == 0:
+                        logger.error(f"请求失败 (尝试 {state.attempt}/{state.policy.max_attempts}, {target.name}): {str(e)}")
+                        continue
+                    
+                    if isinstance(e, httpx.HTTPError):
+                        logger.error(f"HTTP错误 ({target.name}): {str(e)}")
+                        error = f"API请求失败: {str(e)}"
+                    elif isinstance(e, (CircuitOpenError, ContextOverflowError)):
+                        logger.warning(str(e))
+                        error = f"生成失败: {str(e)}"
+                    else:
+                        logger.exception(f"流式生成文本时发生错误: {str(e)}")
+                        # 改进错误信息可读性
+                        error = self._format_error_message(e)
+                    
+                    # 通过回调发送用户错误消息
+                    if callback:
+                        callback(error)
+                    yield error
+                    return
+                finally:
+                    # 流读取结束后才释放租约，连接池此后才可能关闭该客户端
+                    if lease is not None:
+                        lease.release()
+        finally:
+            handle.finish(error)
     
-    def _build_params(self, messages: List[Dict[str, Any]]) -> Dict[str, Any]:
-        """构建API请求参数"""
+    def _record_stream_usage(self, handle: GenerationHandle, target: ModelTarget, chunk,
+                             prompt_family: Optional[str]):
+        """记录流式响应末尾返回的usage"""
+        usage = getattr(chunk, 'usage', None)
+        if not usage:
+            return
+        handle.completion_tokens = getattr(usage, 'completion_tokens', None)
+        self.prompt_cache.record(prompt_family, target.name, usage)
+
+    def _handle_tokens(self, handle: GenerationHandle) -> int:
+        """本次流式生成的输出token数，优先使用接口返回的usage"""
+        if handle.completion_tokens:
+            return handle.completion_tokens
+        return self.tokens.count(handle.content)
+
+    def _is_reasoning_model(self) -> bool:
+        """当前模型是否输出思维链"""
+        return ModelTarget.current().is_reasoning
+
+    def _build_params(self, messages: List[Dict[str, Any]], stream: bool = False,
+                      target: Optional[ModelTarget] = None,
+                      settings: Optional[GenerationSettings] = None) -> Dict[str, Any]:
+        """构建API请求参数，target默认为当前选择的模型，settings默认取当前全局参数"""
+        target = target or ModelTarget.current()
+        settings = settings or global_config.generation_settings()
+        model_name = target.name
+        is_qwen_model = "Qwen" in model_name
+        is_hunyuan_model = "HunYuan" in model_name
+        # 按目标模型的上下文窗口打包消息，故障转移到小窗口模型时会重新压缩
+        messages = self.packer.pack(messages, model_name, target.context_window, settings.max_tokens)
+        prompt_tokens = self.tokens.count_messages(messages, model_name)
+        
+        # 构建基本参数
         params = {
-            "model": global_config.model_config.model,
+            "model": target.model,
             "messages": messages,
-            "temperature": global_config.generation_params.temperature,
-            "top_p": global_config.generation_params.top_p,
-            "max_tokens": self._calculate_max_tokens(messages),
-            "frequency_penalty": global_config.generation_params.frequency_penalty,
-            "presence_penalty": global_config.generation_params.presence_penalty,
+            "temperature": settings.temperature,
+            "top_p": settings.top_p,
+            "frequency_penalty": settings.frequency_penalty,
+            "presence_penalty": settings.presence_penalty,
+            # 按实际prompt token数设定最大tokens
+            "max_tokens": self._calculate_max_tokens(messages, prompt_tokens, target.context_window,
+                                                     settings.max_tokens),
+            "stream": stream,
         }
+        if stream and target.provider in _STREAM_USAGE_PROVIDERS:
+            # 流末尾返回usage，用于统计前缀缓存命中与实际token消耗
+            params["stream_options"] = {"include_usage": True}
         
-        # 添加响应格式（如果配置了）
-        if hasattr(global_config.generation_params, 'response_format'):
-            params["response_format"] = global_config.generation_params.response_format
+        # 模型特定参数调整
+        if is_qwen_model:
+            # 青云模型特定参数，有些模型不支持response_format参数
+            response_format = settings.response_format_dict()
+            if response_format.get('type') == 'json':
+                params['response_format'] = response_format
+        elif is_hunyuan_model:
+            # 混元模型特殊处理
+            # 注意：混元模型可能对某些参数有特殊要求
+            # 例如可能不支持某些OpenAI参数或需要额外参数
+            pass
+        else:
+            # 非特殊模型使用标准参数
+            params["response_format"] = settings.response_format_dict()
             
         return params
+
+    def _format_error_message(self, e: Exception) -> str:
+        """生成面向用户的错误信息，认证错误附带排查建议"""
+        user_error_msg = f"生成失败: {str(e)}"
+        
+        # 针对认证错误提供更具体的建议
+        if "AuthenticationError" in str(type(e)) or "401" in str(e):
+            provider = global_config.model_config.provider
+            provider_info = ""
+            
+            if provider == "Qwen":
+                provider_info = "对于Qwen模型，确保使用的是通义千问提供的密钥"
+            elif provider == "HunYuan":
+                provider_info = "对于HunYuan模型，确保使用的是腾讯混元提供的密钥"
+            elif provider == "DeepSeek":
+                provider_info = "对于DeepSeek模型，确保使用的是DeepSeek提供的密钥"
+                
+            user_error_msg = (
+                f"API密钥认证失败: {str(e)}\n\n"
+                f"可能的解决方案:\n"
+                f"1. 检查apikey.yaml中的密钥是否正确\n"
+                f"2. {provider_info}\n"
+                f"3. 确认当前选择的模型({global_config.model_config.name})与您的API密钥匹配\n"
+                f"4. 检查模型配置中的base_url是否正确"
+            )
+        return user_error_msg
     
-    def _calculate_max_tokens(self, messages: List[Dict[str, Any]]) -> int:
-        """计算最大令牌数，确保不超过模型上下文窗口"""
-        # 简单估算已用token
-        used_tokens = sum(len(m.get("content", "")) // 4 for m in messages)
+    def _calculate_max_tokens(self, messages: List[Dict[str, Any]], prompt_tokens: Optional[int] = None,
+                              context_window: Optional[int] = None, max_tokens: Optional[int] = None) -> int:
+        """计算最大令牌数，确保prompt与输出之和不超过模型上下文窗口
+
+        剩余空间不足以输出时抛出ContextOverflowError，不发送max_tokens为0的请求。
+        """
+        if prompt_tokens is None:
+            prompt_tokens = self.tokens.count_messages(messages)
         
-        # 确保不超过模型上下文窗口的80%
-        max_context = global_config.model_config.context_window
-        available = max(max_context - used_tokens, 0)
+        # 预留估算误差余量
+        margin = max(64, int(prompt_tokens * 0.05))
+        max_context = context_window or global_config.model_config.context_window
+        available = max(max_context - prompt_tokens - margin, 0)
         
         # 取配置值和可用值的较小值
-        return min(global_config.generation_params.max_tokens, int(available * 0.8))
+        if max_tokens is None:
+            max_tokens = global_config.generation_params.max_tokens
+        if available < min(max_tokens, _MIN_OUTPUT_TOKENS):
+            raise ContextOverflowError(
+                f"输入内容过长：prompt约 {prompt_tokens} tokens，模型上下文窗口为 {max_context} tokens，"
+                f"剩余空间不足以生成内容，请精简输入或切换到上下文更大的模型"
+            )
+        return min(max_tokens, available)
     
     def check_connection(self) -> bool:
         """检查与API的连接状态"""
         try:
-            client = httpx.Client(timeout=5)
-            response = client.get(f"{global_config.model_config.base_url}/models")
+            api_key = self._get_api_key()
+            with self.pool.lease(
+                global_config.model_config.provider,
+                global_config.model_config.base_url,
+                api_key
+            ) as lease:
+                response = lease.http_client.get(
+                    f"{global_config.model_config.base_url}/models",
+                    headers={"Authorization": f"Bearer {api_key}"},
+                    timeout=5
+                )
             return response.status_code == 200
         except Exception as e:
             logger.error(f"API连接检查失败: {str(e)}")
             return False
 
 # 单例实例
-api_client = DeepSeekAPIClient() 
\ No newline at end of file
+api_client = DeepSeekAPIClient()
+# 共享连接池与预热服务的模型切换处理只注册一次（异步客户端与其他实例共用同一连接池，不重复注册）
+global_config.add_model_listener(api_client._on_model_changed)
@@ -0,0 +1,232 @@
+from typing import Dict, Any, List, Optional
+import itertools
+import asyncio
+import threading
+import time
+import logging
+from core.api_client.tokenizer import token_counter
+from core.api_client.telemetry import telemetry
+from core.persistence import journal
+
+logger = logging.getLogger(__name__)
+
+# 生成状态
+PENDING = "pending"
+RUNNING = "running"
+FINISHED = "finished"
+CANCELLED = "cancelled"
+FAILED = "failed"
+
+_ids = itertools.count(1)
+
+
+class GenerationHandle:
+    """单次生成的句柄：取消令牌与运行状态
+
+    每个流式生成持有自己的句柄，流内状态（是否已发送thinking_finished等）
+    都保存在句柄上，多个并发生成互不干扰。cancel可在任意线程调用：
+    同步流会立即关闭底层HTTP响应，异步流会取消正在读取的任务，连接随即释放。
+    """
+
+    def __init__(self, label: str = ""):
+        self.id = next(_ids)
+        self.label = label  # 便于在状态列表中识别，如"模板生成"
+        self.state = PENDING
+        self.error: Optional[str] = None
+        self.thinking_finished_sent = False
+        self.created_at = time.time()
+        self.started_at: Optional[float] = None
+        self.first_chunk_at: Optional[float] = None
+        self.finished_at: Optional[float] = None
+        self.bytes = 0  # 已接收的正文与思维链字节数
+        self.chunks = 0
+        self.completion_tokens: Optional[int] = None  # 接口返回的usage，未返回时为None
+        self._content: List[str] = []
+        self._reasoning_chars = 0
+        self._event = threading.Event()
+        self._lock = threading.Lock()
+        self._response = None
+        self._task: Optional[asyncio.Task] = None
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self.journal: Optional[journal.JournalWriter] = None  # 崩溃安全日志，收到的增量同步写入
+
+    @property
+    def cancel_event(self) -> threading.Event:
+        """取消事件，可传给generate_many等接受cancel_event的接口"""
+        return self._event
+
+    @property
+    def cancelled(self) -> bool:
+        return self._event.is_set()
+
+    @property
+    def done(self) -> bool:
+        return self.state in (FINISHED, CANCELLED, FAILED)
+
+    @property
+    def content(self) -> str:
+        """目前为止收到的正文"""
+        return "".join(self._content)
+
+    @property
+    def content_chunks(self) -> int:
+        """已记录的正文增量数，可据此区分流中产出的正文与最后产出的错误信息"""
+        return len(self._content)
+
+    def cancel(self):
+        """取消生成（线程安全，可重复调用）"""
+        if self._event.is_set():
+            return
+        self._event.set()
+        logger.info(f"生成 #{self.id} 已请求取消")
+        with self._lock:
+            response, task, loop = self._response, self._task, self._loop
+        if response is not None:
+            try:
+                response.close()
+            except Exception as e:
+                logger.debug(f"关闭响应失败: {str(e)}")
+        if task is not None and loop is not None and not loop.is_closed():
+            loop.call_soon_threadsafe(task.cancel)
+
+    def start(self):
+        with self._lock:
+            self.state = RUNNING
+            self.started_at = time.time()
+
+    def bind_response(self, response):
+        """关联同步流式响应，取消时关闭"""
+        with self._lock:
+            self._response = response
+        if self.cancelled:
+            response.close()
+
+    def bind_task(self, task: asyncio.Task, loop: asyncio.AbstractEventLoop):
+        """关联正在读取异步流的任务，取消时在其事件循环中cancel"""
+        with self._lock:
+            self._task, self._loop = task, loop
+        if self.cancelled:
+            loop.call_soon_threadsafe(task.cancel)
+
+    def attach_journal(self, writer: Optional[journal.JournalWriter]):
+        """关联生成日志，之后收到的思维链与正文会追加写入"""
+        self.journal = writer
+
+    def _write_journal(self, method: str, text: str):
+        if self.journal is None:
+            return
+        try:
+            getattr(self.journal, method)(text)
+        except (OSError, ValueError) as e:
+            # 磁盘错误不影响生成本身
+            logger.warning(f"写入生成日志失败，已停止记录: {str(e)}")
+            self.journal = None
+
+    def unbind(self):
+        with self._lock:
+            self._response = self._task = self._loop = None
+
+    def record_content(self, text: str):
+        self._record(text)
+        self._content.append(text)
+        self._write_journal("content", text)
+
+    def record_reasoning(self, text: str):
+        self._record(text)
+        self._reasoning_chars += len(text)
+        self._write_journal("reasoning", text)
+
+    def _record(self, text: str):
+        now = time.time()
+        if self.first_chunk_at is None:
+            self.first_chunk_at = now
+        self.chunks += 1
+        self.bytes += len(text.encode('utf-8'))
+
+    def finish(self, error: Optional[str] = None):
+        """结束生成，根据取消与错误情况确定最终状态"""
+        self.unbind()
+        with self._lock:
+            if self.done:
+                return
+            self.finished_at = time.time()
+            if self.cancelled:
+                self.state = CANCELLED
+            elif error:
+                self.state = FAILED
+                self.error = error
+            else:
+                self.state = FINISHED
+        if self.started_at is not None:
+            # 界面各生成步骤（按label区分）的总耗时
+            telemetry.generation(self.label, self.state, self.finished_at - self.started_at)
+        if self.journal is not None:
+            status = {FINISHED: journal.COMPLETE, CANCELLED: journal.CANCELLED}.get(self.state, journal.FAILED)
+            journal.generation_journal.close(self.journal, status, self.error)
+        handle_registry.unregister(self)
+
+    def status(self) -> Dict[str, Any]:
+        """返回运行状态：字节数、token数、耗时与首字延迟"""
+        end = self.finished_at or time.time()
+        tokens = self.completion_tokens
+        if tokens is None:
+            tokens = token_counter.for_model().count(self.content)
+        return {
+            "id": self.id,
+            "label": self.label,
+            "state": self.state,
+            "bytes": self.bytes,
+            "chunks": self.chunks,
+            "content_chars": sum(len(part) for part in self._content),
+            "reasoning_chars": self._reasoning_chars,
+            "tokens": tokens,
+            "elapsed": round(end - self.started_at, 3) if self.started_at else 0.0,
+            "ttft": round(self.first_chunk_at - self.started_at, 3)
+            if self.first_chunk_at and self.started_at else None,
+            "error": self.error,
+            "journal_id": self.journal.id if self.journal is not None else None
+        }
+
+    def __repr__(self):
+        return f"GenerationHandle(#{self.id} {self.label or ''} {self.state})"
+
+
+class HandleRegistry:
+    """正在进行的生成句柄列表，便于统一查看或取消"""
+
+    def __init__(self):
+        self._handles: Dict[int, GenerationHandle] = {}
+        self._lock = threading.Lock()
+
+    def register(self, handle: GenerationHandle):
+        with self._lock:
+            self._handles[handle.id] = handle
+
+    def unregister(self, handle: GenerationHandle):
+        with self._lock:
+            self._handles.pop(handle.id, None)
+
+    def active(self) -> List[GenerationHandle]:
+        with self._lock:
+            return list(self._handles.values())
+
+    def cancel_all(self) -> int:
+        """取消全部进行中的生成，返回数量"""
+        handles = self.active()
+        for handle in handles:
+            handle.cancel()
+        return len(handles)
+
+    def status(self) -> List[Dict[str, Any]]:
+        return [handle.status() for handle in self.active()]
+
+
+# 全局句柄注册表
+handle_registry = HandleRegistry()
+
+
+def new_handle(label: str = "") -> GenerationHandle:
+    """创建并登记一个生成句柄"""
+    handle = GenerationHandle(label)
+    handle_registry.register(handle)
+    return handle
@@ -0,0 +1,341 @@
+from openai import OpenAI, AsyncOpenAI
+from typing import Dict, Any, Optional, Tuple
+import asyncio
+import threading
+import hashlib
+import time
+import logging
+import httpx
+
+logger = logging.getLogger(__name__)
+
+
+class _PoolEntry:
+    """连接池中的单个客户端条目"""
+    def __init__(self, client: OpenAI, http_client: httpx.Client):
+        self.client = client
+        self.http_client = http_client
+        self.created_at = time.time()
+        self.last_used = self.created_at
+        self.requests = 0
+        self.leases = 0  # 正在使用该客户端的请求或流
+        self.retired = False  # 已从注册表移除，最后一个租约释放后关闭
+
+    def close(self):
+        self.http_client.close()
+
+
+class _AsyncPoolEntry(_PoolEntry):
+    """异步客户端条目，httpx.AsyncClient的连接绑定在创建它的事件循环上"""
+    def __init__(self, client: AsyncOpenAI, http_client: httpx.AsyncClient, loop: asyncio.AbstractEventLoop):
+        super().__init__(client, http_client)
+        self.loop = loop
+
+    def close(self):
+        """在所属事件循环中关闭连接，循环已结束时直接丢弃"""
+        if self.loop.is_closed():
+            return
+        coro = self.http_client.aclose()
+        try:
+            running = asyncio.get_running_loop()
+        except RuntimeError:
+            running = None
+        if running is self.loop:
+            self.loop.create_task(coro)
+        elif self.loop.is_running():
+            asyncio.run_coroutine_threadsafe(coro, self.loop)
+        else:
+            coro.close()
+
+
+class PoolLease:
+    """一次请求或流对连接池客户端的使用权
+
+    持有期间客户端不会因空闲超时、切换模型或重新配置而被关闭：这些操作只把客户端移出
+    注册表（之后的请求创建新客户端），在最后一个租约释放时才真正关闭。
+    release可重复调用；也可作为上下文管理器使用，退出时释放。
+    """
+
+    def __init__(self, pool: "ClientPool", entry: _PoolEntry):
+        self._pool = pool
+        self._entry = entry
+        self.client = entry.client
+        self.http_client = entry.http_client
+        self._released = False
+
+    def release(self):
+        if not self._released:
+            self._released = True
+            self._pool._release(self._entry)
+
+    def __enter__(self) -> "PoolLease":
+        return self
+
+    def __exit__(self, *exc_info):
+        self.release()
+
+
+class ClientPool:
+    """按(provider, base_url, api_key)复用的长连接客户端注册表
+
+    每个键对应一个OpenAI客户端及其底层httpx连接池，重复请求可直接复用
+    已完成TLS握手的keep-alive连接。空闲超时的客户端由后台定时器关闭。
+    请求与流经lease/lease_async取得客户端，持有租约的客户端不算空闲；
+    invalidate、configure等需要关闭仍在使用的客户端时，推迟到最后一个租约释放后关闭。
+    """
+
+    def __init__(self, max_connections: int = 20, max_keepalive_connections: int = 10,
+                 keepalive_expiry: float = 120.0, connect_timeout: float = 10.0,
+                 read_timeout: float = 600.0, idle_timeout: float = 600.0,
+                 reap_interval: float = 60.0):
+        self.max_connections = max_connections  # 单个客户端最大连接数
+        self.max_keepalive_connections = max_keepalive_connections  # 保持活跃的连接数
+        self.keepalive_expiry = keepalive_expiry  # keep-alive连接过期时间（秒）
+        self.connect_timeout = connect_timeout  # 建连超时（秒）
+        self.read_timeout = read_timeout  # 读取超时（秒），推理模型需要较长时间
+        self.idle_timeout = idle_timeout  # 客户端空闲多久后关闭（秒）
+        self.reap_interval = reap_interval  # 空闲清理间隔（秒）
+        self._entries: Dict[Tuple[str, str, str], _PoolEntry] = {}
+        self._async_entries: Dict[Tuple[str, str, str, int], _AsyncPoolEntry] = {}
+        self._lock = threading.RLock()
+        self._reaper = None
+        self.cassette = None  # 录制/回放API会话时使用的Cassette
+        self._counters = {"hits": 0, "misses": 0, "created": 0, "closed": 0, "deferred": 0}
+
+    @staticmethod
+    def _make_key(provider: str, base_url: str, api_key: str) -> Tuple[str, str, str]:
+        """构建注册表键，密钥只保存摘要"""
+        key_digest = hashlib.sha256((api_key or "").encode('utf-8')).hexdigest()[:16]
+        return (provider or "", (base_url or "").rstrip('/'), key_digest)
+
+    def _build_http_client(self) -> httpx.Client:
+        """按当前连接池参数创建httpx客户端"""
+        if self.cassette is None:
+            return httpx.Client(**self._build_limits())
+        options = self._build_limits()
+        transport = httpx.HTTPTransport(limits=options.pop("limits"))
+        return httpx.Client(transport=self.cassette.wrap(transport), **options)
+
+    def _build_async_http_client(self) -> httpx.AsyncClient:
+        if self.cassette is None:
+            return httpx.AsyncClient(**self._build_limits())
+        options = self._build_limits()
+        transport = httpx.AsyncHTTPTransport(limits=options.pop("limits"))
+        return httpx.AsyncClient(transport=self.cassette.wrap_async(transport), **options)
+
+    def _build_limits(self) -> Dict[str, Any]:
+        """httpx连接池与超时参数，同步/异步客户端共用"""
+        return {
+            "limits": httpx.Limits(
+                max_connections=self.max_connections,
+                max_keepalive_connections=self.max_keepalive_connections,
+                keepalive_expiry=self.keepalive_expiry
+            ),
+            "timeout": httpx.Timeout(self.read_timeout, connect=self.connect_timeout)
+        }
+
+    def use_cassette(self, cassette=None):
+        """开始（传入Cassette）或结束（传入None）API会话的录制/回放，已有客户端关闭后重建"""
+        with self._lock:
+            self.cassette = cassette
+            self.close_all()
+        if cassette is not None:
+            logger.info(f"API会话{'录制' if cassette.mode == 'record' else '回放'}: {cassette.path}")
+
+    def _get_entry(self, provider: str, base_url: str, api_key: str) -> _PoolEntry:
+        key = self._make_key(provider, base_url, api_key)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._counters["hits"] += 1
+            else:
+                self._counters["misses"] += 1
+                http_client = self._build_http_client()
+                # 重试与熔断统一由retry_engine负责，关闭SDK内置重试
+                client = OpenAI(api_key=api_key, base_url=base_url, http_client=http_client, max_retries=0)
+                entry = _PoolEntry(client, http_client)
+                self._entries[key] = entry
+                self._counters["created"] += 1
+                logger.debug(f"创建新的API客户端: {provider} {base_url}")
+                self._ensure_reaper()
+            entry.last_used = time.time()
+            entry.requests += 1
+            return entry
+
+    def get_client(self, provider: str, base_url: str, api_key: str) -> OpenAI:
+        """获取（或创建）对应提供商的OpenAI客户端"""
+        return self._get_entry(provider, base_url, api_key).client
+
+    def get_http_client(self, provider: str, base_url: str, api_key: str) -> httpx.Client:
+        """获取与OpenAI客户端共享连接池的httpx客户端"""
+        return self._get_entry(provider, base_url, api_key).http_client
+
+    def get_async_client(self, provider: str, base_url: str, api_key: str) -> AsyncOpenAI:
+        """获取当前事件循环中对应提供商的AsyncOpenAI客户端"""
+        return self._get_async_entry(provider, base_url, api_key).client
+
+    def get_async_http_client(self, provider: str, base_url: str, api_key: str) -> httpx.AsyncClient:
+        """获取当前事件循环中与AsyncOpenAI客户端共享连接池的httpx客户端"""
+        return self._get_async_entry(provider, base_url, api_key).http_client
+
+    def lease(self, provider: str, base_url: str, api_key: str) -> PoolLease:
+        """租用对应提供商的客户端，用完（流读取结束）后调用release或以with语句释放"""
+        with self._lock:
+            entry = self._get_entry(provider, base_url, api_key)
+            entry.leases += 1
+            return PoolLease(self, entry)
+
+    def lease_async(self, provider: str, base_url: str, api_key: str) -> PoolLease:
+        """租用当前事件循环中的异步客户端"""
+        with self._lock:
+            entry = self._get_async_entry(provider, base_url, api_key)
+            entry.leases += 1
+            return PoolLease(self, entry)
+
+    def _release(self, entry: _PoolEntry):
+        with self._lock:
+            entry.leases -= 1
+            entry.last_used = time.time()
+            if entry.leases > 0 or not entry.retired:
+                return
+        self._close_entry(entry)
+
+    def _get_async_entry(self, provider: str, base_url: str, api_key: str) -> _AsyncPoolEntry:
+        loop = asyncio.get_running_loop()
+        key = self._make_key(provider, base_url, api_key) + (id(loop),)
+        with self._lock:
+            entry = self._async_entries.get(key)
+            if entry is not None and entry.loop is not loop:
+                # 旧循环已销毁且id被复用
+                self._async_entries.pop(key, None)
+                entry = None
+            if entry is not None:
+                self._counters["hits"] += 1
+            else:
+                self._counters["misses"] += 1
+                http_client = self._build_async_http_client()
+                client = AsyncOpenAI(api_key=api_key, base_url=base_url, http_client=http_client, max_retries=0)
+                entry = _AsyncPoolEntry(client, http_client, loop)
+                self._async_entries[key] = entry
+                self._counters["created"] += 1
+                logger.debug(f"创建新的异步API客户端: {provider} {base_url}")
+                self._ensure_reaper()
+            entry.last_used = time.time()
+            entry.requests += 1
+            return entry
+
+    def configure(self, **limits):
+        """调整连接池参数，已有客户端关闭后按新参数重建"""
+        for name, value in limits.items():
+            if not hasattr(self, name) or name.startswith('_'):
+                raise ValueError(f"未知的连接池参数: {name}")
+            setattr(self, name, value)
+        self.close_all()
+
+    def invalidate(self, provider: Optional[str] = None, base_url: Optional[str] = None) -> int:
+        """关闭匹配提供商/地址的客户端，返回立即关闭的数量（仍有租约的推迟关闭，不计入）"""
+        base_url = base_url.rstrip('/') if base_url else None
+        with self._lock:
+            keys = [
+                key for key in list(self._entries) + list(self._async_entries)
+                if (provider is None or key[0] == provider)
+                and (base_url is None or key[1] == base_url)
+            ]
+            return self._close_keys(keys)
+
+    def close_idle(self, max_idle: Optional[float] = None) -> int:
+        """关闭空闲超过max_idle秒的客户端，返回关闭数量"""
+        max_idle = self.idle_timeout if max_idle is None else max_idle
+        now = time.time()
+        with self._lock:
+            entries = list(self._entries.items()) + list(self._async_entries.items())
+            keys = [key for key, entry in entries if entry.leases == 0 and now - entry.last_used > max_idle]
+            return self._close_keys(keys)
+
+    def close_all(self) -> int:
+        """关闭全部客户端，返回立即关闭的数量"""
+        with self._lock:
+            return self._close_keys(list(self._entries) + list(self._async_entries))
+
+    def _close_keys(self, keys) -> int:
+        """把客户端移出注册表并关闭，仍有租约的推迟到释放后关闭；返回立即关闭的数量"""
+        closed = 0
+        for key in keys:
+            entry = self._entries.pop(key, None) or self._async_entries.pop(key, None)
+            if entry is None:
+                continue
+            if entry.leases > 0:
+                entry.retired = True
+                self._counters["deferred"] += 1
+                continue
+            self._close_entry(entry)
+            closed += 1
+        return closed
+
+    def _close_entry(self, entry: _PoolEntry):
+        try:
+            entry.close()
+        except Exception as e:
+            logger.warning(f"关闭API客户端失败: {str(e)}")
+        with self._lock:
+            self._counters["closed"] += 1
+
+    def _ensure_reaper(self):
+        """启动空闲连接清理定时器"""
+        if self._reaper is None or not self._reaper.is_alive():
+            self._reaper = threading.Timer(self.reap_interval, self._reap)
+            self._reaper.daemon = True
+            self._reaper.start()
+
+    def _reap(self):
+        closed = self.close_idle()
+        if closed:
+            logger.debug(f"已关闭 {closed} 个空闲API客户端")
+        with self._lock:
+            self._reaper = None
+            if self._entries or self._async_entries:
+                self._ensure_reaper()
+
+    def stats(self) -> Dict[str, Any]:
+        """返回连接池统计信息"""
+        now = time.time()
+        with self._lock:
+            clients = []
+            entries = list(self._entries.items()) + list(self._async_entries.items())
+            for (provider, base_url, key_digest, *_), entry in entries:
+                clients.append({
+                    "provider": provider,
+                    "async": isinstance(entry, _AsyncPoolEntry),
+                    "base_url": base_url,
+                    "key": key_digest[:8],
+                    "requests": entry.requests,
+                    "leases": entry.leases,
+                    "age": round(now - entry.created_at, 1),
+                    "idle": round(now - entry.last_used, 1),
+                    "connections": self._connection_stats(entry.http_client)
+                })
+            return {
+                **self._counters,
+                "active_clients": len(self._entries) + len(self._async_entries),
+                "limits": {
+                    "max_connections": self.max_connections,
+                    "max_keepalive_connections": self.max_keepalive_connections,
+                    "keepalive_expiry": self.keepalive_expiry,
+                    "idle_timeout": self.idle_timeout
+                },
+                "clients": clients
+            }
+
+    @staticmethod
+    def _connection_stats(http_client) -> Dict[str, int]:
+        """尽力读取httpx底层连接池的连接状态"""
+        try:
+            connections = http_client._transport._pool.connections
+            idle = sum(1 for conn in connections if conn.is_idle())
+            return {"total": len(connections), "idle": idle, "active": len(connections) - idle}
+        except Exception:
+            return {}
+
+
+# 全局连接池实例
+client_pool = ClientPool()
@@ -0,0 +1,141 @@
+from typing import Any, Dict, List, Optional, Tuple
+import threading
+import logging
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_FAMILY = "default"
+
+
+class PromptLayout:
+    """按前缀缓存友好的顺序组装提示词
+
+    DeepSeek、DashScope等提供商对与之前请求相同的prompt前缀按缓存计费且首字更快，
+    但只有从第一个token开始完全一致的部分才能命中。因此：
+        system与static中放跨请求不变的内容（角色设定、格式要求、固定指令），
+        volatile中放每次请求才确定的取值（作品名、类型、随机选择的角色等），
+    volatile按添加顺序排在最后，越易变的内容应越晚添加。
+    篇幅较长的参考资料（其他部分摘要、前文章节等）可以给volatile指定priority，
+    超出模型上下文窗口时由ContextPacker按优先级压缩这些块，指令本身保持完整。
+
+    用法：
+        layout = PromptLayout("role_generation", system="你是一个专业的小说作家")
+        layout.static(FORMAT_RULES)
+        layout.fields("作品信息", {"作品名称": title, "作品类型": creation_type})
+        messages = layout.messages()
+        api_client.stream_generate(messages, prompt_family=layout.family)
+    """
+
+    def __init__(self, family: str, system: Optional[str] = None):
+        self.family = family  # 提示词族，用于统计各类提示词的缓存命中率
+        self.system = system
+        self._static: List[str] = []
+        self._volatile: List[str] = []
+        self._priorities: Dict[int, float] = {}  # volatile块下标 -> 打包优先级
+
+    def static(self, text: str) -> "PromptLayout":
+        """添加固定指令块（不能包含随请求变化的取值）"""
+        self._static.append(text.strip())
+        return self
+
+    def volatile(self, text: str, priority: Optional[float] = None) -> "PromptLayout":
+        """添加易变内容块，priority越小越先被压缩（默认与所在消息相同，即不单独压缩）"""
+        if priority is not None:
+            self._priorities[len(self._volatile)] = priority
+        self._volatile.append(text.strip())
+        return self
+
+    def fields(self, heading: str, values: Dict[str, Any]) -> "PromptLayout":
+        """以“标题 + 键：值”列表的形式添加易变字段"""
+        lines = [f"{heading}："] + [f"- {key}：{value}" for key, value in values.items()]
+        return self.volatile("\n".join(lines))
+
+    def text(self) -> str:
+        """user消息正文：固定指令在前，易变内容在后"""
+        return "\n\n".join(block for block in self._static + self._volatile if block)
+
+    def messages(self) -> List[Dict[str, Any]]:
+        messages = []
+        if self.system:
+            messages.append({"role": "system", "content": self.system})
+        message = {"role": "user", "content": self.text()}
+        if self._priorities:
+            # 分块信息只供ContextPacker使用，发送前会被剥离
+            blocks = [{"text": block} for block in self._static if block]
+            for i, block in enumerate(self._volatile):
+                if block:
+                    blocks.append({"text": block, "priority": self._priorities.get(i)})
+            message["blocks"] = blocks
+        messages.append(message)
+        return messages
+
+
+def _usage_value(obj: Any, name: str) -> Any:
+    if obj is None:
+        return None
+    if isinstance(obj, dict):
+        return obj.get(name)
+    return getattr(obj, name, None)
+
+
+def cache_usage(usage: Any) -> Optional[Tuple[int, int]]:
+    """从接口返回的usage读取(prompt tokens, 命中缓存的tokens)
+
+    DeepSeek返回prompt_cache_hit_tokens/prompt_cache_miss_tokens，
+    DashScope等OpenAI兼容接口返回prompt_tokens_details.cached_tokens。
+    没有缓存字段时返回None。
+    """
+    prompt_tokens = _usage_value(usage, 'prompt_tokens')
+    hit = _usage_value(usage, 'prompt_cache_hit_tokens')
+    if hit is not None:
+        miss = _usage_value(usage, 'prompt_cache_miss_tokens') or 0
+        return (prompt_tokens or hit + miss), hit
+    cached = _usage_value(_usage_value(usage, 'prompt_tokens_details'), 'cached_tokens')
+    if cached is not None and prompt_tokens is not None:
+        return prompt_tokens, cached
+    return None
+
+
+class PromptCacheStats:
+    """按提示词族与模型统计提供商前缀缓存命中情况"""
+
+    def __init__(self):
+        self._stats: Dict[Tuple[str, str], Dict[str, int]] = {}
+        self._lock = threading.Lock()
+
+    def record(self, family: Optional[str], model: str, usage: Any) -> Optional[int]:
+        """记录一次请求的usage，返回命中缓存的token数（接口未提供时返回None）"""
+        result = cache_usage(usage)
+        key = (family or DEFAULT_FAMILY, model)
+        with self._lock:
+            stats = self._stats.setdefault(key, {
+                "requests": 0, "reported": 0, "prompt_tokens": 0, "cached_tokens": 0
+            })
+            stats["requests"] += 1
+            if result is not None:
+                stats["reported"] += 1
+                stats["prompt_tokens"] += result[0]
+                stats["cached_tokens"] += result[1]
+        if result is None:
+            return None
+        logger.debug(f"前缀缓存命中 {result[1]}/{result[0]} tokens ({key[0]}, {model})")
+        return result[1]
+
+    def reset(self):
+        with self._lock:
+            self._stats.clear()
+
+    def stats(self) -> Dict[str, Dict[str, Any]]:
+        """返回{提示词族: {模型: 统计}}，hit_rate为命中缓存的prompt token占比"""
+        with self._lock:
+            items = [(key, dict(value)) for key, value in self._stats.items()]
+        result: Dict[str, Dict[str, Any]] = {}
+        for (family, model), stats in items:
+            prompt_tokens = stats["prompt_tokens"]
+            stats["hit_rate"] = round(stats["cached_tokens"] / prompt_tokens, 4) if prompt_tokens else None
+            result.setdefault(family, {})[model] = stats
+        return result
+
+
+# 全局前缀缓存统计
+prompt_cache_stats = PromptCacheStats()
@@ -0,0 +1,146 @@
+from concurrent.futures import CancelledError
+from typing import Dict, Any, Optional, Tuple
+import asyncio
+import threading
+import time
+import logging
+from modules.SecurityModule import security_config, SecurityConfig
+
+logger = logging.getLogger(__name__)
+
+
+class TokenBucket:
+    """令牌桶，按每分钟速率匀速补充
+
+    采用预约模式：reserve立即扣减并返回需要等待的秒数，余额可以为负，
+    后续请求会相应顺延，因此同步线程与协程都可以各自等待。
+    """
+
+    def __init__(self, rate_per_minute: float, capacity: Optional[float] = None):
+        self.rate_per_minute = rate_per_minute
+        self.capacity = capacity if capacity is not None else rate_per_minute
+        self._rate = rate_per_minute / 60.0  # 每秒补充量
+        self._tokens = self.capacity
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _refill(self, now: float):
+        self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self._rate)
+        self._updated = now
+
+    def reserve(self, amount: float = 1) -> float:
+        """预约amount个令牌，返回需要等待的秒数"""
+        with self._lock:
+            self._refill(time.monotonic())
+            self._tokens -= amount
+            if self._tokens >= 0:
+                return 0.0
+            return -self._tokens / self._rate
+
+    def debit(self, amount: float):
+        """事后扣减令牌（如实际消耗的输出token），不等待"""
+        with self._lock:
+            self._refill(time.monotonic())
+            self._tokens -= amount
+
+    @property
+    def available(self) -> float:
+        with self._lock:
+            self._refill(time.monotonic())
+            return self._tokens
+
+
+class RateLimiter:
+    """按提供商限制请求数与token数
+
+    速率取自SecurityConfig：rate_limit_per_minute限制每分钟请求数，
+    tokens_per_minute限制每分钟token数（0表示不限制），
+    enable_rate_limiting为False时不做任何限制。修改配置后下次请求即生效。
+    """
+
+    def __init__(self, config: SecurityConfig = security_config):
+        self.config = config
+        self._buckets: Dict[str, Tuple[Optional[TokenBucket], Optional[TokenBucket]]] = {}
+        self._lock = threading.Lock()
+        self._counters = {"acquired": 0, "throttled": 0, "waited": 0.0}
+
+    def _get_buckets(self, provider: str) -> Tuple[Optional[TokenBucket], Optional[TokenBucket]]:
+        rpm = self.config.rate_limit_per_minute
+        tpm = getattr(self.config, 'tokens_per_minute', 0)
+        with self._lock:
+            requests, tokens = self._buckets.get(provider, (None, None))
+            if (requests.rate_per_minute if requests else 0) != rpm:
+                requests = TokenBucket(rpm) if rpm > 0 else None
+            if (tokens.rate_per_minute if tokens else 0) != tpm:
+                tokens = TokenBucket(tpm) if tpm > 0 else None
+            self._buckets[provider] = (requests, tokens)
+            return requests, tokens
+
+    def _reserve(self, provider: str, tokens: int) -> float:
+        if not self.config.enable_rate_limiting:
+            return 0.0
+        request_bucket, token_bucket = self._get_buckets(provider)
+        wait = 0.0
+        if request_bucket:
+            wait = max(wait, request_bucket.reserve(1))
+        if token_bucket and tokens:
+            wait = max(wait, token_bucket.reserve(tokens))
+        with self._lock:
+            self._counters["acquired"] += 1
+            if wait > 0:
+                self._counters["throttled"] += 1
+                self._counters["waited"] += wait
+        if wait > 0:
+            logger.debug(f"{provider} 触发速率限制，等待 {wait:.2f} 秒")
+        return wait
+
+    def acquire(self, provider: str, tokens: int = 0,
+                cancel_event: Optional[threading.Event] = None) -> float:
+        """请求前调用，必要时阻塞等待，返回等待秒数
+
+        cancel_event被设置时立即抛出CancelledError。
+        """
+        wait = self._reserve(provider, tokens)
+        if wait > 0:
+            if cancel_event is not None:
+                if cancel_event.wait(wait):
+                    raise CancelledError()
+            else:
+                time.sleep(wait)
+        return wait
+
+    async def acquire_async(self, provider: str, tokens: int = 0) -> float:
+        """acquire的协程版本"""
+        wait = self._reserve(provider, tokens)
+        if wait > 0:
+            await asyncio.sleep(wait)
+        return wait
+
+    def record(self, provider: str, tokens: int):
+        """请求完成后记录输出token消耗"""
+        if not self.config.enable_rate_limiting or not tokens:
+            return
+        _, token_bucket = self._get_buckets(provider)
+        if token_bucket:
+            token_bucket.debit(tokens)
+
+    def stats(self) -> Dict[str, Any]:
+        """返回限流统计信息"""
+        with self._lock:
+            buckets = {
+                provider: {
+                    "requests_available": round(requests.available, 1) if requests else None,
+                    "tokens_available": round(tokens.available, 1) if tokens else None
+                }
+                for provider, (requests, tokens) in self._buckets.items()
+            }
+            return {
+                **self._counters,
+                "waited": round(self._counters["waited"], 2),
+                "enabled": self.config.enable_rate_limiting,
+                "buckets": buckets
+            }
+
+
+# 全局限流器实例
+rate_limiter = RateLimiter()
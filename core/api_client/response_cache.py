@@ -0,0 +1,232 @@
+from collections import OrderedDict
+from typing import Dict, Any, Optional
+import threading
+import hashlib
+import sqlite3
+import json
+import time
+import logging
+from core.persistence.db_connector import DB_PATH
+
+logger = logging.getLogger(__name__)
+
+# 缓存策略
+CACHE_NEVER = "never"  # 不使用缓存（默认）
+CACHE_DETERMINISTIC = "deterministic"  # 仅缓存低温度的确定性请求
+CACHE_ALWAYS = "always"  # 无论采样参数如何都使用缓存
+
+CACHE_POLICIES = (CACHE_NEVER, CACHE_DETERMINISTIC, CACHE_ALWAYS)
+
+# 参与缓存键计算的请求参数，stream等传输层参数不影响结果
+_KEY_FIELDS = (
+    "model", "messages", "temperature", "top_p", "frequency_penalty",
+    "presence_penalty", "max_tokens", "response_format"
+)
+
+
+class ResponseCache:
+    """按请求内容寻址的模型响应缓存
+
+    键为(模型, 消息, 采样参数, response_format)的哈希。前端为内存LRU，
+    后端为novel_data.db（默认取项目根目录下的DB_PATH，与工作目录无关）中按总大小限制的SQLite表，
+    两级均有TTL。
+    """
+
+    def __init__(self, db_path: str = str(DB_PATH), max_memory_entries: int = 256,
+                 max_disk_bytes: int = 50 * 1024 * 1024, ttl: float = 7 * 24 * 3600,
+                 deterministic_temperature: float = 0.2):
+        self.db_path = db_path  # 磁盘缓存所在的SQLite文件
+        self.max_memory_entries = max_memory_entries  # 内存LRU最大条目数
+        self.max_disk_bytes = max_disk_bytes  # 磁盘缓存最大字节数
+        self.ttl = ttl  # 缓存有效期（秒）
+        self.deterministic_temperature = deterministic_temperature  # 视为确定性请求的温度上限
+        self._memory: "OrderedDict[str, tuple]" = OrderedDict()
+        self._lock = threading.RLock()
+        self._conn: Optional[sqlite3.Connection] = None
+        self._disk_disabled = False
+        self._counters = {
+            "hits": 0, "memory_hits": 0, "disk_hits": 0, "misses": 0,
+            "stores": 0, "evictions": 0, "expired": 0, "bypassed": 0
+        }
+
+    @staticmethod
+    def make_key(params: Dict[str, Any]) -> str:
+        """根据请求参数计算缓存键"""
+        payload = {field: params.get(field) for field in _KEY_FIELDS}
+        raw = json.dumps(payload, ensure_ascii=False, sort_keys=True, default=str)
+        return hashlib.sha256(raw.encode('utf-8')).hexdigest()
+
+    def should_cache(self, params: Dict[str, Any], policy: Optional[str]) -> bool:
+        """按策略判断本次请求是否走缓存"""
+        if policy not in CACHE_POLICIES:
+            raise ValueError(f"未知的缓存策略: {policy}")
+        if policy == CACHE_ALWAYS:
+            return True
+        if policy == CACHE_DETERMINISTIC:
+            temperature = params.get("temperature")
+            if temperature is not None and temperature <= self.deterministic_temperature:
+                return True
+            self._counters["bypassed"] += 1
+        return False
+
+    def get(self, key: str) -> Optional[str]:
+        """读取缓存，未命中或已过期返回None"""
+        now = time.time()
+        with self._lock:
+            item = self._memory.get(key)
+            if item is not None:
+                response, created_at = item
+                if now - created_at <= self.ttl:
+                    self._memory.move_to_end(key)
+                    self._counters["hits"] += 1
+                    self._counters["memory_hits"] += 1
+                    return response
+                del self._memory[key]
+                self._counters["expired"] += 1
+
+            row = self._disk_get(key, now)
+            if row is not None:
+                response, created_at = row
+                self._remember(key, response, created_at)
+                self._counters["hits"] += 1
+                self._counters["disk_hits"] += 1
+                return response
+
+            self._counters["misses"] += 1
+            return None
+
+    def put(self, key: str, response: str, model: str = ""):
+        """写入缓存，空响应不缓存"""
+        if not response:
+            return
+        now = time.time()
+        with self._lock:
+            self._remember(key, response, now)
+            self._disk_put(key, response, model, now)
+            self._counters["stores"] += 1
+
+    def clear(self):
+        """清空内存与磁盘缓存"""
+        with self._lock:
+            self._memory.clear()
+            conn = self._get_conn()
+            if conn is not None:
+                try:
+                    conn.execute("DELETE FROM llm_response_cache")
+                    conn.commit()
+                except sqlite3.Error as e:
+                    logger.warning(f"清空响应缓存失败: {str(e)}")
+
+    def stats(self) -> Dict[str, Any]:
+        """返回缓存统计信息"""
+        with self._lock:
+            disk_entries, disk_bytes = 0, 0
+            conn = self._get_conn()
+            if conn is not None:
+                try:
+                    disk_entries, disk_bytes = conn.execute(
+                        "SELECT COUNT(*), COALESCE(SUM(size), 0) FROM llm_response_cache"
+                    ).fetchone()
+                except sqlite3.Error:
+                    pass
+            lookups = self._counters["hits"] + self._counters["misses"]
+            return {
+                **self._counters,
+                "hit_rate": round(self._counters["hits"] / lookups, 3) if lookups else 0.0,
+                "memory_entries": len(self._memory),
+                "disk_entries": disk_entries,
+                "disk_bytes": disk_bytes,
+                "max_disk_bytes": self.max_disk_bytes
+            }
+
+    def _remember(self, key: str, response: str, created_at: float):
+        self._memory[key] = (response, created_at)
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.max_memory_entries:
+            self._memory.popitem(last=False)
+
+    def _get_conn(self) -> Optional[sqlite3.Connection]:
+        """延迟打开磁盘缓存，失败时退化为仅内存缓存"""
+        if self._disk_disabled:
+            return None
+        if self._conn is None:
+            try:
+                self._conn = sqlite3.connect(self.db_path, check_same_thread=False)
+                self._conn.execute(
+                    "CREATE TABLE IF NOT EXISTS llm_response_cache ("
+                    "key TEXT PRIMARY KEY, model TEXT, response TEXT NOT NULL, "
+                    "size INTEGER NOT NULL, created_at REAL NOT NULL, "
+                    "last_access REAL NOT NULL, hits INTEGER NOT NULL DEFAULT 0)"
+                )
+                self._conn.execute(
+                    "CREATE INDEX IF NOT EXISTS idx_llm_response_cache_access "
+                    "ON llm_response_cache(last_access)"
+                )
+                self._conn.commit()
+            except sqlite3.Error as e:
+                logger.warning(f"响应缓存数据库不可用，仅使用内存缓存: {str(e)}")
+                self._conn = None
+                self._disk_disabled = True
+        return self._conn
+
+    def _disk_get(self, key: str, now: float) -> Optional[tuple]:
+        conn = self._get_conn()
+        if conn is None:
+            return None
+        try:
+            row = conn.execute(
+                "SELECT response, created_at FROM llm_response_cache WHERE key = ?", (key,)
+            ).fetchone()
+            if row is None:
+                return None
+            if now - row[1] > self.ttl:
+                conn.execute("DELETE FROM llm_response_cache WHERE key = ?", (key,))
+                conn.commit()
+                self._counters["expired"] += 1
+                return None
+            conn.execute(
+                "UPDATE llm_response_cache SET last_access = ?, hits = hits + 1 WHERE key = ?",
+                (now, key)
+            )
+            conn.commit()
+            return row
+        except sqlite3.Error as e:
+            logger.warning(f"读取响应缓存失败: {str(e)}")
+            return None
+
+    def _disk_put(self, key: str, response: str, model: str, now: float):
+        conn = self._get_conn()
+        if conn is None:
+            return
+        size = len(response.encode('utf-8'))
+        try:
+            conn.execute(
+                "INSERT OR REPLACE INTO llm_response_cache "
+                "(key, model, response, size, created_at, last_access, hits) "
+                "VALUES (?, ?, ?, ?, ?, ?, 0)",
+                (key, model, response, size, now, now)
+            )
+            # 先清理过期条目，再按最近访问时间淘汰超出容量的部分
+            expired = conn.execute(
+                "DELETE FROM llm_response_cache WHERE created_at < ?", (now - self.ttl,)
+            ).rowcount
+            self._counters["expired"] += max(expired, 0)
+            total = conn.execute(
+                "SELECT COALESCE(SUM(size), 0) FROM llm_response_cache"
+            ).fetchone()[0]
+            if total > self.max_disk_bytes:
+                for old_key, old_size in conn.execute(
+                    "SELECT key, size FROM llm_response_cache ORDER BY last_access ASC"
+                ).fetchall():
+                    if total <= self.max_disk_bytes:
+                        break
+                    conn.execute("DELETE FROM llm_response_cache WHERE key = ?", (old_key,))
+                    total -= old_size
+                    self._counters["evictions"] += 1
+            conn.commit()
+        except sqlite3.Error as e:
+            logger.warning(f"写入响应缓存失败: {str(e)}")
+
+
+# 全局响应缓存实例
+response_cache = ResponseCache()
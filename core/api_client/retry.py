@@ -0,0 +1,397 @@
+from email.utils import parsedate_to_datetime
+from typing import Any, Callable, Dict, List, Optional, Sequence, Tuple
+import random
+import threading
+import time
+import logging
+import httpx
+import openai
+from modules.SecurityModule import security_config
+
+logger = logging.getLogger(__name__)
+
+# 错误类别
+RATE_LIMIT = "rate_limit"  # 429
+SERVER = "server"  # 5xx
+TIMEOUT = "timeout"  # 建连或读取超时
+CONNECTION = "connection"  # 连接失败、连接被重置
+AUTH = "auth"  # 401/403
+CLIENT = "client"  # 其他4xx，参数错误等
+UNKNOWN = "unknown"
+
+# 可以重试（或换提供商重试）的类别，也是熔断器计入的失败
+RETRYABLE = frozenset({RATE_LIMIT, SERVER, TIMEOUT, CONNECTION})
+
+# 熔断器状态
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half_open"
+
+
+class CircuitOpenError(Exception):
+    """目标的熔断器处于打开状态，请求被直接拒绝"""
+
+    def __init__(self, key: Tuple[str, str], retry_in: float):
+        self.key = key
+        self.retry_in = retry_in
+        super().__init__(f"{key[0]}/{key[1]} 连续请求失败，已暂停请求，约 {retry_in:.0f} 秒后恢复")
+
+
+def _status_code(e: Exception) -> Optional[int]:
+    status = getattr(e, 'status_code', None)
+    if status is None:
+        response = getattr(e, 'response', None)
+        status = getattr(response, 'status_code', None)
+    return status if isinstance(status, int) else None
+
+
+def classify_error(e: Exception) -> str:
+    """把异常归类为RATE_LIMIT/SERVER/TIMEOUT/CONNECTION/AUTH/CLIENT/UNKNOWN"""
+    # 超时需先于连接错误判断：openai.APITimeoutError是APIConnectionError的子类
+    if isinstance(e, (openai.APITimeoutError, httpx.TimeoutException, TimeoutError)):
+        return TIMEOUT
+    if isinstance(e, (openai.APIConnectionError, httpx.TransportError, ConnectionError)):
+        return CONNECTION
+    status = _status_code(e)
+    if status is None:
+        return UNKNOWN
+    if status == 429:
+        return RATE_LIMIT
+    if status in (401, 403):
+        return AUTH
+    if status >= 500:
+        return SERVER
+    if status == 408:
+        return TIMEOUT
+    if status >= 400:
+        return CLIENT
+    return UNKNOWN
+
+
+def is_retryable(e: Exception) -> bool:
+    """连接失败、超时、限流和服务端错误可以重试或换提供商，参数或认证错误不行"""
+    return classify_error(e) in RETRYABLE
+
+
+def retry_after(e: Exception) -> Optional[float]:
+    """从响应头读取服务端要求的等待秒数（Retry-After或retry-after-ms），没有时返回None"""
+    response = getattr(e, 'response', None)
+    headers = getattr(response, 'headers', None)
+    if not headers:
+        return None
+    value = headers.get('retry-after-ms')
+    if value:
+        try:
+            return max(0.0, float(value) / 1000)
+        except ValueError:
+            pass
+    value = headers.get('retry-after')
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    # HTTP日期格式
+    try:
+        return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError, IndexError, OverflowError):
+        return None
+
+
+class RetryPolicy:
+    """重试参数，取自security_config.retry_policy
+
+        max_attempts: 单次请求最多尝试次数（含故障转移）
+        backoff_factor: 退避基准秒数
+        max_backoff: 单次等待上限（秒），Retry-After超过该值时放弃重试
+        breaker_threshold: 同一目标连续失败多少次后熔断
+        breaker_cooldown: 熔断持续时间（秒），之后放行一个探测请求
+    """
+
+    def __init__(self, max_attempts: int = 3, backoff_factor: float = 0.5, max_backoff: float = 30.0,
+                 breaker_threshold: int = 5, breaker_cooldown: float = 30.0):
+        self.max_attempts = max(1, int(max_attempts))
+        self.backoff_factor = max(0.0, float(backoff_factor))
+        self.max_backoff = max(self.backoff_factor, float(max_backoff))
+        self.breaker_threshold = max(1, int(breaker_threshold))
+        self.breaker_cooldown = max(0.0, float(breaker_cooldown))
+
+    @classmethod
+    def from_config(cls, config=security_config) -> "RetryPolicy":
+        policy = config.retry_policy or {}
+        return cls(**{key: policy[key] for key in (
+            'max_attempts', 'backoff_factor', 'max_backoff', 'breaker_threshold', 'breaker_cooldown'
+        ) if key in policy})
+
+    def backoff(self, previous: float) -> float:
+        """去相关抖动（decorrelated jitter）：在[base, 上次等待*3]间随机取值，不超过上限"""
+        base = self.backoff_factor
+        return min(self.max_backoff, random.uniform(base, max(base, previous * 3)))
+
+    def as_dict(self) -> Dict[str, Any]:
+        return {
+            "max_attempts": self.max_attempts,
+            "backoff_factor": self.backoff_factor,
+            "max_backoff": self.max_backoff,
+            "breaker_threshold": self.breaker_threshold,
+            "breaker_cooldown": self.breaker_cooldown
+        }
+
+
+class CircuitBreaker:
+    """单个(提供商, 模型)的熔断器
+
+    连续threshold次可重试的失败后打开，冷却期内直接拒绝请求；
+    冷却结束后进入半开状态，只放行一个探测请求，成功则关闭，失败则重新打开。
+    """
+
+    def __init__(self, key: Tuple[str, str], threshold: int, cooldown: float):
+        self.key = key
+        self.threshold = threshold
+        self.cooldown = cooldown
+        self.state = CLOSED
+        self.failures = 0  # 连续失败次数
+        self.opened_at = 0.0
+        self.last_error: Optional[str] = None
+        self.total_failures = 0
+        self.total_successes = 0
+        self.rejected = 0
+        self._probe_at: Optional[float] = None
+        self._lock = threading.Lock()
+
+    def retry_in(self) -> float:
+        """距离允许探测还需等待的秒数"""
+        if self.state != OPEN:
+            return 0.0
+        return max(0.0, self.opened_at + self.cooldown - time.monotonic())
+
+    def allow(self) -> bool:
+        """是否放行一个请求，半开状态下同一时间只放行一个探测"""
+        with self._lock:
+            now = time.monotonic()
+            if self.state == OPEN and now - self.opened_at >= self.cooldown:
+                self.state = HALF_OPEN
+                self._probe_at = None
+            if self.state == HALF_OPEN:
+                # 探测请求被取消而没有回报结果时，超过冷却时间再放行下一个
+                if self._probe_at is None or now - self._probe_at >= self.cooldown:
+                    self._probe_at = now
+                    return True
+            elif self.state == CLOSED:
+                return True
+            self.rejected += 1
+            return False
+
+    def record_success(self):
+        with self._lock:
+            if self.state != CLOSED:
+                logger.info(f"{self.key[0]}/{self.key[1]} 恢复正常，熔断器关闭")
+            self.state = CLOSED
+            self.failures = 0
+            self._probe_at = None
+            self.total_successes += 1
+
+    def record_failure(self, error: Exception):
+        with self._lock:
+            self.failures += 1
+            self.total_failures += 1
+            self.last_error = f"{type(error).__name__}: {error}"[:200]
+            if self.state == HALF_OPEN or (self.state == CLOSED and self.failures >= self.threshold):
+                self.state = OPEN
+                self.opened_at = time.monotonic()
+                self._probe_at = None
+                logger.warning(f"{self.key[0]}/{self.key[1]} 连续失败 {self.failures} 次，熔断 {self.cooldown:.0f} 秒")
+
+    def release(self):
+        """请求以不计入熔断的结果结束（如参数错误），释放半开探测名额"""
+        with self._lock:
+            self._probe_at = None
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "state": self.state,
+                "consecutive_failures": self.failures,
+                "retry_in": round(self.retry_in(), 3),
+                "total_failures": self.total_failures,
+                "total_successes": self.total_successes,
+                "rejected": self.rejected,
+                "last_error": self.last_error
+            }
+
+
+def _target_key(target: Any) -> Tuple[str, str]:
+    """路由目标（ModelTarget）的熔断键"""
+    return target.provider, target.model
+
+
+class RetryState:
+    """单次请求的重试过程
+
+    用法：
+        state = retry_engine.begin(targets)
+        while True:
+            target, delay = state.next()   # 熔断器全部打开时抛出CircuitOpenError
+            sleep(delay)
+            try:
+                ...
+                state.succeeded()
+                break
+            except Exception as e:
+                if not state.failed(e):
+                    raise
+    依次尝试targets：换到尚未尝试过的目标时不等待；
+    回到已失败过的目标时按去相关抖动退避，并且不短于其Retry-After。
+    熔断中的目标会被跳过。
+    """
+
+    def __init__(self, engine: "RetryEngine", targets: Sequence[Any],
+                 key: Callable[[Any], Tuple[str, str]] = _target_key):
+        if not targets:
+            raise ValueError("targets不能为空")
+        self.engine = engine
+        self.policy = engine.policy
+        self.targets = list(targets)
+        self.key = key
+        self.attempt = 0
+        self.target: Any = None
+        self.error: Optional[Exception] = None
+        self._index = -1
+        self._tried = set()
+        self._retry_after: Dict[int, float] = {}
+        self._previous_delay = self.policy.backoff_factor
+
+    def next(self) -> Tuple[Any, float]:
+        """本次尝试的目标与应等待的秒数"""
+        count = len(self.targets)
+        for step in range(1, count + 1):
+            index = (self._index + step) % count
+            breaker = self.engine.breaker(self.key(self.targets[index]))
+            if breaker.allow():
+                break
+        else:
+            self.engine.record("short_circuited")
+            first = self.engine.breaker(self.key(self.targets[0]))
+            raise CircuitOpenError(first.key, first.retry_in())
+
+        delay = 0.0
+        if index in self._tried:
+            delay = self.policy.backoff(self._previous_delay)
+            self._previous_delay = delay
+            delay = max(delay, self._retry_after.get(index, 0.0))
+            self.engine.record("retries")
+        self._index = index
+        self._tried.add(index)
+        self.attempt += 1
+        self.target = self.targets[index]
+        return self.target, delay
+
+    def succeeded(self):
+        self.engine.breaker(self.key(self.target)).record_success()
+
+    def release(self):
+        """本次尝试没有实际访问目标（如命中缓存），不计入熔断"""
+        self.engine.breaker(self.key(self.target)).release()
+
+    def adopt(self, target: Any) -> Any:
+        """改用链路中的另一个目标继续本次尝试（如对冲请求胜出）"""
+        self._index = self.targets.index(target)
+        self._tried.add(self._index)
+        self.target = target
+        return target
+
+    def failed(self, error: Exception) -> bool:
+        """记录本次失败，返回是否应继续尝试"""
+        self.error = error
+        breaker = self.engine.breaker(self.key(self.target))
+        kind = classify_error(error)
+        if kind not in RETRYABLE:
+            breaker.release()
+            return False
+        breaker.record_failure(error)
+        wait = retry_after(error)
+        if wait is not None:
+            self._retry_after[self._index] = wait
+        if self.attempt >= self.policy.max_attempts:
+            return False
+        # 唯一可用的目标要求等待超过上限时直接放弃，不长时间占用线程
+        if wait is not None and wait > self.policy.max_backoff and len(self.targets) == 1:
+            logger.warning(f"服务端要求等待 {wait:.0f} 秒，超过重试等待上限，放弃重试")
+            return False
+        return True
+
+    def kind(self) -> Optional[str]:
+        """最近一次失败的错误类别"""
+        return classify_error(self.error) if self.error is not None else None
+
+
+class RetryEngine:
+    """共享的重试与熔断组件
+
+    所有API客户端（同步、异步及secure_request）经由它决定是否重试、等待多久，
+    熔断器按(提供商, 模型)共享，一个目标持续失败时各调用方都会快速失败，
+    不会在等待中堆积线程。参数来自security_config.retry_policy，修改后自动生效。
+    """
+
+    def __init__(self, config=security_config):
+        self.config = config
+        self._policy_snapshot: Optional[Dict[str, Any]] = None
+        self._policy = RetryPolicy()
+        self._breakers: Dict[Tuple[str, str], CircuitBreaker] = {}
+        self._counters = {"retries": 0, "short_circuited": 0}
+        self._lock = threading.Lock()
+
+    @property
+    def policy(self) -> RetryPolicy:
+        """当前重试参数，配置变化时重建"""
+        snapshot = dict(self.config.retry_policy or {})
+        with self._lock:
+            if snapshot != self._policy_snapshot:
+                self._policy = RetryPolicy.from_config(self.config)
+                self._policy_snapshot = snapshot
+                for breaker in self._breakers.values():
+                    breaker.threshold = self._policy.breaker_threshold
+                    breaker.cooldown = self._policy.breaker_cooldown
+            return self._policy
+
+    def breaker(self, key: Tuple[str, str]) -> CircuitBreaker:
+        policy = self.policy
+        with self._lock:
+            breaker = self._breakers.get(key)
+            if breaker is None:
+                breaker = CircuitBreaker(key, policy.breaker_threshold, policy.breaker_cooldown)
+                self._breakers[key] = breaker
+            return breaker
+
+    def begin(self, targets: Sequence[Any],
+              key: Callable[[Any], Tuple[str, str]] = _target_key) -> RetryState:
+        """开始一次请求的重试过程，key(target)返回熔断键(提供商, 模型)"""
+        return RetryState(self, targets, key)
+
+    def record(self, event: str):
+        with self._lock:
+            self._counters[event] += 1
+
+    def reset(self, key: Optional[Tuple[str, str]] = None):
+        """手动关闭熔断器（如用户修改密钥后），key为空时全部重置"""
+        with self._lock:
+            keys = [key] if key else list(self._breakers)
+            for k in keys:
+                self._breakers.pop(k, None)
+
+    def stats(self) -> Dict[str, Any]:
+        """返回重试计数、重试参数与各熔断器状态"""
+        policy = self.policy
+        with self._lock:
+            counters = dict(self._counters)
+            breakers: List[CircuitBreaker] = list(self._breakers.values())
+        return {
+            **counters,
+            "policy": policy.as_dict(),
+            "breakers": {f"{b.key[0]}/{b.key[1]}": b.stats() for b in breakers}
+        }
+
+
+# 全局重试引擎
+retry_engine = RetryEngine()
@@ -0,0 +1,164 @@
+from collections import deque
+from typing import Callable, Deque, Dict, Any, List, Optional
+import threading
+import logging
+from modules.GlobalModule import global_config
+from utils.config_loader import load_config
+from utils.config_store import config_store
+
+logger = logging.getLogger(__name__)
+
+
+class ModelTarget:
+    """一次请求的目标模型：配置名及其提供商、地址与上下文窗口"""
+
+    def __init__(self, name: str, provider: str, base_url: str, model: str, context_window: int):
+        self.name = name  # model_mapping中的配置名，如"Qwen-R1"
+        self.provider = provider
+        self.base_url = base_url
+        self.model = model  # 官方模型标识
+        self.context_window = context_window
+
+    @classmethod
+    def current(cls) -> "ModelTarget":
+        """当前全局选择的模型"""
+        config = global_config.model_config
+        return cls(config.name, config.provider, config.base_url, config.model, config.context_window)
+
+    @classmethod
+    def from_mapping(cls, name: str) -> Optional["ModelTarget"]:
+        """按配置名从model_mapping构建，不存在时返回None"""
+        config = global_config.model_mapping.get(name)
+        if not config:
+            return None
+        return cls(name, config['provider'], config['base_url'], config['model'], config['context_window'])
+
+    @property
+    def is_reasoning(self) -> bool:
+        """是否输出思维链"""
+        return "DeepSeek-R1" in self.name or "Qwen-R1" in self.name
+
+    def __repr__(self):
+        return f"ModelTarget({self.name} @ {self.provider})"
+
+
+class LatencyTracker:
+    """按模型记录首字延迟（TTFT）样本，用于计算对冲阈值"""
+
+    def __init__(self, max_samples: int = 200):
+        self.max_samples = max_samples
+        self._samples: Dict[str, Deque[float]] = {}
+        self._lock = threading.Lock()
+
+    def observe(self, name: str, ttft: float):
+        with self._lock:
+            samples = self._samples.setdefault(name, deque(maxlen=self.max_samples))
+            samples.append(ttft)
+
+    def count(self, name: str) -> int:
+        with self._lock:
+            return len(self._samples.get(name, ()))
+
+    def percentile(self, name: str, q: float) -> Optional[float]:
+        """返回第q分位（0-1）的TTFT，无样本时返回None"""
+        with self._lock:
+            samples = sorted(self._samples.get(name, ()))
+        if not samples:
+            return None
+        index = min(len(samples) - 1, max(0, int(round(q * (len(samples) - 1)))))
+        return samples[index]
+
+
+class ModelRouter:
+    """在model_mapping中的等价模型之间路由
+
+    配置位于model_config.yaml的routing节：
+        routing:
+          fallbacks:                 # 主模型失败时依次尝试的等价模型
+            DeepSeek-R1: [Qwen-R1]
+          hedge:
+            enabled: false           # 是否启用对冲请求（仅异步流式生成）
+            percentile: 0.9          # 主模型TTFT超过该分位数时向备选模型发起第二个请求
+            min_samples: 20          # 样本数不足时不对冲
+            min_delay: 1.0           # 对冲等待的下限（秒）
+    只有配置了API密钥的提供商会进入链路。修改routing节后无需重启，文件变化时自动重新读取。
+    """
+
+    def __init__(self):
+        self.fallbacks: Dict[str, List[str]] = {}
+        self.hedge_enabled = False
+        self.hedge_percentile = 0.9
+        self.hedge_min_samples = 20
+        self.hedge_min_delay = 1.0
+        self.latency = LatencyTracker()
+        self._counters = {"failovers": 0, "hedges": 0, "hedge_wins": 0}
+        self._lock = threading.Lock()
+        self.reload()
+        config_store.subscribe('model_config.yaml', self._on_config_changed)
+
+    def _on_config_changed(self, snapshot):
+        self.reload()
+        logger.info("model_config.yaml已变化，路由配置已重新读取")
+
+    def reload(self):
+        """重新读取routing配置"""
+        try:
+            routing = (load_config('model_config.yaml') or {}).get('routing') or {}
+        except Exception as e:
+            logger.warning(f"路由配置加载失败: {str(e)}")
+            routing = {}
+        self.fallbacks = {name: list(chain or []) for name, chain in (routing.get('fallbacks') or {}).items()}
+        hedge = routing.get('hedge') or {}
+        self.hedge_enabled = bool(hedge.get('enabled', False))
+        self.hedge_percentile = float(hedge.get('percentile', 0.9))
+        self.hedge_min_samples = int(hedge.get('min_samples', 20))
+        self.hedge_min_delay = float(hedge.get('min_delay', 1.0))
+
+    def chain(self, model_name: Optional[str] = None,
+              has_key: Optional[Callable[[str], bool]] = None) -> List[ModelTarget]:
+        """返回主模型及其可用的备选模型
+
+        model_name为空时使用当前全局选择的模型；has_key(provider)用于过滤未配置密钥的备选。
+        """
+        if model_name and model_name != global_config.model_config.name:
+            primary = ModelTarget.from_mapping(model_name)
+            if primary is None:
+                raise ValueError(f"未知的模型: {model_name}")
+        else:
+            primary = ModelTarget.current()
+        targets = [primary]
+        for name in self.fallbacks.get(primary.name, []):
+            target = ModelTarget.from_mapping(name)
+            if target is None or any(t.name == name for t in targets):
+                continue
+            if has_key is not None and not has_key(target.provider):
+                continue
+            targets.append(target)
+        return targets
+
+    def hedge_delay(self, name: str) -> Optional[float]:
+        """对冲等待时间：TTFT分位数与下限中的较大值，未启用或样本不足时返回None"""
+        if not self.hedge_enabled or self.latency.count(name) < self.hedge_min_samples:
+            return None
+        threshold = self.latency.percentile(name, self.hedge_percentile)
+        return max(self.hedge_min_delay, threshold or 0.0)
+
+    def record(self, event: str):
+        with self._lock:
+            self._counters[event] += 1
+
+    def stats(self) -> Dict[str, Any]:
+        """返回路由统计信息"""
+        with self._lock:
+            counters = dict(self._counters)
+        names = set(self.fallbacks) | {global_config.model_config.name}
+        return {
+            **counters,
+            "hedge_enabled": self.hedge_enabled,
+            "ttft_p50": {name: self.latency.percentile(name, 0.5) for name in names},
+            "ttft_p90": {name: self.latency.percentile(name, 0.9) for name in names}
+        }
+
+
+# 全局路由实例
+model_router = ModelRouter()
@@ -0,0 +1,159 @@
+from typing import Any, Callable, List, Optional
+import threading
+import time
+import logging
+
+logger = logging.getLogger(__name__)
+
+# 片段类型
+_TEXT = "text"
+_REASONING = "reasoning"
+_MARKER = "marker"
+
+
+class StreamBuffer:
+    """流式增量的合并缓冲区
+
+    生产者（网络读取线程或事件循环）调用push，从不等待；消费者调用drain
+    一次取出合并后的块。相邻的同类增量合并为一块，思维链与正文的先后顺序
+    以及thinking_finished等标记的位置保持不变。
+
+    flush_interval与max_batch_chars控制合并粒度：距上次取出超过
+    flush_interval秒或累计超过max_batch_chars个字符时ready()为True。
+    """
+
+    def __init__(self, flush_interval: float = 0.05, max_batch_chars: int = 4096):
+        self.flush_interval = flush_interval  # 合并时间窗口（秒）
+        self.max_batch_chars = max_batch_chars  # 合并字符上限
+        self._segments: List[list] = []
+        self._chars = 0
+        self._last_drain = time.monotonic()
+        self._lock = threading.Lock()
+        self.closed = False
+
+    def push(self, chunk: Any):
+        """写入一个回调格式的增量：字符串、{"reasoning_content": ...}或标记字典"""
+        if isinstance(chunk, dict):
+            reasoning = chunk.get("reasoning_content")
+            if reasoning is not None:
+                self._append(_REASONING, reasoning)
+            else:
+                with self._lock:
+                    self._segments.append([_MARKER, chunk])
+        elif chunk:
+            self._append(_TEXT, chunk)
+
+    def _append(self, kind: str, text: str):
+        if not text:
+            return
+        with self._lock:
+            if self._segments and self._segments[-1][0] == kind:
+                self._segments[-1][1] += text
+            else:
+                self._segments.append([kind, text])
+            self._chars += len(text)
+
+    def ready(self) -> bool:
+        """是否达到合并窗口或字符上限"""
+        with self._lock:
+            if not self._segments:
+                return False
+            return (self._chars >= self.max_batch_chars
+                    or time.monotonic() - self._last_drain >= self.flush_interval)
+
+    def drain(self, max_chars: Optional[int] = None) -> List[Any]:
+        """取出合并后的块（回调格式），max_chars限制本次取出的字符数"""
+        chunks = []
+        with self._lock:
+            budget = max_chars if max_chars else None
+            while self._segments:
+                kind, payload = self._segments[0]
+                if kind == _MARKER:
+                    chunks.append(payload)
+                    self._segments.pop(0)
+                    continue
+                if budget is not None and budget <= 0:
+                    break
+                if budget is not None and len(payload) > budget:
+                    part, self._segments[0][1] = payload[:budget], payload[budget:]
+                else:
+                    part = payload
+                    self._segments.pop(0)
+                self._chars -= len(part)
+                if budget is not None:
+                    budget -= len(part)
+                chunks.append({"reasoning_content": part} if kind == _REASONING else part)
+            self._last_drain = time.monotonic()
+        return chunks
+
+    def close(self):
+        """标记生产者已结束"""
+        self.closed = True
+
+    def __bool__(self):
+        with self._lock:
+            return bool(self._segments)
+
+
+class TkStreamPump:
+    """在Tk主线程中按帧把缓冲内容交给回调
+
+    push可在任意线程调用且只写缓冲区；所有界面更新都在主线程的after定时器中进行，
+    每帧最多调用几次callback，每块为合并后的完整增量。
+    frame_interval_ms控制刷新频率，max_chars_per_frame限制每帧输出量
+    （突发的大段内容会分摊到后续几帧，保持平滑）。
+    """
+
+    def __init__(self, widget, callback: Callable[[Any], None], frame_interval_ms: int = 33,
+                 max_chars_per_frame: Optional[int] = None, buffer: Optional[StreamBuffer] = None):
+        self.widget = widget
+        self.callback = callback
+        self.frame_interval_ms = frame_interval_ms
+        self.max_chars_per_frame = max_chars_per_frame
+        self.buffer = buffer or StreamBuffer(flush_interval=frame_interval_ms / 1000.0)
+        self._on_finished: Optional[Callable[[], None]] = None
+        self._after_id = None
+        self._stopped = False
+
+    def push(self, chunk: Any):
+        """写入增量（线程安全，不等待）"""
+        if not self._stopped:
+            self.buffer.push(chunk)
+
+    def start(self):
+        """开始按帧刷新，必须在Tk主线程调用"""
+        self._schedule()
+        return self
+
+    def finish(self, on_finished: Optional[Callable[[], None]] = None):
+        """生产者结束：剩余内容刷新完后停止，并在主线程调用on_finished（线程安全）"""
+        self._on_finished = on_finished
+        self.buffer.close()
+
+    def stop(self):
+        """立即停止并丢弃未刷新的内容"""
+        self._stopped = True
+        self.buffer.drain()
+
+    def _schedule(self):
+        try:
+            if self.widget.winfo_exists():
+                self._after_id = self.widget.after(self.frame_interval_ms, self._tick)
+        except Exception:
+            self._after_id = None
+
+    def _tick(self):
+        self._after_id = None
+        if self._stopped:
+            return
+        for chunk in self.buffer.drain(self.max_chars_per_frame):
+            try:
+                self.callback(chunk)
+            except Exception as e:
+                logger.error(f"流式回调处理失败: {str(e)}")
+        if self.buffer.closed and not self.buffer:
+            self._stopped = True
+            if self._on_finished:
+                self._on_finished()
+            return
+        self._schedule()
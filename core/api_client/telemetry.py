@@ -0,0 +1,312 @@
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+import atexit
+import bisect
+import os
+import threading
+import time
+import logging
+
+logger = logging.getLogger(__name__)
+
+METRICS_FILE = Path(__file__).parent.parent.parent / 'data/metrics.prom'
+
+# 直方图分桶（秒 / tokens每秒）
+LATENCY_BUCKETS = (0.1, 0.25, 0.5, 1.0, 2.0, 5.0, 10.0, 20.0, 30.0, 60.0, 120.0, 300.0)
+GAP_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.0, 5.0, 10.0)
+RATE_BUCKETS = (1.0, 2.0, 5.0, 10.0, 20.0, 30.0, 50.0, 75.0, 100.0, 150.0, 200.0)
+
+LabelValues = Tuple[str, ...]
+
+
+def _escape(value: str) -> str:
+    return str(value).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+
+def _format_labels(names: Sequence[str], values: Sequence[str], extra: str = "") -> str:
+    parts = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        parts.append(extra)
+    return "{" + ",".join(parts) + "}" if parts else ""
+
+
+class Counter:
+    """带标签的计数器"""
+
+    kind = "counter"
+
+    def __init__(self, name: str, help: str, labels: Sequence[str]):
+        self.name = name
+        self.help = help
+        self.labels = tuple(labels)
+        self._values: Dict[LabelValues, float] = {}
+        self._lock = threading.Lock()
+
+    def inc(self, *values: str, amount: float = 1.0):
+        with self._lock:
+            self._values[values] = self._values.get(values, 0.0) + amount
+
+    def render(self) -> List[str]:
+        with self._lock:
+            items = sorted(self._values.items())
+        return [f"{self.name}{_format_labels(self.labels, values)} {value}" for values, value in items]
+
+    def snapshot(self) -> Dict[str, Any]:
+        with self._lock:
+            return {"/".join(values): value for values, value in self._values.items()}
+
+
+class Histogram:
+    """带标签的累积直方图，与Prometheus的histogram类型一致"""
+
+    kind = "histogram"
+
+    def __init__(self, name: str, help: str, labels: Sequence[str], buckets: Sequence[float]):
+        self.name = name
+        self.help = help
+        self.labels = tuple(labels)
+        self.buckets = tuple(sorted(buckets))
+        # 每组标签：[各桶计数..., +Inf计数], 总和
+        self._values: Dict[LabelValues, Tuple[List[int], List[float]]] = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value: float, *values: str):
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            counts, total = self._values.setdefault(values, ([0] * (len(self.buckets) + 1), [0.0]))
+            counts[index] += 1
+            total[0] += value
+
+    def render(self) -> List[str]:
+        with self._lock:
+            items = sorted((values, (list(counts), total[0])) for values, (counts, total) in self._values.items())
+        lines = []
+        for values, (counts, total) in items:
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float('inf'),), counts):
+                cumulative += count
+                le = "+Inf" if bound == float('inf') else repr(bound)
+                labels = _format_labels(self.labels, values, 'le="%s"' % le)
+                lines.append(f"{self.name}_bucket{labels} {cumulative}")
+            lines.append(f"{self.name}_sum{_format_labels(self.labels, values)} {total}")
+            lines.append(f"{self.name}_count{_format_labels(self.labels, values)} {cumulative}")
+        return lines
+
+    def quantile(self, q: float, counts: List[int]) -> Optional[float]:
+        """按桶估算分位数（取所在桶的上界）"""
+        total = sum(counts)
+        if not total:
+            return None
+        rank = q * total
+        cumulative = 0
+        for bound, count in zip(self.buckets + (float('inf'),), counts):
+            cumulative += count
+            if cumulative >= rank:
+                return bound if bound != float('inf') else self.buckets[-1]
+        return self.buckets[-1]
+
+    def snapshot(self) -> Dict[str, Any]:
+        with self._lock:
+            items = [(values, list(counts), total[0]) for values, (counts, total) in self._values.items()]
+        result = {}
+        for values, counts, total in items:
+            count = sum(counts)
+            result["/".join(values)] = {
+                "count": count,
+                "avg": round(total / count, 4) if count else None,
+                "p50": self.quantile(0.5, counts),
+                "p90": self.quantile(0.9, counts)
+            }
+        return result
+
+
+class StreamTimer:
+    """单次请求的计时：首字、首个思维链token、块间隔与总耗时"""
+
+    def __init__(self, telemetry: "Telemetry", model: str, provider: str, family: Optional[str],
+                 started: Optional[float] = None):
+        self.telemetry = telemetry
+        self.labels = (model, provider, family or "default")
+        self.started = started or time.monotonic()
+        self.first_reasoning: Optional[float] = None
+        self.first_content: Optional[float] = None
+        self._last_chunk: Optional[float] = None
+
+    def chunk(self, reasoning: bool = False):
+        """收到一个有内容的块"""
+        now = time.monotonic()
+        t = self.telemetry
+        if reasoning and self.first_reasoning is None:
+            self.first_reasoning = now
+            t.ttft_reasoning.observe(now - self.started, *self.labels)
+        if not reasoning and self.first_content is None:
+            self.first_content = now
+            t.ttft.observe(now - self.started, *self.labels)
+        if self._last_chunk is not None:
+            t.chunk_gap.observe(now - self._last_chunk, *self.labels)
+        self._last_chunk = now
+
+    def finish(self, status: str, tokens: Optional[int] = None):
+        """结束计时，status为ok/error/cancelled，tokens为输出token数"""
+        now = time.monotonic()
+        t = self.telemetry
+        t.requests.inc(*self.labels, status)
+        if status != "ok":
+            return
+        t.duration.observe(now - self.started, *self.labels)
+        first = self.first_reasoning or self.first_content
+        if self.first_reasoning and self.first_content:
+            first = min(self.first_reasoning, self.first_content)
+        # 生成速度按首字之后的时间计算；非流式请求按总耗时计算
+        elapsed = now - (first or self.started)
+        if tokens and elapsed > 0:
+            t.tokens_per_second.observe(tokens / elapsed, *self.labels)
+
+
+class Telemetry:
+    """进程内的生成指标
+
+    指标以Prometheus文本格式导出：后台定时写入data/metrics.prom，
+    也可通过serve()在本机开启/metrics端点（设置环境变量AIWRITER_METRICS_PORT时启动时自动开启）。
+    """
+
+    def __init__(self, export_path: Path = METRICS_FILE, export_interval: float = 15.0):
+        self.export_path = Path(export_path)
+        self.export_interval = export_interval  # 写文件间隔（秒）
+        self.started_at = time.time()
+        request_labels = ("model", "provider", "family")
+        self.ttft = Histogram(
+            "aiwriter_ttft_seconds", "Time to first content token", request_labels, LATENCY_BUCKETS)
+        self.ttft_reasoning = Histogram(
+            "aiwriter_ttft_reasoning_seconds", "Time to first reasoning token", request_labels, LATENCY_BUCKETS)
+        self.chunk_gap = Histogram(
+            "aiwriter_chunk_gap_seconds", "Gap between streamed chunks", request_labels, GAP_BUCKETS)
+        self.tokens_per_second = Histogram(
+            "aiwriter_tokens_per_second", "Output tokens per second after the first token",
+            request_labels, RATE_BUCKETS)
+        self.duration = Histogram(
+            "aiwriter_request_duration_seconds", "Total latency of successful requests",
+            request_labels, LATENCY_BUCKETS)
+        self.requests = Counter(
+            "aiwriter_requests_total", "Requests by outcome", request_labels + ("status",))
+        self.retries = Counter(
+            "aiwriter_retries_total", "Retries and failovers", ("model", "provider", "reason"))
+        self.errors = Counter(
+            "aiwriter_errors_total", "Failed attempts by error kind", ("model", "provider", "kind"))
+        self.generation_duration = Histogram(
+            "aiwriter_ui_generation_seconds", "Wall time of UI generation steps", ("step", "state"),
+            LATENCY_BUCKETS)
+        self._metrics = [
+            self.ttft, self.ttft_reasoning, self.chunk_gap, self.tokens_per_second, self.duration,
+            self.requests, self.retries, self.errors, self.generation_duration
+        ]
+        self._lock = threading.Lock()
+        self._exporter: Optional[threading.Timer] = None
+        self._exit_hook = False
+        self._server: Optional[ThreadingHTTPServer] = None
+
+    def timer(self, model: str, provider: str, family: Optional[str] = None,
+              started: Optional[float] = None) -> StreamTimer:
+        """开始一次请求的计时，started为time.monotonic()起点（默认当前时刻）"""
+        self._ensure_exporter()
+        return StreamTimer(self, model, provider, family, started)
+
+    def retry(self, model: str, provider: str, reason: str):
+        self.retries.inc(model, provider, reason)
+
+    def error(self, model: str, provider: str, kind: str):
+        self.errors.inc(model, provider, kind)
+
+    def generation(self, step: str, state: str, seconds: float):
+        """记录一次界面生成步骤（模板生成、角色生成等）的总耗时"""
+        self._ensure_exporter()
+        self.generation_duration.observe(seconds, step or "unnamed", state)
+
+    def render(self) -> str:
+        """Prometheus文本格式"""
+        lines = []
+        for metric in self._metrics:
+            lines.append(f"# HELP {metric.name} {metric.help}")
+            lines.append(f"# TYPE {metric.name} {metric.kind}")
+            lines.extend(metric.render())
+        lines.append("# HELP aiwriter_start_time_seconds Process start time")
+        lines.append("# TYPE aiwriter_start_time_seconds gauge")
+        lines.append(f"aiwriter_start_time_seconds {self.started_at}")
+        return "\n".join(lines) + "\n"
+
+    def stats(self) -> Dict[str, Any]:
+        """各指标的摘要：直方图给出次数、均值与估算的p50/p90"""
+        return {metric.name: metric.snapshot() for metric in self._metrics}
+
+    def export(self, path: Optional[Path] = None) -> Path:
+        """写入指标文件（先写临时文件再替换，读取方不会看到写了一半的内容）"""
+        path = Path(path or self.export_path)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        tmp = path.with_suffix(path.suffix + ".tmp")
+        tmp.write_text(self.render(), encoding='utf-8')
+        os.replace(tmp, path)
+        return path
+
+    def _ensure_exporter(self):
+        """启动定时写文件的后台定时器"""
+        with self._lock:
+            if not self._exit_hook:
+                # 退出时写入最后一次，定时器间隔内的数据不会丢失
+                self._exit_hook = True
+                atexit.register(self._export_quietly)
+            if self.export_interval <= 0 or (self._exporter is not None and self._exporter.is_alive()):
+                return
+            self._exporter = threading.Timer(self.export_interval, self._export_periodically)
+            self._exporter.daemon = True
+            self._exporter.start()
+
+    def _export_quietly(self):
+        try:
+            self.export()
+        except OSError as e:
+            logger.warning(f"写入指标文件失败: {str(e)}")
+
+    def _export_periodically(self):
+        self._export_quietly()
+        with self._lock:
+            self._exporter = None
+        self._ensure_exporter()
+
+    def serve(self, port: int = 9464, host: str = "127.0.0.1") -> ThreadingHTTPServer:
+        """在本机开启/metrics端点，返回服务器对象（重复调用返回已开启的服务器）"""
+        with self._lock:
+            if self._server is not None:
+                return self._server
+            telemetry = self
+
+            class MetricsHandler(BaseHTTPRequestHandler):
+                def do_GET(self):
+                    if self.path.split('?')[0] != '/metrics':
+                        self.send_error(404)
+                        return
+                    body = telemetry.render().encode('utf-8')
+                    self.send_response(200)
+                    self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+                    self.send_header("Content-Length", str(len(body)))
+                    self.end_headers()
+                    self.wfile.write(body)
+
+                def log_message(self, format, *args):
+                    logger.debug(format % args)
+
+            self._server = ThreadingHTTPServer((host, port), MetricsHandler)
+            threading.Thread(target=self._server.serve_forever, name="MetricsServer", daemon=True).start()
+            logger.info(f"指标端点已开启: http://{host}:{port}/metrics")
+            return self._server
+
+    def stop_server(self):
+        with self._lock:
+            server, self._server = self._server, None
+        if server is not None:
+            server.shutdown()
+            server.server_close()
+
+
+# 全局指标
+telemetry = Telemetry()
@@ -0,0 +1,197 @@
+from collections import OrderedDict
+from pathlib import Path
+from typing import Dict, Any, Optional, List
+import threading
+import hashlib
+import logging
+from modules.GlobalModule import global_config
+
+logger = logging.getLogger(__name__)
+
+
+class Tokenizer:
+    """分词器基类，子类实现count"""
+    name = "base"
+
+    def count(self, text: str) -> int:
+        raise NotImplementedError
+
+
+class HeuristicTokenizer(Tokenizer):
+    """按字符类别加权的估算分词器
+
+    中文字符与ASCII字符的token密度相差数倍，按类别分别计权。
+    系数来自各提供商公布的换算比例（如DeepSeek：1个中文字符约0.6 token，
+    1个英文字符约0.3 token）。
+    """
+
+    def __init__(self, name: str, cjk: float = 0.6, ascii: float = 0.3,
+                 punctuation: float = 1.0, other: float = 1.0):
+        self.name = name
+        self.cjk = cjk  # 每个汉字的token数
+        self.ascii = ascii  # 每个ASCII字符的token数
+        self.punctuation = punctuation  # 每个全角标点的token数
+        self.other = other  # 其他字符（假名、表情等）的token数
+
+    def count(self, text: str) -> int:
+        if not text:
+            return 0
+        cjk = ascii_chars = punctuation = other = 0
+        for ch in text:
+            code = ord(ch)
+            if code < 0x80:
+                ascii_chars += 1
+            elif 0x4E00 <= code <= 0x9FFF or 0x3400 <= code <= 0x4DBF or 0xF900 <= code <= 0xFAFF:
+                cjk += 1
+            elif 0x3000 <= code <= 0x303F or 0xFF00 <= code <= 0xFFEF:
+                punctuation += 1
+            else:
+                other += 1
+        total = (cjk * self.cjk + ascii_chars * self.ascii
+                 + punctuation * self.punctuation + other * self.other)
+        return max(1, int(total + 0.999))
+
+
+class BPETokenizer(Tokenizer):
+    """基于本地tokenizer.json词表的精确分词器
+
+    需要安装tokenizers包并提供词表文件（如data/tokenizers/deepseek_v3/tokenizer.json），
+    任一条件不满足时load返回None，由调用方回退到估算分词器。
+    """
+
+    def __init__(self, name: str, backend):
+        self.name = name
+        self._backend = backend
+
+    @classmethod
+    def load(cls, name: str, path: str) -> Optional["BPETokenizer"]:
+        if not Path(path).exists():
+            return None
+        try:
+            from tokenizers import Tokenizer as HFTokenizer
+        except ImportError:
+            logger.debug("未安装tokenizers，使用估算分词器")
+            return None
+        try:
+            return cls(name, HFTokenizer.from_file(str(path)))
+        except Exception as e:
+            logger.warning(f"加载词表失败 {path}: {str(e)}")
+            return None
+
+    def count(self, text: str) -> int:
+        if not text:
+            return 0
+        return len(self._backend.encode(text, add_special_tokens=False).ids)
+
+
+# 各提供商的默认估算系数
+_PROVIDER_DEFAULTS = {
+    "DeepSeek": {"cjk": 0.6, "ascii": 0.3},
+    "Qwen": {"cjk": 0.65, "ascii": 0.3},
+    "HunYuan": {"cjk": 0.6, "ascii": 0.3},
+}
+
+# 本地词表的默认位置，存在时优先于估算
+_TOKENIZER_DIR = Path(__file__).parent.parent.parent / 'data/tokenizers'
+
+
+class TokenCounter:
+    """按模型选择分词器并缓存计数结果
+
+    解析顺序：显式注册的模型 -> 模型配置中的tokenizer项 -> 本地词表目录 ->
+    提供商估算系数 -> 通用估算。每条消息的计数按内容哈希缓存，
+    长对话历史不会被重复分词。
+    """
+
+    # 每条消息的角色/分隔符开销与回复引导开销
+    message_overhead = 4
+    reply_overhead = 3
+
+    def __init__(self, max_cached: int = 4096):
+        self.max_cached = max_cached
+        self._tokenizers: Dict[str, Tokenizer] = {}
+        self._resolved: Dict[str, Tokenizer] = {}
+        self._cache: "OrderedDict[tuple, int]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._counters = {"hits": 0, "misses": 0}
+        self.default = HeuristicTokenizer("heuristic")
+
+    def register(self, model: str, tokenizer: Tokenizer):
+        """为模型（配置名或官方模型标识）注册分词器"""
+        with self._lock:
+            self._tokenizers[model] = tokenizer
+            self._resolved.clear()
+
+    def for_model(self, name: Optional[str] = None) -> Tokenizer:
+        """返回模型对应的分词器，默认为当前选择的模型"""
+        name = name or global_config.model_config.name
+        with self._lock:
+            tokenizer = self._resolved.get(name)
+            if tokenizer is None:
+                tokenizer = self._resolve(name, global_config.model_mapping.get(name) or {})
+                self._resolved[name] = tokenizer
+            return tokenizer
+
+    def _resolve(self, name: str, config: Dict[str, Any]) -> Tokenizer:
+        model_id = config.get("model", "")
+        for key in (name, model_id):
+            if key and key in self._tokenizers:
+                return self._tokenizers[key]
+
+        spec = config.get("tokenizer")
+        if isinstance(spec, str):
+            tokenizer = BPETokenizer.load(name, spec)
+            if tokenizer:
+                return tokenizer
+        elif isinstance(spec, dict):
+            return HeuristicTokenizer(name, **spec)
+
+        if model_id:
+            tokenizer = BPETokenizer.load(model_id, str(_TOKENIZER_DIR / model_id / "tokenizer.json"))
+            if tokenizer:
+                return tokenizer
+
+        defaults = _PROVIDER_DEFAULTS.get(config.get("provider", ""))
+        if defaults:
+            return HeuristicTokenizer(config["provider"], **defaults)
+        return self.default
+
+    def count(self, text: str, tokenizer: Optional[Tokenizer] = None) -> int:
+        """计算文本的token数"""
+        tokenizer = tokenizer or self.for_model()
+        if not text:
+            return 0
+        key = (tokenizer.name, hashlib.sha1(text.encode('utf-8')).digest())
+        with self._lock:
+            cached = self._cache.get(key)
+            if cached is not None:
+                self._cache.move_to_end(key)
+                self._counters["hits"] += 1
+                return cached
+        result = tokenizer.count(text)
+        with self._lock:
+            self._counters["misses"] += 1
+            self._cache[key] = result
+            while len(self._cache) > self.max_cached:
+                self._cache.popitem(last=False)
+        return result
+
+    def count_messages(self, messages: List[Dict[str, Any]], model: Optional[str] = None) -> int:
+        """计算消息列表的prompt token数，含消息格式开销"""
+        tokenizer = self.for_model(model)
+        total = self.reply_overhead
+        for message in messages:
+            content = message.get("content") or ""
+            if not isinstance(content, str):
+                content = str(content)
+            total += self.count(content, tokenizer) + self.message_overhead
+        return total
+
+    def stats(self) -> Dict[str, Any]:
+        """返回计数缓存统计信息"""
+        with self._lock:
+            return {**self._counters, "cached": len(self._cache)}
+
+
+# 全局token计数器实例
+token_counter = TokenCounter()
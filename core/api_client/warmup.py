@@ -0,0 +1,258 @@
+from typing import Dict, Any, Optional, Callable, Tuple
+from urllib.parse import urlsplit
+import threading
+import socket
+import time
+import logging
+from modules.GlobalModule import global_config
+from utils.config_loader import get_provider_key
+from core.api_client.pool import client_pool, ClientPool
+from core.api_client.router import ModelTarget
+
+logger = logging.getLogger(__name__)
+
+# 预热状态
+STATE_IDLE = "idle"  # 尚未预热
+STATE_WARMING = "warming"  # 正在解析域名与建立连接
+STATE_READY = "ready"  # 连接已建立并保持在连接池中
+STATE_EXPIRED = "expired"  # 连接已超过keep-alive有效期，下次请求需重新建连
+STATE_FAILED = "failed"  # 预热失败（网络不可达、超时等）
+STATE_NO_KEY = "no_key"  # 提供商未配置密钥，无法建立与之后请求共用的连接
+
+STATE_LABELS = {
+    STATE_IDLE: "未预热",
+    STATE_WARMING: "预热中",
+    STATE_READY: "已就绪",
+    STATE_EXPIRED: "连接已过期",
+    STATE_FAILED: "预热失败",
+    STATE_NO_KEY: "未配置密钥",
+}
+
+
+class _WarmState:
+    """单个(提供商, 地址)的预热记录"""
+
+    def __init__(self, name: str):
+        self.name = name  # 触发预热的模型配置名
+        self.state = STATE_WARMING
+        self.started_at = time.time()
+        self.finished_at: Optional[float] = None
+        self.dns_ms: Optional[float] = None
+        self.connect_ms: Optional[float] = None  # 同步客户端首个请求（含TCP/TLS握手）耗时
+        self.async_connect_ms: Optional[float] = None  # 异步客户端首个请求耗时
+        self.http_status: Optional[int] = None
+        self.error: Optional[str] = None
+        self.done = threading.Event()
+
+    def finish(self, state: str, error: Optional[str] = None):
+        self.state = state
+        self.error = error
+        self.finished_at = time.time()
+        self.done.set()
+
+
+class WarmupService:
+    """在后台为当前提供商预先解析域名并建立连接
+
+    启动时与切换模型时，在后台线程中解析base_url的域名，并通过连接池中
+    与生成请求相同的同步客户端和（AsyncRunner事件循环上的）异步客户端各发一次
+    GET /models，使DNS、TCP与TLS握手在用户点击生成之前完成，首次生成直接复用
+    keep-alive连接。ConnectionMonitor的定时检查也经由probe走同一连接池，
+    在检查状态的同时让连接保持活跃。录制/回放API会话时不预热。
+    """
+
+    def __init__(self, pool: ClientPool = client_pool,
+                 key_provider: Optional[Callable[[str], str]] = None, timeout: float = 10.0):
+        self.pool = pool
+        self.key_provider = key_provider or get_provider_key  # provider -> API密钥
+        self.timeout = timeout  # 单次预热请求的超时（秒）
+        self.warm_async = True  # 是否同时预热AsyncRunner事件循环上的异步客户端
+        self._states: Dict[Tuple[str, str], _WarmState] = {}
+        self._lock = threading.Lock()
+        self._listening = False
+        self._counters = {"warmups": 0, "ready": 0, "failed": 0, "skipped": 0, "probes": 0}
+
+    @staticmethod
+    def _make_key(target: ModelTarget) -> Tuple[str, str]:
+        return (target.provider or "", (target.base_url or "").rstrip('/'))
+
+    def start(self):
+        """预热当前模型的提供商，并在之后每次切换模型时自动预热"""
+        if not self._listening:
+            global_config.add_model_listener(self._on_model_changed)
+            self._listening = True
+        self.warm()
+
+    def _on_model_changed(self, previous: Dict[str, Any]):
+        self.warm()
+
+    def forget(self, provider: Optional[str] = None, base_url: Optional[str] = None):
+        """连接池关闭了对应客户端后清除其预热记录"""
+        base_url = base_url.rstrip('/') if base_url else None
+        with self._lock:
+            for key in list(self._states):
+                if (provider is None or key[0] == provider) and (base_url is None or key[1] == base_url):
+                    del self._states[key]
+
+    def warm(self, target: Optional[ModelTarget] = None, force: bool = False) -> bool:
+        """在后台预热目标（默认当前模型）的连接，已就绪或正在预热时跳过，返回是否发起了预热"""
+        target = target or ModelTarget.current()
+        if self.pool.cassette is not None:
+            return False
+        key = self._make_key(target)
+        with self._lock:
+            current = self._states.get(key)
+            if current is not None and not force and self._state_of(current) in (STATE_WARMING, STATE_READY):
+                self._counters["skipped"] += 1
+                return False
+            state = _WarmState(target.name)
+            self._states[key] = state
+            self._counters["warmups"] += 1
+        threading.Thread(target=self._run, args=(target, state), name="Warmup", daemon=True).start()
+        return True
+
+    def _run(self, target: ModelTarget, state: _WarmState):
+        try:
+            api_key = self.key_provider(target.provider)
+            if not api_key:
+                state.finish(STATE_NO_KEY)
+                return
+            started = time.perf_counter()
+            self._resolve(target.base_url)
+            state.dns_ms = round((time.perf_counter() - started) * 1000, 1)
+
+            started = time.perf_counter()
+            state.http_status = self._request(target, api_key)
+            state.connect_ms = round((time.perf_counter() - started) * 1000, 1)
+
+            if self.warm_async:
+                started = time.perf_counter()
+                self._request_async(target, api_key)
+                state.async_connect_ms = round((time.perf_counter() - started) * 1000, 1)
+        except Exception as e:
+            state.finish(STATE_FAILED, str(e))
+            self._bump("failed")
+            logger.info(f"{target.provider} 连接预热失败: {str(e)}")
+            return
+        state.finish(STATE_READY)
+        self._bump("ready")
+        logger.debug(f"{target.provider} 连接预热完成：DNS {state.dns_ms}ms，建连 {state.connect_ms}ms")
+
+    @staticmethod
+    def _resolve(base_url: str):
+        """解析域名，结果进入系统解析缓存"""
+        parts = urlsplit(base_url)
+        if not parts.hostname:
+            raise ValueError(f"无效的接口地址: {base_url}")
+        port = parts.port or (443 if parts.scheme == "https" else 80)
+        socket.getaddrinfo(parts.hostname, port, type=socket.SOCK_STREAM)
+
+    def _request(self, target: ModelTarget, api_key: str) -> int:
+        """经连接池中的同步客户端请求/models，返回HTTP状态码"""
+        with self.pool.lease(target.provider, target.base_url, api_key) as lease:
+            response = lease.http_client.get(
+                f"{target.base_url.rstrip('/')}/models",
+                headers={"Authorization": f"Bearer {api_key}"},
+                timeout=self.timeout
+            )
+        return response.status_code
+
+    def _request_async(self, target: ModelTarget, api_key: str) -> int:
+        """在AsyncRunner的事件循环上经异步客户端请求/models"""
+        from core.api_client.async_client import async_runner
+
+        async def request():
+            with self.pool.lease_async(target.provider, target.base_url, api_key) as lease:
+                response = await lease.http_client.get(
+                    f"{target.base_url.rstrip('/')}/models",
+                    headers={"Authorization": f"Bearer {api_key}"},
+                    timeout=self.timeout
+                )
+            return response.status_code
+
+        return async_runner.submit(request()).result(self.timeout + 1)
+
+    def probe(self, target: Optional[ModelTarget] = None) -> bool:
+        """经连接池检查接口是否可用（/models返回200），正在预热时先等待预热完成以复用其连接"""
+        target = target or ModelTarget.current()
+        self._bump("probes")
+        api_key = self.key_provider(target.provider)
+        if not api_key:
+            return False
+        with self._lock:
+            state = self._states.get(self._make_key(target))
+        if state is not None and not state.done.is_set():
+            state.done.wait(self.timeout)
+        status = self._request(target, api_key)
+        if state is not None and state.state in (STATE_READY, STATE_FAILED) and status < 500:
+            # 连接已重新使用，刷新keep-alive有效期
+            state.http_status = status
+            state.finish(STATE_READY)
+        return status == 200
+
+    def _state_of(self, state: _WarmState) -> str:
+        if state.state == STATE_READY and time.time() - state.finished_at > self.pool.keepalive_expiry:
+            return STATE_EXPIRED
+        return state.state
+
+    def is_ready(self, target: Optional[ModelTarget] = None) -> bool:
+        """目标（默认当前模型）的连接是否已预热且仍在keep-alive有效期内"""
+        return self.status(target)["state"] == STATE_READY
+
+    def wait_ready(self, timeout: Optional[float] = None, target: Optional[ModelTarget] = None) -> bool:
+        """等待正在进行的预热结束，返回是否就绪"""
+        target = target or ModelTarget.current()
+        with self._lock:
+            state = self._states.get(self._make_key(target))
+        if state is None:
+            return False
+        state.done.wait(timeout)
+        return self.is_ready(target)
+
+    def status(self, target: Optional[ModelTarget] = None) -> Dict[str, Any]:
+        """目标（默认当前模型）的预热状态"""
+        target = target or ModelTarget.current()
+        with self._lock:
+            state = self._states.get(self._make_key(target))
+        if state is None:
+            return {"provider": target.provider, "state": STATE_IDLE, "label": STATE_LABELS[STATE_IDLE]}
+        current = self._state_of(state)
+        return {
+            "provider": target.provider,
+            "model": state.name,
+            "state": current,
+            "label": STATE_LABELS[current],
+            "dns_ms": state.dns_ms,
+            "connect_ms": state.connect_ms,
+            "async_connect_ms": state.async_connect_ms,
+            "http_status": state.http_status,
+            "error": state.error,
+            "age": round(time.time() - (state.finished_at or state.started_at), 1)
+        }
+
+    def describe(self, target: Optional[ModelTarget] = None) -> str:
+        """面向用户的一行状态说明"""
+        status = self.status(target)
+        if status["state"] == STATE_READY and status.get("connect_ms") is not None:
+            return f"{status['label']}（建连 {status['connect_ms']:.0f}ms）"
+        if status["state"] == STATE_FAILED and status.get("error"):
+            return f"{status['label']}: {status['error']}"
+        return status["label"]
+
+    def _bump(self, name: str):
+        with self._lock:
+            self._counters[name] += 1
+
+    def stats(self) -> Dict[str, Any]:
+        """返回预热计数与各提供商的状态"""
+        with self._lock:
+            counters = dict(self._counters)
+            keys = list(self._states)
+        targets = [
+            self.status(ModelTarget(self._states[key].name, key[0], key[1], "", 0)) for key in keys
+        ]
+        return {**counters, "targets": targets}
+
+
+# 全局连接预热实例
+warmup_service = WarmupService()
@@ -0,0 +1,389 @@
+from typing import Any, Callable, Dict, List, Optional
+import asyncio
+import time
+import logging
+from core.api_client.handle import GenerationHandle, new_handle, FINISHED
+from core.api_client.prompt_layout import PromptLayout
+from modules.GlobalModule import global_config, GenerationSettings
+
+logger = logging.getLogger(__name__)
+
+SECTION_FAMILY = "worldview_section"
+REGENERATE_FAMILY = "worldview_section_regenerate"
+
+# 重新生成某一部分时，其他部分作为上下文的摘要长度（字符）
+CONTEXT_CHARS_PER_SECTION = 200
+# 上述上下文的打包优先级，小窗口模型放不下时先压缩它们而不是提纲与要求
+CONTEXT_PRIORITY = 30
+
+SYSTEM_PROMPT = "你是一个专业的世界观设计助手，擅长为各类作品创建详细的世界观模板和设定。"
+
+TEMPLATE_INTRO = "为下方作品设计一个详细的世界观模板，请提供以下要素："
+
+TEMPLATE_REQUIREMENTS = """要求：
+- 契合作品的核心主题
+- 符合主类型的一般特征
+- 融入子类型的典型元素和特色
+- 提供具体细节而非泛泛而谈
+- 构建富有创意且内部逻辑自洽的世界体系"""
+
+
+class WorldviewSection:
+    """世界观模板中的一个部分，key与WorldView._parse_template_content的章节键一致"""
+
+    def __init__(self, key: str, title: str, outline: str):
+        self.key = key
+        self.title = title  # 带序号的标题，如"二、时空与物理法则"
+        self.outline = outline  # 标题及其要点，拼接后即完整模板提纲
+
+    def __repr__(self):
+        return f"WorldviewSection({self.key})"
+
+
+SECTIONS: List[WorldviewSection] = [
+    WorldviewSection("overview", "一、总览设定", """一、总览设定（50字内概括核心）
+- 用一句话定义世界观的"独特性\""""),
+    WorldviewSection("time_space", "二、时空与物理法则", """二、时空与物理法则
+1. 时空背景
+   - 时代：现代/古代/近未来/架空纪元
+   - 地理范围：主要地图构成
+   - 物理法则：常规物理是否与现实一致，超自然规则特点
+
+2. 时间流动
+   - 时间线类型：单线/循环/平行时空
+   - 特殊时间现象"""),
+    WorldviewSection("society", "三、社会结构", """三、社会结构
+1. 权力与阶级
+   - 统治势力：政府/教会/家族/其他形式
+   - 阶级划分标准与社会矛盾
+
+2. 经济与资源
+   - 硬通货类型
+   - 核心资源争夺点
+
+3. 文化与习俗
+   - 禁忌与信仰体系
+   - 特色日常习俗：节日、饮食、服饰等"""),
+    WorldviewSection("power_system", "四、超自然/科技体系", """四、超自然/科技体系
+1. 力量本源
+   - 能力来源
+   - 升级逻辑与等级划分
+   - 能力限制与代价"""),
+    WorldviewSection("organizations", "五、关键组织与势力", """五、关键组织与势力
+- 至少3个重要组织，包含名称、性质、核心目标、与主角关系"""),
+    WorldviewSection("ecology", "六、生态与生物", """六、生态与生物
+- 特殊生物设计
+- 自然环境威胁"""),
+    WorldviewSection("history", "七、历史大事件", """七、历史大事件
+- 按时间轴列出影响世界观的关键事件"""),
+]
+
+
+def template_outline(sections: Optional[List[WorldviewSection]] = None) -> str:
+    """整体生成时使用的完整模板提纲（引导语、各部分要点与要求）"""
+    sections = sections or SECTIONS
+    return "\n\n".join([TEMPLATE_INTRO] + [section.outline for section in sections] + [TEMPLATE_REQUIREMENTS])
+
+
+def section_messages(section: WorldviewSection, work_info: Dict[str, Any],
+                     sections: Optional[List[WorldviewSection]] = None) -> List[Dict[str, Any]]:
+    """单个部分的请求消息
+
+    各部分共用同一个上下文头（完整提纲与要求在前，作品信息随后），
+    只有最后的“本次只写哪一部分”不同，并发的各请求可以共享提供商的前缀缓存，
+    模型也能看到其他部分的范围，避免内容重叠。
+    """
+    layout = PromptLayout(SECTION_FAMILY, system=SYSTEM_PROMPT)
+    layout.static(template_outline(sections))
+    layout.fields("作品信息", work_info)
+    layout.volatile(
+        f"本次只撰写其中的「{section.title}」部分：以“{section.title}”作为第一行标题，"
+        f"按上面列出的要点展开，不要输出其他部分的内容，也不要添加开场白或总结。"
+    )
+    return layout.messages()
+
+
+class SectionSlot:
+    """一个部分的生成状态与输出"""
+
+    def __init__(self, section: WorldviewSection, handle: GenerationHandle):
+        self.section = section
+        self.handle = handle
+        self.started_at: Optional[float] = None
+        self.finished_at: Optional[float] = None
+
+    @property
+    def key(self) -> str:
+        return self.section.key
+
+    @property
+    def content(self) -> str:
+        return self.handle.content
+
+    @property
+    def ok(self) -> bool:
+        return self.handle.state == FINISHED
+
+    @property
+    def elapsed(self) -> float:
+        if self.started_at is None:
+            return 0.0
+        return (self.finished_at or time.monotonic()) - self.started_at
+
+    def status(self) -> Dict[str, Any]:
+        return {**self.handle.status(), "section": self.key, "elapsed": round(self.elapsed, 3)}
+
+
+class SectionedWorldviewGeneration:
+    """把世界观模板拆成各部分并发生成，再按顺序合并
+
+    每个部分是一个独立的流式请求（各自的句柄，可单独失败），总耗时约等于最慢的一个部分。
+    on_chunk(key, chunk)按回调约定接收各部分的增量：正文为字符串，
+    思维链为{"reasoning_content": ...}，思维结束为{"thinking_finished": True}；
+    on_section_done(slot)在某一部分结束（完成、失败或取消）时调用。
+    各部分共用创建时取得的生成参数快照settings，生成过程中调整参数面板不会使各部分参数不一致。
+    两个回调都在事件循环线程中调用，界面更新需要自行转交主线程（如TkStreamPump）。
+
+    用法：
+        generation = SectionedWorldviewGeneration(work_info, on_chunk=...)
+        template_data = await generation.run()   # {"full_content": ..., "sections": {...}}
+    """
+
+    def __init__(self, work_info: Dict[str, Any], client=None,
+                 sections: Optional[List[WorldviewSection]] = None,
+                 concurrency: Optional[int] = None, model_name: Optional[str] = None,
+                 on_chunk: Optional[Callable[[str, Any], None]] = None,
+                 on_section_done: Optional[Callable[[SectionSlot], None]] = None,
+                 settings: Optional[GenerationSettings] = None):
+        if client is None:
+            from core.api_client.async_client import async_api_client
+            client = async_api_client
+        self.client = client
+        self.work_info = work_info
+        self.sections = sections or SECTIONS
+        self.concurrency = concurrency or len(self.sections)  # 同时进行的请求数，默认全部并发
+        self.model_name = model_name
+        self.settings = settings or global_config.generation_settings()
+        self.on_chunk = on_chunk
+        self.on_section_done = on_section_done
+        self.slots = [SectionSlot(section, new_handle(f"世界观分段-{section.title}")) for section in self.sections]
+        self.started_at: Optional[float] = None
+        self.finished_at: Optional[float] = None
+
+    def _emit(self, key: str, chunk: Any):
+        if self.on_chunk is None:
+            return
+        try:
+            self.on_chunk(key, chunk)
+        except Exception as e:
+            logger.error(f"分段生成回调处理失败 ({key}): {str(e)}")
+
+    async def _run_slot(self, slot: SectionSlot):
+        slot.started_at = time.monotonic()
+        messages = section_messages(slot.section, self.work_info, self.sections)
+
+        def forward(chunk):
+            # 正文从迭代结果中转发，这里只处理思维链与标记
+            if isinstance(chunk, dict):
+                self._emit(slot.key, chunk)
+
+        seen = 0
+        try:
+            async for chunk in self.client.stream_generate(messages, callback=forward, handle=slot.handle,
+                                                           model_name=self.model_name,
+                                                           prompt_family=SECTION_FAMILY,
+                                                           settings=self.settings):
+                # 失败时最后产出的是错误信息而不是正文，不写入该部分
+                if slot.handle.content_chunks > seen:
+                    seen = slot.handle.content_chunks
+                    self._emit(slot.key, chunk)
+        finally:
+            slot.finished_at = time.monotonic()
+            if slot.handle.error:
+                logger.warning(f"世界观分段生成失败 ({slot.section.title}): {slot.handle.error}")
+            if self.on_section_done is not None:
+                try:
+                    self.on_section_done(slot)
+                except Exception as e:
+                    logger.error(f"分段完成回调处理失败 ({slot.key}): {str(e)}")
+
+    async def run(self) -> Dict[str, Any]:
+        """并发生成全部部分，返回合并后的模板数据"""
+        self.started_at = time.monotonic()
+        semaphore = asyncio.Semaphore(max(1, self.concurrency))
+
+        async def run_slot(slot: SectionSlot):
+            async with semaphore:
+                if slot.handle.cancelled:
+                    slot.handle.finish()
+                    return
+                await self._run_slot(slot)
+
+        try:
+            await asyncio.gather(*(run_slot(slot) for slot in self.slots))
+        finally:
+            self.finished_at = time.monotonic()
+        logger.info(f"世界观分段生成结束: {sum(slot.ok for slot in self.slots)}/{len(self.slots)} 个部分完成，"
+                    f"耗时 {self.finished_at - self.started_at:.1f} 秒")
+        return self.template_data()
+
+    def cancel(self):
+        """取消全部部分（线程安全）"""
+        for slot in self.slots:
+            slot.handle.cancel()
+
+    @property
+    def cancelled(self) -> bool:
+        return all(slot.handle.cancelled for slot in self.slots)
+
+    def merged_content(self) -> str:
+        """按模板顺序合并各部分的正文"""
+        return "\n\n".join(slot.content.strip() for slot in self.slots if slot.content.strip())
+
+    def template_data(self) -> Dict[str, Any]:
+        """与WorldView._parse_template_content相同的结构"""
+        sections, spans, parts = {}, {}, []
+        offset = 0
+        for slot in self.slots:
+            text = slot.content.strip()
+            if not text:
+                continue
+            if parts:
+                offset += 2  # 分隔的空行
+            sections[slot.key] = text
+            spans[slot.key] = [offset, offset + len(text)]
+            parts.append(text)
+            offset += len(text)
+        return {"full_content": "\n\n".join(parts), "sections": sections, "spans": spans}
+
+    def status(self) -> Dict[str, Any]:
+        end = self.finished_at or time.monotonic()
+        return {
+            "elapsed": round(end - self.started_at, 3) if self.started_at else 0.0,
+            "sections": [slot.status() for slot in self.slots]
+        }
+
+
+def get_section(key: str) -> WorldviewSection:
+    """按章节键查找，不是模板中的部分时抛出ValueError"""
+    for section in SECTIONS:
+        if section.key == key:
+            return section
+    raise ValueError(f"未知的世界观部分: {key}")
+
+
+def _excerpt(text: str, limit: int) -> str:
+    text = " ".join(text.split())
+    return text if len(text) <= limit else text[:limit] + "…"
+
+
+def context_summary(template_data: Dict[str, Any], exclude: str,
+                    limit: int = CONTEXT_CHARS_PER_SECTION) -> str:
+    """其他部分的精简摘要（按模板顺序，每部分截取开头limit个字符并压缩空白）"""
+    sections = template_data.get("sections", {})
+    order = [section.key for section in SECTIONS] + [key for key in sections if key not in {s.key for s in SECTIONS}]
+    lines = [f"- {_excerpt(sections[key], limit)}" for key in order if key != exclude and sections.get(key)]
+    return "\n".join(lines)
+
+
+def regenerate_messages(key: str, work_info: Dict[str, Any], template_data: Dict[str, Any],
+                        instructions: Optional[str] = None) -> List[Dict[str, Any]]:
+    """重新生成某一部分的请求消息：完整提纲与作品信息在前，其他部分的摘要与修改意见在后"""
+    section = get_section(key)
+    layout = PromptLayout(REGENERATE_FAMILY, system=SYSTEM_PROMPT)
+    layout.static(template_outline())
+    layout.fields("作品信息", work_info)
+    summary = context_summary(template_data, key)
+    if summary:
+        layout.volatile(f"其他部分已经确定（摘要），新内容必须与之保持一致、不要重复：\n{summary}",
+                        priority=CONTEXT_PRIORITY)
+    current = template_data.get("sections", {}).get(key)
+    if current:
+        layout.volatile(f"「{section.title}」的当前版本不够理想，需要重写：\n{_excerpt(current, CONTEXT_CHARS_PER_SECTION * 2)}",
+                        priority=CONTEXT_PRIORITY + 10)
+    if instructions and instructions.strip():
+        layout.volatile(f"修改意见：{instructions.strip()}")
+    layout.volatile(
+        f"只重写「{section.title}」部分：以“{section.title}”作为第一行标题，"
+        f"按上面列出的要点展开，不要输出其他部分的内容，也不要添加开场白或总结。"
+    )
+    return layout.messages()
+
+
+def splice_section(template_data: Dict[str, Any], key: str, text: str) -> Dict[str, Any]:
+    """把某一部分替换为text，返回新的模板数据
+
+    按spans记录的位置直接替换full_content中的片段，其余部分逐字节保持不变，
+    之后各部分的位置按长度差平移，不需要重新解析全文。
+    原来没有该部分时，插入到模板顺序中下一个已有部分之前（没有则追加到末尾）。
+    """
+    full = template_data.get("full_content", "")
+    sections = dict(template_data.get("sections", {}))
+    spans = {name: list(span) for name, span in template_data.get("spans", {}).items()}
+    if sections and not spans:
+        raise ValueError("模板数据缺少章节位置信息，请先重新解析")
+    text = text.strip()
+
+    if key in spans:
+        start, end = spans[key]
+        old = full[start:end]
+        # 保留原片段末尾的空行，章节之间的分隔不变
+        replacement = text + old[len(old.rstrip()):]
+    else:
+        order = [section.key for section in SECTIONS]
+        following = [spans[name][0] for name in order[order.index(key) + 1:] if name in spans] \
+            if key in order else []
+        if following:
+            start = end = min(following)
+            replacement = text + "\n\n"
+        else:
+            start = end = len(full)
+            replacement = ("\n\n" if full.strip() else "") + text
+    delta = len(replacement) - (end - start)
+
+    for name, span in spans.items():
+        if name != key and span[0] >= end:
+            span[0] += delta
+            span[1] += delta
+    text_start = start + replacement.index(text) if text else start
+    spans[key] = [text_start, text_start + len(text)]
+    sections[key] = text
+    return {**template_data, "full_content": full[:start] + replacement + full[end:],
+            "sections": sections, "spans": spans}
+
+
+async def regenerate_section(template_data: Dict[str, Any], key: str, work_info: Dict[str, Any],
+                             instructions: Optional[str] = None, client=None,
+                             handle: Optional[GenerationHandle] = None, model_name: Optional[str] = None,
+                             on_chunk: Optional[Callable[[Any], None]] = None,
+                             settings: Optional[GenerationSettings] = None) -> Dict[str, Any]:
+    """只重新生成template_data中的一个部分并拼回全文，返回新的模板数据
+
+    on_chunk按回调约定接收增量。生成失败或被取消时抛出RuntimeError，原模板数据不变。
+    """
+    section = get_section(key)
+    if client is None:
+        from core.api_client.async_client import async_api_client
+        client = async_api_client
+    handle = handle or new_handle(f"世界观重新生成-{section.title}")
+    messages = regenerate_messages(key, work_info, template_data, instructions)
+
+    seen = 0
+
+    def forward(chunk):
+        if isinstance(chunk, dict) and on_chunk is not None:
+            on_chunk(chunk)
+
+    async for chunk in client.stream_generate(messages, callback=forward, handle=handle,
+                                              model_name=model_name, prompt_family=REGENERATE_FAMILY,
+                                              settings=settings):
+        if handle.content_chunks > seen:
+            seen = handle.content_chunks
+            if on_chunk is not None:
+                on_chunk(chunk)
+
+    if handle.state != FINISHED:
+        raise RuntimeError(handle.error or f"「{section.title}」的重新生成已取消")
+    if not handle.content.strip():
+        raise RuntimeError(f"「{section.title}」没有生成任何内容")
+    return splice_section(template_data, key, handle.content)
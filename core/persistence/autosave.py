@@ -0,0 +1,209 @@
+from collections import deque
+from typing import Any, Deque, Dict, List, Optional, Set
+import atexit
+import os
+import threading
+import time
+import logging
+from core.persistence.project_document import ProjectDocument, project_document
+from core.persistence.db_connector import ProjectStore, project_store, DOCUMENT_SOURCE, as_stored, restore_key_types
+
+logger = logging.getLogger(__name__)
+
+
+def _percentile(samples: List[float], q: float) -> Optional[float]:
+    if not samples:
+        return None
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * q / 100))]
+
+
+class AutosaveService:
+    """项目文档的防抖、合并自动保存
+
+    面板修改某一节后调用mark_dirty：新内容立即进入内存中的ProjectDocument（其他面板
+    读取即可见），保存由后台线程在最后一次修改后delay秒、且最迟在首次修改后
+    max_delay秒执行，期间对同一节或不同节的多次修改合并为一次保存。
+    项目库（ProjectStore）可用时，每次保存只把变化的行写入novel_data.db，
+    novel_structure.yaml作为兼容导出最多每export_interval秒整体写回一次；
+    项目库不可用时每次保存都写回YAML。YAML经临时文件加原子替换写入，fsync可选。
+    flush立即保存并写回YAML，关闭窗口与程序退出时自动调用；start在启动时导入旧数据，
+    并恢复上次异常退出时已写入项目库、尚未写回YAML的修改。
+    stats报告保存耗时与从首次修改到保存完成的延迟。
+    """
+
+    def __init__(self, document: ProjectDocument = project_document,
+                 store: Optional[ProjectStore] = project_store, delay: float = 1.0,
+                 max_delay: float = 5.0, export_interval: float = 30.0, fsync: bool = True,
+                 max_samples: int = 200):
+        self.document = document
+        self.store = store  # 行级保存的项目库，None时每次保存都写回YAML
+        self.delay = delay  # 最后一次修改后等待的秒数
+        self.max_delay = max_delay  # 持续修改时，首次修改后最迟保存的秒数
+        self.export_interval = export_interval  # 使用项目库时YAML写回的最短间隔（秒）
+        self.fsync = fsync  # 写入后是否fsync
+        self._unsaved: Set[str] = set()  # 已暂存、尚未写入项目库的节
+        self._last_export = time.monotonic()
+        self._first_mark: Optional[float] = None
+        self._last_mark: Optional[float] = None
+        self._cond = threading.Condition()
+        self._worker: Optional[threading.Thread] = None
+        self._write_ms: Deque[float] = deque(maxlen=max_samples)  # 单次写盘耗时
+        self._lag_ms: Deque[float] = deque(maxlen=max_samples)  # 首次修改到落盘的延迟
+        self.last_error: Optional[str] = None
+        self.last_saved_at: Optional[float] = None
+        self._counters = {"marks": 0, "saves": 0, "exports": 0, "rows": 0, "failures": 0}
+        atexit.register(self.flush)
+
+    def mark_dirty(self, section: str, value: Any):
+        """暂存某一节的新内容并安排写入"""
+        self.document.stage_section(section, value)
+        now = time.monotonic()
+        with self._cond:
+            self._unsaved.add(section)
+            self._counters["marks"] += 1
+            if self._first_mark is None:
+                self._first_mark = now
+            self._last_mark = now
+            self._ensure_worker()
+            self._cond.notify()
+
+    def save(self, section: str, value: Any) -> bool:
+        """暂存并立即写入（用于“保存”按钮等显式保存）"""
+        self.mark_dirty(section, value)
+        return self.flush()
+
+    def pending(self) -> List[str]:
+        """尚未写回YAML文件的节"""
+        return self.document.dirty
+
+    def start(self):
+        """启动时调用：把旧的项目文件导入项目库，并与novel_structure.yaml互相同步"""
+        if self.store is None or not self.store.available:
+            return
+        self.store.import_legacy(self.document.path)
+        try:
+            mtime = os.stat(self.document.path).st_mtime
+        except OSError:
+            mtime = 0.0
+        # 上次退出前已写入项目库、尚未写回YAML的节
+        recovered = self.store.load_document(DOCUMENT_SOURCE, since=mtime) or {}
+        for name, value in recovered.items():
+            # 项目库以JSON保存，YAML中的整数等非字符串键读出后为字符串，按同一形式比较并还原原始键
+            current = self.document.section(name)
+            if as_stored(current) != value:
+                self.document.stage_section(name, restore_key_types(value, current))
+        if recovered:
+            logger.info(f"已从项目库恢复未写回的修改: {', '.join(recovered)}")
+            with self._cond:
+                self._ensure_worker()
+                self._cond.notify()
+        # YAML在程序外被修改时同步到项目库（只写入变化的行）
+        self.store.save_document(self.document.data(), DOCUMENT_SOURCE)
+
+    def replace_document(self, data: Dict[str, Any]):
+        """以导入的内容替换整个项目：写回YAML并同步到项目库"""
+        self.flush()
+        self.document.replace(data)
+        with self._cond:
+            self._last_export = time.monotonic()
+        if self.store is not None:
+            self.store.save_document(data, DOCUMENT_SOURCE)
+
+    def _due(self) -> Optional[float]:
+        due = None
+        if self._first_mark is not None:
+            due = min(self._last_mark + self.delay, self._first_mark + self.max_delay)
+        if self.store is not None and not self._unsaved and self.document.dirty:
+            # 已写入项目库、等待写回YAML
+            export_due = self._last_export + self.export_interval
+            due = export_due if due is None else min(due, export_due)
+        return due
+
+    def _ensure_worker(self):
+        if self._worker is None or not self._worker.is_alive():
+            self._worker = threading.Thread(target=self._run, name="Autosave", daemon=True)
+            self._worker.start()
+
+    def _run(self):
+        while True:
+            with self._cond:
+                due = self._due()
+                while due is None or time.monotonic() < due:
+                    self._cond.wait(None if due is None else due - time.monotonic())
+                    due = self._due()
+            if not self._save():
+                # 写入失败，稍后重试
+                with self._cond:
+                    self._cond.wait(self.delay)
+
+    def flush(self) -> bool:
+        """立即保存所有暂存的修改并写回YAML，失败时返回False（修改保留，稍后重试）"""
+        return self._save(export=True)
+
+    def _save(self, export: Optional[bool] = None) -> bool:
+        """保存到项目库；export为None时按export_interval（或项目库不可用时）决定是否写回YAML"""
+        with self._cond:
+            first_mark = self._first_mark
+            self._first_mark = self._last_mark = None
+            sections, self._unsaved = self._unsaved, set()
+        started = time.monotonic()
+        rows = None
+        try:
+            if sections and self.store is not None:
+                rows = self.store.save_document({name: self.document.section(name) for name in sections},
+                                                DOCUMENT_SOURCE, sections)
+            if export is None:
+                export = self.store is None or (sections and rows is None) \
+                    or started - self._last_export >= self.export_interval
+            written = self.document.commit(self.fsync) if export else False
+        except Exception as e:
+            with self._cond:
+                if rows is None:
+                    self._unsaved |= sections
+                if self._first_mark is None:
+                    self._first_mark = first_mark or time.monotonic()
+                    self._last_mark = time.monotonic()
+                    self._ensure_worker()
+                    self._cond.notify()
+                self._counters["failures"] += 1
+                self.last_error = str(e)
+            logger.error(f"自动保存失败: {str(e)}")
+            return False
+        finished = time.monotonic()
+        with self._cond:
+            if rows is not None:
+                self._counters["rows"] += rows
+            if written:
+                self._counters["exports"] += 1
+                self._last_export = finished
+            if sections or written:
+                self._counters["saves"] += 1
+                self._write_ms.append((finished - started) * 1000)
+                if first_mark is not None:
+                    self._lag_ms.append((finished - first_mark) * 1000)
+                self.last_saved_at = time.time()
+                self.last_error = None
+        return True
+
+    def stats(self) -> Dict[str, Any]:
+        """返回保存与YAML写回次数、写入的行数、合并掉的保存数与延迟分位数（毫秒）"""
+        with self._cond:
+            write_ms, lag_ms = list(self._write_ms), list(self._lag_ms)
+            counters = dict(self._counters)
+            last_error, last_saved_at = self.last_error, self.last_saved_at
+        return {
+            **counters,
+            "coalesced": max(counters["marks"] - counters["saves"], 0),
+            "pending": self.pending(),
+            "write_ms_p50": _percentile(write_ms, 50),
+            "write_ms_p95": _percentile(write_ms, 95),
+            "lag_ms_p50": _percentile(lag_ms, 50),
+            "lag_ms_p95": _percentile(lag_ms, 95),
+            "last_saved_at": last_saved_at,
+            "last_error": last_error
+        }
+
+
+# 全局自动保存实例
+autosave_service = AutosaveService()
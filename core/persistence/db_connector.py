@@ -0,0 +1,739 @@
+from pathlib import Path
+from typing import Any, Callable, Dict, Iterable, List, Optional, Tuple
+import sqlite3
+import json
+import os
+import threading
+import time
+import logging
+import yaml
+from core.persistence.project_document import PROJECT_FILE, load_yaml
+
+logger = logging.getLogger(__name__)
+
+ROOT = Path(__file__).parent.parent.parent
+DB_PATH = ROOT / 'novel_data.db'
+NOVEL_DATA_DIR = ROOT / 'data/NovelData'
+
+# novel_structure.yaml对应的项目在projects表中的来源标识，其余项目以导入文件的相对路径标识
+DOCUMENT_SOURCE = 'novel_structure.yaml'
+
+FRAMEWORK_SUFFIX = '_框架.json'
+OUTLINE_SUFFIX = '_世界观大纲.txt'
+PARAMETERS_FILE = 'parameters_cache.json'
+
+# 按PRAGMA user_version依次执行的迁移，只能追加，不能修改已发布的条目
+MIGRATIONS = [
+    # 1: 初始表结构
+    """
+    CREATE TABLE IF NOT EXISTS projects (
+        id INTEGER PRIMARY KEY,
+        source TEXT NOT NULL UNIQUE,
+        title TEXT NOT NULL DEFAULT '',
+        creation_type TEXT,
+        main_type TEXT,
+        sub_type TEXT,
+        base_config TEXT,
+        role_config TEXT,
+        sections TEXT NOT NULL DEFAULT '[]',
+        section_times TEXT NOT NULL DEFAULT '{}',
+        created_at REAL NOT NULL,
+        updated_at REAL NOT NULL
+    );
+    CREATE TABLE IF NOT EXISTS roles (
+        project_id INTEGER NOT NULL REFERENCES projects(id) ON DELETE CASCADE,
+        role_id TEXT NOT NULL,
+        position INTEGER NOT NULL,
+        data TEXT NOT NULL,
+        updated_at REAL NOT NULL,
+        role_type TEXT,
+        name TEXT,
+        PRIMARY KEY (project_id, role_id)
+    ) WITHOUT ROWID;
+    CREATE TABLE IF NOT EXISTS worldview_sections (
+        project_id INTEGER NOT NULL REFERENCES projects(id) ON DELETE CASCADE,
+        key TEXT NOT NULL,
+        position INTEGER NOT NULL,
+        data TEXT NOT NULL,
+        updated_at REAL NOT NULL,
+        PRIMARY KEY (project_id, key)
+    ) WITHOUT ROWID;
+    CREATE TABLE IF NOT EXISTS parameters (
+        project_id INTEGER NOT NULL REFERENCES projects(id) ON DELETE CASCADE,
+        name TEXT NOT NULL,
+        position INTEGER NOT NULL,
+        data TEXT NOT NULL,
+        updated_at REAL NOT NULL,
+        description TEXT,
+        default_value TEXT,
+        PRIMARY KEY (project_id, name)
+    ) WITHOUT ROWID;
+    CREATE TABLE IF NOT EXISTS project_sections (
+        project_id INTEGER NOT NULL REFERENCES projects(id) ON DELETE CASCADE,
+        name TEXT NOT NULL,
+        position INTEGER NOT NULL,
+        data TEXT NOT NULL,
+        updated_at REAL NOT NULL,
+        PRIMARY KEY (project_id, name)
+    ) WITHOUT ROWID;
+    CREATE TABLE IF NOT EXISTS generations (
+        id INTEGER PRIMARY KEY,
+        project_id INTEGER REFERENCES projects(id) ON DELETE CASCADE,
+        kind TEXT NOT NULL,
+        label TEXT,
+        model TEXT,
+        content TEXT NOT NULL,
+        settings TEXT,
+        created_at REAL NOT NULL
+    );
+    CREATE INDEX IF NOT EXISTS idx_generations_project ON generations(project_id, kind, created_at);
+    CREATE TABLE IF NOT EXISTS imports (
+        path TEXT PRIMARY KEY,
+        signature TEXT NOT NULL,
+        project_id INTEGER,
+        imported_at REAL NOT NULL
+    );
+    """,
+    # 2: 世界观大纲按文件（项目+文件名）只保留一条，清理文件修改后重复导入的记录
+    """
+    DELETE FROM generations WHERE kind = 'worldview_outline' AND id NOT IN (
+        SELECT MAX(id) FROM generations WHERE kind = 'worldview_outline' GROUP BY project_id, label);
+    CREATE UNIQUE INDEX IF NOT EXISTS idx_generations_outline ON generations(project_id, label)
+        WHERE kind = 'worldview_outline';
+    """,
+]
+
+POSITION_STEP = 1024  # 追加行之间的位置间隔，便于之后在中间插入
+
+# 按行保存的表：(主键列, 从每行数据中提取、便于查询的列)
+_ROW_TABLES = {
+    "roles": ("role_id", ("role_type", "name")),
+    "worldview_sections": ("key", ()),
+    "parameters": ("name", ("description", "default_value")),
+    "project_sections": ("name", ()),
+}
+
+# 在projects表中单独保存的节
+_BASE_SECTION = "base_config"
+_ROLE_SECTION = "role_config"
+_WORLDVIEW_SECTION = "world_view"
+
+
+_ENCODER = json.JSONEncoder(ensure_ascii=False, separators=(",", ":"), default=str)
+
+
+def _dumps(value: Any) -> str:
+    return _ENCODER.encode(value)
+
+
+def as_stored(value: Any) -> Any:
+    """数据写入项目库再读出后的形式：非字符串键（如YAML中的整数键）变为字符串，元组变为列表"""
+    return json.loads(_dumps(value))
+
+
+def _stored_key(key: Any) -> str:
+    if isinstance(key, str):
+        return key
+    try:
+        return next(iter(as_stored({key: None})))
+    except TypeError:
+        return str(key)
+
+
+def _yaml_key(key: str) -> Any:
+    try:
+        value = yaml.safe_load(key)
+    except yaml.YAMLError:
+        return key
+    return value if isinstance(value, (int, float, bool)) else key
+
+
+def restore_key_types(value: Any, original: Any) -> Any:
+    """把从项目库读出的数据中的字符串键还原为original中对应的原始键
+
+    original中没有的键，在original使用非字符串键时按YAML的标量规则解析（如"3"还原为3）。
+    """
+    if isinstance(value, dict) and isinstance(original, dict):
+        keys = {_stored_key(key): key for key in original}
+        typed = any(not isinstance(key, str) for key in original)
+        restored = {}
+        for key, item in value.items():
+            key = keys[key] if key in keys else _yaml_key(key) if typed else key
+            restored[key] = restore_key_types(item, original.get(key))
+        return restored
+    if isinstance(value, list) and isinstance(original, list):
+        return [restore_key_types(item, original[index]) if index < len(original) else item
+                for index, item in enumerate(value)]
+    return value
+
+
+def _extract(value: Any, columns: Tuple[str, ...]) -> tuple:
+    """从一行数据中取出单独建列的字段"""
+    if not isinstance(value, dict):
+        return (None,) * len(columns)
+    return tuple(_dumps(value.get(column)) if isinstance(value.get(column), (dict, list)) else value.get(column)
+                 for column in columns)
+
+
+def _signature(path: Path) -> str:
+    st = os.stat(path)
+    return f"{st.st_mtime_ns}:{st.st_size}"
+
+
+class ProjectStore:
+    """novel_data.db中的项目库
+
+    项目的每个角色、世界观的每一部分、每个参数各占一行，保存时只写入发生变化的行：
+    每张表按项目缓存各行的(位置, JSON文本)，与新内容比较后用UPSERT写入变化的行、
+    删除已移除的行，一次保存为一个事务，耗时与变化的行数成正比而与项目大小无关。
+    SQL语句文本固定，由sqlite3的语句缓存复用预编译结果。
+    数据库使用WAL模式，响应缓存等其他连接读写同一文件时互不阻塞。
+    save_document/load_document以novel_structure.yaml的结构（各顶层节）读写项目；
+    import_legacy把已有的novel_structure.yaml与data/NovelData下导出的框架、参数和大纲导入库中。
+    add_listener注册的回调在每次事务提交后收到变化的行（全文索引据此增量更新）。
+    数据库不可用时各方法记录警告并返回None，调用方应退回原有的文件保存方式。
+    """
+
+    def __init__(self, db_path: Path = DB_PATH, cached_statements: int = 256):
+        self.db_path = Path(db_path)
+        self.cached_statements = cached_statements  # sqlite3预编译语句缓存的大小
+        self._conn: Optional[sqlite3.Connection] = None
+        self._disabled = False
+        self._lock = threading.RLock()
+        # (表名, 项目id) -> {主键: (位置, JSON文本, 解析后的值)}，与数据库中的行保持一致
+        self._rows: Dict[Tuple[str, int], Dict[str, Tuple[int, str, Any]]] = {}
+        self._projects: Dict[str, int] = {}  # 来源标识 -> 项目id
+        self._listeners: List[Callable[[str, List[Tuple[str, str, Any]]], None]] = []
+        self._sql = {table: self._build_sql(table, key, extra) for table, (key, extra) in _ROW_TABLES.items()}
+        self._counters = {"saves": 0, "rows_written": 0, "rows_deleted": 0, "rows_unchanged": 0,
+                          "generations": 0, "imports": 0, "errors": 0}
+
+    @staticmethod
+    def _build_sql(table: str, key: str, extra: Tuple[str, ...]) -> Dict[str, str]:
+        columns = ("project_id", key, "position", "data", "updated_at") + extra
+        updates = ", ".join(f"{column} = excluded.{column}" for column in columns[2:])
+        return {
+            "upsert": f"INSERT INTO {table} ({', '.join(columns)}) VALUES ({', '.join('?' * len(columns))}) "
+                      f"ON CONFLICT(project_id, {key}) DO UPDATE SET {updates}",
+            "delete": f"DELETE FROM {table} WHERE project_id = ? AND {key} = ?",
+            "select": f"SELECT {key}, position, data FROM {table} WHERE project_id = ? ORDER BY position",
+            "extra": extra,
+        }
+
+    def _get_conn(self) -> Optional[sqlite3.Connection]:
+        """延迟打开数据库并执行迁移，失败时返回None"""
+        if self._disabled:
+            return None
+        if self._conn is None:
+            try:
+                conn = sqlite3.connect(str(self.db_path), check_same_thread=False, timeout=5.0,
+                                       cached_statements=self.cached_statements)
+                conn.execute("PRAGMA journal_mode=WAL")
+                conn.execute("PRAGMA synchronous=NORMAL")  # WAL模式下仍保证崩溃一致性
+                conn.execute("PRAGMA foreign_keys=ON")
+                self._migrate(conn)
+                self._conn = conn
+            except sqlite3.Error as e:
+                logger.warning(f"项目库不可用，继续使用YAML文件保存: {str(e)}")
+                self._disabled = True
+        return self._conn
+
+    @staticmethod
+    def _migrate(conn: sqlite3.Connection):
+        version = conn.execute("PRAGMA user_version").fetchone()[0]
+        for number, script in enumerate(MIGRATIONS[version:], start=version + 1):
+            conn.executescript(f"BEGIN;\n{script}\nPRAGMA user_version = {number};\nCOMMIT;")
+            logger.info(f"项目库已迁移到版本 {number}")
+
+    @property
+    def available(self) -> bool:
+        with self._lock:
+            return self._get_conn() is not None
+
+    def _project_id(self, conn: sqlite3.Connection, source: str, create: bool = True) -> Optional[int]:
+        project_id = self._projects.get(source)
+        if project_id is not None:
+            return project_id
+        row = conn.execute("SELECT id FROM projects WHERE source = ?", (source,)).fetchone()
+        if row is None:
+            if not create:
+                return None
+            now = time.time()
+            project_id = conn.execute(
+                "INSERT INTO projects (source, created_at, updated_at) VALUES (?, ?, ?)", (source, now, now)
+            ).lastrowid
+        else:
+            project_id = row[0]
+        self._projects[source] = project_id
+        return project_id
+
+    def _cached_rows(self, conn: sqlite3.Connection, table: str, project_id: int) -> Dict[str, Tuple[int, str, Any]]:
+        rows = self._rows.get((table, project_id))
+        if rows is None:
+            rows = {key: (position, data, json.loads(data))
+                    for key, position, data in conn.execute(self._sql[table]["select"], (project_id,))}
+            self._rows[(table, project_id)] = rows
+        return rows
+
+    def _upsert_row(self, conn: sqlite3.Connection, table: str, project_id: int, key: str, value: Any,
+                    position: int, pending: list, now: float) -> int:
+        """写入单行（内容与位置均未变化时跳过），返回写入的行数"""
+        cached = self._cached_rows(conn, table, project_id)
+        old = cached.get(key)
+        # 先直接比较值，只有变化的行才需要序列化
+        if old is not None and old[0] == position and old[2] == value:
+            self._counters["rows_unchanged"] += 1
+            return 0
+        data = _dumps(value)
+        if old is not None and old[0] == position and old[1] == data:
+            self._counters["rows_unchanged"] += 1
+            return 0
+        sql = self._sql[table]
+        conn.execute(sql["upsert"], (project_id, key, position, data, now) + _extract(value, sql["extra"]))
+        # 缓存独立的副本，调用方之后原地修改传入的对象不会影响比较
+        pending.append((table, cached, key, (position, data, json.loads(data))))
+        self._counters["rows_written"] += 1
+        return 1
+
+    def _delete_rows(self, conn: sqlite3.Connection, table: str, project_id: int, keys: List[str],
+                     pending: list) -> int:
+        if keys:
+            cached = self._cached_rows(conn, table, project_id)
+            conn.executemany(self._sql[table]["delete"], [(project_id, key) for key in keys])
+            pending.extend((table, cached, key, None) for key in keys)
+            self._counters["rows_deleted"] += len(keys)
+        return len(keys)
+
+    def _sync_rows(self, conn: sqlite3.Connection, table: str, project_id: int,
+                   items: Iterable[Tuple[str, Any]], pending: list, now: float) -> int:
+        """让一张表中某项目的行与items一致，返回写入与删除的行数；缓存更新记入pending，事务提交后生效"""
+        cached = self._cached_rows(conn, table, project_id)
+        items = [(str(key), value) for key, value in items]
+        changed = 0
+        for (key, value), position in zip(items, self._positions([key for key, _ in items], cached)):
+            changed += self._upsert_row(conn, table, project_id, key, value, position, pending, now)
+        seen = {key for key, _ in items}
+        return changed + self._delete_rows(conn, table, project_id, [key for key in cached if key not in seen],
+                                           pending)
+
+    @staticmethod
+    def _positions(keys: List[str], cached: Dict[str, Tuple[int, str, Any]]) -> List[int]:
+        """为各行分配排序位置：相对顺序未变的行沿用原位置，新增或移动的行放入前后两行之间的空隙，
+        这样追加、删除或修改一行时其余行的位置不变，不需要重写"""
+        following: List[Optional[int]] = [None] * len(keys)  # 之后第一个保留原位置的行的位置（近似）
+        upcoming = None
+        for index in range(len(keys) - 1, -1, -1):
+            following[index] = upcoming
+            old = cached.get(keys[index])
+            if old is not None:
+                upcoming = old[0]
+        positions, previous = [], -1
+        for index, key in enumerate(keys):
+            old = cached.get(key)
+            upper = following[index]
+            if old is not None and old[0] > previous and (upper is None or old[0] < upper):
+                position = old[0]
+            elif upper is None:
+                position = previous + POSITION_STEP
+            elif upper - previous > 1:
+                position = (previous + upper) // 2
+            else:
+                position = previous + 1  # 没有空隙时后续行顺延
+            positions.append(position)
+            previous = position
+        return positions
+
+    def save_document(self, data: Dict[str, Any], source: str = DOCUMENT_SOURCE,
+                      sections: Optional[Iterable[str]] = None) -> Optional[int]:
+        """按novel_structure.yaml的结构保存项目，返回写入与删除的行数，数据库不可用时返回None
+
+        sections为None时data视为完整文档（不在data中的节被删除），否则只保存列出的节，
+        列出但不在data中（或为None）的节被删除。
+        """
+        names = list(data) if sections is None else list(sections)
+        with self._lock:
+            conn = self._get_conn()
+            if conn is None:
+                return None
+            pending: list = []
+            try:
+                with conn:
+                    changed = self._save_sections(conn, source, data, names, sections is None, pending)
+            except sqlite3.Error as e:
+                self._invalidate(source)
+                self._counters["errors"] += 1
+                logger.warning(f"保存项目失败 ({source}): {str(e)}")
+                return None
+            self._apply_pending(source, pending)
+            self._counters["saves"] += 1
+            return changed
+
+    def _save_sections(self, conn: sqlite3.Connection, source: str, data: Dict[str, Any],
+                       names: List[str], full: bool, pending: list) -> int:
+        now = time.time()
+        project_id = self._project_id(conn, source)
+        row = conn.execute(
+            "SELECT base_config, role_config, sections, section_times FROM projects WHERE id = ?", (project_id,)
+        ).fetchone()
+        base_json, role_json = row[0], row[1]
+        order, times = json.loads(row[2]), json.loads(row[3])
+        if full:
+            # 完整文档中已不存在的节一并删除
+            names = names + [name for name in order if name not in data]
+        changed = 0
+        for name in names:
+            value = data.get(name)
+            rows_changed = 0
+            if name == _BASE_SECTION:
+                text = None if value is None else _dumps(value)
+                if text != base_json:
+                    base = value if isinstance(value, dict) else {}
+                    conn.execute(
+                        "UPDATE projects SET base_config = ?, title = ?, creation_type = ?, main_type = ?, "
+                        "sub_type = ? WHERE id = ?",
+                        (text, str(base.get("title") or ""), base.get("creation_type"), base.get("main_type"),
+                         base.get("sub_type"), project_id))
+                    base_json, rows_changed = text, 1
+            elif name == _ROLE_SECTION:
+                # 角色逐行保存，role_config的其余字段（current_role等）保存在项目行中
+                roles = value.get("roles") if isinstance(value, dict) else None
+                meta = None if value is None else {k: v for k, v in value.items() if k != "roles"} \
+                    if isinstance(value, dict) else value
+                text = None if value is None else _dumps(meta)
+                if text != role_json:
+                    conn.execute("UPDATE projects SET role_config = ? WHERE id = ?", (text, project_id))
+                    role_json, rows_changed = text, 1
+                rows_changed += self._sync_rows(conn, "roles", project_id,
+                                                (roles or {}).items() if isinstance(roles, dict) else (),
+                                                pending, now)
+            elif name == _WORLDVIEW_SECTION:
+                items = value.items() if isinstance(value, dict) else \
+                    (() if value is None else [("content", value)])
+                rows_changed = self._sync_rows(conn, "worldview_sections", project_id, items, pending, now)
+            elif value is None:
+                if name in self._cached_rows(conn, "project_sections", project_id):
+                    rows_changed = self._delete_rows(conn, "project_sections", project_id, [name], pending)
+            else:
+                # 其他节整体作为一行，顺序由项目行的sections记录
+                rows_changed = self._upsert_row(conn, "project_sections", project_id, name, value, 0, pending, now)
+            if rows_changed:
+                times[name] = now
+                changed += rows_changed
+
+        # 维护顶层节的顺序：保留原有顺序，去掉已删除的节，新节追加在末尾
+        new_order = [name for name in order if name not in names or data.get(name) is not None]
+        new_order += [name for name in names if data.get(name) is not None and name not in new_order]
+        if full:
+            new_order = [name for name in data if data[name] is not None]
+        if changed or new_order != order:
+            conn.execute("UPDATE projects SET sections = ?, section_times = ?, updated_at = ? WHERE id = ?",
+                         (_dumps(new_order), _dumps(times), now, project_id))
+        return changed
+
+    def add_listener(self, callback: Callable[[str, List[Tuple[str, str, Any]]], None]):
+        """注册保存监听器，回调参数为(来源标识, [(表名, 主键, 新值或None), ...])
+
+        回调在事务提交后、仍持有项目库锁时依次调用，同一行的变化按提交顺序到达，回调应尽快返回。
+        """
+        if callback not in self._listeners:
+            self._listeners.append(callback)
+
+    def remove_listener(self, callback: Callable[[str, List[Tuple[str, str, Any]]], None]):
+        if callback in self._listeners:
+            self._listeners.remove(callback)
+
+    def _apply_pending(self, source: str, pending: list):
+        """事务提交后更新行缓存并通知监听器"""
+        changes = []
+        for table, cached, key, value in pending:
+            if value is None:
+                cached.pop(key, None)
+                changes.append((table, key, None))
+            else:
+                cached[key] = value
+                changes.append((table, key, value[2]))
+        self._notify(source, changes)
+
+    def _notify(self, source: str, changes: List[Tuple[str, str, Any]]):
+        if not changes:
+            return
+        for callback in list(self._listeners):
+            try:
+                callback(source, changes)
+            except Exception as e:
+                logger.warning(f"项目库保存回调执行失败: {str(e)}")
+
+    def _invalidate(self, source: str):
+        """事务失败后丢弃该项目的行缓存，下次保存时重新读取"""
+        project_id = self._projects.pop(source, None)
+        if project_id is not None:
+            for key in [key for key in self._rows if key[1] == project_id]:
+                del self._rows[key]
+
+    def load_document(self, source: str = DOCUMENT_SOURCE,
+                      since: Optional[float] = None) -> Optional[Dict[str, Any]]:
+        """按novel_structure.yaml的结构读取项目，项目不存在或数据库不可用时返回None
+
+        指定since时只返回在该时间（time.time()）之后修改过的节。
+        """
+        with self._lock:
+            conn = self._get_conn()
+            if conn is None:
+                return None
+            try:
+                project_id = self._project_id(conn, source, create=False)
+                if project_id is None:
+                    return None
+                row = conn.execute(
+                    "SELECT base_config, role_config, sections, section_times FROM projects WHERE id = ?",
+                    (project_id,)).fetchone()
+                order, times = json.loads(row[2]), json.loads(row[3])
+                document: Dict[str, Any] = {}
+                for name in order:
+                    if since is not None and times.get(name, 0) <= since:
+                        continue
+                    if name == _BASE_SECTION:
+                        document[name] = json.loads(row[0]) if row[0] is not None else {}
+                    elif name == _ROLE_SECTION:
+                        meta = json.loads(row[1]) if row[1] is not None else {}
+                        roles = {key: json.loads(row[1]) for key, row in
+                                 sorted(self._cached_rows(conn, "roles", project_id).items(),
+                                        key=lambda item: item[1][0])}
+                        document[name] = {**meta, "roles": roles} if isinstance(meta, dict) else meta
+                    elif name == _WORLDVIEW_SECTION:
+                        rows = self._cached_rows(conn, "worldview_sections", project_id)
+                        document[name] = {key: json.loads(row[1]) for key, row in
+                                          sorted(rows.items(), key=lambda item: item[1][0])}
+                    else:
+                        cached = self._cached_rows(conn, "project_sections", project_id).get(name)
+                        if cached is not None:
+                            document[name] = json.loads(cached[1])
+                return document
+            except sqlite3.Error as e:
+                self._counters["errors"] += 1
+                logger.warning(f"读取项目失败 ({source}): {str(e)}")
+                return None
+
+    def updated_at(self, source: str = DOCUMENT_SOURCE) -> Optional[float]:
+        """项目最后一次保存的时间（time.time()），不存在时返回None"""
+        with self._lock:
+            conn = self._get_conn()
+            if conn is None:
+                return None
+            row = conn.execute("SELECT updated_at FROM projects WHERE source = ?", (source,)).fetchone()
+            return row[0] if row else None
+
+    def projects(self) -> List[Dict[str, Any]]:
+        """列出库中的项目"""
+        with self._lock:
+            conn = self._get_conn()
+            if conn is None:
+                return []
+            rows = conn.execute(
+                "SELECT p.id, p.source, p.title, p.main_type, p.sub_type, p.updated_at, "
+                "(SELECT COUNT(*) FROM roles r WHERE r.project_id = p.id) "
+                "FROM projects p ORDER BY p.updated_at DESC").fetchall()
+        return [{"id": row[0], "source": row[1], "title": row[2], "main_type": row[3], "sub_type": row[4],
+                 "updated_at": row[5], "roles": row[6]} for row in rows]
+
+    def save_parameters(self, parameters: List[Dict[str, Any]], source: str = DOCUMENT_SOURCE) -> Optional[int]:
+        """保存世界观参数列表（每项含name、description、default_value等），返回变化的行数"""
+        items = [(str(item.get("name") or index), item) for index, item in enumerate(parameters)]
+        with self._lock:
+            conn = self._get_conn()
+            if conn is None:
+                return None
+            pending: list = []
+            try:
+                with conn:
+                    project_id = self._project_id(conn, source)
+                    changed = self._sync_rows(conn, "parameters", project_id, items, pending, time.time())
+            except sqlite3.Error as e:
+                self._invalidate(source)
+                self._counters["errors"] += 1
+                logger.warning(f"保存参数失败 ({source}): {str(e)}")
+                return None
+            self._apply_pending(source, pending)
+            return changed
+
+    def parameters(self, source: str = DOCUMENT_SOURCE) -> List[Dict[str, Any]]:
+        with self._lock:
+            conn = self._get_conn()
+            if conn is None:
+                return []
+            project_id = self._project_id(conn, source, create=False)
+            if project_id is None:
+                return []
+            rows = self._cached_rows(conn, "parameters", project_id)
+            return [json.loads(row[1]) for row in sorted(rows.values(), key=lambda row: row[0])]
+
+    def add_generation(self, kind: str, content: str, source: str = DOCUMENT_SOURCE, label: str = "",
+                       model: Optional[str] = None, settings: Optional[Dict[str, Any]] = None,
+                       created_at: Optional[float] = None, replace: bool = False) -> Optional[int]:
+        """记录一次完成的生成（世界观模板、角色等），返回记录id
+
+        replace为True时更新项目中同类别、同标签的已有记录，而不是追加一条新记录。
+        """
+        with self._lock:
+            conn = self._get_conn()
+            if conn is None:
+                return None
+            try:
+                with conn:
+                    project_id = self._project_id(conn, source)
+                    values = (model, content, _dumps(settings) if settings is not None else None,
+                              created_at or time.time())
+                    row = conn.execute(
+                        "SELECT id FROM generations WHERE project_id = ? AND kind = ? AND label = ? "
+                        "ORDER BY id DESC LIMIT 1", (project_id, kind, label)
+                    ).fetchone() if replace else None
+                    if row is not None:
+                        generation_id = row[0]
+                        conn.execute("UPDATE generations SET model = ?, content = ?, settings = ?, created_at = ? "
+                                     "WHERE id = ?", values + (generation_id,))
+                    else:
+                        generation_id = conn.execute(
+                            "INSERT INTO generations (project_id, kind, label, model, content, settings, created_at) "
+                            "VALUES (?, ?, ?, ?, ?, ?, ?)", (project_id, kind, label) + values
+                        ).lastrowid
+            except sqlite3.Error as e:
+                self._invalidate(source)
+                self._counters["errors"] += 1
+                logger.warning(f"记录生成结果失败: {str(e)}")
+                return None
+            self._counters["generations"] += 1
+            self._notify(source, [("generations", str(generation_id),
+                                   {"kind": kind, "label": label, "content": content})])
+            return generation_id
+
+    def generations(self, source: str = DOCUMENT_SOURCE, kind: Optional[str] = None,
+                    limit: int = 50) -> List[Dict[str, Any]]:
+        """按时间倒序返回项目的生成记录"""
+        with self._lock:
+            conn = self._get_conn()
+            if conn is None:
+                return []
+            project_id = self._project_id(conn, source, create=False)
+            if project_id is None:
+                return []
+            sql = "SELECT id, kind, label, model, content, settings, created_at FROM generations WHERE project_id = ?"
+            args: list = [project_id]
+            if kind is not None:
+                sql += " AND kind = ?"
+                args.append(kind)
+            rows = conn.execute(sql + " ORDER BY created_at DESC LIMIT ?", args + [limit]).fetchall()
+        return [{"id": row[0], "kind": row[1], "label": row[2], "model": row[3], "content": row[4],
+                 "settings": json.loads(row[5]) if row[5] else None, "created_at": row[6]} for row in rows]
+
+    def import_legacy(self, project_file: Path = PROJECT_FILE,
+                      novel_dir: Path = NOVEL_DATA_DIR) -> Dict[str, int]:
+        """导入已有的项目文件，已导入且未修改的文件跳过
+
+        novel_structure.yaml只在库中还没有对应项目时导入（之后由自动保存同步）；
+        data/NovelData/<作品>/下的*_框架.json、parameters_cache.json与*_世界观大纲.txt
+        作为以文件路径标识的项目导入，文件修改后重新导入。
+        """
+        counts = {"documents": 0, "parameters": 0, "outlines": 0}
+        if not self.available:
+            return counts
+        project_file = Path(project_file)
+        if project_file.exists() and self.updated_at(DOCUMENT_SOURCE) is None:
+            if self._import_file(project_file, DOCUMENT_SOURCE, self._import_document):
+                counts["documents"] += 1
+        novel_dir = Path(novel_dir)
+        if not novel_dir.is_dir():
+            return counts
+        for work_dir in sorted(path for path in novel_dir.iterdir() if path.is_dir()):
+            frameworks = sorted(work_dir.glob(f"*{FRAMEWORK_SUFFIX}"))
+            source = self._source_for(frameworks[0] if frameworks else work_dir)
+            for path in frameworks[:1]:
+                if self._import_file(path, source, self._import_document):
+                    counts["documents"] += 1
+            parameters_file = work_dir / PARAMETERS_FILE
+            if parameters_file.exists() and self._import_file(parameters_file, source, self._import_parameters):
+                counts["parameters"] += 1
+            for path in sorted(work_dir.glob(f"*{OUTLINE_SUFFIX}")):
+                if self._import_file(path, source, self._import_outline):
+                    counts["outlines"] += 1
+        return counts
+
+    @staticmethod
+    def _source_for(path: Path) -> str:
+        try:
+            return path.resolve().relative_to(ROOT.resolve()).as_posix()
+        except ValueError:
+            return path.resolve().as_posix()
+
+    def _import_file(self, path: Path, source: str, importer) -> bool:
+        key = self._source_for(path)
+        try:
+            signature = _signature(path)
+            with self._lock:
+                conn = self._get_conn()
+                row = conn.execute("SELECT signature FROM imports WHERE path = ?", (key,)).fetchone()
+                if row is not None and row[0] == signature:
+                    return False
+            if importer(path, source) is None:
+                return False
+            with self._lock:
+                conn = self._get_conn()
+                with conn:
+                    conn.execute(
+                        "INSERT INTO imports (path, signature, project_id, imported_at) VALUES (?, ?, ?, ?) "
+                        "ON CONFLICT(path) DO UPDATE SET signature = excluded.signature, "
+                        "project_id = excluded.project_id, imported_at = excluded.imported_at",
+                        (key, signature, self._projects.get(source), time.time()))
+                self._counters["imports"] += 1
+            logger.info(f"已导入 {key} 到项目库")
+            return True
+        except (OSError, ValueError, sqlite3.Error, yaml.YAMLError) as e:
+            self._counters["errors"] += 1
+            logger.warning(f"导入 {key} 失败: {str(e)}")
+            return False
+
+    def _import_document(self, path: Path, source: str) -> Optional[int]:
+        with open(path, 'r', encoding='utf-8') as f:
+            data = json.load(f) if path.suffix == '.json' else load_yaml(f)
+        if not isinstance(data, dict):
+            raise ValueError("顶层不是键值结构")
+        return self.save_document(data, source)
+
+    def _import_parameters(self, path: Path, source: str) -> Optional[int]:
+        with open(path, 'r', encoding='utf-8') as f:
+            data = json.load(f)
+        parameters = data.get("parameters") if isinstance(data, dict) else data
+        if not isinstance(parameters, list):
+            raise ValueError("未找到参数列表")
+        return self.save_parameters([item for item in parameters if isinstance(item, dict)], source)
+
+    def _import_outline(self, path: Path, source: str) -> Optional[int]:
+        # 同一作品目录下的大纲以文件名区分，文件修改后更新原记录
+        content = path.read_text(encoding='utf-8')
+        return self.add_generation("worldview_outline", content, source, label=path.stem,
+                                   created_at=path.stat().st_mtime, replace=True)
+
+    def stats(self) -> Dict[str, Any]:
+        """返回写入统计与各表行数"""
+        with self._lock:
+            counts: Dict[str, int] = {}
+            conn = self._get_conn()
+            if conn is not None:
+                try:
+                    for table in ("projects", "generations") + tuple(_ROW_TABLES):
+                        counts[table] = conn.execute(f"SELECT COUNT(*) FROM {table}").fetchone()[0]
+                except sqlite3.Error:
+                    pass
+            return {**self._counters, "available": conn is not None, "tables": counts,
+                    "cached_tables": len(self._rows)}
+
+    def close(self):
+        with self._lock:
+            if self._conn is not None:
+                self._conn.close()
+                self._conn = None
+            self._rows.clear()
+            self._projects.clear()
+
+
+# 全局项目库实例
+project_store = ProjectStore()
@@ -0,0 +1,316 @@
+from pathlib import Path
+from typing import Any, Dict, List, Optional
+import json
+import os
+import threading
+import time
+import uuid
+import logging
+
+logger = logging.getLogger(__name__)
+
+# 生成结束状态
+COMPLETE = "complete"
+CANCELLED = "cancelled"
+FAILED = "failed"
+INCOMPLETE = "incomplete"  # 没有结束记录：程序崩溃或窗口被强制关闭
+
+# 记录类型
+_START = "start"
+_REASONING = "r"
+_CONTENT = "c"
+_END = "end"
+
+JOURNAL_DIR = Path(__file__).parent.parent.parent / 'data/journal'
+
+RESUME_PROMPT = "上文在此处中断，请从中断处继续输出，不要重复已经输出的内容。"
+
+
+class JournalWriter:
+    """单次生成的追加写日志
+
+    每条增量以一行JSON追加写入，思维链与正文分别记录。
+    写入方（流读取所在的线程或事件循环）只写文件缓冲：距上次交给操作系统超过fsync_interval秒
+    或累计超过fsync_bytes字节时flush，进程崩溃时最多丢失最后一个间隔内的增量。
+    fsync由GenerationJournal的后台定时器线程完成，磁盘较慢时也不会阻塞流的读取。
+    """
+
+    def __init__(self, path: Path, fsync_interval: float = 1.0, fsync_bytes: int = 64 * 1024):
+        self.path = path
+        self.id = path.stem
+        self.fsync_interval = fsync_interval
+        self.fsync_bytes = fsync_bytes
+        self.closed = False  # 已写入结束记录，不再接受增量
+        self._file = open(path, 'a', encoding='utf-8')
+        self._buffered = 0  # 尚未交给操作系统的字节数
+        self._unsynced = 0  # 尚未fsync的字节数
+        self._last_flush = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _append(self, record: Dict[str, Any], flush: bool = False):
+        line = json.dumps(record, ensure_ascii=False) + "\n"
+        with self._lock:
+            if self.closed:
+                return
+            self._file.write(line)
+            self._buffered += len(line)
+            self._unsynced += len(line)
+            if flush or self._buffered >= self.fsync_bytes \
+                    or time.monotonic() - self._last_flush >= self.fsync_interval:
+                self._flush_buffer()
+
+    def _flush_buffer(self):
+        self._file.flush()
+        self._buffered = 0
+        self._last_flush = time.monotonic()
+
+    def start(self, label: str, model: str, messages: List[Dict[str, Any]], resume_of: Optional[str] = None):
+        self._append({
+            "t": _START, "ts": time.time(), "label": label, "model": model,
+            "messages": messages, "resume_of": resume_of
+        }, flush=True)
+
+    def reasoning(self, text: str):
+        self._append({"t": _REASONING, "d": text})
+
+    def content(self, text: str):
+        self._append({"t": _CONTENT, "d": text})
+
+    def flush(self):
+        """把缓冲中的增量落盘（由后台定时器线程调用），fsync期间写入方不必等待"""
+        with self._lock:
+            if self._file.closed or not self._unsynced:
+                return
+            self._flush_buffer()
+            self._unsynced = 0
+            fileno = self._file.fileno()
+        os.fsync(fileno)
+
+    def close(self, status: str = COMPLETE, error: Optional[str] = None):
+        """写入结束记录并交给操作系统，之后由release落盘并关闭文件"""
+        self._append({"t": _END, "ts": time.time(), "status": status, "error": error}, flush=True)
+        with self._lock:
+            self.closed = True
+
+    def release(self):
+        """落盘并关闭文件（由后台定时器线程调用）"""
+        self.flush()
+        with self._lock:
+            self._file.close()
+
+
+class JournalRecord:
+    """从日志文件恢复出的一次生成"""
+
+    def __init__(self, id: str, path: Path):
+        self.id = id
+        self.path = path
+        self.label = ""
+        self.model = ""
+        self.messages: List[Dict[str, Any]] = []
+        self.resume_of: Optional[str] = None
+        self.started_at: Optional[float] = None
+        self.finished_at: Optional[float] = None
+        self.status = INCOMPLETE
+        self.error: Optional[str] = None
+        self._reasoning: List[str] = []
+        self._content: List[str] = []
+
+    @property
+    def reasoning(self) -> str:
+        return "".join(self._reasoning)
+
+    @property
+    def content(self) -> str:
+        return "".join(self._content)
+
+    @property
+    def complete(self) -> bool:
+        return self.status == COMPLETE
+
+    @classmethod
+    def load(cls, path: Path) -> "JournalRecord":
+        """逐行解析日志，末尾写了一半的行（崩溃时）被忽略"""
+        record = cls(path.stem, path)
+        with open(path, 'r', encoding='utf-8', errors='replace') as f:
+            for line in f:
+                try:
+                    item = json.loads(line)
+                except ValueError:
+                    continue
+                kind = item.get("t")
+                if kind == _CONTENT:
+                    record._content.append(item.get("d", ""))
+                elif kind == _REASONING:
+                    record._reasoning.append(item.get("d", ""))
+                elif kind == _START:
+                    record.label = item.get("label", "")
+                    record.model = item.get("model", "")
+                    record.messages = item.get("messages") or []
+                    record.resume_of = item.get("resume_of")
+                    record.started_at = item.get("ts")
+                elif kind == _END:
+                    record.status = item.get("status", COMPLETE)
+                    record.error = item.get("error")
+                    record.finished_at = item.get("ts")
+        return record
+
+    def summary(self) -> Dict[str, Any]:
+        return {
+            "id": self.id,
+            "label": self.label,
+            "model": self.model,
+            "status": self.status,
+            "started_at": self.started_at,
+            "finished_at": self.finished_at,
+            "content_chars": sum(len(part) for part in self._content),
+            "reasoning_chars": sum(len(part) for part in self._reasoning),
+            "resume_of": self.resume_of,
+            "error": self.error
+        }
+
+    def resume_messages(self) -> List[Dict[str, Any]]:
+        """续写用的消息：原始消息、已生成的部分正文与继续指令"""
+        messages = list(self.messages)
+        if self.content:
+            messages.append({"role": "assistant", "content": self.content})
+            messages.append({"role": "user", "content": RESUME_PROMPT})
+        return messages
+
+
+class GenerationJournal:
+    """流式生成的崩溃安全日志
+
+    每次生成对应data/journal下的一个JSONL文件。正常结束的日志保留keep_days天，
+    取消、失败或崩溃留下的未完成日志一直保留，直到被恢复后调用discard删除。
+    后台定时器每隔fsync_interval秒把各日志的缓冲落盘，流停滞时增量也不会只停留在内存中；
+    已结束的日志也由定时器线程落盘并关闭，流读取所在的线程从不等待fsync。
+    """
+
+    def __init__(self, directory: Path = JOURNAL_DIR, fsync_interval: float = 1.0,
+                 fsync_bytes: int = 64 * 1024, keep_days: float = 7.0, enabled: bool = True):
+        self.directory = Path(directory)
+        self.fsync_interval = fsync_interval  # 落盘间隔（秒）
+        self.fsync_bytes = fsync_bytes  # 累计多少字节后立即落盘
+        self.keep_days = keep_days  # 已完成日志的保留天数
+        self.enabled = enabled
+        self._writers: Dict[str, JournalWriter] = {}
+        self._closing: List[JournalWriter] = []  # 已结束、等待落盘关闭的日志
+        self._lock = threading.Lock()
+        self._flusher = None
+        self._pruned = False
+
+    def open(self, label: str, model: str, messages: List[Dict[str, Any]],
+             resume_of: Optional[str] = None) -> Optional[JournalWriter]:
+        """为一次生成创建日志，未启用或目录不可写时返回None"""
+        if not self.enabled:
+            return None
+        try:
+            self.directory.mkdir(parents=True, exist_ok=True)
+            if not self._pruned:
+                self._pruned = True
+                self.prune()
+            journal_id = f"{time.strftime('%Y%m%d-%H%M%S')}-{uuid.uuid4().hex[:8]}"
+            writer = JournalWriter(self.directory / f"{journal_id}.jsonl",
+                                   self.fsync_interval, self.fsync_bytes)
+            writer.start(label, model, messages, resume_of)
+        except OSError as e:
+            logger.warning(f"创建生成日志失败: {str(e)}")
+            return None
+        with self._lock:
+            self._writers[writer.id] = writer
+            self._ensure_flusher()
+        return writer
+
+    def close(self, writer: JournalWriter, status: str = COMPLETE, error: Optional[str] = None):
+        try:
+            writer.close(status, error)
+        except OSError as e:
+            logger.warning(f"关闭生成日志失败: {str(e)}")
+        with self._lock:
+            self._writers.pop(writer.id, None)
+            self._closing.append(writer)
+            self._ensure_flusher()
+
+    def _ensure_flusher(self):
+        """启动后台落盘定时器"""
+        if self._flusher is None or not self._flusher.is_alive():
+            self._flusher = threading.Timer(self.fsync_interval, self._flush_all)
+            self._flusher.daemon = True
+            self._flusher.start()
+
+    def _flush_all(self):
+        with self._lock:
+            writers = list(self._writers.values())
+            closing, self._closing = self._closing, []
+        for writer in writers:
+            try:
+                writer.flush()
+            except (OSError, ValueError) as e:
+                logger.debug(f"生成日志落盘失败: {str(e)}")
+        for writer in closing:
+            try:
+                writer.release()
+            except (OSError, ValueError) as e:
+                logger.debug(f"关闭生成日志失败: {str(e)}")
+        with self._lock:
+            self._flusher = None
+            if self._writers or self._closing:
+                self._ensure_flusher()
+
+    def _paths(self) -> List[Path]:
+        if not self.directory.exists():
+            return []
+        return sorted(self.directory.glob("*.jsonl"), reverse=True)
+
+    def list(self, incomplete_only: bool = True) -> List[Dict[str, Any]]:
+        """列出日志（新的在前），默认只列出可恢复的未完成生成，不含正在进行的"""
+        with self._lock:
+            active = set(self._writers)
+        result = []
+        for path in self._paths():
+            if path.stem in active:
+                continue
+            try:
+                record = JournalRecord.load(path)
+            except OSError as e:
+                logger.warning(f"读取生成日志失败 {path.name}: {str(e)}")
+                continue
+            if incomplete_only and record.complete:
+                continue
+            result.append(record.summary())
+        return result
+
+    def recover(self, journal_id: str) -> JournalRecord:
+        """读取一次生成已保存的思维链与正文，不存在时抛出FileNotFoundError"""
+        path = self.directory / f"{journal_id}.jsonl"
+        if not path.exists():
+            raise FileNotFoundError(f"生成日志不存在: {journal_id}")
+        return JournalRecord.load(path)
+
+    def discard(self, journal_id: str) -> bool:
+        """删除日志（恢复完成或用户放弃后调用）"""
+        path = self.directory / f"{journal_id}.jsonl"
+        try:
+            path.unlink()
+            return True
+        except FileNotFoundError:
+            return False
+
+    def prune(self) -> int:
+        """删除超过保留期的已完成日志，返回删除数量"""
+        cutoff = time.time() - self.keep_days * 86400
+        removed = 0
+        for path in self._paths():
+            try:
+                if path.stat().st_mtime >= cutoff or not JournalRecord.load(path).complete:
+                    continue
+                path.unlink()
+                removed += 1
+            except OSError as e:
+                logger.debug(f"清理生成日志失败 {path.name}: {str(e)}")
+        return removed
+
+
+# 全局生成日志
+generation_journal = GenerationJournal()
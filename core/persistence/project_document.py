@@ -0,0 +1,224 @@
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Set, Tuple
+import copy
+import os
+import threading
+import logging
+import yaml
+
+try:
+    # PyYAML编译了LibYAML时使用C实现，解析与序列化快一个数量级
+    from yaml import CSafeLoader as _Loader, CSafeDumper as _Dumper
+    LIBYAML = True
+except ImportError:
+    from yaml import SafeLoader as _Loader, SafeDumper as _Dumper
+    LIBYAML = False
+
+logger = logging.getLogger(__name__)
+
+PROJECT_FILE = Path(__file__).parent.parent.parent / 'data/configs/novel_structure.yaml'
+
+# 与各面板原有写法一致：保留中文、不排序键
+_DUMP_OPTIONS = {"allow_unicode": True, "sort_keys": False}
+
+
+def load_yaml(stream) -> Any:
+    """解析YAML文本或文件对象（优先使用LibYAML）"""
+    return yaml.load(stream, Loader=_Loader)
+
+
+def dump_yaml(data: Any, stream=None) -> Optional[str]:
+    """序列化为YAML（优先使用LibYAML），stream为None时返回字符串"""
+    return yaml.dump(data, stream, Dumper=_Dumper, **_DUMP_OPTIONS)
+
+
+class ProjectDocument:
+    """novel_structure.yaml的共享读写入口
+
+    整个会话只保留一份解析后的文档，各面板按节（base_config、role_config、world_view等）
+    读取时直接从内存取副本；每次访问用一次os.stat确认文件未被外部修改，变化时才重新解析。
+    写入某一节时不再读取、解析整个文件：各顶层节分别序列化并缓存其文本，
+    只有被修改的节重新序列化，再与其余节的缓存文本拼接，写入临时文件后原子替换。
+    stage_section只修改内存中的文档（读取立即可见），由commit（或AutosaveService）
+    合并写入；暂存期间文件被外部修改时，未写入的节覆盖在重新解析的内容之上。
+    """
+
+    def __init__(self, path: Path = PROJECT_FILE):
+        self.path = Path(path)
+        self._data: Dict[str, Any] = {}
+        self._rendered: Dict[str, str] = {}  # 顶层节 -> 已序列化的YAML文本
+        self._dirty: Set[str] = set()  # 已暂存、尚未写入文件的节
+        self._signature: Optional[Tuple[int, int, int]] = None
+        self._loaded = False
+        self._writing = False
+        self._replaced = False  # replace后尚未写入：内存中的文档整体优先于文件
+        self._version = 0  # 内容每变化一次加一，供面板判断是否需要刷新
+        self.fsync = True  # 写入后是否fsync（关闭后更快，但断电时可能丢失最近一次写入）
+        self._lock = threading.RLock()
+        self._write_lock = threading.Lock()  # 串行化文件写入，序列化与写盘期间不阻塞读取
+        self._counters = {"parses": 0, "writes": 0, "sections_rendered": 0, "reads": 0}
+
+    def _stat(self) -> Optional[Tuple[int, int, int]]:
+        try:
+            st = os.stat(self.path)
+        except OSError:
+            return None
+        return (st.st_mtime_ns, st.st_size, st.st_ino)
+
+    def _revalidate(self):
+        """首次访问或文件被外部修改（导入、手动编辑）时重新解析"""
+        if self._writing or self._replaced:
+            return
+        signature = self._stat()
+        if self._loaded and signature == self._signature:
+            return
+        data: Dict[str, Any] = {}
+        if signature is not None:
+            with open(self.path, 'r', encoding='utf-8') as f:
+                data = load_yaml(f) or {}
+            if not isinstance(data, dict):
+                raise ValueError(f"{self.path.name} 的顶层不是映射")
+            self._counters["parses"] += 1
+        for name in self._dirty:
+            data[name] = self._data[name]
+        self._data = data
+        self._rendered = {}
+        self._signature = signature
+        self._loaded = True
+        self._version += 1
+
+    def exists(self) -> bool:
+        return self.path.exists()
+
+    @property
+    def version(self) -> int:
+        """文档版本号，内容被修改（暂存、写入或外部修改）后增加"""
+        with self._lock:
+            self._revalidate()
+            return self._version
+
+    @property
+    def dirty(self) -> List[str]:
+        """已暂存、尚未写入文件的节"""
+        with self._lock:
+            return sorted(self._dirty)
+
+    def section(self, name: str, default: Any = None) -> Any:
+        """返回某一节的副本（含已暂存的修改），不存在时返回default"""
+        with self._lock:
+            self._revalidate()
+            self._counters["reads"] += 1
+            if name not in self._data:
+                return default
+            return copy.deepcopy(self._data[name])
+
+    def data(self) -> Dict[str, Any]:
+        """返回整个文档的副本（用于导出）"""
+        with self._lock:
+            self._revalidate()
+            return copy.deepcopy(self._data)
+
+    def stage_section(self, name: str, value: Any):
+        """只在内存中替换某一节，等待commit写入"""
+        with self._lock:
+            self._revalidate()
+            self._data[name] = copy.deepcopy(value)
+            self._rendered.pop(name, None)
+            self._dirty.add(name)
+            self._version += 1
+
+    def update_section(self, name: str, value: Any):
+        """替换某一节并立即写回文件，其余节保持原样与原顺序"""
+        self.update_sections({name: value})
+
+    def update_sections(self, sections: Dict[str, Any], fsync: Optional[bool] = None):
+        """一次替换多节并只写一次文件"""
+        for name, value in sections.items():
+            self.stage_section(name, value)
+        self.commit(fsync)
+
+    def replace(self, data: Dict[str, Any]):
+        """以新内容替换整个文档（用于导入）"""
+        if not isinstance(data, dict):
+            raise ValueError("导入的内容必须是键值结构")
+        with self._lock:
+            self._data = copy.deepcopy(data)
+            self._rendered = {}
+            self._dirty = set(self._data)
+            self._replaced = True
+            self._loaded = True
+            self._version += 1
+        self.commit()
+
+    def commit(self, fsync: Optional[bool] = None) -> bool:
+        """把已暂存的修改写入文件，没有修改时返回False；fsync默认取self.fsync"""
+        fsync = self.fsync if fsync is None else fsync
+        with self._write_lock:
+            with self._lock:
+                if not self._dirty and not self._replaced:
+                    return False
+                self._revalidate()
+                text = "".join(self._render(name) for name in self._data) if self._data else dump_yaml({})
+                dirty, self._dirty = self._dirty, set()
+                replaced, self._replaced = self._replaced, False
+                self._writing = True
+            try:
+                self._write(text, fsync)
+            except Exception:
+                with self._lock:
+                    self._dirty |= dirty
+                    self._replaced = self._replaced or replaced
+                raise
+            finally:
+                with self._lock:
+                    self._writing = False
+            with self._lock:
+                self._signature = self._stat()
+                self._counters["writes"] += 1
+            return True
+
+    def _render(self, name: str) -> str:
+        text = self._rendered.get(name)
+        if text is None:
+            # 块格式下逐节序列化后拼接，与整体序列化的结果相同
+            text = dump_yaml({name: self._data[name]})
+            self._rendered[name] = text
+            self._counters["sections_rendered"] += 1
+        return text
+
+    def _write(self, text: str, fsync: bool):
+        """写入临时文件后原子替换，写到一半崩溃时原文件保持完整"""
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        temp = self.path.with_name(self.path.name + ".tmp")
+        with open(temp, 'w', encoding='utf-8') as f:
+            f.write(text)
+            if fsync:
+                f.flush()
+                os.fsync(f.fileno())
+        os.replace(temp, self.path)
+        if fsync:
+            self._fsync_dir()
+
+    def _fsync_dir(self):
+        """落盘目录项，使rename在断电后同样生效（Windows不支持对目录fsync，忽略）"""
+        try:
+            fd = os.open(str(self.path.parent), os.O_RDONLY)
+        except OSError:
+            return
+        try:
+            os.fsync(fd)
+        except OSError:
+            pass
+        finally:
+            os.close(fd)
+
+    def stats(self) -> Dict[str, Any]:
+        """返回解析、写入次数与序列化缓存情况"""
+        with self._lock:
+            return {**self._counters, "libyaml": LIBYAML, "sections": list(self._data),
+                    "cached_sections": len(self._rendered), "dirty": sorted(self._dirty),
+                    "version": self._version}
+
+
+# 全局项目文档实例
+project_document = ProjectDocument()
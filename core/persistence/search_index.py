@@ -0,0 +1,483 @@
+from pathlib import Path
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+import sqlite3
+import hashlib
+import json
+import re
+import threading
+import time
+import logging
+from core.persistence.db_connector import ROOT, DB_PATH, ProjectStore, project_store
+
+logger = logging.getLogger(__name__)
+
+STUDY_DATA_DIR = ROOT / 'data/StudyData'
+
+# 文档类别
+KIND_STUDY = "study"  # data/StudyData中的类型说明
+KIND_WORLDVIEW = "worldview"  # 世界观的各部分
+KIND_ROLE = "role"  # 角色设定
+KIND_GENERATION = "generation"  # 生成记录（世界观模板、大纲等）
+
+KIND_LABELS = {
+    KIND_STUDY: "类型资料",
+    KIND_WORLDVIEW: "世界观",
+    KIND_ROLE: "角色",
+    KIND_GENERATION: "生成记录",
+}
+
+# 项目库中需要索引的表 -> 文档类别
+_TABLE_KINDS = {
+    "roles": KIND_ROLE,
+    "worldview_sections": KIND_WORLDVIEW,
+    "generations": KIND_GENERATION,
+}
+
+# 分词规则变化后递增，已有索引会被清空重建
+TOKENIZER_VERSION = 1
+
+_CJK = "\u3400-\u4dbf\u4e00-\u9fff\uf900-\ufaff"  # 与HeuristicTokenizer统计的汉字范围一致
+# 连续的汉字，或连续的其他字母数字（英文单词、数字、假名等）
+_TOKEN = re.compile(f"([{_CJK}]+)|([^\\W_{_CJK}]+)")
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS search_documents (
+    id INTEGER PRIMARY KEY,
+    kind TEXT NOT NULL,
+    source TEXT NOT NULL,
+    doc_key TEXT NOT NULL,
+    title TEXT NOT NULL,
+    content TEXT NOT NULL,
+    digest TEXT NOT NULL,
+    updated_at REAL NOT NULL,
+    UNIQUE (kind, source, doc_key)
+);
+CREATE VIRTUAL TABLE IF NOT EXISTS search_fts USING fts5(
+    title, body, content='', prefix='1', tokenize='unicode61'
+);
+CREATE TABLE IF NOT EXISTS search_meta (
+    key TEXT PRIMARY KEY,
+    value TEXT NOT NULL
+);
+"""
+
+
+def tokenize(text: str) -> Tuple[List[str], bool]:
+    """把文本切分为索引词，返回(词列表, 是否以两个以上汉字的连续段结尾)
+
+    连续汉字切成重叠的二元组（“修真文明” -> 修真 真文 文明），段尾再补一个单字，
+    使单字查询可以用前缀匹配命中每一个位置；其他字母数字按整词小写。
+    """
+    tokens: List[str] = []
+    ends_with_run = False
+    for run, word in _TOKEN.findall(text):
+        if word:
+            tokens.append(word.lower())
+            ends_with_run = False
+        else:
+            ends_with_run = len(run) > 1
+            if ends_with_run:
+                tokens.extend(map(str.__add__, run[:-1], run[1:]))
+            tokens.append(run[-1])
+    return tokens, ends_with_run
+
+
+def _index_text(text: str) -> str:
+    """写入FTS5的文本：以空格分隔的索引词，由unicode61分词器按空格切分"""
+    return " ".join(tokenize(text)[0])
+
+
+def _query_tokens(term: str) -> Tuple[List[str], bool]:
+    """查询词对应的索引词序列，返回(词列表, 是否按前缀匹配)"""
+    tokens, ends_with_run = tokenize(term)
+    if ends_with_run:
+        # 段尾单字只在文本中的段尾出现，查询词之后可能还有其他汉字，去掉后按短语匹配
+        tokens.pop()
+    prefix = len(tokens) == 1 and len(tokens[0]) == 1 and bool(re.match(f"[{_CJK}]", tokens[0]))
+    return tokens, prefix
+
+
+def _text(value: Any) -> str:
+    """把一行数据（字符串、字典或列表）展开为可检索的纯文本"""
+    if value is None:
+        return ""
+    if isinstance(value, str):
+        return value
+    if isinstance(value, dict):
+        return "\n".join(text for text in (_text(item) for item in value.values()) if text)
+    if isinstance(value, (list, tuple)):
+        return "\n".join(text for text in (_text(item) for item in value) if text)
+    return str(value)
+
+
+def _digest(title: str, content: str) -> str:
+    return hashlib.sha1(f"{title}\0{content}".encode('utf-8')).hexdigest()[:16]
+
+
+def _project_document(table: str, key: str, value: Any) -> Optional[Tuple[str, str, str]]:
+    """项目库中的一行对应的(类别, 标题, 正文)，不需要索引时返回None"""
+    kind = _TABLE_KINDS.get(table)
+    if kind is None or value is None:
+        return None
+    if kind == KIND_ROLE:
+        title = value.get("name") if isinstance(value, dict) else None
+        return kind, str(title or key), _text(value)
+    if kind == KIND_WORLDVIEW:
+        return kind, "世界观" if key == "content" else key, _text(value)
+    label = value.get("label") or value.get("kind") or "生成记录"
+    return kind, str(label), _text(value.get("content"))
+
+
+class SearchIndex:
+    """类型资料与项目内容的全文索引
+
+    索引对象为data/StudyData中的类型说明、项目库中各项目的世界观各部分、角色设定与生成记录，
+    保存在novel_data.db的FTS5表中。SQLite的内置分词器不能切分中文，这里在写入前把连续汉字
+    切成重叠的二元组，查询词按同样规则切分后作为短语匹配，任意长度的中文子串都能命中；
+    单个汉字按前缀匹配。FTS5表不保存原文（content=''），原文与摘要值保存在search_documents，
+    更新或删除时按原文重新切分后从倒排索引中移除。
+    start注册项目库的保存监听，之后每次保存只重新索引变化的行，并在后台做一次全量核对
+    （首次建立索引、补上程序外的修改）；内容未变的文档按摘要值跳过。
+    search按bm25排序（标题权重更高），返回带命中位置的摘要。
+    """
+
+    def __init__(self, db_path: Path = DB_PATH, store: Optional[ProjectStore] = project_store,
+                 study_dir: Path = STUDY_DATA_DIR, title_weight: float = 5.0):
+        self.db_path = Path(db_path)
+        self.store = store  # 提供世界观、角色与生成记录的项目库，None时只索引类型资料
+        self.study_dir = Path(study_dir)
+        self.title_weight = title_weight  # bm25中标题列相对正文的权重
+        self._conn: Optional[sqlite3.Connection] = None
+        self._disabled = False
+        self._lock = threading.RLock()
+        self._listening = False
+        self._synced = threading.Event()
+        self._counters = {"queries": 0, "indexed": 0, "removed": 0, "unchanged": 0, "syncs": 0, "errors": 0}
+        self._query_ms: List[float] = []
+
+    def _get_conn(self) -> Optional[sqlite3.Connection]:
+        """延迟打开索引，FTS5不可用等情况下返回None"""
+        if self._disabled:
+            return None
+        if self._conn is None:
+            try:
+                conn = sqlite3.connect(str(self.db_path), check_same_thread=False, timeout=5.0)
+                conn.execute("PRAGMA journal_mode=WAL")
+                conn.execute("PRAGMA synchronous=NORMAL")
+                conn.executescript(_SCHEMA)
+                row = conn.execute("SELECT value FROM search_meta WHERE key = 'tokenizer'").fetchone()
+                if row is None or row[0] != str(TOKENIZER_VERSION):
+                    with conn:
+                        conn.execute("DELETE FROM search_documents")
+                        conn.execute("INSERT INTO search_fts(search_fts) VALUES ('delete-all')")
+                        conn.execute("INSERT OR REPLACE INTO search_meta (key, value) VALUES ('tokenizer', ?)",
+                                     (str(TOKENIZER_VERSION),))
+                self._conn = conn
+            except sqlite3.Error as e:
+                logger.warning(f"全文索引不可用: {str(e)}")
+                self._disabled = True
+        return self._conn
+
+    @property
+    def available(self) -> bool:
+        with self._lock:
+            return self._get_conn() is not None
+
+    def start(self, background: bool = True):
+        """注册项目库保存监听，并（默认在后台线程中）核对全部文档"""
+        if self.store is not None and not self._listening:
+            self.store.add_listener(self._on_store_saved)
+            self._listening = True
+        if background:
+            threading.Thread(target=self.sync, name="SearchIndex", daemon=True).start()
+        else:
+            self.sync()
+
+    def wait_synced(self, timeout: Optional[float] = None) -> bool:
+        """等待启动时的全量核对完成"""
+        return self._synced.wait(timeout)
+
+    def _put(self, conn: sqlite3.Connection, kind: str, source: str, key: str, title: str, content: str,
+             now: float, existing: Optional[Tuple[int, str]] = None, lookup: bool = True) -> bool:
+        """写入一篇文档，内容未变时跳过，返回是否写入；existing为已知的(id, 摘要值)"""
+        if not content.strip() and not title.strip():
+            return self._remove(conn, kind, source, key)
+        digest = _digest(title, content)
+        if existing is None and lookup:
+            existing = conn.execute(
+                "SELECT id, digest FROM search_documents WHERE kind = ? AND source = ? AND doc_key = ?",
+                (kind, source, key)).fetchone()
+        if existing is not None and existing[1] == digest:
+            self._counters["unchanged"] += 1
+            return False
+        if existing is not None:
+            self._unindex(conn, existing[0])
+            conn.execute("UPDATE search_documents SET title = ?, content = ?, digest = ?, updated_at = ? "
+                         "WHERE id = ?", (title, content, digest, now, existing[0]))
+            doc_id = existing[0]
+        else:
+            doc_id = conn.execute(
+                "INSERT INTO search_documents (kind, source, doc_key, title, content, digest, updated_at) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?)", (kind, source, key, title, content, digest, now)).lastrowid
+        conn.execute("INSERT INTO search_fts (rowid, title, body) VALUES (?, ?, ?)",
+                     (doc_id, _index_text(title), _index_text(content)))
+        self._counters["indexed"] += 1
+        return True
+
+    @staticmethod
+    def _unindex(conn: sqlite3.Connection, doc_id: int):
+        """从倒排索引中移除一篇文档（无原文的FTS5表需要提供写入时的同一组索引词）"""
+        row = conn.execute("SELECT title, content FROM search_documents WHERE id = ?", (doc_id,)).fetchone()
+        if row is not None:
+            conn.execute("INSERT INTO search_fts (search_fts, rowid, title, body) VALUES ('delete', ?, ?, ?)",
+                         (doc_id, _index_text(row[0]), _index_text(row[1])))
+
+    def _remove(self, conn: sqlite3.Connection, kind: str, source: str, key: str) -> bool:
+        row = conn.execute("SELECT id FROM search_documents WHERE kind = ? AND source = ? AND doc_key = ?",
+                           (kind, source, key)).fetchone()
+        if row is None:
+            return False
+        self._unindex(conn, row[0])
+        conn.execute("DELETE FROM search_documents WHERE id = ?", (row[0],))
+        self._counters["removed"] += 1
+        return True
+
+    def _on_store_saved(self, source: str, changes: List[Tuple[str, str, Any]]):
+        """项目库保存后只重新索引变化的行"""
+        changes = [change for change in changes if change[0] in _TABLE_KINDS]
+        if not changes:
+            return
+        with self._lock:
+            conn = self._get_conn()
+            if conn is None:
+                return
+            now = time.time()
+            try:
+                with conn:
+                    for table, key, value in changes:
+                        document = _project_document(table, key, value)
+                        if document is None:
+                            self._remove(conn, _TABLE_KINDS[table], source, key)
+                        else:
+                            kind, title, content = document
+                            self._put(conn, kind, source, key, title, content, now)
+            except sqlite3.Error as e:
+                self._counters["errors"] += 1
+                logger.warning(f"更新全文索引失败: {str(e)}")
+
+    def sync(self) -> Dict[str, int]:
+        """全量核对：索引新增或修改的文档，删除已不存在的文档，返回各项数量"""
+        counts = {"indexed": 0, "removed": 0, "documents": 0}
+        try:
+            with self._lock:
+                conn = self._get_conn()
+                if conn is None:
+                    return counts
+                documents = list(self._study_documents())
+                kinds = {KIND_STUDY}
+                if self.store is not None and self.store.available:
+                    documents.extend(self._project_documents(conn))
+                    kinds.update(_TABLE_KINDS.values())
+                existing = {(row[0], row[1], row[2]): (row[3], row[4]) for row in conn.execute(
+                    "SELECT kind, source, doc_key, id, digest FROM search_documents")}
+                now = time.time()
+                with conn:
+                    for kind, source, key, title, content in documents:
+                        known = existing.pop((kind, source, key), None)
+                        if self._put(conn, kind, source, key, title, content, now, known, lookup=False):
+                            counts["indexed"] += 1
+                    # 本次未核对的类别（项目库不可用时的项目内容）保持原样
+                    for kind, source, key in [item for item in existing if item[0] in kinds]:
+                        if self._remove(conn, kind, source, key):
+                            counts["removed"] += 1
+                counts["documents"] = len(documents)
+                self._counters["syncs"] += 1
+        except (OSError, sqlite3.Error) as e:
+            self._counters["errors"] += 1
+            logger.warning(f"全文索引核对失败: {str(e)}")
+        finally:
+            self._synced.set()
+        if counts["indexed"] or counts["removed"]:
+            logger.info(f"全文索引已更新: 新增或修改 {counts['indexed']} 篇，删除 {counts['removed']} 篇")
+        return counts
+
+    def _study_documents(self) -> Iterable[Tuple[str, str, str, str, str]]:
+        """StudyData下各JSON文件中的条目，各文件间内容相同的条目只索引一次"""
+        if not self.study_dir.is_dir():
+            return
+        seen = set()
+        for path in sorted(self.study_dir.glob("*.json")):
+            try:
+                with open(path, 'r', encoding='utf-8') as f:
+                    data = json.load(f)
+            except (OSError, ValueError) as e:
+                logger.warning(f"读取类型资料失败 ({path.name}): {str(e)}")
+                continue
+            if isinstance(data, dict):
+                entries = [(str(key), str(key), _text(value)) for key, value in data.items()]
+            elif isinstance(data, list):
+                entries = [(str(item.get("name") or index), str(item.get("name") or ""), _text(item))
+                           for index, item in enumerate(data) if isinstance(item, dict)]
+            else:
+                continue
+            source = f"StudyData/{path.name}"
+            for key, title, content in entries:
+                if (title, content) in seen:
+                    continue
+                seen.add((title, content))
+                yield KIND_STUDY, source, key, title, content
+
+    @staticmethod
+    def _project_documents(conn: sqlite3.Connection) -> Iterable[Tuple[str, str, str, str, str]]:
+        """项目库中需要索引的行（经由本连接读取，不占用项目库的锁）"""
+        queries = {
+            "roles": "SELECT p.source, r.role_id, r.data FROM roles r JOIN projects p ON p.id = r.project_id",
+            "worldview_sections": "SELECT p.source, w.key, w.data FROM worldview_sections w "
+                                  "JOIN projects p ON p.id = w.project_id",
+        }
+        for table, sql in queries.items():
+            for source, key, data in conn.execute(sql):
+                document = _project_document(table, key, json.loads(data))
+                if document is not None:
+                    yield (document[0], source, key) + document[1:]
+        for source, generation_id, kind, label, content in conn.execute(
+                "SELECT p.source, g.id, g.kind, g.label, g.content FROM generations g "
+                "JOIN projects p ON p.id = g.project_id"):
+            document = _project_document("generations", str(generation_id),
+                                         {"kind": kind, "label": label, "content": content})
+            yield (document[0], source, str(generation_id)) + document[1:]
+
+    @staticmethod
+    def _match_expression(query: str, fuzzy: bool) -> Tuple[Optional[str], List[str]]:
+        """把用户输入转换为FTS5查询，返回(查询表达式, 用于标注命中位置的词)"""
+        clauses: List[str] = []
+        terms: List[str] = []
+        for term in query.split():
+            tokens, prefix = _query_tokens(term)
+            if not tokens:
+                continue
+            # 近似查找时整词往往不在原文中，按各二元组标注命中位置
+            terms.extend(tokens) if fuzzy else terms.append(term.lower())
+            if fuzzy:
+                clauses.extend(f'"{token}"' + ("*" if prefix else "") for token in tokens)
+            else:
+                clauses.append(f'"{" ".join(tokens)}"' + ("*" if prefix else ""))
+        if not clauses:
+            return None, terms
+        return (" OR " if fuzzy else " AND ").join(clauses), terms
+
+    def search(self, query: str, kinds: Optional[Iterable[str]] = None, source: Optional[str] = None,
+               limit: int = 20, width: int = 60, fuzzy: bool = False) -> List[Dict[str, Any]]:
+        """检索文档，按相关度排序
+
+        多个以空格分隔的词须同时命中；fuzzy为True时任一二元组命中即可（用于近似查找）。
+        kinds限定文档类别，source限定项目来源。每条结果含类别、来源、标题、
+        约width个字符的摘要snippet及其中命中位置highlights[(起, 止)]。
+        """
+        expression, terms = self._match_expression(query, fuzzy)
+        if expression is None:
+            return []
+        started = time.perf_counter()
+        # 先只在倒排索引中排序取前limit个，再读取这些文档的原文，避免为每个命中读取正文
+        filters: List[str] = []
+        filter_args: List[Any] = []
+        if kinds is not None:
+            kinds = list(kinds)
+            filters.append(f"d.kind IN ({', '.join('?' * len(kinds))})")
+            filter_args.extend(kinds)
+        if source is not None:
+            filters.append("d.source = ?")
+            filter_args.append(source)
+        join = "".join(f" AND {condition}" for condition in filters)
+        sql = ("SELECT search_fts.rowid, bm25(search_fts, ?, 1.0) AS score FROM search_fts "
+               + (f"JOIN search_documents d ON d.id = search_fts.rowid{join} " if filters else "")
+               + "WHERE search_fts MATCH ? ORDER BY score LIMIT ?")
+        args = [self.title_weight] + filter_args + [expression, limit]
+        with self._lock:
+            conn = self._get_conn()
+            if conn is None:
+                return []
+            try:
+                ranked = conn.execute(sql, args).fetchall()
+                documents = {row[0]: row[1:] for row in conn.execute(
+                    f"SELECT id, kind, source, doc_key, title, content FROM search_documents "
+                    f"WHERE id IN ({', '.join('?' * len(ranked))})", [row[0] for row in ranked])}
+                rows = [(doc_id,) + documents[doc_id] + (score,) for doc_id, score in ranked if doc_id in documents]
+            except sqlite3.Error as e:
+                self._counters["errors"] += 1
+                logger.warning(f"全文检索失败: {str(e)}")
+                return []
+            self._counters["queries"] += 1
+            self._query_ms.append((time.perf_counter() - started) * 1000)
+            del self._query_ms[:-200]
+        results = []
+        for doc_id, kind, doc_source, key, title, content, score in rows:
+            snippet, highlights = self.snippet(content, terms, width)
+            results.append({
+                "id": doc_id, "kind": kind, "label": KIND_LABELS.get(kind, kind), "source": doc_source,
+                "key": key, "title": title, "snippet": snippet, "highlights": highlights,
+                "score": round(-score, 4)
+            })
+        return results
+
+    @staticmethod
+    def snippet(content: str, terms: List[str], width: int = 60) -> Tuple[str, List[Tuple[int, int]]]:
+        """截取包含最多不同查询词的一段正文，返回(摘要, 命中位置)"""
+        lowered = content.lower()
+        hits: List[Tuple[int, int, int]] = []  # (起, 止, 词序号)
+        for number, term in enumerate(terms):
+            start = lowered.find(term)
+            while start != -1 and len(hits) < 200:
+                hits.append((start, start + len(term), number))
+                start = lowered.find(term, start + len(term))
+        hits.sort()
+        begin = 0
+        if hits:
+            # 以每个命中位置为起点，选择窗口内不同查询词最多的一段
+            best = max(range(len(hits)), key=lambda index: (
+                len({hit[2] for hit in hits[index:] if hit[1] <= hits[index][0] + width}), -index))
+            begin = max(0, hits[best][0] - width // 4)
+        end = min(len(content), begin + width)
+        prefix = "…" if begin > 0 else ""
+        text = prefix + content[begin:end].replace("\n", " ") + ("…" if end < len(content) else "")
+        highlights = [(start - begin + len(prefix), min(stop, end) - begin + len(prefix))
+                      for start, stop, _ in hits if start >= begin and start < end]
+        return text, highlights
+
+    def document(self, doc_id: int) -> Optional[Dict[str, Any]]:
+        """按search返回的id取得文档全文"""
+        with self._lock:
+            conn = self._get_conn()
+            if conn is None:
+                return None
+            row = conn.execute("SELECT kind, source, doc_key, title, content, updated_at FROM search_documents "
+                               "WHERE id = ?", (doc_id,)).fetchone()
+        if row is None:
+            return None
+        return {"id": doc_id, "kind": row[0], "label": KIND_LABELS.get(row[0], row[0]), "source": row[1],
+                "key": row[2], "title": row[3], "content": row[4], "updated_at": row[5]}
+
+    def stats(self) -> Dict[str, Any]:
+        """返回各类别文档数、写入次数与查询耗时（毫秒）"""
+        with self._lock:
+            counts: Dict[str, int] = {}
+            conn = self._get_conn()
+            if conn is not None:
+                counts = dict(conn.execute("SELECT kind, COUNT(*) FROM search_documents GROUP BY kind").fetchall())
+            query_ms = sorted(self._query_ms)
+            return {
+                **self._counters, "available": conn is not None, "documents": counts,
+                "synced": self._synced.is_set(),
+                "query_ms_p50": query_ms[len(query_ms) // 2] if query_ms else None,
+                "query_ms_p95": query_ms[min(len(query_ms) - 1, int(len(query_ms) * 0.95))] if query_ms else None
+            }
+
+    def close(self):
+        with self._lock:
+            if self._conn is not None:
+                self._conn.close()
+                self._conn = None
+
+
+# 全局全文索引实例
+search_index = SearchIndex()
@@ -28,6 +28,30 @@ def setup_application():
     # 设置日志记录器
     logger = setup_logger('app', str(log_dir / 'app.log'))
     
+    # 设置AIWRITER_METRICS_PORT时在本机开启/metrics端点，指标文件始终写入data/metrics.prom
+    metrics_port = os.getenv('AIWRITER_METRICS_PORT')
+    if metrics_port:
+        try:
+            from core.api_client.telemetry import telemetry
+            telemetry.serve(int(metrics_port))
+        except (ValueError, OSError) as e:
+            logger.warning(f"指标端点开启失败: {str(e)}")
+
+    # 设置AIWRITER_CASSETTE时录制（AIWRITER_CASSETTE_MODE=record）或回放API会话，
+    # AIWRITER_CASSETTE_SPEED为回放速度倍数
+    cassette_path = os.getenv('AIWRITER_CASSETTE')
+    if cassette_path:
+        try:
+            from core.api_client.cassette import Cassette
+            from core.api_client.pool import client_pool
+            client_pool.use_cassette(Cassette(
+                cassette_path,
+                mode=os.getenv('AIWRITER_CASSETTE_MODE', 'replay'),
+                speed=float(os.getenv('AIWRITER_CASSETTE_SPEED', '1'))
+            ))
+        except (ValueError, OSError) as e:
+            logger.warning(f"API会话录制/回放开启失败: {str(e)}")
+    
     # 打印系统信息
     logger.info("=== 系统信息 ===")
     encoding_info = check_encoding()
@@ -64,6 +88,9 @@ def main():
         window = create_main_window()
         if window:
             window.mainloop()
+            # 关闭窗口后写入尚未保存的修改（进程退出时也会再检查一次）
+            from core.persistence.autosave import autosave_service
+            autosave_service.flush()
         else:
             print("窗口初始化失败，请检查错误日志")
             return 1
@@ -1,9 +1,10 @@
 from __future__ import annotations
 from typing import Optional, TYPE_CHECKING
+from types import MappingProxyType
 from utils.config_loader import load_config
 import os
+import copy
 import threading
-import httpx
 from datetime import datetime
 
 
@@ -27,13 +28,76 @@ class GenerationParameter:
         self.frequency_penalty: float = kwargs.get('frequency_penalty', 0.0)  # [-2.0, 2.0]
         self.presence_penalty: float = kwargs.get('presence_penalty', 0.0)   # [-2.0, 2.0]
 
+class GenerationSettings:
+    """单次请求使用的生成参数快照（不可修改）
+
+    由GlobalAPIConfig.generation_settings()从全局默认值加上本次调用的覆盖值构建，
+    显式传给生成接口；之后参数面板再修改全局参数，也不会影响已发出或正在重试的请求，
+    并发的生成可以各自使用不同的参数而无需加锁。需要调整时用replace()得到新的快照。
+    """
+    __slots__ = ("temperature", "top_p", "max_tokens", "response_format",
+                 "frequency_penalty", "presence_penalty")
+
+    def __init__(self, temperature: float = 1.0, top_p: float = 1.0, max_tokens: int = 2000,
+                 response_format: Optional[dict] = None, frequency_penalty: float = 0.0,
+                 presence_penalty: float = 0.0):
+        set_field = object.__setattr__
+        set_field(self, "temperature", float(temperature))
+        set_field(self, "top_p", float(top_p))
+        set_field(self, "max_tokens", int(max_tokens))
+        # 只读映射，发送时通过response_format_dict()取得副本
+        set_field(self, "response_format", MappingProxyType(copy.deepcopy(dict(response_format or {"type": "text"}))))
+        set_field(self, "frequency_penalty", float(frequency_penalty))
+        set_field(self, "presence_penalty", float(presence_penalty))
+
+    def __setattr__(self, name, value):
+        raise AttributeError("GenerationSettings不可修改，请使用replace()创建新的快照")
+
+    def __delattr__(self, name):
+        raise AttributeError("GenerationSettings不可修改，请使用replace()创建新的快照")
+
+    def as_dict(self) -> dict:
+        return {
+            "temperature": self.temperature,
+            "top_p": self.top_p,
+            "max_tokens": self.max_tokens,
+            "response_format": self.response_format_dict(),
+            "frequency_penalty": self.frequency_penalty,
+            "presence_penalty": self.presence_penalty
+        }
+
+    def response_format_dict(self) -> dict:
+        return copy.deepcopy(dict(self.response_format))
+
+    def replace(self, **overrides) -> GenerationSettings:
+        """返回覆盖了指定参数的新快照，参数名无效时抛出TypeError"""
+        unknown = set(overrides) - set(self.__slots__)
+        if unknown:
+            raise TypeError(f"未知的生成参数: {', '.join(sorted(unknown))}")
+        if not overrides:
+            return self
+        values = self.as_dict()
+        values.update(overrides)
+        return GenerationSettings(**values)
+
+    def __eq__(self, other):
+        if not isinstance(other, GenerationSettings):
+            return NotImplemented
+        return all(getattr(self, name) == getattr(other, name) for name in self.__slots__)
+
+    def __repr__(self):
+        fields = ", ".join(f"{name}={getattr(self, name)!r}" for name in self.__slots__)
+        return f"GenerationSettings({fields})"
+
 class GlobalAPIConfig:
     """统一配置入口"""
     def __init__(self):
         self.model_config = APIModelConfig()
         self.generation_params = GenerationParameter()  # 修正变量名
+        self._params_lock = threading.Lock()  # 保证快照不会读到只改了一半的预设
         self.model_mapping = self._load_model_config()
         self.connection_monitor = ConnectionMonitor()
+        self._model_listeners = []  # 模型切换监听器
 
     def _load_model_config(self) -> dict:
         """从配置文件加载模型映射"""
@@ -56,6 +120,7 @@ class GlobalAPIConfig:
         """更新模型配置"""
         config = self.model_mapping.get(model_name)
         if config:
+            previous = dict(self.model_config.__dict__)
             # 更新模型基础配置
             self.model_config.__dict__.update({
                 'name': model_name,
@@ -66,12 +131,51 @@ class GlobalAPIConfig:
             })
             # 自动调整参数
             self._adjust_parameters(config)
+            # 通知监听器（如连接池重建客户端）
+            self._notify_model_listeners(previous)
+
+    def add_model_listener(self, callback):
+        """注册模型切换监听器，回调参数为切换前的模型配置字典"""
+        if callback not in self._model_listeners:
+            self._model_listeners.append(callback)
+
+    def _notify_model_listeners(self, previous: dict):
+        """依次调用模型切换监听器"""
+        for callback in list(self._model_listeners):
+            try:
+                callback(previous)
+            except Exception as e:
+                print(f"模型切换回调执行失败: {e}")
     
     def _adjust_parameters(self, config: dict):
         """自动调整生成参数"""
         safe_max_tokens = int(config["context_window"] * 0.8)
-        if self.generation_params.max_tokens > safe_max_tokens:
-            self.generation_params.max_tokens = safe_max_tokens
+        with self._params_lock:
+            if self.generation_params.max_tokens > safe_max_tokens:
+                self.generation_params.max_tokens = safe_max_tokens
+
+    def generation_settings(self, **overrides) -> GenerationSettings:
+        """以当前全局生成参数为默认值、叠加本次调用的覆盖值，返回不可修改的快照"""
+        with self._params_lock:
+            params = self.generation_params
+            settings = GenerationSettings(
+                temperature=params.temperature,
+                top_p=params.top_p,
+                max_tokens=params.max_tokens,
+                response_format=params.response_format,
+                frequency_penalty=params.frequency_penalty,
+                presence_penalty=params.presence_penalty
+            )
+        return settings.replace(**overrides)
+
+    def update_generation_params(self, **values):
+        """一次性修改多个全局生成参数（如应用预设），只影响之后创建的快照"""
+        unknown = set(values) - set(GenerationSettings.__slots__)
+        if unknown:
+            raise TypeError(f"未知的生成参数: {', '.join(sorted(unknown))}")
+        with self._params_lock:
+            for name, value in values.items():
+                setattr(self.generation_params, name, dict(value) if name == "response_format" else value)
 
     def save_config(self):
         """保存当前配置"""
@@ -108,24 +212,23 @@ class ConnectionMonitor:
         self.last_check = "尚未检查"
         
     def start_monitoring(self, interval=60):
-        """启动定时状态检查"""
-        self._check_status()
-        self._timer = threading.Timer(interval, self.start_monitoring, [interval])
+        """启动定时状态检查，检查在后台线程中执行，不阻塞界面"""
+        self._schedule(0, interval)
+
+    def _schedule(self, delay, interval):
+        self._timer = threading.Timer(delay, self._run, [interval])
         self._timer.daemon = True
         self._timer.start()
+
+    def _run(self, interval):
+        self._check_status()
+        self._schedule(interval, interval)
         
     def _check_status(self):
-        """实际执行状态检查"""
+        """实际执行状态检查，经连接池与生成请求共用连接（同时保持连接活跃）"""
         try:
-            from utils.config_loader import get_api_key
-            api_key = get_api_key()["providers"].get(global_config.model_config.provider, "")
-            
-            response = httpx.get(
-                f"{global_config.model_config.base_url}/models",
-                headers={"Authorization": f"Bearer {api_key}"},
-                timeout=5
-            )
-            self._status = response.status_code == 200
+            from core.api_client.warmup import warmup_service
+            self._status = warmup_service.probe()
             self.last_check = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
         except Exception as e:
             self._status = False
@@ -48,10 +48,14 @@ class SecurityConfig:
         self.request_timeout: int = 30  # 秒
         self.retry_policy: Dict[str, Any] = {
             'max_attempts': 3,
-            'backoff_factor': 0.5
+            'backoff_factor': 0.5,
+            'max_backoff': 30.0,  # 单次重试等待上限（秒）
+            'breaker_threshold': 5,  # 同一提供商/模型连续失败多少次后熔断
+            'breaker_cooldown': 30.0  # 熔断持续时间（秒）
         }
         self.enable_rate_limiting: bool = True
         self.rate_limit_per_minute: int = 60
+        self.tokens_per_minute: int = 0  # 每分钟token预算，0表示不限制
 
 class SecureApiClient:
     """安全API客户端"""
@@ -146,12 +150,13 @@ class SecureApiClient:
         
         # 创建安全的HTTP客户端
         async with httpx.AsyncClient(timeout=self.config.request_timeout) as client:
-            # 发送请求并实现重试逻辑
-            retry_count = 0
-            max_retries = self.config.retry_policy['max_attempts']
-            backoff = self.config.retry_policy['backoff_factor']
-            
-            while retry_count < max_retries:
+            # 发送请求，重试与熔断由共享的重试引擎决定
+            state = _begin_retry(url)
+            while True:
+                _, delay = state.next()
+                if delay:
+                    import asyncio
+                    await asyncio.sleep(delay)
                 try:
                     response = await client.request(
                         method=method,
@@ -159,17 +164,29 @@ class SecureApiClient:
                         json=data,
                         headers=headers
                     )
+                    _check_status(response)
+                    state.succeeded()
                     return response
+                except httpx.HTTPStatusError as e:
+                    # 重试用尽时返回最后一次的响应，由调用方处理状态码
+                    if not state.failed(e):
+                        return e.response
                 except Exception as e:
-                    retry_count += 1
-                    if retry_count >= max_retries:
-                        raise e
-                    # 指数退避策略
-                    import asyncio
-                    await asyncio.sleep(backoff * (2 ** (retry_count - 1)))
-        
-        # 不应该到达这里
-        raise RuntimeError("请求失败")
+                    if not state.failed(e):
+                        raise
+
+def _begin_retry(url: str):
+    """按URL主机名开始一次重试过程，同一主机共享熔断器"""
+    from urllib.parse import urlparse
+    from core.api_client.retry import retry_engine
+    return retry_engine.begin([urlparse(url).netloc], key=lambda host: (host, "http"))
+
+def _check_status(response: httpx.Response):
+    """限流与服务端错误按可重试的失败处理"""
+    if response.status_code == 429 or response.status_code >= 500:
+        raise httpx.HTTPStatusError(
+            f"HTTP {response.status_code}", request=response.request, response=response
+        )
 
 # 全局安全配置实例
 security_config = SecurityConfig()
@@ -190,11 +207,11 @@ def secure_request(method: str, url: str, data: Optional[Dict[str, Any]] = None,
     
     # 创建HTTP客户端并发送请求
     with httpx.Client(timeout=security_config.request_timeout) as http_client:
-        retry_count = 0
-        max_retries = security_config.retry_policy['max_attempts']
-        backoff = security_config.retry_policy['backoff_factor']
-        
-        while retry_count < max_retries:
+        state = _begin_retry(url)
+        while True:
+            _, delay = state.next()
+            if delay:
+                time.sleep(delay)
             try:
                 response = http_client.request(
                     method=method,
@@ -202,14 +219,12 @@ def secure_request(method: str, url: str, data: Optional[Dict[str, Any]] = None,
                     json=data,
                     headers=headers
                 )
+                _check_status(response)
+                state.succeeded()
                 return response
+            except httpx.HTTPStatusError as e:
+                if not state.failed(e):
+                    return e.response
             except Exception as e:
-                retry_count += 1
-                if retry_count >= max_retries:
-                    raise e
-                # 指数退避策略
-                import time
-                time.sleep(backoff * (2 ** (retry_count - 1)))
-    
-    # 不应该到达这里
-    raise RuntimeError("请求失败") 
\ No newline at end of file
+                if not state.failed(e):
+                    raise
@@ -0,0 +1,431 @@
+"""本地OpenAI兼容模拟服务器
+
+在没有DeepSeek/Qwen/HunYuan密钥或网络的机器上压测客户端与界面流水线。
+只依赖标准库（可选PyYAML读取配置文件），支持：
+    - /v1/chat/completions 的流式（SSE）与非流式响应，推理模型输出reasoning_content增量
+    - 可配置的首字延迟、思维链首字延迟、生成速度（tokens/秒）与每块字符数
+    - 按比例注入500错误、429限流（带Retry-After）与流中途断开
+    - 脚本化输出：按顺序循环返回文件中给定的思维链与正文
+    - stream_options.include_usage时在流末尾返回usage，并模拟DeepSeek的前缀缓存命中字段
+
+用法：
+    python proxyserver/mock_server.py --port 8765 --ttft 0.8 --tps 40 --error-rate 0.02
+
+然后在data/configs/model_config.yaml中添加指向它的模型（apikey.yaml的providers中
+为Mock配置任意非空密钥）：
+    Mock-R1:
+      provider: "Mock"
+      base_url: "http://127.0.0.1:8765/v1"
+      model: "mock-reasoner"
+      context_window: 65536
+
+每个模型可在配置文件（--config，YAML或JSON）的models节中覆盖默认参数：
+    ttft: 0.5
+    tps: 50
+    models:
+      mock-reasoner: {ttft: 2.0, reasoning_chars: 400}
+也可在单个请求中通过X-Mock-<参数>请求头覆盖，如X-Mock-Ttft: 3。
+"""
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+import argparse
+import itertools
+import json
+import random
+import re
+import threading
+import time
+import uuid
+import logging
+
+logger = logging.getLogger(__name__)
+
+_CJK = re.compile(r'[　-〿㐀-䶿一-鿿＀-￯]')
+
+# 未指定脚本时循环使用的填充文本
+_FILLER_REASONING = "先梳理需求中的关键要素，再逐项确认设定之间是否自洽，最后按要求的格式组织输出。"
+_FILLER_CONTENT = (
+    "一、总览设定\n这是一个由模拟服务器生成的世界观，用于测试流式输出的显示与解析。\n\n"
+    "二、时空与物理法则\n时代为架空纪元，物理法则与现实一致，只有少数遗迹中残留着失落的技术。\n\n"
+    "三、社会结构\n七座城邦以河流为界，议会与商会分掌权力，资源争夺集中在上游的水源。\n\n"
+)
+
+
+class MockConfig:
+    """模拟参数，数值均可被模型级配置与请求头覆盖
+
+        ttft: 首个正文token前的等待（秒）
+        reasoning_ttft: 推理模型首个思维链token前的等待（秒）
+        jitter: 延迟的随机抖动比例（0.1表示±10%）
+        tps: 生成速度（tokens/秒），决定块间隔
+        chunk_chars: 每个增量块的字符数
+        reasoning_chars / content_chars: 未使用脚本时生成的思维链/正文长度（字符）
+        error_rate / rate_limit_rate / disconnect_rate: 500错误、429限流、流中途断开的概率
+        retry_after: 429响应的Retry-After秒数
+    """
+
+    DEFAULTS: Dict[str, Any] = {
+        "ttft": 0.5,
+        "reasoning_ttft": 0.3,
+        "jitter": 0.1,
+        "tps": 40.0,
+        "chunk_chars": 4,
+        "reasoning_chars": 200,
+        "content_chars": 600,
+        "error_rate": 0.0,
+        "rate_limit_rate": 0.0,
+        "disconnect_rate": 0.0,
+        "retry_after": 1.0,
+    }
+
+    def __init__(self, script: Optional[List[Dict[str, str]]] = None,
+                 models: Optional[Dict[str, Dict[str, Any]]] = None, **values):
+        unknown = set(values) - set(self.DEFAULTS)
+        if unknown:
+            raise ValueError(f"未知的模拟参数: {', '.join(sorted(unknown))}")
+        self.values = {**self.DEFAULTS, **values}
+        self.models = models or {}
+        self._lock = threading.Lock()
+        self.set_script(script)
+
+    @classmethod
+    def load(cls, path: Path, **overrides) -> "MockConfig":
+        """从YAML或JSON文件读取参数，overrides中非None的值优先"""
+        text = Path(path).read_text(encoding='utf-8')
+        if Path(path).suffix.lower() in ('.yaml', '.yml'):
+            import yaml
+            data = yaml.safe_load(text) or {}
+        else:
+            data = json.loads(text)
+        models = data.pop('models', None)
+        script = data.pop('script', None)
+        data.update({key: value for key, value in overrides.items() if value is not None})
+        return cls(script=load_script(Path(script)) if script else None, models=models, **data)
+
+    def resolve(self, model: str, headers) -> Dict[str, Any]:
+        """本次请求的参数：默认值 < 模型级配置 < X-Mock-*请求头"""
+        values = {**self.values, **self.models.get(model, {})}
+        for key, default in self.DEFAULTS.items():
+            header = headers.get("X-Mock-" + key.replace("_", "-").title())
+            if header is not None:
+                values[key] = type(default)(header)
+        return values
+
+    def set_script(self, script: Optional[List[Dict[str, str]]]):
+        """设置按顺序循环返回的输出，None表示使用填充文本"""
+        with self._lock:
+            self.script = script or []
+            self._script_cycle = itertools.cycle(self.script) if self.script else None
+
+    def next_script(self) -> Optional[Dict[str, str]]:
+        if self._script_cycle is None:
+            return None
+        with self._lock:
+            return next(self._script_cycle)
+
+
+def load_script(path: Path) -> List[Dict[str, str]]:
+    """读取脚本化输出
+
+    JSONL文件每行一个{"reasoning": ..., "content": ...}；
+    其他文本文件以单独一行的“---”分隔多段正文。
+    """
+    text = Path(path).read_text(encoding='utf-8')
+    if Path(path).suffix.lower() == '.jsonl':
+        return [json.loads(line) for line in text.splitlines() if line.strip()]
+    return [{"content": part.strip("\n")} for part in re.split(r'^---$', text, flags=re.M) if part.strip()]
+
+
+def estimate_tokens(text: str) -> int:
+    """粗略估算token数：中文约0.6，其余字符约0.3"""
+    cjk = len(_CJK.findall(text))
+    return max(1, int(round(cjk * 0.6 + (len(text) - cjk) * 0.3))) if text else 0
+
+
+def _repeat(text: str, length: int) -> str:
+    if length <= 0:
+        return ""
+    return (text * (length // len(text) + 1))[:length]
+
+
+def _chunks(text: str, size: int) -> Iterator[str]:
+    size = max(1, int(size))
+    for start in range(0, len(text), size):
+        yield text[start:start + size]
+
+
+class PrefixCache:
+    """模拟提供商的前缀缓存：与最近请求的最长公共前缀按64 token为单位计为命中"""
+
+    BLOCK = 64
+
+    def __init__(self, size: int = 32):
+        self._recent: List[str] = []
+        self.size = size
+        self._lock = threading.Lock()
+
+    def hit_tokens(self, prompt: str) -> int:
+        with self._lock:
+            best = 0
+            for previous in self._recent:
+                n = 0
+                for a, b in zip(prompt, previous):
+                    if a != b:
+                        break
+                    n += 1
+                best = max(best, n)
+            if prompt in self._recent:
+                self._recent.remove(prompt)
+            self._recent.append(prompt)
+            del self._recent[:-self.size]
+        tokens = estimate_tokens(prompt[:best])
+        return tokens // self.BLOCK * self.BLOCK
+
+
+class MockHandler(BaseHTTPRequestHandler):
+    """OpenAI chat-completions协议的请求处理"""
+
+    protocol_version = "HTTP/1.1"
+    server: "MockServer"
+
+    def log_message(self, format, *args):
+        logger.debug(format % args)
+
+    def do_GET(self):
+        if self.path.rstrip('/').endswith('/models'):
+            models = sorted(set(self.server.config.models) | {"mock-chat", "mock-reasoner"})
+            self._send_json(200, {"object": "list", "data": [
+                {"id": name, "object": "model", "owned_by": "mock"} for name in models
+            ]})
+        else:
+            self._send_json(404, {"error": {"message": "not found", "type": "invalid_request_error"}})
+
+    def do_POST(self):
+        length = int(self.headers.get("Content-Length", 0))
+        try:
+            request = json.loads(self.rfile.read(length) or b"{}")
+        except ValueError:
+            self._send_json(400, {"error": {"message": "invalid JSON body", "type": "invalid_request_error"}})
+            return
+        if not self.path.rstrip('/').endswith('/chat/completions'):
+            self._send_json(404, {"error": {"message": "not found", "type": "invalid_request_error"}})
+            return
+        if not request.get("messages"):
+            self._send_json(400, {"error": {"message": "messages is required", "type": "invalid_request_error"}})
+            return
+
+        server = self.server
+        model = request.get("model", "mock-chat")
+        try:
+            params = server.config.resolve(model, self.headers)
+        except ValueError as e:
+            self._send_json(400, {"error": {"message": f"bad X-Mock header: {e}", "type": "invalid_request_error"}})
+            return
+        server.count("requests")
+
+        # 错误注入
+        roll = random.random()
+        if roll < params["rate_limit_rate"]:
+            server.count("rate_limited")
+            self._send_json(429, {"error": {"message": "Rate limit reached (mock)", "type": "rate_limit_error"}},
+                            {"Retry-After": str(params["retry_after"])})
+            return
+        if roll < params["rate_limit_rate"] + params["error_rate"]:
+            server.count("errors")
+            self._send_json(500, {"error": {"message": "Internal server error (mock)", "type": "server_error"}})
+            return
+
+        reasoning, content = self._output(model, request, params)
+        prompt = "".join(str(m.get("content", "")) for m in request["messages"])
+        usage = self._usage(prompt, reasoning + content)
+
+        if request.get("stream"):
+            self._stream(model, request, params, reasoning, content, usage)
+        else:
+            time.sleep(self._delay(params["ttft"], params) + estimate_tokens(reasoning + content) / params["tps"])
+            message = {"role": "assistant", "content": content}
+            if reasoning:
+                message["reasoning_content"] = reasoning
+            self._send_json(200, {
+                "id": self._id(), "object": "chat.completion", "created": int(time.time()), "model": model,
+                "choices": [{"index": 0, "message": message, "finish_reason": "stop"}],
+                "usage": usage
+            })
+            server.count("completed")
+
+    def _output(self, model: str, request: Dict[str, Any], params: Dict[str, Any]) -> Tuple[str, str]:
+        """本次返回的思维链与正文"""
+        reasoning_model = "reason" in model or "r1" in model.lower()
+        scripted = self.server.config.next_script()
+        if scripted is not None:
+            content = scripted.get("content", "")
+            reasoning = scripted.get("reasoning", "") if reasoning_model else ""
+        else:
+            content = _repeat(_FILLER_CONTENT, int(params["content_chars"]))
+            reasoning = _repeat(_FILLER_REASONING, int(params["reasoning_chars"])) if reasoning_model else ""
+        # 遵守max_tokens
+        max_tokens = request.get("max_tokens")
+        if max_tokens and estimate_tokens(content) > max_tokens:
+            ratio = max_tokens / estimate_tokens(content)
+            content = content[:max(1, int(len(content) * ratio))]
+        return reasoning, content
+
+    def _usage(self, prompt: str, output: str) -> Dict[str, Any]:
+        prompt_tokens = estimate_tokens(prompt)
+        hit = min(prompt_tokens, self.server.prefix_cache.hit_tokens(prompt))
+        return {
+            "prompt_tokens": prompt_tokens,
+            "completion_tokens": estimate_tokens(output),
+            "total_tokens": prompt_tokens + estimate_tokens(output),
+            "prompt_cache_hit_tokens": hit,
+            "prompt_cache_miss_tokens": prompt_tokens - hit,
+        }
+
+    @staticmethod
+    def _delay(base: float, params: Dict[str, Any]) -> float:
+        jitter = params["jitter"]
+        return max(0.0, base * random.uniform(1 - jitter, 1 + jitter))
+
+    @staticmethod
+    def _id() -> str:
+        return "chatcmpl-mock-" + uuid.uuid4().hex[:12]
+
+    def _stream(self, model: str, request: Dict[str, Any], params: Dict[str, Any],
+                reasoning: str, content: str, usage: Dict[str, Any]):
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream; charset=utf-8")
+        self.send_header("Cache-Control", "no-cache")
+        self.send_header("Transfer-Encoding", "chunked")
+        self.end_headers()
+
+        completion_id, created = self._id(), int(time.time())
+
+        def event(delta: Optional[Dict[str, Any]], finish_reason=None, extra=None):
+            data = {"id": completion_id, "object": "chat.completion.chunk", "created": created, "model": model,
+                    "choices": [] if delta is None else
+                    [{"index": 0, "delta": delta, "finish_reason": finish_reason}]}
+            if extra:
+                data.update(extra)
+            self._write_chunk("data: " + json.dumps(data, ensure_ascii=False) + "\n\n")
+
+        # 流中途断开发生在正文的随机位置
+        total = len(reasoning) + len(content)
+        disconnect_at = random.randint(1, max(1, total)) if random.random() < params["disconnect_rate"] else None
+        sent = 0
+        try:
+            event({"role": "assistant", "content": ""})
+            for kind, text, wait in (("reasoning_content", reasoning, params["reasoning_ttft"]),
+                                     ("content", content, params["ttft"])):
+                if not text:
+                    continue
+                time.sleep(self._delay(wait, params))
+                for piece in _chunks(text, params["chunk_chars"]):
+                    if disconnect_at is not None and sent >= disconnect_at:
+                        self.server.count("disconnects")
+                        self.close_connection = True
+                        return
+                    delta = {"content": piece, "reasoning_content": None} if kind == "content" \
+                        else {"content": None, "reasoning_content": piece}
+                    event(delta)
+                    sent += len(piece)
+                    time.sleep(estimate_tokens(piece) / params["tps"])
+            event({}, finish_reason="stop")
+            if (request.get("stream_options") or {}).get("include_usage"):
+                event(None, extra={"usage": usage})
+            self._write_chunk("data: [DONE]\n\n")
+            self._write_chunk("")
+            self.server.count("completed")
+        except (BrokenPipeError, ConnectionResetError):
+            # 客户端取消
+            self.server.count("client_closed")
+            self.close_connection = True
+
+    def _write_chunk(self, text: str):
+        data = text.encode('utf-8')
+        self.wfile.write(b"%x\r\n" % len(data) + data + b"\r\n")
+        self.wfile.flush()
+
+    def _send_json(self, status: int, body: Dict[str, Any], headers: Optional[Dict[str, str]] = None):
+        data = json.dumps(body, ensure_ascii=False).encode('utf-8')
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(data)
+
+
+class MockServer(ThreadingHTTPServer):
+    """模拟服务器，可在测试与基准脚本中直接启动
+
+        server = MockServer(MockConfig(ttft=0.2, tps=200), port=0).start()
+        base_url = server.base_url  # http://127.0.0.1:<随机端口>/v1
+    """
+
+    daemon_threads = True
+
+    def __init__(self, config: Optional[MockConfig] = None, host: str = "127.0.0.1", port: int = 8765):
+        super().__init__((host, port), MockHandler)
+        self.config = config or MockConfig()
+        self.prefix_cache = PrefixCache()
+        self._counters: Dict[str, int] = {}
+        self._lock = threading.Lock()
+
+    @property
+    def base_url(self) -> str:
+        host, port = self.server_address[:2]
+        return f"http://{host}:{port}/v1"
+
+    def count(self, event: str):
+        with self._lock:
+            self._counters[event] = self._counters.get(event, 0) + 1
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return dict(self._counters)
+
+    def start(self) -> "MockServer":
+        """在后台线程中运行"""
+        threading.Thread(target=self.serve_forever, name="MockServer", daemon=True).start()
+        return self
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="本地OpenAI兼容模拟服务器")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--config", type=Path, help="YAML或JSON参数文件，可含models节按模型覆盖")
+    parser.add_argument("--script", type=Path, help="脚本化输出文件（.jsonl或以---分隔的文本）")
+    for key, default in MockConfig.DEFAULTS.items():
+        parser.add_argument("--" + key.replace("_", "-"), dest=key, type=type(default), default=None,
+                            help=f"默认 {default}")
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(message)s")
+    overrides = {key: getattr(args, key) for key in MockConfig.DEFAULTS}
+    if args.config:
+        config = MockConfig.load(args.config, **overrides)
+    else:
+        config = MockConfig(**{key: value for key, value in overrides.items() if value is not None})
+    if args.script:
+        config.set_script(load_script(args.script))
+
+    server = MockServer(config, args.host, args.port)
+    logger.info(f"模拟服务器已启动: {server.base_url}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        logger.info(f"已停止，统计: {server.stats()}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1 @@
+# 流式生成流水线的基准测试，运行方式见__main__.py
@@ -0,0 +1,69 @@
+"""运行流水线基准测试并与基线比较
+
+    python -m tests.benchmarks                      # 全部阶段，某阶段相对基线明显变慢时退出码为1
+    python -m tests.benchmarks --stages stream_generate,parse_free_text
+    python -m tests.benchmarks --cassette data/cassettes/worldview.jsonl   # 使用真实接口录制的会话
+    python -m tests.benchmarks --update-baseline    # 以本次结果作为新基线
+
+无图形环境时跳过Tk阶段（Linux下可用xvfb-run运行）。
+"""
+from pathlib import Path
+import argparse
+import json
+import logging
+import sys
+
+from tests.benchmarks.bench_pipeline import STAGES, Workload
+from tests.benchmarks.harness import BASELINE_FILE, compare, format_table, load_baseline, save_baseline, speed_factor
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(prog="python -m tests.benchmarks", description="流式生成流水线基准测试")
+    parser.add_argument("--stages", help=f"逗号分隔的阶段，默认全部: {', '.join(STAGES)}")
+    parser.add_argument("--cassette", type=Path, help="回放的会话文件，默认录制一次合成输出")
+    parser.add_argument("--runs", type=int, default=5, help="每个阶段重复完整输出的次数")
+    parser.add_argument("--tolerance", type=float, default=1.0,
+                        help="按本机速度换算后，相对基线允许的变慢比例")
+    parser.add_argument("--baseline", type=Path, default=BASELINE_FILE)
+    parser.add_argument("--update-baseline", action="store_true", help="把本次结果写入基线文件")
+    parser.add_argument("--json", action="store_true", help="以JSON输出结果")
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.ERROR)
+    names = [name.strip() for name in args.stages.split(",")] if args.stages else list(STAGES)
+    unknown = [name for name in names if name not in STAGES]
+    if unknown:
+        parser.error(f"未知的阶段: {', '.join(unknown)}")
+
+    workload = Workload(args.cassette, runs=args.runs)
+    try:
+        results = {name: STAGES[name](workload).summary() for name in names}
+    finally:
+        workload.close()
+
+    baseline = load_baseline(args.baseline)
+    if args.json:
+        print(json.dumps(results, ensure_ascii=False, indent=2))
+    else:
+        print(format_table(results, baseline))
+
+    if args.update_baseline:
+        save_baseline(results, args.baseline)
+        print(f"\n基线已更新: {args.baseline}")
+        return 0
+    if not baseline:
+        print(f"\n没有基线文件 {args.baseline}，使用--update-baseline生成")
+        return 0
+    print(f"\n本机相对基线的速度系数: {speed_factor(results, baseline):.2f}")
+    regressions = compare(results, baseline, args.tolerance)
+    if regressions:
+        print("\n性能回归：")
+        for line in regressions:
+            print(f"  {line}")
+        return 1
+    print("\n未发现性能回归")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
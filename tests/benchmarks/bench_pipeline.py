@@ -0,0 +1,314 @@
+"""流式生成流水线各阶段的基准测试
+
+每个阶段是一个接收Workload、返回StageResult的函数，登记在STAGES中。
+输入来自录制的API会话（Cassette）：默认先用本地模拟服务器录制一条合成的推理模型输出，
+也可传入用真实接口录制的会话文件。回放不访问网络、不等待，测量的是客户端自身的开销。
+"""
+from pathlib import Path
+from typing import Any, Callable, Dict, List, Optional
+import sys
+import tempfile
+import time
+import yaml
+
+ROOT = Path(__file__).resolve().parent.parent.parent
+if str(ROOT) not in sys.path:
+    sys.path.insert(0, str(ROOT))
+
+from core.api_client.cassette import Cassette, RECORD, REPLAY
+from core.api_client.deepseek import DeepSeekAPIClient
+from core.api_client.pool import ClientPool
+from core.api_client.stream_buffer import StreamBuffer
+from core.api_client.telemetry import Telemetry
+from core.persistence.journal import GenerationJournal
+from modules.GlobalModule import global_config
+from tests.benchmarks.harness import StageResult, measure
+
+BENCH_MODEL = "Bench-DeepSeek-R1"
+BENCH_PROVIDER = "Bench"
+
+BENCH_MESSAGES = [
+    {"role": "system", "content": "你是一个专业的小说作家"},
+    {"role": "user", "content": "为一部架空历史小说设计一个详细的世界观模板。"}
+]
+
+# 与RoleConfiguration预览格式一致的角色文本
+ROLE_TEXT = (
+    "▬ 核心定位 ▬\n"
+    "●角色定位：{role_type}\n\n"
+    "▬ 基础信息 ▬\n"
+    "●姓名：{name}\n"
+    "●性别：男\n"
+    "●年龄：{age}\n"
+    "●身份地位：边境城邦的见习书记官\n\n"
+    "▬ 人物画像 ▬\n"
+    "●外貌特征：身形瘦削，左手常年缠着褪色的布条\n"
+    "●随身物品：一本写满密文的旧账册\n\n"
+    "▬ 行为动机 ▬\n"
+    "●显性目标：查清父亲失踪的真相\n"
+    "●隐性动机：证明自己不只是议会的棋子\n\n"
+    "▬ 标志特征 ▬\n"
+    "●人设金句：账目不会说谎，说谎的是记账的人"
+)
+
+
+class _BenchClient(DeepSeekAPIClient):
+    """使用独立连接池、日志与指标的客户端，密钥固定（回放时不会发往任何服务器）"""
+
+    def __init__(self, workdir: Path):
+        super().__init__()
+        self.pool = ClientPool()
+        self.journal = GenerationJournal(workdir / 'journal')
+        self.telemetry = Telemetry(workdir / 'metrics.prom', export_interval=0)
+
+    def _get_api_key(self, provider: Optional[str] = None) -> str:
+        return "sk-bench"
+
+    def _has_api_key(self, provider: str) -> bool:
+        return True
+
+
+class Workload:
+    """各阶段共用的输入：回放用的会话、客户端与一次完整生成的输出块"""
+
+    def __init__(self, cassette_path: Optional[Path] = None, runs: int = 5, content_chars: int = 8000,
+                 reasoning_chars: int = 2000):
+        self.runs = runs
+        self._tmp = tempfile.TemporaryDirectory(prefix="aiwriter-bench-")
+        self.workdir = Path(self._tmp.name)
+        global_config.model_mapping[BENCH_MODEL] = {
+            'provider': BENCH_PROVIDER, 'base_url': "http://127.0.0.1:9/v1",
+            'model': "mock-reasoner", 'context_window': 65536
+        }
+        self.client = _BenchClient(self.workdir)
+        if cassette_path is None:
+            cassette_path = self._record_synthetic(content_chars, reasoning_chars)
+        self.cassette = Cassette(cassette_path, REPLAY, speed=0, strict=False)
+        self.client.pool.use_cassette(self.cassette)
+        self.chunks = self._collect_chunks()
+        self.content = "".join(chunk for chunk in self.chunks if isinstance(chunk, str))
+
+    def _record_synthetic(self, content_chars: int, reasoning_chars: int) -> Path:
+        """用本地模拟服务器录制一次合成输出"""
+        from proxyserver.mock_server import MockConfig, MockServer
+        server = MockServer(MockConfig(ttft=0, reasoning_ttft=0, jitter=0, tps=1e6, chunk_chars=4,
+                                       content_chars=content_chars, reasoning_chars=reasoning_chars),
+                            port=0).start()
+        path = self.workdir / 'synthetic.jsonl'
+        global_config.model_mapping[BENCH_MODEL]['base_url'] = server.base_url
+        try:
+            self.client.pool.use_cassette(Cassette(path, RECORD))
+            for _ in self.client.stream_generate(BENCH_MESSAGES, model_name=BENCH_MODEL):
+                pass
+        finally:
+            self.client.pool.use_cassette(None)
+            server.stop()
+        return path
+
+    def stream(self, callback: Optional[Callable[[Any], None]] = None):
+        """回放一次完整的流式生成"""
+        self.cassette.load()
+        for _ in self.client.stream_generate(BENCH_MESSAGES, callback=callback, model_name=BENCH_MODEL):
+            pass
+
+    def _collect_chunks(self) -> List[Any]:
+        chunks: List[Any] = []
+        self.stream(chunks.append)
+        if not any(isinstance(chunk, str) for chunk in chunks):
+            raise RuntimeError("录制的会话中没有正文输出")
+        return chunks
+
+    def text_chunks(self) -> List[str]:
+        return [chunk for chunk in self.chunks if isinstance(chunk, str)]
+
+    def close(self):
+        self.client.pool.close_all()
+        self._tmp.cleanup()
+
+
+def _chunk_size(chunk: Any) -> int:
+    if isinstance(chunk, dict):
+        return len(chunk.get("reasoning_content") or "")
+    return len(chunk or "")
+
+
+def bench_stream_generate(workload: Workload) -> StageResult:
+    """客户端解析：从回放的SSE字节到回调收到增量，样本为相邻两次回调的间隔"""
+    samples: List[float] = []
+    chars = 0
+    elapsed = 0.0
+    for _ in range(workload.runs):
+        marks: List[float] = []
+
+        def callback(chunk):
+            marks.append(time.perf_counter())
+
+        started = time.perf_counter()
+        workload.stream(callback)
+        finished = time.perf_counter()
+        elapsed += finished - started
+        samples.extend(b - a for a, b in zip([started] + marks, marks))
+        chars += sum(_chunk_size(chunk) for chunk in workload.chunks)
+    return StageResult("stream_generate", samples, chars, elapsed)
+
+
+def bench_callback_dispatch(workload: Workload) -> StageResult:
+    """回调分发：增量写入StreamBuffer并取出合并块交给界面回调（与TkStreamPump每帧的工作相同）"""
+    buffer = StreamBuffer(flush_interval=0)
+    delivered: List[Any] = []
+
+    def dispatch(chunk):
+        buffer.push(chunk)
+        if buffer.ready():
+            delivered.extend(buffer.drain())
+
+    return measure("callback_dispatch", dispatch, workload.chunks * workload.runs, size=_chunk_size)
+
+
+def bench_filter_special_symbols(workload: Workload) -> StageResult:
+    """WorldView对每个正文增量调用的符号过滤"""
+    from ui.panels.WorldView import WorldViewPanel
+    return measure("filter_special_symbols", lambda chunk: WorldViewPanel._filter_special_symbols(None, chunk),
+                   workload.text_chunks() * workload.runs)
+
+
+def bench_parse_template_content(workload: Workload) -> StageResult:
+    """生成结束后对完整模板的章节解析"""
+    from ui.panels.WorldView import WorldViewPanel
+    return measure("parse_template_content", lambda text: WorldViewPanel._parse_template_content(None, text),
+                   [workload.content] * max(20, workload.runs * 10))
+
+
+def bench_parse_free_text(workload: Workload) -> StageResult:
+    """角色预览文本的解析"""
+    from ui.panels.RoleConfiguration import RoleConfiguration
+    role_types = [role for roles in RoleConfiguration.ROLE_TYPES.values() for role in roles]
+    texts = [ROLE_TEXT.format(role_type=role_types[i % len(role_types)], name=f"角色{i}", age=18 + i % 40)
+             for i in range(200)]
+    return measure("parse_free_text", lambda text: RoleConfiguration._parse_free_text(RoleConfiguration, text),
+                   texts * workload.runs)
+
+
+def bench_yaml_persistence(workload: Workload) -> StageResult:
+    """按面板的保存方式把完整配置写入YAML文件"""
+    roles = {f"role_{i}": {"role_type": "主角", "name": f"角色{i}", "gender": "男", "age": str(18 + i),
+                           "identity": "见习书记官", "appearance": "身形瘦削", "belongings": "旧账册",
+                           "goal": "查清真相", "motive": "证明自己", "tagline": "账目不会说谎"}
+             for i in range(30)}
+    config = {
+        "base_config": {"title": "基准测试作品", "creation_type": "网络小说"},
+        "role_config": {"current_role": "role_0", "roles": roles},
+        "worldview_config": {"template": workload.content}
+    }
+    path = workload.workdir / 'current_config.yaml'
+    size = len(yaml.dump(config, allow_unicode=True, sort_keys=False))
+
+    def save(_):
+        with open(path, "w", encoding='utf-8') as f:
+            yaml.dump(config, f, allow_unicode=True, sort_keys=False)
+
+    return measure("yaml_persistence", save, list(range(max(20, workload.runs * 8))), size=lambda _: size)
+
+
+def bench_project_section_write(workload: Workload) -> StageResult:
+    """经共享项目文档只写角色配置一节（其余节使用缓存的序列化文本）"""
+    from core.persistence.project_document import ProjectDocument, dump_yaml
+    roles = {f"role_{i}": {"role_type": "主角", "name": f"角色{i}", "gender": "男", "age": str(18 + i)}
+             for i in range(30)}
+    document = ProjectDocument(workload.workdir / 'novel_structure.yaml')
+    document.replace({
+        "base_config": {"title": "基准测试作品", "creation_type": "网络小说"},
+        "role_config": {"current_role": "role_0", "roles": roles},
+        "world_view": {"content": workload.content}
+    })
+    size = len(dump_yaml(document.data()))
+
+    def save(i):
+        roles["role_0"]["age"] = str(i)
+        document.update_section("role_config", {"current_role": "role_0", "roles": roles})
+
+    return measure("project_section_write", save, list(range(max(20, workload.runs * 8))), size=lambda _: size)
+
+
+def bench_project_store_save(workload: Workload) -> StageResult:
+    """项目库按行保存：300个角色中每次修改一个，只写入变化的行"""
+    from core.persistence.db_connector import ProjectStore
+    roles = {f"role_{i}": {"role_type": "主角", "name": f"角色{i}", "gender": "男", "age": str(18 + i)}
+             for i in range(300)}
+    store = ProjectStore(workload.workdir / 'novel_data.db')
+    store.save_document({
+        "base_config": {"title": "基准测试作品", "creation_type": "网络小说"},
+        "role_config": {"current_role": "role_0", "roles": roles},
+        "world_view": {"content": workload.content}
+    })
+
+    def save(i):
+        roles[f"role_{i % 300}"]["age"] = str(i)
+        store.save_document({"role_config": {"current_role": "role_0", "roles": roles}}, sections=["role_config"])
+
+    try:
+        return measure("project_store_save", save, list(range(max(20, workload.runs * 8))),
+                       size=lambda i: len(str(roles[f"role_{i % 300}"])))
+    finally:
+        store.close()
+
+
+def bench_search_query(workload: Workload) -> StageResult:
+    """全文检索：在StudyData的类型资料中按二元组查询，含单字前缀与近似查找"""
+    from core.persistence.search_index import SearchIndex
+    index = SearchIndex(workload.workdir / 'search.db', store=None, study_dir=ROOT / 'data/StudyData')
+    index.sync()
+    queries = ["修真", "龙", "赛博朋克", "灵气 复苏", "命运骰", "都市生活", "CRPG", "战後重建"]
+
+    def search(query):
+        index.search(query, fuzzy=query == "战後重建")
+
+    try:
+        return measure("search_query", search, queries * max(5, workload.runs * 2))
+    finally:
+        index.close()
+
+
+def bench_tk_text_insert(workload: Workload) -> StageResult:
+    """Text控件插入增量并滚动到末尾（与_update_template_editor相同），需要图形环境"""
+    try:
+        import tkinter as tk
+        root = tk.Tk()
+    except Exception as e:
+        return StageResult.skip("tk_text_insert", f"无法创建Tk窗口: {str(e).splitlines()[0]}")
+    try:
+        root.withdraw()
+        editor = tk.Text(root, wrap="word")
+        editor.pack()
+        chunks = workload.text_chunks()
+
+        def insert(chunk):
+            editor.insert("end", chunk)
+            editor.see("end")
+
+        result = StageResult("tk_text_insert", [], 0, 0.0)
+        for _ in range(workload.runs):
+            editor.delete("1.0", "end")
+            run = measure("tk_text_insert", insert, chunks, warmup=0)
+            started = time.perf_counter()
+            root.update_idletasks()
+            result.samples.extend(run.samples)
+            result.chars += run.chars
+            result.elapsed += run.elapsed + time.perf_counter() - started
+        return result
+    finally:
+        root.destroy()
+
+
+STAGES: Dict[str, Callable[[Workload], StageResult]] = {
+    "stream_generate": bench_stream_generate,
+    "callback_dispatch": bench_callback_dispatch,
+    "filter_special_symbols": bench_filter_special_symbols,
+    "parse_template_content": bench_parse_template_content,
+    "parse_free_text": bench_parse_free_text,
+    "yaml_persistence": bench_yaml_persistence,
+    "project_section_write": bench_project_section_write,
+    "project_store_save": bench_project_store_save,
+    "search_query": bench_search_query,
+    "tk_text_insert": bench_tk_text_insert,
+}
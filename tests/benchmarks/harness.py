@@ -0,0 +1,154 @@
+from pathlib import Path
+from typing import Any, Callable, Dict, List, Optional
+import json
+import math
+import platform
+import time
+
+BASELINE_FILE = Path(__file__).parent / 'baseline.json'
+
+
+def percentile(samples: List[float], q: float) -> float:
+    """线性插值的分位数，q取0-100"""
+    if not samples:
+        return 0.0
+    ordered = sorted(samples)
+    rank = (len(ordered) - 1) * q / 100
+    low, high = math.floor(rank), math.ceil(rank)
+    return ordered[low] + (ordered[high] - ordered[low]) * (rank - low)
+
+
+class StageResult:
+    """单个阶段的测量结果
+
+    samples为每次操作的耗时（秒），chars为处理的字符总数，
+    elapsed为整个阶段的墙钟时间（用于计算吞吐，包含操作之间的开销）。
+    """
+
+    def __init__(self, name: str, samples: List[float], chars: int = 0, elapsed: Optional[float] = None,
+                 skipped: Optional[str] = None):
+        self.name = name
+        self.samples = samples
+        self.chars = chars
+        self.elapsed = elapsed if elapsed is not None else sum(samples)
+        self.skipped = skipped  # 跳过原因（例如没有图形环境）
+
+    @classmethod
+    def skip(cls, name: str, reason: str) -> "StageResult":
+        return cls(name, [], skipped=reason)
+
+    def summary(self) -> Dict[str, Any]:
+        if self.skipped:
+            return {"skipped": self.skipped}
+        elapsed = self.elapsed or 1e-9
+        return {
+            "ops": len(self.samples),
+            "ops_per_sec": round(len(self.samples) / elapsed, 1),
+            "chars_per_sec": round(self.chars / elapsed, 1) if self.chars else None,
+            "p50_ms": round(percentile(self.samples, 50) * 1000, 4),
+            "p95_ms": round(percentile(self.samples, 95) * 1000, 4),
+            "p99_ms": round(percentile(self.samples, 99) * 1000, 4)
+        }
+
+
+def measure(name: str, operation: Callable[[Any], Any], items: List[Any],
+            size: Callable[[Any], int] = lambda item: len(item) if isinstance(item, str) else 0,
+            warmup: int = 3) -> StageResult:
+    """对每个输入调用一次operation并计时"""
+    for item in items[:warmup]:
+        operation(item)
+    samples = []
+    chars = 0
+    started = time.perf_counter()
+    for item in items:
+        t0 = time.perf_counter()
+        operation(item)
+        samples.append(time.perf_counter() - t0)
+        chars += size(item)
+    return StageResult(name, samples, chars, time.perf_counter() - started)
+
+
+def machine_info() -> Dict[str, str]:
+    return {
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "machine": platform.machine()
+    }
+
+
+def load_baseline(path: Path = BASELINE_FILE) -> Dict[str, Any]:
+    if not path.exists():
+        return {}
+    with open(path, 'r', encoding='utf-8') as f:
+        return json.load(f)
+
+
+def save_baseline(results: Dict[str, Dict[str, Any]], path: Path = BASELINE_FILE):
+    data = {
+        "machine": machine_info(),
+        "updated": time.strftime('%Y-%m-%d %H:%M:%S'),
+        "stages": {name: summary for name, summary in results.items() if "skipped" not in summary}
+    }
+    with open(path, 'w', encoding='utf-8') as f:
+        json.dump(data, f, ensure_ascii=False, indent=2)
+        f.write("\n")
+
+
+def speed_factor(results: Dict[str, Dict[str, Any]], baseline: Dict[str, Any], min_stages: int = 3) -> float:
+    """本机相对基线机器的整体快慢：各阶段p95与基线之比的中位数（大于1表示本机更慢）
+
+    基线中是某一台机器上的绝对耗时，换一台机器或负载不同时所有阶段会一起变快或变慢，
+    比较前先除去这一共同因素。可比较的阶段少于min_stages个时无法区分，返回1。
+    """
+    stages = baseline.get("stages", {})
+    ratios = [summary["p95_ms"] / stages[name]["p95_ms"] for name, summary in results.items()
+              if "skipped" not in summary and stages.get(name, {}).get("p95_ms")]
+    if len(ratios) < min_stages:
+        return 1.0
+    return percentile(ratios, 50)
+
+
+def compare(results: Dict[str, Dict[str, Any]], baseline: Dict[str, Any], tolerance: float = 1.0,
+            min_delta_ms: float = 0.05) -> List[str]:
+    """与基线比较，返回回归说明列表（为空表示通过）
+
+    按speed_factor换算到本机后，p95延迟超过基线的(1 + tolerance)倍、
+    或吞吐低于基线的1 / (1 + tolerance)时判定为回归，即只报告相对其他阶段明显变慢的阶段；
+    延迟差值小于min_delta_ms毫秒时视为计时噪声忽略。
+    """
+    regressions = []
+    stages = baseline.get("stages", {})
+    factor = speed_factor(results, baseline)
+    for name, summary in results.items():
+        base = stages.get(name)
+        if not base or "skipped" in summary:
+            continue
+        p95, base_p95 = summary["p95_ms"], base.get("p95_ms")
+        if base_p95 is not None:
+            expected = base_p95 * factor
+            if p95 > expected * (1 + tolerance) and p95 - expected > min_delta_ms:
+                regressions.append(f"{name}: p95 {p95:.4f}ms > 基线 {base_p95:.4f}ms × {factor:.2f}")
+        for key in ("ops_per_sec", "chars_per_sec"):
+            value, base_value = summary.get(key), base.get(key)
+            if value is not None and base_value and value < base_value / factor / (1 + tolerance):
+                regressions.append(f"{name}: {key} {value} < 基线 {base_value} / {factor:.2f}")
+    return regressions
+
+
+def format_table(results: Dict[str, Dict[str, Any]], baseline: Optional[Dict[str, Any]] = None) -> str:
+    stages = (baseline or {}).get("stages", {})
+    header = f"{'stage':<24}{'ops':>7}{'ops/s':>12}{'chars/s':>14}{'p50 ms':>11}{'p95 ms':>11}{'p99 ms':>11}{'base p95':>11}"
+    lines = [header, "-" * len(header)]
+    for name, summary in results.items():
+        if "skipped" in summary:
+            lines.append(f"{name:<24}skipped: {summary['skipped']}")
+            continue
+        base = stages.get(name, {}).get("p95_ms")
+        chars = summary["chars_per_sec"]
+        lines.append(
+            f"{name:<24}{summary['ops']:>7}{summary['ops_per_sec']:>12}"
+            f"{(chars if chars is not None else '-'):>14}"
+            f"{summary['p50_ms']:>11.4f}{summary['p95_ms']:>11.4f}{summary['p99_ms']:>11.4f}"
+            f"{(base if base is not None else '-'):>11}"
+        )
+    return "\n".join(lines)
@@ -0,0 +1,99 @@
+"""行为测试共用的夹具：本地模拟服务器与使用独立组件的API客户端"""
+from pathlib import Path
+from types import SimpleNamespace
+from typing import Optional
+import sys
+
+import pytest
+
+ROOT = Path(__file__).resolve().parent.parent
+if str(ROOT) not in sys.path:
+    sys.path.insert(0, str(ROOT))
+
+from core.api_client.async_client import AsyncDeepSeekAPIClient
+from core.api_client.deepseek import DeepSeekAPIClient
+from core.api_client.pool import ClientPool
+from core.api_client.rate_limit import RateLimiter
+from core.api_client.response_cache import ResponseCache
+from core.api_client.retry import RetryEngine
+from core.api_client.telemetry import Telemetry
+from core.persistence.journal import GenerationJournal
+from modules.GlobalModule import global_config
+from proxyserver.mock_server import MockConfig, MockServer
+
+TEST_MODEL = "Test-Mock-Chat"
+FAILING_MODEL = "Test-Mock-Failing"  # 模拟服务器对该模型总是返回500
+TEST_PROVIDER = "TestMock"
+
+RETRY_POLICY = {"max_attempts": 3, "backoff_factor": 0, "max_backoff": 0,
+                "breaker_threshold": 3, "breaker_cooldown": 60}
+
+
+class _IsolatedClient:
+    """使用独立连接池、重试引擎、响应缓存、日志与指标的客户端，密钥固定"""
+
+    def __init__(self, workdir: Path):
+        super().__init__()
+        self.pool = ClientPool()
+        self.retry = RetryEngine(SimpleNamespace(retry_policy=dict(RETRY_POLICY)))
+        self.cache = ResponseCache(db_path=str(workdir / 'cache.db'))
+        self.limiter = RateLimiter(SimpleNamespace(enable_rate_limiting=False, rate_limit_per_minute=0))
+        self.journal = GenerationJournal(workdir / 'journal')
+        self.telemetry = Telemetry(workdir / 'metrics.prom', export_interval=0)
+
+    def _get_api_key(self, provider: Optional[str] = None) -> str:
+        return "sk-test"
+
+    def _has_api_key(self, provider: str) -> bool:
+        return True
+
+
+class _TestClient(_IsolatedClient, DeepSeekAPIClient):
+    pass
+
+
+class _AsyncTestClient(_IsolatedClient, AsyncDeepSeekAPIClient):
+    pass
+
+
+def _register_models(base_url: str):
+    for name, model in ((TEST_MODEL, "mock-chat"), (FAILING_MODEL, "mock-failing")):
+        global_config.model_mapping[name] = {
+            'provider': TEST_PROVIDER, 'base_url': base_url,
+            'model': model, 'context_window': 65536
+        }
+
+
+def _unregister_models():
+    for name in (TEST_MODEL, FAILING_MODEL):
+        global_config.model_mapping.pop(name, None)
+
+
+@pytest.fixture
+def mock_server():
+    """不等待、不抖动的模拟服务器，输出固定的填充文本"""
+    server = MockServer(MockConfig(ttft=0, reasoning_ttft=0, jitter=0, tps=1e6, content_chars=40,
+                                   models={"mock-failing": {"error_rate": 1.0}}),
+                        port=0).start()
+    yield server
+    server.stop()
+
+
+@pytest.fixture
+def client(tmp_path, mock_server):
+    """指向模拟服务器的客户端，测试模型登记在model_mapping中，结束时移除"""
+    _register_models(mock_server.base_url)
+    api_client = _TestClient(tmp_path)
+    yield api_client
+    api_client.pool.close_all()
+    _unregister_models()
+
+
+@pytest.fixture
+def async_client(tmp_path, mock_server):
+    """指向模拟服务器的异步客户端，在测试自己的事件循环（asyncio.run）中使用"""
+    _register_models(mock_server.base_url)
+    api_client = _AsyncTestClient(tmp_path)
+    yield api_client
+    api_client.pool.close_all()
+    _unregister_models()
@@ -0,0 +1,63 @@
+"""异步客户端：并发流、模型切换监听只注册一次、磁盘缓存与打包不在事件循环线程中执行"""
+import asyncio
+import threading
+
+from core.api_client.deepseek import DeepSeekAPIClient, api_client
+from core.api_client.response_cache import CACHE_DETERMINISTIC
+from modules.GlobalModule import global_config
+from tests.conftest import TEST_MODEL
+
+MESSAGES = [{"role": "user", "content": "用一句话介绍边境城邦。"}]
+
+
+def _model_listeners():
+    return [callback for callback in global_config._model_listeners
+            if getattr(callback, '__func__', None) is DeepSeekAPIClient._on_model_changed]
+
+
+def test_model_listener_registered_once(client, async_client):
+    listeners = _model_listeners()
+    assert len(listeners) == 1
+    assert listeners[0].__self__ is api_client
+
+
+async def _collect(client, **kwargs):
+    return "".join([chunk async for chunk in client.stream_generate(MESSAGES, model_name=TEST_MODEL, **kwargs)])
+
+
+def test_concurrent_streams(async_client, mock_server):
+    async def run():
+        return await asyncio.gather(*(_collect(async_client) for _ in range(3)))
+
+    results = asyncio.run(run())
+    assert all(results) and len(set(results)) == 1
+    assert mock_server.stats()["requests"] == 3
+
+
+def test_cache_and_packing_run_off_the_loop(async_client, mock_server):
+    loop_threads, worker_threads = set(), set()
+    get, build = async_client.cache.get, async_client._build_params
+
+    def record(func):
+        def wrapper(*args, **kwargs):
+            worker_threads.add(threading.get_ident())
+            return func(*args, **kwargs)
+        return wrapper
+
+    async_client.cache.get = record(get)
+    async_client._build_params = record(build)
+    settings = global_config.generation_settings(temperature=0.1, max_tokens=256)
+
+    async def run():
+        loop_threads.add(threading.get_ident())
+        first = await _collect(async_client, cache_policy=CACHE_DETERMINISTIC, settings=settings)
+        second = await _collect(async_client, cache_policy=CACHE_DETERMINISTIC, settings=settings)
+        third = await async_client.generate(MESSAGES, CACHE_DETERMINISTIC, model_name=TEST_MODEL, settings=settings)
+        return first, second, third
+
+    first, second, third = asyncio.run(run())
+    assert first and first == second == third
+    assert worker_threads and not worker_threads & loop_threads
+    # 之后的流式与非流式请求都命中第一次写入的缓存
+    assert mock_server.stats()["requests"] == 1
+    assert async_client.cache.stats()["hits"] == 2
@@ -0,0 +1,115 @@
+"""自动保存：连续修改合并为少量保存，flush立即写回YAML，启动时恢复未写回的修改"""
+import time
+
+import pytest
+
+from core.persistence.autosave import AutosaveService
+from core.persistence.db_connector import ProjectStore
+from core.persistence.project_document import ProjectDocument, load_yaml
+
+DOCUMENT = {
+    "base_config": {"title": "边境账册"},
+    "role_config": {"current_role": "r1", "roles": {"r1": {"name": "书记官"}}},
+    "worldview": {1: "第一章设定"}
+}
+
+
+def _read(path):
+    with open(path, 'r', encoding='utf-8') as f:
+        return load_yaml(f)
+
+
+def _wait(predicate, timeout: float = 3.0) -> bool:
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if predicate():
+            return True
+        time.sleep(0.01)
+    return predicate()
+
+
+@pytest.fixture
+def project(tmp_path):
+    document = ProjectDocument(tmp_path / 'novel_structure.yaml')
+    document.replace(DOCUMENT)
+    store = ProjectStore(tmp_path / 'novel_data.db')
+    yield document, store
+    store.close()
+
+
+def test_marks_coalesce_into_few_saves(project):
+    document, store = project
+    service = AutosaveService(document, store, delay=0.2, max_delay=2.0, export_interval=60, fsync=False)
+    service.start()
+    for i in range(20):
+        service.mark_dirty("role_config", {"current_role": "r1", "roles": {"r1": {"name": f"书记官{i}"}}})
+    # 修改立即可见
+    assert document.section("role_config")["roles"]["r1"]["name"] == "书记官19"
+
+    assert _wait(lambda: service.stats()["saves"] >= 1)
+    stats = service.stats()
+    assert stats["marks"] == 20
+    assert stats["saves"] <= 2
+    assert stats["coalesced"] >= 18
+    assert store.load_document()["role_config"]["roles"]["r1"]["name"] == "书记官19"
+    # YAML按export_interval写回，尚未到期
+    assert service.pending() == ["role_config"]
+
+
+def test_max_delay_bounds_continuous_edits(project):
+    document, store = project
+    service = AutosaveService(document, store, delay=0.2, max_delay=0.3, export_interval=60, fsync=False)
+    deadline = time.monotonic() + 0.6
+    i = 0
+    while time.monotonic() < deadline:
+        service.mark_dirty("base_config", {"title": f"边境账册{i}"})
+        i += 1
+        time.sleep(0.02)
+    # 持续修改期间最迟max_delay秒保存一次
+    assert service.stats()["saves"] >= 1
+
+
+def test_flush_writes_yaml(project):
+    document, store = project
+    path = document.path
+    service = AutosaveService(document, store, delay=60, max_delay=60, export_interval=60, fsync=False)
+    service.mark_dirty("base_config", {"title": "新标题"})
+    assert _read(path)["base_config"]["title"] == "边境账册"
+
+    assert service.flush()
+    assert _read(path)["base_config"]["title"] == "新标题"
+    assert store.load_document()["base_config"] == {"title": "新标题"}
+    assert service.pending() == []
+    assert service.stats()["exports"] == 1
+
+
+def test_without_store_every_save_exports(tmp_path):
+    document = ProjectDocument(tmp_path / 'novel_structure.yaml')
+    document.replace(DOCUMENT)
+    service = AutosaveService(document, None, delay=0.05, max_delay=0.5, fsync=False)
+    service.mark_dirty("base_config", {"title": "无项目库"})
+    assert _wait(lambda: service.stats()["exports"] >= 1)
+    assert _read(document.path)["base_config"]["title"] == "无项目库"
+
+
+def test_start_recovers_unexported_changes(project, tmp_path):
+    """保存到项目库但未写回YAML就退出：下次启动时恢复，并保留YAML中的整数键"""
+    document, store = project
+    service = AutosaveService(document, store, delay=0.05, max_delay=0.5, export_interval=60, fsync=False)
+    service.start()
+    time.sleep(0.05)  # 使恢复的修改晚于YAML的修改时间
+    service.mark_dirty("worldview", {1: "第一章设定（修订）", 2: "第二章设定"})
+    assert _wait(lambda: service.stats()["saves"] >= 1)
+    assert _read(document.path)["worldview"] == {1: "第一章设定"}
+
+    # 模拟重启：新的文档与项目库实例
+    restarted = ProjectDocument(document.path)
+    restarted_store = ProjectStore(tmp_path / 'novel_data.db')
+    try:
+        recovered = AutosaveService(restarted, restarted_store, delay=60, export_interval=60, fsync=False)
+        recovered.start()
+        assert restarted.section("worldview") == {1: "第一章设定（修订）", 2: "第二章设定"}
+        assert recovered.flush()
+        assert _read(document.path)["worldview"] == {1: "第一章设定（修订）", 2: "第二章设定"}
+    finally:
+        restarted_store.close()
@@ -0,0 +1,41 @@
+"""基准测试与基线的比较：整体变慢按本机速度换算，只报告相对其他阶段明显变慢的阶段"""
+from tests.benchmarks.harness import compare, speed_factor
+
+BASELINE = {"stages": {
+    "a": {"p95_ms": 1.0, "ops_per_sec": 1000.0},
+    "b": {"p95_ms": 2.0, "ops_per_sec": 500.0},
+    "c": {"p95_ms": 4.0, "ops_per_sec": 250.0},
+    "d": {"p95_ms": 0.5, "ops_per_sec": 2000.0},
+}}
+
+
+def _results(scale: float, **overrides):
+    results = {name: {"p95_ms": base["p95_ms"] * scale, "ops_per_sec": base["ops_per_sec"] / scale}
+               for name, base in BASELINE["stages"].items()}
+    for name, p95 in overrides.items():
+        results[name] = {"p95_ms": p95, "ops_per_sec": 1000.0 / p95}
+    return results
+
+
+def test_uniformly_slower_machine_passes():
+    results = _results(1.6)
+    assert abs(speed_factor(results, BASELINE) - 1.6) < 1e-9
+    assert compare(results, BASELINE) == []
+
+
+def test_single_stage_regression_reported():
+    regressions = compare(_results(1.0, c=12.0), BASELINE)
+    assert len(regressions) == 2
+    assert all(line.startswith("c:") for line in regressions)
+
+
+def test_noise_within_tolerance_ignored():
+    # 单个磁盘阶段的p95比基线高60%，在默认容差内
+    assert compare(_results(1.0, d=0.8), BASELINE) == []
+
+
+def test_few_stages_not_normalized():
+    results = {"a": {"p95_ms": 3.0, "ops_per_sec": 333.0}}
+    assert speed_factor(results, BASELINE) == 1.0
+    assert compare(results, BASELINE)
+    assert compare({"a": {"skipped": "无图形环境"}}, BASELINE) == []
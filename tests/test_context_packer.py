@@ -0,0 +1,120 @@
+"""上下文打包：未超出时原样返回，超出时按优先级压缩并放进预算"""
+from core.api_client.context_packer import ContextPacker, OMITTED_TEXT, strip_packing_keys
+from core.api_client.tokenizer import token_counter
+
+MODEL = "Test-Mock-Chat"
+WINDOW = 4096
+MAX_OUTPUT = 1024
+
+SYSTEM = "你是一个专业的小说作家，请保持设定前后一致。"
+REQUEST = "请根据以上设定续写下一章，约两千字。"
+
+
+def _history(paragraphs: int) -> str:
+    return "\n".join(f"第{i}段：边境城邦的议会连夜召开，书记官把每一笔账目都抄进了旧账册。" for i in range(paragraphs))
+
+
+def _tokens(messages) -> int:
+    return token_counter.count_messages(messages, MODEL)
+
+
+def test_fitting_messages_unchanged():
+    packer = ContextPacker()
+    messages = [
+        {"role": "system", "content": SYSTEM, "priority": 100},
+        {"role": "user", "content": REQUEST, "compress": False}
+    ]
+    packed = packer.pack(messages, MODEL, WINDOW, MAX_OUTPUT)
+    assert packed == strip_packing_keys(messages)
+    assert all("priority" not in m and "compress" not in m for m in packed)
+    assert packer.stats()["packed"] == 0
+
+
+def test_oversized_history_compressed_into_budget():
+    packer = ContextPacker()
+    messages = [
+        {"role": "system", "content": SYSTEM},
+        {"role": "user", "content": _history(200)},
+        {"role": "assistant", "content": _history(200)},
+        {"role": "user", "content": REQUEST}
+    ]
+    budget = packer.budget(WINDOW, MAX_OUTPUT)
+    assert _tokens(messages) > budget
+
+    packed = packer.pack(messages, MODEL, WINDOW, MAX_OUTPUT)
+    assert _tokens(packed) <= budget
+    assert [m["role"] for m in packed] == [m["role"] for m in messages]
+    # 系统提示与本次请求保持不变
+    assert packed[0]["content"] == SYSTEM
+    assert packed[-1]["content"] == REQUEST
+    stats = packer.stats()
+    assert stats["packed"] == 1 and stats["overflow"] == 0
+    assert stats["saved_tokens"] > 0
+
+
+def test_lower_priority_compressed_first():
+    packer = ContextPacker()
+    important = _history(60)
+    messages = [
+        {"role": "system", "content": SYSTEM},
+        {"role": "user", "content": _history(300), "priority": 10},
+        {"role": "user", "content": important, "priority": 90},
+        {"role": "user", "content": REQUEST}
+    ]
+    packed = packer.pack(messages, MODEL, WINDOW, MAX_OUTPUT)
+    assert packed[2]["content"] == important
+    assert packed[1]["content"] != messages[1]["content"]
+
+
+def test_blocks_omitted_when_shrinking_is_not_enough():
+    packer = ContextPacker()
+    blocks = [{"text": _history(150), "priority": 20}, {"text": _history(5), "priority": 60}]
+    messages = [
+        {"role": "system", "content": SYSTEM},
+        {"role": "user", "content": "\n\n".join(b["text"] for b in blocks), "blocks": blocks},
+        {"role": "assistant", "content": _history(400), "priority": 10},
+        {"role": "user", "content": REQUEST}
+    ]
+    packed = packer.pack(messages, MODEL, 2048, 512)
+    assert _tokens(packed) <= packer.budget(2048, 512)
+    assert OMITTED_TEXT in packed[2]["content"]
+    assert all("blocks" not in m for m in packed)
+
+
+def test_pinned_truncated_last():
+    packer = ContextPacker()
+    long_request = REQUEST + _history(400)
+    messages = [
+        {"role": "system", "content": SYSTEM},
+        {"role": "user", "content": long_request}
+    ]
+    packed = packer.pack(messages, MODEL, WINDOW, MAX_OUTPUT)
+    assert _tokens(packed) <= packer.budget(WINDOW, MAX_OUTPUT)
+    assert packed[-1]["content"].startswith(REQUEST)
+    assert "中间省略" in packed[-1]["content"]
+
+
+def test_compression_cached_across_requests():
+    packer = ContextPacker()
+    messages = [
+        {"role": "system", "content": SYSTEM},
+        {"role": "user", "content": _history(300)},
+        {"role": "user", "content": REQUEST}
+    ]
+    first = packer.pack(messages, MODEL, WINDOW, MAX_OUTPUT)
+    second = packer.pack(messages, MODEL, WINDOW, MAX_OUTPUT)
+    assert first == second
+    assert packer.stats()["cache_hits"] >= 1
+
+
+def test_summarizer_used_when_it_fits():
+    packer = ContextPacker()
+    packer.summarizer = lambda text, target: "前情提要：书记官查账。"
+    messages = [
+        {"role": "system", "content": SYSTEM},
+        {"role": "user", "content": _history(300)},
+        {"role": "user", "content": REQUEST}
+    ]
+    packed = packer.pack(messages, MODEL, WINDOW, MAX_OUTPUT)
+    assert packed[1]["content"] == "前情提要：书记官查账。"
+    assert packer.stats()["summarized"] == 1
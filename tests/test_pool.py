@@ -0,0 +1,44 @@
+"""连接池：复用客户端，持有租约的客户端推迟关闭，关闭数量只计实际关闭的"""
+from core.api_client.pool import ClientPool
+
+BASE_URL = "http://127.0.0.1:9/v1"
+
+
+def test_reuses_client_per_provider():
+    pool = ClientPool()
+    try:
+        with pool.lease("A", BASE_URL, "sk-a") as first, pool.lease("A", BASE_URL + "/", "sk-a") as second:
+            assert first.client is second.client
+        with pool.lease("B", BASE_URL, "sk-a") as other:
+            assert other.client is not first.client
+        assert pool.stats()["created"] == 2
+    finally:
+        pool.close_all()
+
+
+def test_invalidate_counts_only_closed_clients():
+    pool = ClientPool()
+    pool.lease("A", BASE_URL, "sk-a").release()
+    lease = pool.lease("B", BASE_URL, "sk-b")
+
+    assert pool.invalidate() == 1
+    stats = pool.stats()
+    assert (stats["closed"], stats["deferred"], stats["active_clients"]) == (1, 1, 0)
+    assert not lease.http_client.is_closed
+
+    # 最后一个租约释放后才真正关闭，重复释放无影响
+    lease.release()
+    lease.release()
+    assert lease.http_client.is_closed
+    assert pool.stats()["closed"] == 2
+
+
+def test_close_idle_skips_leased_clients():
+    pool = ClientPool()
+    try:
+        pool.lease("A", BASE_URL, "sk-a").release()
+        with pool.lease("B", BASE_URL, "sk-b"):
+            assert pool.close_idle(max_idle=-1) == 1
+            assert [client["provider"] for client in pool.stats()["clients"]] == ["B"]
+    finally:
+        pool.close_all()
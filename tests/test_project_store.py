@@ -0,0 +1,136 @@
+"""项目库：文档保存与读取、行级增量写入、生成记录与旧文件导入、迁移"""
+import sqlite3
+
+import pytest
+
+from core.persistence.db_connector import MIGRATIONS, ProjectStore
+
+DOCUMENT = {
+    "base_config": {"title": "边境账册", "creation_type": "长篇", "main_type": "历史", "sub_type": "架空"},
+    "role_config": {
+        "current_role": "r1",
+        "roles": {
+            "r1": {"name": "书记官", "role_type": "主角"},
+            "r2": {"name": "议长", "role_type": "反派"}
+        }
+    },
+    "world_view": {"geography": "群山环绕的城邦", "politics": "议会共治"},
+    "outline": ["第一章", "第二章"]
+}
+
+
+@pytest.fixture
+def store(tmp_path):
+    project_store = ProjectStore(tmp_path / 'novel_data.db')
+    yield project_store
+    project_store.close()
+
+
+def test_round_trip(store, tmp_path):
+    assert store.load_document() is None
+    assert store.save_document(DOCUMENT)
+    assert store.load_document() == DOCUMENT
+
+    # 新实例从磁盘读取，结果一致且保持顺序
+    reopened = ProjectStore(tmp_path / 'novel_data.db')
+    try:
+        loaded = reopened.load_document()
+        assert loaded == DOCUMENT
+        assert list(loaded["role_config"]["roles"]) == ["r1", "r2"]
+    finally:
+        reopened.close()
+
+
+def test_only_changed_rows_written(store):
+    store.save_document(DOCUMENT)
+    written = store.stats()["rows_written"]
+
+    changed = {**DOCUMENT, "role_config": {
+        "current_role": "r1",
+        "roles": {**DOCUMENT["role_config"]["roles"], "r2": {"name": "老议长", "role_type": "反派"}}
+    }}
+    assert store.save_document(changed) == 1
+    stats = store.stats()
+    assert stats["rows_written"] == written + 1
+    assert stats["rows_unchanged"] >= 1
+    assert store.load_document()["role_config"]["roles"]["r2"]["name"] == "老议长"
+
+    assert store.save_document(changed) == 0
+
+
+def test_partial_save_and_delete(store):
+    store.save_document(DOCUMENT)
+    store.save_document({"world_view": {"geography": "沿海平原"}}, sections=["world_view"])
+    loaded = store.load_document()
+    assert loaded["world_view"] == {"geography": "沿海平原"}
+    assert loaded["base_config"] == DOCUMENT["base_config"]
+    assert store.stats()["tables"]["worldview_sections"] == 1
+
+    store.save_document({}, sections=["outline"])
+    assert "outline" not in store.load_document()
+
+
+def test_since_returns_recent_sections(store):
+    store.save_document(DOCUMENT)
+    updated_at = store.updated_at()
+    assert store.load_document(since=updated_at) == {}
+    store.save_document({"base_config": {"title": "新标题"}}, sections=["base_config"])
+    assert store.load_document(since=updated_at) == {"base_config": {"title": "新标题"}}
+
+
+def test_projects_are_separate(store):
+    store.save_document(DOCUMENT)
+    store.save_document({"base_config": {"title": "另一部"}}, "works/另一部")
+    assert store.load_document("works/另一部") == {"base_config": {"title": "另一部"}}
+    assert store.load_document()["base_config"]["title"] == "边境账册"
+
+
+def test_generations(store):
+    first = store.add_generation("role", "角色A", label="r1", model="mock-chat", settings={"temperature": 0.7})
+    store.add_generation("role", "角色B", label="r2", created_at=1.0)
+    assert store.add_generation("role", "角色A2", label="r1", replace=True) == first
+
+    records = store.generations(kind="role")
+    assert [r["content"] for r in records] == ["角色A2", "角色B"]
+    assert store.generations(kind="worldview") == []
+
+
+def test_outline_reimport_updates_record(store, tmp_path):
+    work = tmp_path / 'NovelData' / '边境账册'
+    work.mkdir(parents=True)
+    outline = work / '边境账册_世界观大纲.txt'
+    outline.write_text("初版大纲", encoding='utf-8')
+
+    assert store.import_legacy(tmp_path / 'missing.yaml', tmp_path / 'NovelData')["outlines"] == 1
+    # 未修改的文件跳过
+    assert store.import_legacy(tmp_path / 'missing.yaml', tmp_path / 'NovelData')["outlines"] == 0
+
+    outline.write_text("修订后的大纲", encoding='utf-8')
+    assert store.import_legacy(tmp_path / 'missing.yaml', tmp_path / 'NovelData')["outlines"] == 1
+    source = store._source_for(work)
+    records = store.generations(source, kind="worldview_outline")
+    assert [r["content"] for r in records] == ["修订后的大纲"]
+
+
+def test_migrates_to_latest_version(tmp_path):
+    path = tmp_path / 'novel_data.db'
+    conn = sqlite3.connect(str(path))
+    conn.executescript(MIGRATIONS[0])
+    conn.execute("PRAGMA user_version = 1")
+    conn.execute("INSERT INTO projects (source, created_at, updated_at) VALUES ('w', 0, 0)")
+    for content in ("旧", "新"):
+        conn.execute("INSERT INTO generations (project_id, kind, label, content, created_at) "
+                     "VALUES (1, 'worldview_outline', 'w_世界观大纲', ?, 0)", (content,))
+    conn.commit()
+    conn.close()
+
+    migrated = ProjectStore(path)
+    try:
+        assert [r["content"] for r in migrated.generations("w")] == ["新"]
+    finally:
+        migrated.close()
+    conn = sqlite3.connect(str(path))
+    try:
+        assert conn.execute("PRAGMA user_version").fetchone()[0] == len(MIGRATIONS)
+    finally:
+        conn.close()
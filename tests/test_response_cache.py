@@ -0,0 +1,106 @@
+"""响应缓存：命中与未命中、过期、按策略绕过，以及经客户端录制/回放的端到端命中"""
+import time
+
+from core.api_client.cassette import Cassette, RECORD, REPLAY
+from core.api_client.response_cache import (
+    ResponseCache, CACHE_ALWAYS, CACHE_DETERMINISTIC, CACHE_NEVER
+)
+from modules.GlobalModule import global_config
+from tests.conftest import TEST_MODEL
+
+MESSAGES = [{"role": "user", "content": "用一句话介绍边境城邦。"}]
+
+
+def _params(temperature: float = 0.0, content: str = "你好"):
+    return {"model": "mock-chat", "messages": [{"role": "user", "content": content}],
+            "temperature": temperature, "top_p": 1.0}
+
+
+def test_miss_then_hit(tmp_path):
+    cache = ResponseCache(db_path=str(tmp_path / 'cache.db'))
+    key = cache.make_key(_params())
+    assert cache.get(key) is None
+    cache.put(key, "回答", "mock-chat")
+    assert cache.get(key) == "回答"
+    stats = cache.stats()
+    assert (stats["misses"], stats["hits"], stats["memory_hits"], stats["stores"]) == (1, 1, 1, 1)
+
+
+def test_key_depends_on_request():
+    assert ResponseCache.make_key(_params()) == ResponseCache.make_key(_params())
+    assert ResponseCache.make_key(_params()) != ResponseCache.make_key(_params(content="再见"))
+    assert ResponseCache.make_key(_params()) != ResponseCache.make_key(_params(temperature=0.1))
+
+
+def test_disk_hit_after_restart(tmp_path):
+    path = str(tmp_path / 'cache.db')
+    key = ResponseCache.make_key(_params())
+    ResponseCache(db_path=path).put(key, "回答", "mock-chat")
+
+    cache = ResponseCache(db_path=path)
+    assert cache.get(key) == "回答"
+    assert cache.stats()["disk_hits"] == 1
+    assert cache.get(key) == "回答"
+    assert cache.stats()["memory_hits"] == 1
+
+
+def test_expired_entry_is_miss(tmp_path):
+    cache = ResponseCache(db_path=str(tmp_path / 'cache.db'), ttl=0.05)
+    key = cache.make_key(_params())
+    cache.put(key, "回答")
+    time.sleep(0.1)
+    assert cache.get(key) is None
+    assert cache.stats()["expired"] >= 1
+
+
+def test_empty_response_not_stored(tmp_path):
+    cache = ResponseCache(db_path=str(tmp_path / 'cache.db'))
+    cache.put(cache.make_key(_params()), "")
+    assert cache.stats()["stores"] == 0
+
+
+def test_policies(tmp_path):
+    cache = ResponseCache(db_path=str(tmp_path / 'cache.db'))
+    assert not cache.should_cache(_params(0.0), CACHE_NEVER)
+    assert cache.should_cache(_params(0.1), CACHE_DETERMINISTIC)
+    assert not cache.should_cache(_params(0.9), CACHE_DETERMINISTIC)
+    assert cache.should_cache(_params(0.9), CACHE_ALWAYS)
+    assert cache.stats()["bypassed"] == 1
+
+
+def test_client_hit_skips_request(client, mock_server, tmp_path):
+    """录制一次真实请求后停止服务器：重复的确定性请求由缓存返回，不消耗回放记录"""
+    settings = global_config.generation_settings(temperature=0.1, max_tokens=256)
+    path = tmp_path / 'session.jsonl'
+
+    client.pool.use_cassette(Cassette(path, RECORD))
+    try:
+        recorded = client.generate(MESSAGES, model_name=TEST_MODEL, settings=settings)
+    finally:
+        client.pool.use_cassette(None)
+    assert recorded and not recorded.startswith(("生成失败", "API请求失败"))
+    assert mock_server.stats()["requests"] == 1
+    mock_server.stop()
+
+    # 换一个空缓存，第一次从回放取得响应，第二次命中缓存
+    client.cache = ResponseCache(db_path=str(tmp_path / 'replay-cache.db'))
+    cassette = Cassette(path, REPLAY, speed=0)
+    client.pool.use_cassette(cassette)
+    try:
+        first = client.generate(MESSAGES, CACHE_DETERMINISTIC, model_name=TEST_MODEL, settings=settings)
+        second = client.generate(MESSAGES, CACHE_DETERMINISTIC, model_name=TEST_MODEL, settings=settings)
+    finally:
+        client.pool.use_cassette(None)
+    assert first == second == recorded
+    assert cassette.stats()["played"] == 1
+    stats = client.cache.stats()
+    assert (stats["misses"], stats["hits"], stats["stores"]) == (1, 1, 1)
+
+
+def test_client_bypasses_cache_for_sampled_requests(client, mock_server):
+    settings = global_config.generation_settings(temperature=0.9, max_tokens=256)
+    for _ in range(2):
+        client.generate(MESSAGES, CACHE_DETERMINISTIC, model_name=TEST_MODEL, settings=settings)
+    assert mock_server.stats()["requests"] == 2
+    stats = client.cache.stats()
+    assert stats["hits"] == 0 and stats["bypassed"] == 2
@@ -0,0 +1,145 @@
+"""重试与熔断：熔断器状态转换，以及客户端对模拟服务器500错误的重试与短路"""
+from types import SimpleNamespace
+
+import httpx
+import openai
+import pytest
+
+from core.api_client.retry import (
+    CircuitBreaker, CircuitOpenError, RetryEngine, CLOSED, OPEN, HALF_OPEN,
+    SERVER, CLIENT, CONNECTION, classify_error
+)
+from tests.conftest import FAILING_MODEL, TEST_MODEL, TEST_PROVIDER
+
+
+def _status_error(status: int) -> openai.APIStatusError:
+    request = httpx.Request("POST", "http://mock/v1/chat/completions")
+    response = httpx.Response(status, request=request)
+    return openai.APIStatusError("mock", response=response, body=None)
+
+
+def _engine(**policy) -> RetryEngine:
+    values = {"max_attempts": 3, "backoff_factor": 0, "max_backoff": 0,
+              "breaker_threshold": 2, "breaker_cooldown": 60}
+    values.update(policy)
+    return RetryEngine(SimpleNamespace(retry_policy=values))
+
+
+def _target(model: str = "m"):
+    return SimpleNamespace(provider="p", model=model, name=model)
+
+
+def test_classify_error():
+    assert classify_error(_status_error(500)) == SERVER
+    assert classify_error(_status_error(400)) == CLIENT
+    assert classify_error(httpx.ConnectError("refused")) == CONNECTION
+
+
+def test_breaker_opens_after_threshold():
+    breaker = CircuitBreaker(("p", "m"), threshold=2, cooldown=60)
+    breaker.record_failure(RuntimeError("1"))
+    assert breaker.state == CLOSED and breaker.allow()
+    breaker.record_failure(RuntimeError("2"))
+    assert breaker.state == OPEN
+    assert not breaker.allow()
+    assert breaker.stats()["rejected"] == 1
+    assert breaker.retry_in() > 0
+
+
+def test_breaker_half_open_admits_one_probe():
+    breaker = CircuitBreaker(("p", "m"), threshold=1, cooldown=0.05)
+    breaker.record_failure(RuntimeError("down"))
+    breaker.opened_at -= 1  # 冷却期已过
+    assert breaker.allow()
+    assert breaker.state == HALF_OPEN
+    assert not breaker.allow()  # 探测结果返回前不放行第二个请求
+
+    breaker.record_success()
+    assert breaker.state == CLOSED
+    assert breaker.allow()
+
+
+def test_breaker_failed_probe_reopens():
+    breaker = CircuitBreaker(("p", "m"), threshold=3, cooldown=60)
+    for _ in range(3):
+        breaker.record_failure(RuntimeError("down"))
+    breaker.opened_at -= 120
+    assert breaker.allow() and breaker.state == HALF_OPEN
+    breaker.record_failure(RuntimeError("still down"))
+    assert breaker.state == OPEN
+    assert not breaker.allow()
+
+
+def test_released_probe_allows_next():
+    """探测请求以不计入熔断的结果结束时释放名额"""
+    breaker = CircuitBreaker(("p", "m"), threshold=1, cooldown=60)
+    breaker.record_failure(RuntimeError("down"))
+    breaker.opened_at -= 120
+    assert breaker.allow()
+    breaker.release()
+    assert breaker.allow()
+
+
+def test_retry_state_stops_on_client_error():
+    state = _engine().begin([_target()])
+    state.next()
+    assert not state.failed(_status_error(400))
+    assert state.attempt == 1
+    # 参数错误不计入熔断
+    assert state.engine.breaker(("p", "m")).failures == 0
+
+
+def test_retry_state_gives_up_after_max_attempts():
+    engine = _engine(breaker_threshold=10)
+    state = engine.begin([_target()])
+    results = []
+    for _ in range(3):
+        _, delay = state.next()
+        assert delay == 0
+        results.append(state.failed(_status_error(503)))
+    assert results == [True, True, False]
+    assert engine.stats()["retries"] == 2
+
+
+def test_retry_state_fails_over_and_short_circuits():
+    engine = _engine(breaker_threshold=1)
+    state = engine.begin([_target("a"), _target("b")])
+    first, _ = state.next()
+    assert state.failed(_status_error(500))
+    second, delay = state.next()
+    assert (first.model, second.model, delay) == ("a", "b", 0.0)
+    assert state.failed(_status_error(500))
+    with pytest.raises(CircuitOpenError):
+        state.next()
+    assert engine.stats()["short_circuited"] == 1
+
+
+def test_generate_retries_then_opens_breaker(client, mock_server):
+    result = client.generate([{"role": "user", "content": "你好"}], model_name=FAILING_MODEL)
+    assert result.startswith("生成失败")
+    assert mock_server.stats()["requests"] == 3
+    assert mock_server.stats()["errors"] == 3
+
+    breaker = client.retry.stats()["breakers"][f"{TEST_PROVIDER}/mock-failing"]
+    assert breaker["state"] == OPEN
+    assert breaker["total_failures"] == 3
+
+    # 熔断期间直接失败，不再访问服务器
+    result = client.generate([{"role": "user", "content": "你好"}], model_name=FAILING_MODEL)
+    assert "生成失败" in result
+    assert mock_server.stats()["requests"] == 3
+    assert client.retry.stats()["short_circuited"] == 1
+
+
+def test_breakers_are_per_model(client, mock_server):
+    client.generate([{"role": "user", "content": "你好"}], model_name=FAILING_MODEL)
+    result = client.generate([{"role": "user", "content": "你好"}], model_name=TEST_MODEL)
+    assert not result.startswith("生成失败")
+    assert client.retry.stats()["breakers"][f"{TEST_PROVIDER}/mock-chat"]["state"] == CLOSED
+
+
+def test_reset_closes_breaker(client, mock_server):
+    client.generate([{"role": "user", "content": "你好"}], model_name=FAILING_MODEL)
+    client.retry.reset((TEST_PROVIDER, "mock-failing"))
+    client.generate([{"role": "user", "content": "你好"}], model_name=FAILING_MODEL)
+    assert mock_server.stats()["requests"] == 6
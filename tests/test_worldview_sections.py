@@ -0,0 +1,68 @@
+"""世界观单部分重新生成：解析出的章节位置与按位置替换，其余部分逐字节不变"""
+import pytest
+
+from core.narrative_engine.worldview_sections import splice_section
+from ui.panels.WorldView import WorldViewPanel
+
+TEMPLATE = """# 世界观模板：边境账册
+
+一、总览设定
+- 一座靠账目维系和平的边境城邦，历史由记账的人书写
+
+二、时空背景
+- 时间线类型：线性
+- 社会形态随历史演进
+### 特殊时间现象
+- 每逢闰月，旧账册上的字迹会短暂消失
+
+三、社会结构
+1. 权力与阶级
+   - 议会与书记官公会共治，组织严密
+2. 经济与资源
+   - 硬通货为盐引
+
+四、超自然/科技体系
+- 力量来源于被记录的契约，违约者付出代价
+
+五、关键组织与势力
+- 书记官公会：掌握全部账册，与主角亦敌亦友
+
+六、生态与生物
+- 沼泽中的“食纸虫”威胁档案馆
+
+七、历史大事件
+- 焚账之变：百年前议会焚毁旧账，社会秩序重建"""
+
+
+def _parse(content):
+    return WorldViewPanel._parse_template_content(None, content)
+
+
+def test_body_keywords_do_not_start_sections():
+    data = _parse(TEMPLATE)
+    assert list(data["sections"]) == ["other", "overview", "time_space", "society", "power_system",
+                                      "organizations", "ecology", "history"]
+    time_space = data["sections"]["time_space"]
+    assert "- 社会形态随历史演进" in time_space
+    assert "### 特殊时间现象" in time_space
+    for key, (start, end) in data["spans"].items():
+        assert TEMPLATE[start:end] == data["sections"][key]
+
+
+@pytest.mark.parametrize("key", ["overview", "time_space", "society", "history"])
+def test_splice_keeps_other_sections_identical(key):
+    data = _parse(TEMPLATE)
+    new_text = f"{data['sections'][key].splitlines()[0]}\n- 重新生成的内容"
+    spliced = splice_section(data, key, new_text)
+
+    for name, text in data["sections"].items():
+        start, end = spliced["spans"][name]
+        if name == key:
+            assert spliced["full_content"][start:end] == new_text
+        else:
+            assert spliced["full_content"][start:end] == text
+    # 被替换部分的旧正文不会残留，重新解析得到相同的各部分
+    assert data["sections"][key].strip().splitlines()[-1] not in spliced["full_content"]
+    reparsed = _parse(spliced["full_content"])
+    assert {name: text.strip() for name, text in reparsed["sections"].items()} == \
+        {name: text.strip() for name, text in spliced["sections"].items()}
@@ -1,6 +1,10 @@
 import tkinter as tk
 from tkinter import ttk
 from modules.GlobalModule import global_config as global_api_config
+from core.api_client.warmup import warmup_service
+from core.persistence.project_document import project_document, load_yaml
+from core.persistence.autosave import autosave_service
+from core.persistence.search_index import search_index
 from utils.config_loader import get_version_info
 from tkinter import Toplevel, Label
 from tkinter import messagebox
@@ -13,7 +17,6 @@ from ui.panels.RoleConfiguration import RoleConfiguration
 import json
 from pathlib import Path
 from tkinter import filedialog
-import yaml
 
 # 将Tooltip类定义移到文件顶部
 class Tooltip:
@@ -55,6 +58,13 @@ def create_main_window():
     global root  # 添加全局引用
     if not root:
         root = tk.Tk()
+        # 在各面板读取项目之前同步项目库（导入旧数据、恢复上次未写回YAML的修改）
+        try:
+            autosave_service.start()
+        except Exception as e:
+            print(f"项目库同步失败: {str(e)}")
+        # 后台建立并核对全文索引，之后随项目库的每次保存增量更新
+        search_index.start()
         version = get_version_info()
         root.title(f"AIWriter {version}")
         
@@ -113,6 +123,7 @@ def create_main_window():
             status_label,
             lambda: (
                 f"● 服务状态: {'已连接' if global_api_config.connection_monitor.status else '已断开'}\n"
+                f"连接预热: {warmup_service.describe()}\n"
                 f"━━━━━━━━━━━━━━━━\n"
                 f"服务商: {global_api_config.model_config.provider}\n"
                 f"AI模型: {global_api_config.model_config.model}\n"
@@ -232,7 +243,8 @@ def create_main_window():
             print(f"联动功能暂不可用: {str(e)}")
             print("请确保已更新 BaseConfiguration 类")
 
-        # 启动连接监控
+        # 后台预热当前提供商的连接（切换模型时自动重新预热），再启动连接监控
+        warmup_service.start()
         global_api_config.connection_monitor.start_monitoring()
         
         # 添加状态更新循环
@@ -300,14 +312,12 @@ def force_check_status(label):
 def export_novel_structure(parent):
     """导出小说框架数据"""
     try:
-        # 读取当前配置
-        config_file = Path("data/configs/novel_structure.yaml")
-        if not config_file.exists():
+        # 读取当前配置（使用会话内已解析的文档）
+        if not project_document.exists():
             messagebox.showwarning("提示", "没有可导出的配置")
             return
             
-        with open(config_file, "r", encoding='utf-8') as f:
-            data = yaml.safe_load(f)
+        data = project_document.data()
         
         # 获取作品名称
         base_config = data.get("base_config", {})
@@ -372,23 +382,19 @@ def import_novel_structure(parent):
         if not file_path:
             return
             
-        target_file = Path("data/configs/novel_structure.yaml")
-        target_file.parent.mkdir(exist_ok=True)
-        
         # 读取文件内容
         with open(file_path, "r", encoding='utf-8') as f:
             if file_path.endswith(".json"):
                 data = json.load(f)
             else:  # 支持yaml格式
-                data = yaml.safe_load(f)
+                data = load_yaml(f)
         
-        # 写入配置文件时添加sort_keys=False
-        with open(target_file, "w", encoding='utf-8') as f:
-            yaml.dump(data, f, allow_unicode=True, sort_keys=False)
+        # 先写入尚未保存的修改，再替换共享文档，写回novel_structure.yaml并同步到项目库
+        autosave_service.replace_document(data)
         
         messagebox.showinfo("导入成功", 
             "配置已导入，部分功能可能需要重启后生效\n"
-            f"文件路径：{target_file}")
+            f"文件路径：{project_document.path}")
             
     except Exception as e:
         messagebox.showerror("导入失败", f"错误信息：{str(e)}")
@@ -1,11 +1,13 @@
 import tkinter as tk
 from tkinter import ttk
 from tkinter import scrolledtext
-import yaml
 import json
 from pathlib import Path
 from tkinter import messagebox
 from ui.panels.RoleConfiguration import RoleConfiguration
+from core.persistence.project_document import project_document
+from core.persistence.autosave import autosave_service
+from core.persistence.search_index import search_index, KIND_STUDY
 
 class BaseConfiguration(ttk.Frame):
     """作品基础配置面板"""
@@ -71,9 +73,10 @@ class BaseConfiguration(ttk.Frame):
 
     def __init__(self, master):
         super().__init__(master)
-        self.config_file = Path("data/configs/novel_structure.yaml")
+        self.config_file = project_document.path
         self.subtypes_file = Path("data/StudyData/AllSubtypes.json")
         self.subtypes_content = {}
+        self._result_lines = {}  # 预览框中检索结果标题所在行 -> 文档id
         
         # 加载子类型内容说明
         if self.subtypes_file.exists():
@@ -150,11 +153,29 @@ class BaseConfiguration(ttk.Frame):
         
         # 设置标签配置以增加行距
         self.subtype_preview.tag_configure("line_spacing", spacing1=3, spacing2=3, spacing3=3)
+        # 检索结果：标题可点击查看全文，命中的词高亮
+        self.subtype_preview.tag_configure("result", foreground="#1a5fb4", font=("SimSun", 9, "bold"))
+        self.subtype_preview.tag_configure("match", background="#fff3a0")
+        self.subtype_preview.tag_bind("result", "<Button-1>", self._open_result)
+        self.subtype_preview.tag_bind("result", "<Enter>", lambda e: self.subtype_preview.config(cursor="hand2"))
+        self.subtype_preview.tag_bind("result", "<Leave>", lambda e: self.subtype_preview.config(cursor=""))
         self.subtype_preview.config(state="disabled")  # 设置为只读
         
         # 设置行权重，使子类型预览框能够垂直拉伸
         base_frame.rowconfigure(2, weight=1)
 
+        # 全文检索：类型资料、世界观、角色与生成记录，结果显示在预览框中
+        search_frame = ttk.Frame(base_frame)
+        search_frame.grid(row=3, column=0, columnspan=6, sticky="we", padx=5, pady=(0, 5))
+        ttk.Label(search_frame, text="检索:").pack(side=tk.LEFT, padx=2)
+        self.search_entry = ttk.Entry(search_frame, width=40)
+        self.search_entry.pack(side=tk.LEFT, padx=2, fill=tk.X, expand=True)
+        self.search_entry.bind("<Return>", self._search)
+        search_btn = tk.Button(search_frame, text="搜索", width=5, height=1,
+                               relief=tk.GROOVE, borderwidth=1, command=self._search)
+        search_btn.configure(font=("SimSun", 9))
+        search_btn.pack(side=tk.LEFT, padx=2)
+
         # 角色配置组件
         self.role_config = RoleConfiguration(role_frame)
         self.role_config.pack(fill=tk.BOTH, expand=True, padx=5, pady=5)
@@ -189,19 +210,67 @@ class BaseConfiguration(ttk.Frame):
         """更新子类型内容预览"""
         selected = self.sub_type.get()
         if selected:
-            preview_text = self.subtypes_content.get(selected, "未找到子类型内容")
+            preview_text = self.subtypes_content.get(selected)
+            if preview_text is None:
+                # 资料中没有同名条目（如繁简写法不同）时列出相近的类型资料
+                results = search_index.search(selected, kinds=[KIND_STUDY], limit=5, fuzzy=True)
+                self._show_results("未找到子类型内容" + ("，相近的类型资料：" if results else ""), results)
+                return
+            self._result_lines = {}
             self.subtype_preview.config(state="normal")
             self.subtype_preview.delete(1.0, tk.END)
             self.subtype_preview.insert(tk.END, preview_text, "line_spacing")  # 应用行距标签
             self.subtype_preview.config(state="disabled")
 
+    def _search(self, event=None):
+        """全文检索并在预览框中列出结果，检索词为空时恢复子类型预览"""
+        query = self.search_entry.get().strip()
+        if not query:
+            self._update_subtype_preview()
+            return
+        results = search_index.search(query, limit=30)
+        self._show_results(f"“{query}”的检索结果：{len(results)}条" if results else f"未找到“{query}”", results)
+
+    def _show_results(self, header, results):
+        """在预览框中显示检索结果：标题（可点击）与高亮命中词的摘要"""
+        preview = self.subtype_preview
+        preview.config(state="normal")
+        preview.delete(1.0, tk.END)
+        preview.insert(tk.END, header + "\n", "line_spacing")
+        self._result_lines = {}
+        for result in results:
+            line = int(preview.index(tk.END).split(".")[0]) - 1
+            self._result_lines[line] = result["id"]
+            source = f"（{result['source']}）" if result["kind"] != KIND_STUDY else ""
+            preview.insert(tk.END, f"【{result['label']}】{result['title']}{source}\n", ("line_spacing", "result"))
+            snippet, position = result["snippet"], 0
+            for start, end in result["highlights"]:
+                if start < position:
+                    continue
+                preview.insert(tk.END, snippet[position:start], "line_spacing")
+                preview.insert(tk.END, snippet[start:end], ("line_spacing", "match"))
+                position = end
+            preview.insert(tk.END, snippet[position:] + "\n", "line_spacing")
+        preview.config(state="disabled")
+
+    def _open_result(self, event):
+        """点击检索结果标题时显示文档全文"""
+        line = int(self.subtype_preview.index(f"@{event.x},{event.y}").split(".")[0])
+        document = search_index.document(self._result_lines.get(line, -1))
+        if document is None:
+            return
+        self._result_lines = {}
+        self.subtype_preview.config(state="normal")
+        self.subtype_preview.delete(1.0, tk.END)
+        self.subtype_preview.insert(tk.END, f"【{document['label']}】{document['title']}\n", ("line_spacing", "result"))
+        self.subtype_preview.insert(tk.END, document["content"], "line_spacing")
+        self.subtype_preview.config(state="disabled")
+
     def _load_config(self):
         """加载已有配置"""
-        if self.config_file.exists():
+        if project_document.exists():
             try:
-                with open(self.config_file, "r", encoding='utf-8') as f:
-                    all_config = yaml.safe_load(f) or {}
-                config = all_config.get("base_config", {})
+                config = project_document.section("base_config", {})
                 
                 self.title_entry.insert(0, config.get("title", ""))
                 self.creation_type.set(config.get("creation_type", ""))
@@ -218,24 +287,15 @@ class BaseConfiguration(ttk.Frame):
     def _save_config(self):
         """保存配置到文件"""
         try:
-            if self.config_file.exists():
-                with open(self.config_file, "r", encoding='utf-8') as f:
-                    all_config = yaml.safe_load(f) or {}
-            else:
-                all_config = {}
-
-            # 调整字段顺序，title放在第一个
-            all_config["base_config"] = {
+            # 调整字段顺序，title放在第一个；只写基础配置部分，其余部分保持不变
+            autosave_service.mark_dirty("base_config", {
                 "title": self.title_entry.get(),  # 第一行
                 "creation_type": self.creation_type.get(),
                 "main_type": self.main_type.get(),
                 "sub_type": self.sub_type.get()
-            }
-
-            self.config_file.parent.mkdir(parents=True, exist_ok=True)
-            
-            with open(self.config_file, "w", encoding='utf-8') as f:
-                yaml.dump(all_config, f, allow_unicode=True, sort_keys=False)  # 禁止自动排序
+            })
+            if not autosave_service.flush():
+                raise IOError(autosave_service.last_error)
             
             # 通知世界观面板更新
             creation_type = self.creation_type.get()
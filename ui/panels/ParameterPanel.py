@@ -319,7 +319,7 @@ class ParameterPanel(ttk.Frame):
 
     def _update_temp(self, value):
         val = min(max(float(value), 0.0), 2.0)
-        global_config.generation_params.temperature = val
+        global_config.update_generation_params(temperature=val)
         self.temp_value.config(text=f"{val:.1f}")
 
     def _create_top_p_control(self):
@@ -339,7 +339,7 @@ class ParameterPanel(ttk.Frame):
             to=1.0,
             length=200,
             command=lambda v: [
-                setattr(global_config.generation_params, 'top_p', float(v)),
+                global_config.update_generation_params(top_p=float(v)),
                 self.top_p_value.config(text=f"{float(v):.2f}")
             ]
         )
@@ -363,7 +363,7 @@ class ParameterPanel(ttk.Frame):
             to=2.0,
             length=200,
             command=lambda v: [
-                setattr(global_config.generation_params, 'frequency_penalty', float(v)),
+                global_config.update_generation_params(frequency_penalty=float(v)),
                 self.freq_penalty_value.config(text=f"{float(v):.1f}")
             ]
         )
@@ -385,7 +385,7 @@ class ParameterPanel(ttk.Frame):
             to=2.0,
             length=200,
             command=lambda v: [
-                setattr(global_config.generation_params, 'presence_penalty', float(v)),
+                global_config.update_generation_params(presence_penalty=float(v)),
                 self.pres_penalty_value.config(text=f"{float(v):.1f}")
             ]
         )
@@ -450,7 +450,7 @@ class ParameterPanel(ttk.Frame):
 
     def _update_response_format(self, event):
         selected = self.format_combo.get()
-        global_config.generation_params.response_format = {"type": selected}
+        global_config.update_generation_params(response_format={"type": selected})
 
     def _create_parameter_input(self):
         """创建参数输入区域"""
@@ -472,7 +472,7 @@ class ParameterPanel(ttk.Frame):
         try:
             value = int(self.max_tokens_spin.get())
             safe_value = max(1, min(value, 8192))
-            global_config.generation_params.max_tokens = safe_value
+            global_config.update_generation_params(max_tokens=safe_value)
             self.max_tokens_spin.set(safe_value)
         except ValueError:
             self.max_tokens_spin.set(global_config.generation_params.max_tokens)
@@ -485,23 +485,25 @@ class ParameterPanel(ttk.Frame):
         if not config:
             return
         
-        for param, value in config.items():
-            if hasattr(global_config.generation_params, param):
-                setattr(global_config.generation_params, param, value)
-                
-                # 更新各个控件
-                if param == 'temperature':
-                    self.temp_slider.set(value)
-                elif param == 'top_p':
-                    self.top_p_slider.set(value)
-                elif param == 'frequency_penalty':
-                    self.freq_penalty_slider.set(value)
-                elif param == 'presence_penalty':
-                    self.pres_penalty_slider.set(value)
-                elif param == 'max_tokens':
-                    safe_value = max(1, min(value, 8192))  # 确保不超过全局限制
-                    self.max_tokens_spin.set(safe_value)
-                    global_config.generation_params.max_tokens = safe_value
+        # 预设中的参数一次性写入全局配置，进行中的生成使用各自的参数快照，不受影响
+        values = {param: value for param, value in config.items()
+                  if hasattr(global_config.generation_params, param)}
+        if 'max_tokens' in values:
+            values['max_tokens'] = max(1, min(values['max_tokens'], 8192))  # 确保不超过全局限制
+        global_config.update_generation_params(**values)
+        
+        # 更新各个控件
+        for param, value in values.items():
+            if param == 'temperature':
+                self.temp_slider.set(value)
+            elif param == 'top_p':
+                self.top_p_slider.set(value)
+            elif param == 'frequency_penalty':
+                self.freq_penalty_slider.set(value)
+            elif param == 'presence_penalty':
+                self.pres_penalty_slider.set(value)
+            elif param == 'max_tokens':
+                self.max_tokens_spin.set(value)
         
         self.update_idletasks()
 
@@ -1,15 +1,15 @@
 import tkinter as tk
 from tkinter import ttk
-import yaml
-from pathlib import Path
 from tkinter import messagebox
 import time
 import os
 import traceback
 import json
-import threading
 import logging
 import random  # 新增随机模块
+import threading
+from core.persistence.project_document import project_document
+from core.persistence.autosave import autosave_service
 
 class RoleConfiguration(ttk.Frame):
     """角色配置面板"""
@@ -30,13 +30,14 @@ class RoleConfiguration(ttk.Frame):
     def __init__(self, master):
         super().__init__(master)
         self.role_map = {}  # 新增初始化
-        self.config_file = Path("data/configs/novel_structure.yaml")
+        self.config_file = project_document.path
         self.entries = {}
         self.current_role_id = None
         self.roles = {}
         self.operation_history = []  # 统一操作历史记录
         self.reasoning_window = None
         self.reasoning_text = None
+        self._autosave_job = None  # 输入防抖：连续输入只保留最后一次定时保存
         self._create_widgets()  # 确保先创建组件
         self._load_config()     # 后加载配置
         self._setup_character_undo()  # 设置字符级撤销功能
@@ -131,8 +132,9 @@ class RoleConfiguration(ttk.Frame):
         ttk.Button(btn_frame, text="新建", width=5, command=self._add_role).pack(side=tk.LEFT, padx=1)
         ttk.Button(btn_frame, text="删除", width=5, command=self._delete_role).pack(side=tk.LEFT, padx=1)
         ttk.Button(btn_frame, text="撤销", width=5, command=self._undo_last).pack(side=tk.LEFT, padx=1)
-        ttk.Button(btn_frame, text="保存", width=5, command=self._save_config).pack(side=tk.LEFT, padx=1)
+        ttk.Button(btn_frame, text="保存", width=5, command=self._save_now).pack(side=tk.LEFT, padx=1)
         ttk.Button(btn_frame, text="AI生成", width=5, command=self._ai_generate_role).pack(side=tk.LEFT, padx=1)  # 新增AI生成按钮
+        ttk.Button(btn_frame, text="批量生成", width=8, command=self._ai_generate_roles_batch).pack(side=tk.LEFT, padx=1)
 
         # 初始化角色类型
         self._update_role_types()
@@ -169,8 +171,7 @@ class RoleConfiguration(ttk.Frame):
         try:
             # 如果未传入类型，从配置文件获取
             if not creation_type:
-                with open(self.config_file, "r", encoding='utf-8') as f:
-                    config = yaml.safe_load(f).get("base_config", {})
+                config = project_document.section("base_config", {})
                 creation_type = config.get("creation_type", "严肃小说")
             
             types = self.ROLE_TYPES.get(creation_type, [])
@@ -223,12 +224,9 @@ class RoleConfiguration(ttk.Frame):
     def _load_config(self):
         """修复旧版配置兼容性问题"""
         try:
-            if self.config_file.exists():
-                with open(self.config_file, "r", encoding='utf-8') as f:
-                    all_config = yaml.safe_load(f) or {}
-
+            if project_document.exists():
                 # 兼容旧版本列表格式
-                role_config = all_config.get("role_config", {})
+                role_config = project_document.section("role_config", {})
                 raw_roles = role_config.get("roles", [])
                 
                 # 转换旧数据格式
@@ -277,28 +275,36 @@ class RoleConfiguration(ttk.Frame):
             # 更新到角色字典
             self.roles[self.current_role_id] = current_data
         
-        # 读取现有配置
-        all_config = {}
-        if self.config_file.exists():
-            with open(self.config_file, "r", encoding='utf-8') as f:
-                all_config = yaml.safe_load(f) or {}
-
-        # 更新角色配置部分
-        all_config["role_config"] = {
+        # 只暂存角色配置部分，由自动保存服务合并写入
+        autosave_service.mark_dirty("role_config", {
             "current_role": self.current_role_id,
             "roles": self.roles
-        }
-
-        # 确保配置目录存在
-        self.config_file.parent.mkdir(parents=True, exist_ok=True)
-
-        # 写入完整配置
-        with open(self.config_file, "w", encoding='utf-8') as f:
-            yaml.dump(all_config, f, allow_unicode=True, sort_keys=False)
+        })
             
         # 保存后更新角色选择下拉框，确保显示最新的角色名称
         self._update_role_list(select_id=self.current_role_id)
 
+    def _save_now(self):
+        """“保存”按钮：立即写入文件"""
+        self._cancel_autosave()
+        self._save_config()
+        if not autosave_service.flush():
+            messagebox.showerror("保存失败", f"写入配置文件失败：{autosave_service.last_error}")
+
+    def _schedule_autosave(self):
+        """输入停止2秒后保存，期间的每次输入都会重新计时"""
+        self._cancel_autosave()
+        self._autosave_job = self.after(2000, self._run_autosave)
+
+    def _cancel_autosave(self):
+        if self._autosave_job is not None:
+            self.after_cancel(self._autosave_job)
+            self._autosave_job = None
+
+    def _run_autosave(self):
+        self._autosave_job = None
+        self._save_config()
+
     def _update_role_list(self, select_id=None):
         """支持指定选中角色"""
         self.role_map = {}  # 每次更新前重置
@@ -475,7 +481,7 @@ class RoleConfiguration(ttk.Frame):
                 entry.edit_pointer -= removed_count
                 
             # 延迟自动保存
-            self.after(2000, self._save_config)
+            self._schedule_autosave()
         
         var.trace_add("write", on_change)
 
@@ -766,8 +772,7 @@ class RoleConfiguration(ttk.Frame):
             parsed_data = self._parse_free_text(content)
             
             # 获取当前创作类型
-            with open(self.config_file, "r", encoding='utf-8') as f:
-                creation_type = yaml.safe_load(f).get("base_config", {}).get("creation_type", "网络小说")
+            creation_type = project_document.section("base_config", {}).get("creation_type", "网络小说")
             
             # 验证角色定位
             valid_role_types = self.ROLE_TYPES.get(creation_type, [])
@@ -924,65 +929,79 @@ class RoleConfiguration(ttk.Frame):
         except Exception as e:
             messagebox.showerror("撤销失败", str(e))
 
+    def _role_generation_context(self):
+        """读取作品名称、创作类型与可选角色定位，配置无效时抛出ValueError"""
+        novel_config = project_document.section("base_config", {})
+        novel_name = novel_config.get("novel_name", "当前小说")
+        creation_type = novel_config.get("creation_type")  # 直接使用配置项
+        
+        if not creation_type:
+            raise ValueError("配置文件中缺少创作类型(creation_type)")
+            
+        # 严格匹配当前类型
+        if creation_type not in self.ROLE_TYPES:
+            raise ValueError(f"无效的创作类型：{creation_type}，请使用：{', '.join(self.ROLE_TYPES.keys())}")
+            
+        return novel_name, creation_type, self.ROLE_TYPES[creation_type]
+
+    def _build_role_prompt(self, novel_name, creation_type, available_roles, selected_role):
+        """生成指定角色定位的提示词"""
+        # 固定的要求与格式在前，作品信息与本次选择的角色定位在后，便于命中提供商的前缀缓存
+        from core.api_client.prompt_layout import PromptLayout
+        layout = PromptLayout("role_generation")
+        layout.static("""你是一个专业的小说作家，请为下方作品生成一个指定角色定位的详细角色设定。要求包含：
+1. 姓名要符合作品创作类型与角色定位
+2. 年龄需要与角色定位的典型设定匹配
+3. 身份地位要体现该创作类型中这一角色定位的特点
+4. 显性目标和隐性动机要有戏剧冲突
+5. 人设金句要突出角色性格
+
+必须严格遵循以下要求：
+1. 角色定位必须从作品信息中的可选角色定位列表选择
+2. 不要自行发明新的角色类型
+3. 所有字段必须完整填写
+
+如：●姓名：夜无殇
+...（其他字段保持相同格式）
+
+请严格使用以下格式（不要使用方括号）：
+
+▬ 核心定位 ▬
+●角色定位：[角色定位]
+▬ 基础信息 ▬
+●姓名：[姓名]
+●性别：[性别]
+●年龄：[年龄]
+●身份地位：[身份地位]
+▬ 人物画像 ▬
+●外貌特征：[详细描述]
+●随身物品：[特征物品]
+▬ 行为动机 ▬
+●显性目标：[明确目标]
+●隐性动机：[隐藏动机]
+▬ 标志特征 ▬
+●人设金句：[人设金句]""")
+        layout.fields("作品信息", {
+            "作品名称": f"《{novel_name}》",
+            "创作类型": creation_type,
+            "可选角色定位": ", ".join(available_roles)
+        })
+        layout.fields("本次生成", {"角色定位": selected_role})
+        return layout.text()
+
     def _ai_generate_role(self):
         """打开AI生成窗口"""
-        from core.api_client.deepseek import api_client
-        
         try:
-            with open(self.config_file, "r", encoding='utf-8') as f:
-                novel_config = yaml.safe_load(f).get("base_config", {})
-                novel_name = novel_config.get("novel_name", "当前小说")
-                creation_type = novel_config.get("creation_type")  # 直接使用配置项
-                
-                if not creation_type:
-                    raise ValueError("配置文件中缺少创作类型(creation_type)")
-                
-                # 严格匹配当前类型
-                if creation_type not in self.ROLE_TYPES:
-                    raise ValueError(f"无效的创作类型：{creation_type}，请使用：{', '.join(self.ROLE_TYPES.keys())}")
-                
-                available_roles = self.ROLE_TYPES[creation_type]
-                existing_roles = [r["role_type"] for r in self.roles.values()]
-                candidates = [rt for rt in available_roles if rt not in existing_roles]
-                selected_role = random.choice(candidates) if candidates else random.choice(available_roles)
+            novel_name, creation_type, available_roles = self._role_generation_context()
+            existing_roles = [r["role_type"] for r in self.roles.values()]
+            candidates = [rt for rt in available_roles if rt not in existing_roles]
+            selected_role = random.choice(candidates) if candidates else random.choice(available_roles)
 
         except Exception as e:
             messagebox.showerror("配置错误", f"加载配置失败：{str(e)}")
             return
 
-        # 更新提示词中的类型引用
-        prompt = f"""你是一个专业的{creation_type}作家，请为《{novel_name}》生成一个{selected_role}的详细角色设定。要求包含：
-        1. 姓名要符合{creation_type}的{selected_role}定位
-        2. 年龄需要与{selected_role}的典型设定匹配
-        3. 身份地位要体现{creation_type}中{selected_role}的特点
-        4. 显性目标和隐性动机要有戏剧冲突
-        5. 人设金句要突出角色性格
-
-        必须严格遵循以下要求：
-        1. 角色定位必须从以下列表选择：{", ".join(available_roles)}
-        2. 不要自行发明新的角色类型
-        3. 所有字段必须完整填写
-        
-        如：●姓名：夜无殇
-        ...（其他字段保持相同格式）
-        
-        请严格使用以下格式（不要使用方括号）：
-        
-        ▬ 核心定位 ▬
-        ●角色定位：[角色定位]
-        ▬ 基础信息 ▬
-        ●姓名：[姓名]
-        ●性别：[性别]
-        ●年龄：[年龄]
-        ●身份地位：[身份地位]
-        ▬ 人物画像 ▬
-        ●外貌特征：[详细描述]
-        ●随身物品：[特征物品]
-        ▬ 行为动机 ▬
-        ●显性目标：[明确目标]
-        ●隐性动机：[隐藏动机]
-        ▬ 标志特征 ▬
-        ●人设金句：[人设金句]"""
+        prompt = self._build_role_prompt(novel_name, creation_type, available_roles, selected_role)
 
         # 创建生成窗口（仅界面，不启动生成）
         gen_win = tk.Toplevel(self)
@@ -1066,13 +1085,95 @@ class RoleConfiguration(ttk.Frame):
         # 将编辑器保存为实例变量
         self.ai_editor = editor  # 新增
 
+    def _ai_generate_roles_batch(self):
+        """为当前创作类型中尚无角色的每个角色定位并发生成一个角色，完成一个加入一个"""
+        try:
+            novel_name, creation_type, available_roles = self._role_generation_context()
+            existing_roles = {r.get("role_type") for r in self.roles.values()}
+            targets = [rt for rt in available_roles if rt not in existing_roles]
+        except Exception as e:
+            messagebox.showerror("配置错误", f"加载配置失败：{str(e)}")
+            return
+        if not targets:
+            messagebox.showinfo("提示", "当前创作类型的每个角色定位都已有角色")
+            return
+
+        # 角色由用户点击生成，每次应得到不同的结果，不走响应缓存
+        from core.api_client.response_cache import CACHE_NEVER
+        requests = [{
+            "messages": [{"role": "user", "content": self._build_role_prompt(
+                novel_name, creation_type, available_roles, role_type)}],
+            "prompt_family": "role_generation",
+            "cache_policy": CACHE_NEVER,
+            "label": f"角色生成-{role_type}"
+        } for role_type in targets]
+
+        # 进度窗口：每个角色定位一行
+        batch_win = tk.Toplevel(self)
+        batch_win.title("批量生成角色")
+        batch_win.resizable(False, False)
+        progress = ttk.Treeview(batch_win, columns=("status",), height=len(targets))
+        progress.heading("#0", text="角色定位")
+        progress.heading("status", text="状态")
+        progress.column("#0", width=120)
+        progress.column("status", width=300)
+        for role_type in targets:
+            progress.insert("", tk.END, iid=role_type, text=role_type, values=("生成中...",))
+        progress.pack(fill=tk.BOTH, expand=True, padx=10, pady=10)
+
+        # 停止时取消排队的请求并关闭执行中的连接
+        cancel_event = threading.Event()
+        stop_btn = ttk.Button(batch_win, text="停止生成", width=12, command=cancel_event.set)
+        stop_btn.pack(pady=5)
+        batch_win.protocol("WM_DELETE_WINDOW", lambda: (cancel_event.set(), batch_win.destroy()))
+
+        def show_result(result):
+            role_type = targets[result.index]
+            if result.ok:
+                try:
+                    parsed = self._parse_free_text(result.content)
+                    if not parsed.get('name'):
+                        raise ValueError("角色必须包含姓名")
+                    new_id = self._add_role(silent=True)
+                    self.roles[new_id].update(parsed)
+                    self._record_operation('create', new_id)
+                    self._save_config()
+                    status = f"已保存：{parsed['name']}（{result.elapsed:.1f}秒）"
+                except Exception as e:
+                    status = f"解析失败：{str(e)}"
+            elif result.cancelled:
+                status = "已停止"
+            else:
+                status = f"生成失败：{str(result.error)}"
+            if progress.winfo_exists():
+                progress.set(role_type, "status", status)
+
+        def batch_finished():
+            if stop_btn.winfo_exists():
+                stop_btn.config(text="关闭", command=batch_win.destroy)
+
+        def run_batch():
+            from core.api_client.deepseek import api_client
+            try:
+                for result in api_client.generate_many(requests, max_concurrency=3, cancel_event=cancel_event):
+                    self.after(0, show_result, result)
+            except Exception as e:
+                logging.error(f"批量生成角色失败：{traceback.format_exc()}")
+                msg = str(e)
+                self.after(0, lambda: messagebox.showerror("错误", f"批量生成失败：{msg}"))
+            finally:
+                self.after(0, batch_finished)
+
+        threading.Thread(target=run_batch, daemon=True, name="role_batch").start()
+
     def _start_generation(self, window, prompt, editor):
         """启动生成线程，安全处理流式输出"""
         if self.generating:
             messagebox.showwarning("提示", "生成正在进行中", parent=window)
             return
         
-        from core.api_client.deepseek import api_client
+        from core.api_client.async_client import async_api_client, async_runner
+        from core.api_client.response_cache import CACHE_NEVER
         
         # 不再需要单独创建思维链窗口
         
@@ -1086,8 +1187,8 @@ class RoleConfiguration(ttk.Frame):
             if window.winfo_exists():
                 window.after(0, func, *args)
         
-        def safe_callback(chunk):
-            """安全处理回调，确保窗口存在"""
+        def handle_chunk(chunk):
+            """在主线程中处理合并后的增量，确保窗口存在"""
             if not window.winfo_exists() or self.stop_generation:
                 return
                 
@@ -1096,7 +1197,19 @@ class RoleConfiguration(ttk.Frame):
             except Exception as e:
                 logging.error(f"回调处理异常: {str(e)}")
         
-        def generate_thread():
+        # 回调只写入缓冲区，由主线程按帧合并刷新，网络读取不等待界面
+        from core.api_client.stream_buffer import TkStreamPump
+        pump = TkStreamPump(window, handle_chunk).start()
+        
+        def safe_callback(chunk):
+            """写入流式缓冲区"""
+            if not self.stop_generation:
+                pump.push(chunk)
+        
+        # 本次生成独立的句柄，停止时只取消这一个生成
+        handle = self.generation_handle = async_api_client.new_handle("角色生成")
+        
+        async def generate_task():
             self.generating = True
             self.stop_generation = False
             
@@ -1108,7 +1221,10 @@ class RoleConfiguration(ttk.Frame):
                 messages = [{"role": "user", "content": prompt}]
                 
                 # 使用安全回调处理流式输出
-                for chunk in api_client.stream_generate(messages, callback=safe_callback):
+                async for chunk in async_api_client.stream_generate(messages, callback=safe_callback,
+                                                                     handle=handle,
+                                                                     prompt_family="role_generation",
+                                                                     cache_policy=CACHE_NEVER):
                     if self.stop_generation or not window.winfo_exists():
                         logging.info("检测到停止信号，中断生成")
                         break
@@ -1129,11 +1245,13 @@ class RoleConfiguration(ttk.Frame):
                 if window.winfo_exists():
                     safe_update_ui(messagebox.showerror, "生成失败", str(e), parent=window)
             finally:
+                pump.finish()
                 self.generating = False
                 self.stop_generation = False
-                logging.info("生成线程结束")
+                logging.info("生成任务结束")
 
-        threading.Thread(target=generate_thread, daemon=True).start()
+        # 提交到共享的后台事件循环，多个生成窗口不再各占一个线程
+        async_runner.submit(generate_task())
 
     def _stop_generation(self):
         """安全停止生成逻辑"""
@@ -1142,13 +1260,11 @@ class RoleConfiguration(ttk.Frame):
             self.stop_generation = True
             logging.info("设置停止标志")
             
-            # 通知API客户端停止生成
-            try:
-                from core.api_client.deepseek import api_client
-                setattr(api_client, '_generation_stopped', True)
-                logging.info("已设置API客户端停止标志")
-            except Exception as e:
-                logging.error(f"设置API客户端停止标志失败: {str(e)}")
+            # 取消本窗口的生成句柄，立即关闭连接
+            handle = getattr(self, 'generation_handle', None)
+            if handle is not None:
+                handle.cancel()
+                logging.info(f"已取消生成 #{handle.id}")
             
             # 确保状态标签存在
             if hasattr(self, 'status_label') and self.status_label.winfo_exists():
@@ -1164,12 +1280,6 @@ class RoleConfiguration(ttk.Frame):
                 # 仅当标签仍存在时更新
                 if hasattr(self, 'status_label') and self.status_label.winfo_exists():
                     self.status_label.config(text="已停止")
-                # 双重保险:再次设置API客户端停止标志
-                try:
-                    from core.api_client.deepseek import api_client
-                    setattr(api_client, '_generation_stopped', True)
-                except:
-                    pass
             
             # 使用短延迟确保UI更新
             self.after(300, ensure_stopped)
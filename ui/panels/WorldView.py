@@ -6,11 +6,11 @@ import tkinter.filedialog as filedialog
 from pathlib import Path
 import datetime
 import json
-import threading
 import random
 import os
-import time
 import re
+import asyncio
+from core.persistence.project_document import project_document
 
 class WorldViewPanel:
     def __init__(self, master):
@@ -23,7 +23,7 @@ class WorldViewPanel:
         # 当前工作目录作为配置文件的位置
         self.config_dir = Path("data/configs")
         self.config_file = self.config_dir / "base_config.yaml"
-        self.novel_config_file = self.config_dir / "novel_structure.yaml"
+        self.novel_config_file = project_document.path
         
         # 加载配置,如果不存在则创建默认配置
         self._load_config()
@@ -331,18 +331,15 @@ class WorldViewPanel:
         """定期检查配置文件变化,更新界面"""
         try:
             if self.novel_config_file.exists():
-                # 检查配置文件的修改时间是否变化
-                current_mtime = self.novel_config_file.stat().st_mtime
+                # 检查共享文档的版本是否变化（文件未变时不会重新解析）
+                current_version = project_document.version
                 
                 # 如果是第一次检查或配置文件已被修改
-                if not hasattr(self, 'last_config_mtime') or current_mtime > self.last_config_mtime:
-                    self.last_config_mtime = current_mtime
+                if not hasattr(self, 'last_config_version') or current_version != self.last_config_version:
+                    self.last_config_version = current_version
                     
                     # 读取基础配置信息
-                    with open(self.novel_config_file, "r", encoding='utf-8') as f:
-                        all_config = yaml.safe_load(f) or {}
-                    
-                    base_config = all_config.get("base_config", {})
+                    base_config = project_document.section("base_config", {})
                     # 保存基础配置信息供各步骤使用
                     self.base_config = {
                         "creation_type": base_config.get("creation_type", ""),
@@ -445,6 +442,14 @@ class WorldViewPanel:
         )
         ai_gen_btn.pack(side="left", padx=5)
         
+        # 只重新生成某一部分
+        regen_btn = ttk.Button(
+            button_frame, 
+            text="重新生成部分", 
+            command=self._regenerate_template_section
+        )
+        regen_btn.pack(side="left", padx=5)
+        
         # 确认应用模板按钮
         apply_btn = ttk.Button(
             button_frame, 
@@ -452,6 +457,122 @@ class WorldViewPanel:
             command=self._apply_template_from_preview
         )
         apply_btn.pack(side="right", padx=5)
+    
+    def _regenerate_template_section(self):
+        """只重新生成模板中选定的一个部分，其余部分保持不变"""
+        from core.narrative_engine.worldview_sections import SECTIONS, regenerate_section
+        
+        if not hasattr(self, 'preview_editor') or not self.preview_editor.winfo_exists():
+            messagebox.showwarning("提示", "预览编辑器不存在，请重新加载界面")
+            return
+        content = self.preview_editor.get("1.0", "end-1c")
+        if not content.strip():
+            messagebox.showwarning("提示", "请先生成模板内容")
+            return
+        
+        # 预览内容被手动修改过时重新解析一次，之后的替换只改动对应部分
+        if self.worldview_data.get("full_content") != content or "spans" not in self.worldview_data:
+            self._apply_template_data(self._parse_template_content(content))
+        
+        dialog = tk.Toplevel(self.master)
+        dialog.title("重新生成部分")
+        self._center_window(dialog, 700, 520)
+        
+        form = ttk.Frame(dialog)
+        form.pack(fill="x", padx=10, pady=10)
+        ttk.Label(form, text="部分:").grid(row=0, column=0, sticky="w")
+        titles = [section.title for section in SECTIONS]
+        section_var = tk.StringVar(value=titles[0])
+        ttk.Combobox(form, textvariable=section_var, values=titles, state="readonly",
+                     width=30).grid(row=0, column=1, sticky="w", padx=5)
+        ttk.Label(form, text="修改意见:").grid(row=1, column=0, sticky="w", pady=5)
+        instructions_entry = ttk.Entry(form, width=70)
+        instructions_entry.grid(row=1, column=1, sticky="we", padx=5, pady=5)
+        
+        output = scrolledtext.ScrolledText(dialog, wrap="word", height=18)
+        output.pack(fill="both", expand=True, padx=10)
+        
+        btn_frame = ttk.Frame(dialog)
+        btn_frame.pack(fill="x", padx=10, pady=10)
+        state = {"handle": None, "result": None}
+        
+        def on_chunk(chunk):
+            if isinstance(chunk, str) and output.winfo_exists():
+                output.insert("end", chunk)
+                output.see("end")
+        
+        def start():
+            from core.api_client.async_client import async_runner
+            from core.api_client.handle import new_handle
+            from core.api_client.stream_buffer import TkStreamPump
+            
+            key = SECTIONS[titles.index(section_var.get())].key
+            output.delete("1.0", "end")
+            gen_btn.config(state="disabled")
+            apply_btn.config(state="disabled")
+            state["result"] = None
+            handle = state["handle"] = new_handle(f"世界观重新生成-{section_var.get()}")
+            pump = TkStreamPump(dialog, on_chunk).start()
+            template_data = self.worldview_data
+            
+            def finished(result, error):
+                if not dialog.winfo_exists():
+                    return
+                gen_btn.config(state="normal")
+                if error:
+                    if not handle.cancelled:
+                        messagebox.showerror("错误", f"重新生成失败: {error}", parent=dialog)
+                    return
+                state["result"] = result
+                apply_btn.config(state="normal")
+            
+            async def task():
+                try:
+                    result = await regenerate_section(template_data, key, self._template_work_info(),
+                                                      instructions_entry.get(), handle=handle,
+                                                      on_chunk=pump.push)
+                    pump.finish(lambda: finished(result, None))
+                except Exception as e:
+                    error = str(e)
+                    pump.finish(lambda: finished(None, error))
+            
+            async_runner.submit(task())
+        
+        def apply():
+            result = state["result"]
+            if result is None or not self.preview_editor.winfo_exists():
+                return
+            old = self.preview_editor.get("1.0", "end-1c")
+            if old != self.worldview_data.get("full_content"):
+                messagebox.showwarning("提示", "生成期间模板内容已被修改，请重新生成该部分", parent=dialog)
+                return
+            new = result["full_content"]
+            # 只替换变化的区间，其余文字不动
+            prefix = 0
+            limit = min(len(old), len(new))
+            while prefix < limit and old[prefix] == new[prefix]:
+                prefix += 1
+            suffix = 0
+            while suffix < limit - prefix and old[-1 - suffix] == new[-1 - suffix]:
+                suffix += 1
+            self.preview_editor.delete(f"1.0 + {prefix} chars", f"1.0 + {len(old) - suffix} chars")
+            self.preview_editor.insert(f"1.0 + {prefix} chars", new[prefix:len(new) - suffix])
+            self._apply_template_data(result)
+            self.worldview_template = new
+            dialog.destroy()
+        
+        def close():
+            if state["handle"] is not None:
+                state["handle"].cancel()
+            dialog.destroy()
+        
+        gen_btn = ttk.Button(btn_frame, text="生成", command=start)
+        gen_btn.pack(side="left", padx=5)
+        apply_btn = ttk.Button(btn_frame, text="替换到模板", command=apply, state="disabled")
+        apply_btn.pack(side="right", padx=5)
+        ttk.Button(btn_frame, text="取消", command=close).pack(side="right", padx=5)
+        dialog.protocol("WM_DELETE_WINDOW", close)
+        dialog.transient(self.master)
             
     def _apply_template_from_preview(self):
         """从预览编辑器中应用模板内容"""
@@ -583,9 +704,16 @@ class WorldViewPanel:
             
             # 开始生成模板按钮
             self.gen_btn = ttk.Button(left_btn_frame, text="生成模板", 
-                                command=lambda: self._start_template_generation(gen_window, prompt_editor.get("1.0", "end-1c"), editor))
+                                command=lambda: self._start_sectioned_template_generation(gen_window, editor)
+                                if self.sectioned_generation_var.get()
+                                else self._start_template_generation(gen_window, prompt_editor.get("1.0", "end-1c"), editor))
             self.gen_btn.pack(side="left", padx=5)
             
+            # 分段并行生成：各部分同时请求，总耗时约为最慢的一个部分（使用内置的分段提示词）
+            self.sectioned_generation_var = tk.BooleanVar(value=False)
+            ttk.Checkbutton(left_btn_frame, text="分段并行", 
+                            variable=self.sectioned_generation_var).pack(side="left", padx=5)
+            
             # 生成提示词按钮
             gen_prompt_btn = ttk.Button(left_btn_frame, text="生成提示词",
                                  command=lambda: self._generate_prompt_via_api(gen_window, prompt_editor))
@@ -658,65 +786,93 @@ class WorldViewPanel:
                 if window.winfo_exists():
                     window.after(0, func, *args)
             
-            # 回调函数处理流式响应
-            def prompt_callback(chunk):
+            # 主线程中按帧处理合并后的流式内容
+            def handle_prompt_chunk(chunk):
                 if not window.winfo_exists() or self.generation_stopped:
                     return
                 
                 if isinstance(chunk, dict):
                     # 思维链内容通过模板回调处理
-                    safe_update_ui(lambda: self._template_stream_callback(chunk))
+                    self._template_stream_callback(chunk)
                 else:
                     # 文本内容直接更新到编辑器
-                    safe_update_ui(lambda: self._update_prompt_editor(prompt_editor, chunk))
+                    self._update_prompt_editor(prompt_editor, chunk)
+            
+            # 回调只写入缓冲区，不阻塞网络读取
+            from core.api_client.stream_buffer import TkStreamPump
+            pump = TkStreamPump(window, handle_prompt_chunk).start()
             
-            def generate_thread():
+            # 本次生成独立的句柄，停止时只取消这一个生成
+            from core.api_client.handle import new_handle
+            handle = self.generation_handle = new_handle("提示词生成")
+            
+            def prompt_callback(chunk):
+                if not self.generation_stopped:
+                    pump.push(chunk)
+            
+            async def generate_task():
                 try:
                     # 尝试导入API客户端并生成内容
                     try:
-                        from core.api_client.deepseek import api_client
+                        from core.api_client.async_client import async_api_client
+                        # 创作类生成不使用响应缓存，再次点击生成总是请求新内容
+                        from core.api_client.response_cache import CACHE_NEVER
                         
-                        # 准备消息
-                        meta_prompt = f"""我需要你帮我创建一个提示词，这个提示词将用于生成《{work_title}》这部{work_type}类型的{main_type}-{sub_type}作品的世界观模板。
+                        # 准备消息：固定指令在前、作品信息在后，便于命中提供商的前缀缓存
+                        from core.api_client.prompt_layout import PromptLayout
+                        layout = PromptLayout(
+                            "worldview_meta_prompt",
+                            system="你是一个专业的提示词工程师，擅长创建用于生成世界观设定的高质量提示词。在生成提示词前，请思考并解释你的决策过程。"
+                        )
+                        layout.static("""我需要你帮我创建一个提示词，这个提示词将用于生成下方作品的世界观模板。
 
 请根据作品特点，创建一个详细的提示词，包含：
-1. {work_type}类型的{main_type}-{sub_type}作品的世界观应该包含哪些核心要素
+1. 该作品类型、主类型与子类型的世界观应该包含哪些核心要素
 2. 每个要素应该包含哪些具体细节
 3. 需要考虑的特殊设定或限制条件
-4. 与《{work_title}》作为{work_type}类型的{main_type}-{sub_type}作品相关的典型元素和特色
+4. 与该作品及其类型相关的典型元素和特色
 
-提示词应该结构清晰，层次分明，便于AI理解和生成。请直接给出提示词内容，无需额外解释。"""
-                        
-                        messages = [
-                            {"role": "system", "content": "你是一个专业的提示词工程师，擅长创建用于生成世界观设定的高质量提示词。在生成提示词前，请思考并解释你的决策过程。"},
-                            {"role": "user", "content": meta_prompt}
-                        ]
+提示词应该结构清晰，层次分明，便于AI理解和生成。请直接给出提示词内容，无需额外解释。""")
+                        layout.fields("作品信息", {
+                            "作品名称": f"《{work_title}》",
+                            "作品类型": work_type,
+                            "主类型-子类型": f"{main_type}-{sub_type}"
+                        })
+                        messages = layout.messages()
                         
                         # 启用编辑器用于流式更新
                         safe_update_ui(lambda: prompt_editor.config(state="normal"))
                         safe_update_ui(lambda: prompt_editor.delete("1.0", "end"))
                         
-                        # 使用API客户端的流式生成，使用相同的回调处理机制
-                        for chunk in api_client.stream_generate(messages, callback=prompt_callback):
+                        # 使用异步客户端的流式生成，使用相同的回调处理机制
+                        async for chunk in async_api_client.stream_generate(messages, callback=prompt_callback,
+                                                                             handle=handle,
+                                                                             prompt_family=layout.family,
+                                                                             cache_policy=CACHE_NEVER):
                             if self.generation_stopped or not window.winfo_exists():
                                 print("提示词生成被停止")
                                 break
                         
-                        # 生成完成
-                        if window.winfo_exists():
+                        # 生成完成，缓冲内容全部显示后再更新状态
+                        def on_prompt_finished():
                             if not self.generation_stopped:
-                                safe_update_ui(lambda: self.thinking_text.insert("end", "\n\n提示词生成完成！\n"))
-                            safe_update_ui(lambda: self.thinking_indicator.config(foreground="green", text="●"))
-                            safe_update_ui(lambda: self.gen_btn.config(state="normal"))
-                            safe_update_ui(lambda: self.stop_btn.config(state="disabled"))
+                                self.thinking_text.insert("end", "\n\n提示词生成完成！\n")
+                            self.thinking_indicator.config(foreground="green", text="●")
+                            self.gen_btn.config(state="normal")
+                            self.stop_btn.config(state="disabled")
+                        
+                        if window.winfo_exists():
+                            pump.finish(on_prompt_finished)
                             self.prompt_generation_active = False
                         
                     except Exception as e:
                         print(f"生成提示词API调用失败: {str(e)}")
+                        msg = str(e)  # except块结束后e被清除，回调中使用msg
+                        pump.stop()
                         if window.winfo_exists():
                             # 生成失败，回退到默认提示词
                             default_prompt = self._build_template_prompt()
-                            safe_update_ui(lambda: self.thinking_text.insert("end", f"\nAPI调用失败: {str(e)}，使用默认提示词\n"))
+                            safe_update_ui(lambda: self.thinking_text.insert("end", f"\nAPI调用失败: {msg}，使用默认提示词\n"))
                             safe_update_ui(lambda: prompt_editor.config(state="normal"))
                             safe_update_ui(lambda: prompt_editor.delete("1.0", "end"))
                             safe_update_ui(lambda: prompt_editor.insert("1.0", default_prompt))
@@ -726,9 +882,10 @@ class WorldViewPanel:
                             self.prompt_generation_active = False
                 
                 except Exception as e:
-                    print(f"生成提示词线程异常: {str(e)}")
+                    print(f"生成提示词任务异常: {str(e)}")
+                    msg = str(e)
                     if window.winfo_exists():
-                        safe_update_ui(lambda: messagebox.showerror("错误", f"生成提示词出错: {str(e)}", parent=window))
+                        safe_update_ui(lambda: messagebox.showerror("错误", f"生成提示词出错: {msg}", parent=window))
                         safe_update_ui(lambda: prompt_editor.config(state="normal"))
                         safe_update_ui(lambda: prompt_editor.delete("1.0", "end"))
                         safe_update_ui(lambda: prompt_editor.insert("1.0", self._build_template_prompt()))
@@ -736,10 +893,9 @@ class WorldViewPanel:
                         safe_update_ui(lambda: self.stop_btn.config(state="disabled"))
                         self.prompt_generation_active = False
             
-            # 启动生成线程
-            prompt_thread = threading.Thread(target=generate_thread)
-            prompt_thread.daemon = True
-            prompt_thread.start()
+            # 提交到共享的后台事件循环
+            from core.api_client.async_client import async_runner
+            async_runner.submit(generate_task())
             
         except Exception as e:
             messagebox.showerror("错误", f"生成提示词时出错: {str(e)}", parent=window)
@@ -811,8 +967,8 @@ class WorldViewPanel:
         # 重新组合处理后的文本
         return '\n'.join(lines)
     
-    def _build_template_prompt(self):
-        """根据当前创作类型构建提示词"""
+    def _template_work_info(self):
+        """模板提示词中的作品信息"""
         # 设置默认值
         main_type = "通用"  # 默认主类型
         sub_type = "通用"   # 默认子类型
@@ -830,57 +986,22 @@ class WorldViewPanel:
         else:
             print("_build_template_prompt: 未找到当前基础配置信息，使用默认值")
         
-        # 构建提示词
-        prompt = f"""为《{work_title}》这部{work_type}类型的{main_type}-{sub_type}作品设计一个详细的世界观模板，请提供以下要素：
-
-一、总览设定（50字内概括核心）
-- 用一句话定义世界观的"独特性"
-
-二、时空与物理法则
-1. 时空背景
-   - 时代：现代/古代/近未来/架空纪元
-   - 地理范围：主要地图构成
-   - 物理法则：常规物理是否与现实一致，超自然规则特点
-
-2. 时间流动
-   - 时间线类型：单线/循环/平行时空
-   - 特殊时间现象
-
-三、社会结构
-1. 权力与阶级
-   - 统治势力：政府/教会/家族/其他形式
-   - 阶级划分标准与社会矛盾
-
-2. 经济与资源
-   - 硬通货类型
-   - 核心资源争夺点
-
-3. 文化与习俗
-   - 禁忌与信仰体系
-   - 特色日常习俗：节日、饮食、服饰等
-
-四、超自然/科技体系
-1. 力量本源
-   - 能力来源
-   - 升级逻辑与等级划分
-   - 能力限制与代价
-
-五、关键组织与势力
-- 至少3个重要组织，包含名称、性质、核心目标、与主角关系
-
-六、生态与生物
-- 特殊生物设计
-- 自然环境威胁
-
-七、历史大事件
-- 按时间轴列出影响世界观的关键事件
+        return {
+            "作品名称": f"《{work_title}》",
+            "作品类型": work_type,
+            "主类型": main_type,
+            "子类型": sub_type
+        }
 
-要求：
-- 契合《{work_title}》这部{work_type}作品的核心主题
-- 符合{main_type}的一般特征
-- 融入{sub_type}的典型元素和特色
-- 提供具体细节而非泛泛而谈
-- 构建富有创意且内部逻辑自洽的世界体系"""
+    def _build_template_prompt(self):
+        """根据当前创作类型构建提示词"""
+        # 固定的模板框架在前，作品信息在后，相同框架的请求可以命中提供商的前缀缓存
+        from core.api_client.prompt_layout import PromptLayout
+        from core.narrative_engine.worldview_sections import template_outline
+        layout = PromptLayout("worldview_template")
+        layout.static(template_outline())
+        layout.fields("作品信息", self._template_work_info())
+        prompt = layout.text()
         
         return prompt
 
@@ -908,9 +1029,16 @@ class WorldViewPanel:
                 if window.winfo_exists():
                     window.after(0, func, *args)
             
-            # 回调函数用于处理流式响应
+            # 回调只写入缓冲区，由主线程按帧合并显示，网络读取不等待界面
+            from core.api_client.stream_buffer import TkStreamPump
+            pump = self.generation_pump = TkStreamPump(window, self._template_stream_callback).start()
+            
+            # 本次生成独立的句柄，停止时只取消这一个生成
+            from core.api_client.handle import new_handle
+            handle = self.generation_handle = new_handle("模板生成")
+            
             def safe_callback(chunk):
-                safe_update_ui(self._template_stream_callback, chunk)
+                pump.push(chunk)
             
             # 备用内容，当API调用失败时使用
             fallback_content = """# 世界观模板（备用内容）
@@ -944,12 +1072,13 @@ class WorldViewPanel:
    - 市长选举舞弊案（2年前）
    - 博物馆失窃案（3个月前）"""
             
-            # 在新线程中运行生成过程
-            def generate_thread():
+            # 在后台事件循环中运行生成过程
+            async def generate_task():
                 try:
                     # 尝试导入API客户端并生成内容
                     try:
-                        from core.api_client.deepseek import api_client
+                        from core.api_client.async_client import async_api_client
+                        from core.api_client.response_cache import CACHE_NEVER
                         
                         # 准备消息
                         messages = [
@@ -957,15 +1086,20 @@ class WorldViewPanel:
                             {"role": "user", "content": prompt}
                         ]
                         
-                        # 使用API客户端的流式生成
-                        for chunk in api_client.stream_generate(messages, callback=safe_callback):
+                        # 使用异步客户端的流式生成
+                        async for chunk in async_api_client.stream_generate(messages, callback=safe_callback,
+                                                                             handle=handle,
+                                                                             prompt_family="worldview_template",
+                                                                             cache_policy=CACHE_NEVER):
                             if self.generation_stopped or not window.winfo_exists():
                                 print("生成被停止")
                                 break
                         
-                        # 生成完成
+                        # 生成完成，缓冲内容全部显示后再标记；被停止时立即停止刷新
                         if not self.generation_stopped and window.winfo_exists():
-                            safe_update_ui(self._mark_template_thinking_finished)
+                            pump.finish(self._mark_template_thinking_finished)
+                        else:
+                            pump.stop()
                             
                     except Exception as e:
                         print(f"API调用失败: {str(e)}，使用备用内容")
@@ -980,21 +1114,27 @@ class WorldViewPanel:
                                 if self.generation_stopped:
                                     break
                                 safe_callback(chunk + '\n\n')
-                                time.sleep(0.3)
+                                await asyncio.sleep(0.3)
                             
-                            safe_update_ui(self._mark_template_thinking_finished)
+                            if self.generation_stopped:
+                                pump.stop()
+                            else:
+                                pump.finish(self._mark_template_thinking_finished)
+                        else:
+                            pump.stop()
                         
                 except Exception as e:
-                    print(f"生成线程发生异常: {str(e)}")
+                    print(f"生成任务发生异常: {str(e)}")
+                    msg = str(e)
+                    pump.stop()
                     if window.winfo_exists():
-                        safe_update_ui(lambda: messagebox.showerror("错误", f"生成过程发生错误: {str(e)}", parent=window))
+                        safe_update_ui(lambda: messagebox.showerror("错误", f"生成过程发生错误: {msg}", parent=window))
                         safe_update_ui(lambda: self.gen_btn.config(state="normal"))
                         safe_update_ui(lambda: self.stop_btn.config(state="disabled"))
             
-            # 启动生成线程
-            self.gen_thread = threading.Thread(target=generate_thread)
-            self.gen_thread.daemon = True
-            self.gen_thread.start()
+            # 提交到共享的后台事件循环
+            from core.api_client.async_client import async_runner
+            self.gen_thread = async_runner.submit(generate_task())
         
         except Exception as e:
             messagebox.showerror("错误", f"启动生成过程时出错: {str(e)}", parent=window)
@@ -1004,6 +1144,133 @@ class WorldViewPanel:
             self.gen_btn.config(state="normal")
             self.stop_btn.config(state="disabled")
     
+    def _start_sectioned_template_generation(self, window, editor):
+        """分段并行生成模板：各部分并发请求，分别流入编辑器中各自的位置"""
+        print("WorldView: 开始分段并行生成模板")
+        try:
+            from core.api_client.stream_buffer import TkStreamPump
+            from core.narrative_engine.worldview_sections import SECTIONS, SectionedWorldviewGeneration
+            
+            # 清空编辑器和思考区域
+            editor.delete("1.0", "end")
+            self.thinking_text.delete("1.0", "end")
+            
+            # 更新UI状态
+            self.gen_btn.config(state="disabled")
+            self.stop_btn.config(state="normal")
+            self.save_btn.config(state="disabled")
+            self.thinking_indicator.config(foreground="red", text="●")
+            
+            self.current_gen_window = window
+            self.current_editor = editor
+            self.generation_stopped = False
+            
+            # 每个部分在编辑器中占一个位置，用右侧gravity的标记定位，插入的内容留在标记之前
+            editor.insert("1.0", "\n\n" * (len(SECTIONS) - 1))
+            for index, section in enumerate(SECTIONS):
+                mark = f"section_{section.key}"
+                editor.mark_set(mark, f"1.0 + {index * 2} chars")
+                editor.mark_gravity(mark, "right")
+            
+            def safe_update_ui(func, *args):
+                if window.winfo_exists():
+                    window.after(0, func, *args)
+            
+            # 每个部分一个缓冲泵，主线程按帧合并显示
+            pumps = {
+                section.key: TkStreamPump(
+                    window, lambda chunk, key=section.key: self._section_stream_callback(editor, key, chunk)
+                ).start()
+                for section in SECTIONS
+            }
+            
+            def on_section_done(slot):
+                if slot.ok:
+                    line = f"{slot.section.title}：完成（{slot.elapsed:.1f}秒）\n"
+                elif slot.handle.cancelled:
+                    line = f"{slot.section.title}：已停止\n"
+                else:
+                    line = f"{slot.section.title}：生成失败 - {slot.handle.error}\n"
+                safe_update_ui(lambda: self.thinking_text.insert("end", line))
+            
+            generation = SectionedWorldviewGeneration(
+                self._template_work_info(),
+                on_chunk=lambda key, chunk: pumps[key].push(chunk),
+                on_section_done=on_section_done
+            )
+            # 停止按钮通过generation_handle.cancel()取消全部部分
+            self.generation_handle = generation
+            self.thinking_text.insert(
+                "end", f"分段并行生成 {len(SECTIONS)} 个部分（使用内置分段提示词）...\n\n")
+            
+            async def generate_task():
+                try:
+                    template_data = await generation.run()
+                    if all(slot.ok for slot in generation.slots):
+                        # 记录完整生成的模板，供之后查阅或恢复；写库放到线程池，不阻塞共享事件循环上的其他流
+                        from core.persistence.db_connector import project_store
+                        await asyncio.get_running_loop().run_in_executor(
+                            None, lambda: project_store.add_generation(
+                                "worldview_template", template_data["full_content"],
+                                label=generation.work_info.get("作品名称", ""),
+                                settings=generation.settings.as_dict()))
+                    if self.generation_stopped or not window.winfo_exists():
+                        for pump in pumps.values():
+                            pump.stop()
+                        return
+                    
+                    # 全部缓冲显示完后合并结果
+                    remaining = [len(pumps)]
+                    
+                    def pump_finished():
+                        remaining[0] -= 1
+                        if remaining[0] == 0:
+                            # 编辑器内容与保存、应用的模板数据都取自同一份合并结果
+                            if editor.winfo_exists():
+                                editor.delete("1.0", "end")
+                                editor.insert("1.0", template_data["full_content"])
+                            self._apply_template_data(template_data)
+                            elapsed = generation.status()["elapsed"]
+                            self.thinking_text.insert("end", f"\n全部部分已结束，耗时 {elapsed:.1f} 秒\n")
+                            self._mark_template_thinking_finished()
+                            self.stop_btn.config(state="disabled")
+                            self.gen_btn.config(state="normal")
+                    
+                    for pump in pumps.values():
+                        pump.finish(pump_finished)
+                except Exception as e:
+                    print(f"分段生成任务发生异常: {str(e)}")
+                    msg = str(e)
+                    for pump in pumps.values():
+                        pump.stop()
+                    if window.winfo_exists():
+                        safe_update_ui(lambda: messagebox.showerror("错误", f"生成过程发生错误: {msg}", parent=window))
+                        safe_update_ui(lambda: self.gen_btn.config(state="normal"))
+                        safe_update_ui(lambda: self.stop_btn.config(state="disabled"))
+            
+            from core.api_client.async_client import async_runner
+            self.gen_thread = async_runner.submit(generate_task())
+        
+        except Exception as e:
+            messagebox.showerror("错误", f"启动生成过程时出错: {str(e)}", parent=window)
+            print(f"启动分段生成错误: {str(e)}")
+            
+            # 恢复UI状态
+            self.gen_btn.config(state="normal")
+            self.stop_btn.config(state="disabled")
+    
+    def _section_stream_callback(self, editor, key, chunk):
+        """把某一部分的正文增量插入到编辑器中该部分的位置"""
+        # 各部分的思维链交错输出难以阅读，思考区域只显示各部分的进度
+        if isinstance(chunk, dict) or not chunk:
+            return
+        try:
+            # 按原文插入，结束时替换为合并结果不会改变已显示的内容
+            if editor.winfo_exists():
+                editor.insert(f"section_{key}", chunk)
+        except tk.TclError:
+            pass  # 忽略可能的窗口已关闭错误
+    
     def _stop_template_generation(self):
         """停止模板或提示词生成"""
         print("WorldView: 停止生成被触发")
@@ -1011,12 +1278,15 @@ class WorldViewPanel:
         # 设置停止标记
         self.generation_stopped = True
         
-        # 调用API客户端的停止方法
-        try:
-            from core.api_client.deepseek import api_client
-            setattr(api_client, '_generation_stopped', True)
-        except Exception as e:
-            print(f"设置API客户端停止标志失败: {str(e)}")
+        # 取消当前生成，立即关闭其连接，不影响其他窗口的生成
+        handle = getattr(self, 'generation_handle', None)
+        if handle is not None:
+            handle.cancel()
+        # 停止模板生成的缓冲刷新，不再继续调度after定时器
+        pump = getattr(self, 'generation_pump', None)
+        if pump is not None:
+            pump.stop()
+            self.generation_pump = None
         
         # 更新UI状态
         self.thinking_indicator.config(foreground="orange", text="⏹")
@@ -1199,55 +1469,68 @@ class WorldViewPanel:
         # 简化的解析逻辑，只提取大标题及其内容
         template_data = {
             "full_content": content,
-            "sections": {}
+            "sections": {},
+            "spans": {}  # 各章节在full_content中的[起, 止)字符位置，用于单独替换某一章节
         }
         
         try:
             lines = content.split('\n')
             current_section = None
             current_text = []
+            current_start = 0
+            offset = 0
             
             # 识别主要标题和内容
             for line in lines:
-                line_lower = line.lower()
-                
-                # 检查是否为新章节标题
-                if (line.startswith('#') or 
-                    any(line.startswith(prefix) for prefix in ['一、', '二、', '三、', '四、', '五、', '六、', '七、', '八、']) or
-                    any(keyword in line_lower for keyword in ['总览', '时空', '社会', '力量', '组织', '生态', '历史'])):
-                    
-                    # 保存之前的章节内容
-                    if current_section and current_text:
-                        template_data["sections"][current_section] = '\n'.join(current_text)
-                    
-                    # 确定新章节名称
-                    if '总览' in line_lower or '概述' in line_lower:
-                        current_section = "overview"
-                    elif '时空' in line_lower or '背景' in line_lower:
-                        current_section = "time_space"
-                    elif '社会' in line_lower or '文化' in line_lower:
-                        current_section = "society"
-                    elif '力量' in line_lower or '体系' in line_lower or '科技' in line_lower:
-                        current_section = "power_system"
-                    elif '组织' in line_lower or '势力' in line_lower:
-                        current_section = "organizations"
-                    elif '生态' in line_lower or '生物' in line_lower or '环境' in line_lower:
-                        current_section = "ecology"
-                    elif '历史' in line_lower or '事件' in line_lower:
-                        current_section = "history"
-                    else:
-                        current_section = "other"
-                    
-                    # 重置当前文本收集
-                    current_text = [line]
-                else:
+                line_start = offset
+                offset += len(line) + 1
+
+                # 只有“#”开头或“一、”至“八、”开头的行是章节标题，正文中出现“社会”“历史”等词不算
+                numbered = any(line.startswith(prefix) for prefix in ['一、', '二、', '三、', '四、', '五、', '六、', '七、', '八、'])
+                if not (numbered or line.startswith('#')):
                     # 继续收集当前章节文本
                     if current_section:
                         current_text.append(line)
-            
+                    continue
+
+                # 确定新章节名称
+                heading = line.lstrip('#').strip().lower()
+                if '总览' in heading or '概述' in heading:
+                    section = "overview"
+                elif '时空' in heading or '背景' in heading:
+                    section = "time_space"
+                elif '社会' in heading or '文化' in heading:
+                    section = "society"
+                elif '力量' in heading or '体系' in heading or '科技' in heading:
+                    section = "power_system"
+                elif '组织' in heading or '势力' in heading:
+                    section = "organizations"
+                elif '生态' in heading or '生物' in heading or '环境' in heading:
+                    section = "ecology"
+                elif '历史' in heading or '事件' in heading:
+                    section = "history"
+                else:
+                    section = "other"
+
+                # 章节内的“#”小标题（无法归类或仍属当前章节）不拆分章节
+                if current_section and not numbered and section in ("other", current_section):
+                    current_text.append(line)
+                    continue
+
+                # 保存之前的章节内容
+                if current_section and current_text:
+                    template_data["sections"][current_section] = '\n'.join(current_text)
+                    template_data["spans"][current_section] = [current_start, line_start - 1]
+
+                # 重置当前文本收集
+                current_section = section
+                current_text = [line]
+                current_start = line_start
+
             # 保存最后一个章节
             if current_section and current_text:
                 template_data["sections"][current_section] = '\n'.join(current_text)
+                template_data["spans"][current_section] = [current_start, len(content)]
                 
         except Exception as e:
             print(f"解析模板内容时出错: {str(e)}")
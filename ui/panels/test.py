@@ -2316,43 +2316,41 @@ class WorldViewPanel:
             self.master.after(0, lambda: self.param_progress_label.config(text="正在分析模板内容...", foreground="blue"))
             self.master.after(0, lambda: self.param_progress_indicator.config(text="⏳"))
             
-            # 准备提示
+            # 准备提示：固定的格式要求在前，模板内容在后，便于命中提供商的前缀缓存
+            from core.api_client.prompt_layout import PromptLayout
             template_content = self.worldview_template
-            prompt = f"""请分析以下世界观模板内容，提取出关键参数及其默认值。
+            layout = PromptLayout(
+                "parameter_extraction",
+                system="你是一个专业的世界观设计助手，擅长分析世界观模板并提取关键参数。"
+            )
+            layout.static("""请分析下方世界观模板内容，提取出关键参数及其默认值。
 以JSON格式返回，格式为：
-{{
+{
   "parameters": [
-    {{"name": "参数名称", "description": "参数描述", "default_value": "默认值示例"}}
+    {"name": "参数名称", "description": "参数描述", "default_value": "默认值示例"}
   ]
-}}
-
-模板内容:
-{template_content}
+}
 
-只返回JSON格式的结果，不要有任何其他文字。"""
+只返回JSON格式的结果，不要有任何其他文字。""")
+            layout.volatile(f"模板内容:\n{template_content}")
 
             # 调用API
             try:
                 from core.api_client.deepseek import api_client
                 from modules.GlobalModule import global_config
                 
-                # 保存当前温度设置
-                original_temp = global_config.generation_params.temperature
-                
-                # 设置低温度以获得更确定性的结果
-                global_config.generation_params.temperature = 0.1
-                
                 # 准备消息
-                messages = [
-                    {"role": "system", "content": "你是一个专业的世界观设计助手，擅长分析世界观模板并提取关键参数。"},
-                    {"role": "user", "content": prompt}
-                ]
-                
-                # 调用API
-                response = api_client.generate(messages)
-                
-                # 恢复原始温度设置
-                global_config.generation_params.temperature = original_temp
+                messages = layout.messages()
+                
+                # 调用API：以低温度的参数快照获得更确定的结果（不修改全局参数），
+                # 相同模板的低温度请求直接命中响应缓存
+                started = time.monotonic()
+                response = api_client.generate(messages, cache_policy="deterministic",
+                                               prompt_family=layout.family,
+                                               settings=global_config.generation_settings(temperature=0.1))
+                failed = response.startswith(("错误:", "API请求失败", "生成失败"))
+                api_client.telemetry.generation("参数提取", "failed" if failed else "finished",
+                                                time.monotonic() - started)
                 
                 # 解析JSON响应
                 try:
@@ -2999,8 +2997,9 @@ class WorldViewPanel:
                         # 清除编辑器内容
                         safe_update_ui(lambda: editor.delete("1.0", "end"))
                         
-                        # 设置停止标志
+                        # 设置停止标志，并创建本次生成独立的句柄
                         self.generation_stopped = False
+                        self.generation_handle = api_client.new_handle("模板生成")
                         
                         # 准备消息
                         messages = [
@@ -3010,7 +3009,8 @@ class WorldViewPanel:
                         
                         # 使用API客户端的流式生成
                         print("WorldView: 开始调用API生成内容")
-                        for chunk in api_client.stream_generate(messages, callback=safe_callback):
+                        for chunk in api_client.stream_generate(messages, callback=safe_callback,
+                                                                handle=self.generation_handle):
                             if self.generation_stopped or not window.winfo_exists():
                                 print("WorldView: 生成被用户停止")
                                 break
@@ -3105,13 +3105,11 @@ class WorldViewPanel:
         # 设置停止标志
         self.generation_stopped = True
         
-        # 通知API客户端停止生成
-        try:
-            from core.api_client.deepseek import api_client
-            setattr(api_client, '_generation_stopped', True)
-            print("WorldView: 已设置API客户端停止标志")
-        except Exception as e:
-            print(f"WorldView: 设置API客户端停止标志失败: {str(e)}")
+        # 取消当前生成句柄，立即关闭连接
+        handle = getattr(self, 'generation_handle', None)
+        if handle is not None:
+            handle.cancel()
+            print(f"WorldView: 已取消生成 #{handle.id}")
         
         # 更新UI状态
         self.thinking_indicator.config(foreground="orange", text="⏹")
@@ -3125,13 +3123,6 @@ class WorldViewPanel:
         # 等待线程结束
         def ensure_stopped():
             print("WorldView: 确认停止状态")
-            # 双重保险:再次设置API客户端停止标志
-            try:
-                from core.api_client.deepseek import api_client
-                setattr(api_client, '_generation_stopped', True)
-            except:
-                pass
-                
             if hasattr(self, 'gen_thread') and self.gen_thread.is_alive():
                 self.current_gen_window.after(100, ensure_stopped)
             else:
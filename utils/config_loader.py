@@ -18,8 +18,9 @@ def load_config(file_path: str) -> Dict[str, Any]:
         file_path: 相对于configs目录的配置文件路径
     
     返回:
-        配置字典，加载失败则返回空字典
+        配置字典（可修改的副本），加载失败则返回空字典
     """
+    from utils.config_store import config_store, thaw
     ensure_config_dir()
     config_file = CONFIG_PATH / file_path
     
@@ -28,8 +29,8 @@ def load_config(file_path: str) -> Dict[str, Any]:
             print(f"配置文件不存在: {file_path}，将使用默认配置")
             create_default_config(file_path)
             
-        with open(config_file, 'r', encoding='utf-8') as f:
-            return yaml.safe_load(f) or {}
+        # 文件未变化时直接使用已解析的结果
+        return thaw(config_store.get(file_path))
     except Exception as e:
         print(f"配置加载失败 ({file_path}): {str(e)}")
         return {}
@@ -129,28 +130,35 @@ def save_config(file_name: str, config: dict) -> bool:
     try:
         with open(config_path, 'w', encoding='utf-8') as f:
             yaml.safe_dump(config, f, allow_unicode=True)
-        return True
     except Exception as e:
         print(f"保存配置文件 {file_name} 失败: {str(e)}")
         return False
+    # 立即刷新缓存并通知订阅者
+    from utils.config_store import config_store
+    config_store.refresh(file_name)
+    return True
 
 def get_api_key() -> Dict[str, Dict[str, str]]:
-    """获取API密钥配置"""
-    try:
-        config_path = get_config_path('apikey.yaml')
-        if not config_path.exists():
-            # 创建默认API密钥配置
-            create_default_config('apikey.yaml')
-            
-        with open(config_path, 'r', encoding='utf-8') as f:
-            data = yaml.safe_load(f) or {}
-            # 确保providers结构存在
-            data.setdefault("providers", {"DeepSeek": "", "Qwen": ""})
-            return data
-    except FileNotFoundError:
-        default_config = {"providers": {"DeepSeek": "", "Qwen": ""}}
-        save_config('apikey.yaml', default_config)
-        return default_config
+    """获取API密钥配置（可修改的副本）"""
+    from utils.config_store import thaw
+    data = thaw(_api_key_snapshot())
+    # 确保providers结构存在
+    data.setdefault("providers", {"DeepSeek": "", "Qwen": ""})
+    return data
+
+def get_provider_key(provider: str) -> str:
+    """获取单个提供商的API密钥，供请求路径使用：文件未变化时不读取、不解析"""
+    providers = _api_key_snapshot().get("providers") or {}
+    return providers.get(provider) or ""
+
+def _api_key_snapshot():
+    """apikey.yaml的只读快照，文件不存在时先创建默认配置"""
+    from utils.config_store import config_store
+    snapshot = config_store.get('apikey.yaml')
+    if not snapshot and not get_config_path('apikey.yaml').exists():
+        create_default_config('apikey.yaml')
+        snapshot = config_store.get('apikey.yaml')
+    return snapshot
 
 def save_api_key(data: dict) -> bool:
     """保存API密钥配置"""
@@ -0,0 +1,209 @@
+from pathlib import Path
+from types import MappingProxyType
+from typing import Any, Callable, Dict, List, Mapping, Optional, Tuple
+import os
+import threading
+import time
+import logging
+import yaml
+from utils.config_loader import CONFIG_PATH
+
+logger = logging.getLogger(__name__)
+
+_EMPTY = MappingProxyType({})
+
+
+def freeze(value: Any) -> Any:
+    """把解析结果转换为只读结构：dict -> MappingProxyType，list -> tuple"""
+    if isinstance(value, dict):
+        return MappingProxyType({key: freeze(item) for key, item in value.items()})
+    if isinstance(value, (list, tuple)):
+        return tuple(freeze(item) for item in value)
+    return value
+
+
+def thaw(value: Any) -> Any:
+    """freeze的逆操作，返回可修改、可序列化的深拷贝"""
+    if isinstance(value, Mapping):
+        return {key: thaw(item) for key, item in value.items()}
+    if isinstance(value, tuple):
+        return [thaw(item) for item in value]
+    return value
+
+
+class _Entry:
+    """单个配置文件的缓存：文件签名与解析后的只读快照"""
+    __slots__ = ("signature", "snapshot")
+
+    def __init__(self, signature: Optional[Tuple[int, int, int]], snapshot: Mapping):
+        self.signature = signature
+        self.snapshot = snapshot
+
+
+class ConfigStore:
+    """按文件签名缓存解析结果的配置存储
+
+    每个YAML文件只在内容变化时解析一次。get()通过一次os.stat比较
+    (mtime_ns, size, inode)判断是否需要重新解析，请求路径上不再有文件读取与YAML解析。
+    返回的快照为只读结构（MappingProxyType/tuple），需要修改时用thaw()取得副本，
+    改完经save_config写回。subscribe注册的回调在文件变化时收到新快照：
+    安装了watchdog时由文件系统事件（Linux上为inotify）触发，否则由后台线程按
+    poll_interval轮询签名；经save_config写入的修改会立即通知。
+    """
+
+    def __init__(self, base_dir: Path = CONFIG_PATH, poll_interval: float = 1.0):
+        self.base_dir = Path(base_dir)
+        self.poll_interval = poll_interval  # 无watchdog时后台轮询订阅文件的间隔（秒）
+        self._entries: Dict[str, _Entry] = {}
+        self._listeners: Dict[str, List[Callable[[Mapping], None]]] = {}
+        self._lock = threading.RLock()
+        self._watcher = None
+        self._counters = {"hits": 0, "loads": 0, "errors": 0, "notifications": 0}
+
+    def path(self, file_name: str) -> Path:
+        return self.base_dir / file_name
+
+    def _signature(self, file_name: str) -> Optional[Tuple[int, int, int]]:
+        try:
+            st = os.stat(self.path(file_name))
+        except OSError:
+            return None
+        return (st.st_mtime_ns, st.st_size, st.st_ino)
+
+    def get(self, file_name: str) -> Mapping:
+        """返回配置文件的只读快照，文件不存在时为空映射"""
+        snapshot, changed = self._revalidate(file_name)
+        if changed:
+            self._notify(file_name, snapshot)
+        return snapshot
+
+    def refresh(self, file_name: str) -> Mapping:
+        """忽略缓存重新读取（用于本进程刚写入的文件：同一时钟刻度内等长的改写签名可能不变）"""
+        with self._lock:
+            entry = self._entries.get(file_name)
+            if entry is not None:
+                entry.signature = ()
+        return self.get(file_name)
+
+    def _revalidate(self, file_name: str) -> Tuple[Mapping, bool]:
+        """签名未变时返回缓存快照，否则重新解析，返回(快照, 是否发生变化)"""
+        signature = self._signature(file_name)
+        with self._lock:
+            entry = self._entries.get(file_name)
+            if entry is not None and entry.signature == signature:
+                self._counters["hits"] += 1
+                return entry.snapshot, False
+            previous = entry.snapshot if entry is not None else None
+            snapshot = self._load(file_name, signature, previous)
+            changed = previous is not None and snapshot != previous
+            if previous is not None and not changed:
+                snapshot = previous  # 内容未变（如仅touch）时沿用原快照
+            self._entries[file_name] = _Entry(signature, snapshot)
+            return snapshot, changed
+
+    def _load(self, file_name: str, signature, previous: Optional[Mapping]) -> Mapping:
+        if signature is None:
+            return _EMPTY
+        try:
+            with open(self.path(file_name), 'r', encoding='utf-8') as f:
+                data = yaml.safe_load(f) or {}
+        except Exception as e:
+            # 文件正在被编辑器写入等情况下保留上一个可用版本
+            self._counters["errors"] += 1
+            logger.warning(f"配置解析失败 ({file_name}): {str(e)}")
+            return previous if previous is not None else _EMPTY
+        self._counters["loads"] += 1
+        if not isinstance(data, dict):
+            logger.warning(f"配置文件 {file_name} 的顶层不是映射，已忽略")
+            return _EMPTY
+        return freeze(data)
+
+    def subscribe(self, file_name: str, callback: Callable[[Mapping], None]):
+        """注册文件变化回调，回调参数为新的只读快照"""
+        with self._lock:
+            callbacks = self._listeners.setdefault(file_name, [])
+            if callback not in callbacks:
+                callbacks.append(callback)
+            # 记录当前版本作为比较基准
+            self._revalidate(file_name)
+        self._ensure_watcher()
+
+    def unsubscribe(self, file_name: str, callback: Callable[[Mapping], None]):
+        with self._lock:
+            callbacks = self._listeners.get(file_name, [])
+            if callback in callbacks:
+                callbacks.remove(callback)
+
+    def _notify(self, file_name: str, snapshot: Mapping):
+        with self._lock:
+            callbacks = list(self._listeners.get(file_name, ()))
+            self._counters["notifications"] += 1
+        for callback in callbacks:
+            try:
+                callback(snapshot)
+            except Exception as e:
+                logger.warning(f"配置变更回调执行失败 ({file_name}): {str(e)}")
+
+    def check(self):
+        """检查所有已订阅的文件，变化时通知订阅者"""
+        with self._lock:
+            files = [name for name, callbacks in self._listeners.items() if callbacks]
+        for file_name in files:
+            self.get(file_name)
+
+    def _ensure_watcher(self):
+        with self._lock:
+            if self._watcher is not None:
+                return
+            self._watcher = self._start_fs_watcher() or self._start_poller()
+
+    def _start_fs_watcher(self):
+        """使用watchdog监听配置目录，未安装时返回None"""
+        try:
+            from watchdog.observers import Observer
+            from watchdog.events import FileSystemEventHandler
+        except ImportError:
+            return None
+        store = self
+
+        class _Handler(FileSystemEventHandler):
+            def on_any_event(self, event):
+                store.check()
+
+        try:
+            self.base_dir.mkdir(parents=True, exist_ok=True)
+            observer = Observer()
+            observer.daemon = True
+            observer.schedule(_Handler(), str(self.base_dir), recursive=False)
+            observer.start()
+            return observer
+        except Exception as e:
+            logger.info(f"文件监听启动失败，改为轮询: {str(e)}")
+            return None
+
+    def _start_poller(self) -> threading.Thread:
+        def poll():
+            while True:
+                time.sleep(self.poll_interval)
+                try:
+                    self.check()
+                except Exception as e:
+                    logger.warning(f"配置轮询失败: {str(e)}")
+
+        thread = threading.Thread(target=poll, name="ConfigStore", daemon=True)
+        thread.start()
+        return thread
+
+    def stats(self) -> Dict[str, Any]:
+        """返回解析次数、缓存命中与订阅情况"""
+        with self._lock:
+            return {
+                **self._counters,
+                "files": sorted(self._entries),
+                "subscriptions": {name: len(callbacks) for name, callbacks in self._listeners.items()},
+                "watcher": type(self._watcher).__name__ if self._watcher is not None else None
+            }
+
+
+# 全局配置存储实例
+config_store = ConfigStore()